@@ -0,0 +1,147 @@
+###############################################################################
+##
+## Copyright (C) 2014-2016, New York University.
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah.
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice,
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright
+##    notice, this list of conditions and the following disclaimer in the
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the New York University nor the names of its
+##    contributors may be used to endorse or promote products derived from
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""Times opening a large generated vistrail file.
+
+Compares reading every operation when the file is opened with reading
+them only when a version is materialized. Each measurement runs in its own
+process so the peak memory use can be compared.
+
+usage: python benchmark_open_vistrail.py [actions] [functions per action]
+"""
+
+from __future__ import division
+
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmark_utils import start_application, timed
+
+
+def create_vistrail(nb_actions, nb_functions):
+    """Creates a version tree where each action adds a module.
+    """
+    from vistrails.db.domain import DBAction, DBAdd, DBFunction, \
+        DBModule, DBParameter, DBVistrail
+
+    random.seed(0)
+    vistrail = DBVistrail()
+    id_scope = vistrail.idScope
+    for i in xrange(nb_actions):
+        functions = []
+        for j in xrange(nb_functions):
+            parameter = DBParameter(id=id_scope.getNewId(DBParameter.vtType),
+                                    pos=0,
+                                    type='org.vistrails.vistrails.basic:'
+                                         'Integer',
+                                    val=str(i + j))
+            functions.append(DBFunction(
+                    id=id_scope.getNewId(DBFunction.vtType),
+                    pos=j, name='value', parameters=[parameter]))
+        module = DBModule(id=id_scope.getNewId(DBModule.vtType),
+                          name='Integer',
+                          package='org.vistrails.vistrails.basic',
+                          version='1.6', functions=functions)
+        add = DBAdd(id=id_scope.getNewId(DBAdd.vtType),
+                    what=DBModule.vtType, objectId=module.db_id, data=module)
+        # Mostly grow a branch, sometimes start a new one
+        if i == 0:
+            parent = 0
+        elif random.random() < 0.9:
+            parent = i
+        else:
+            parent = random.randint(1, i)
+        vistrail.db_add_action(DBAction(
+                id=id_scope.getNewId(DBAction.vtType), prevId=parent,
+                date=None, user='benchmark', operations=[add]))
+    return vistrail
+
+
+def measure(mode, filename):
+    app = start_application()
+    from vistrails.db.domain import DBVistrail
+    from vistrails.db.services import io
+    from vistrails.db.services.vistrail import materializeWorkflow, \
+        update_id_scope
+
+    def open_eager():
+        vistrail = io.getVersionDAO(io.currentVersion).open_from_xml(
+                filename, DBVistrail.vtType)
+        update_id_scope(vistrail)
+        return vistrail
+
+    if mode == 'eager':
+        open_time, vistrail = timed(open_eager)
+    else:
+        open_time, vistrail = timed(io.open_vistrail_from_xml, filename)
+    version = max(vistrail.db_actions_id_index)
+    materialize_time, _ = timed(materializeWorkflow, vistrail, version)
+    print "%-5s open: %.3fs  materialize: %.3fs  peak memory: %dMB" % (
+            mode, open_time, materialize_time,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024)
+
+    app.finishSession()
+
+
+def main(nb_actions=20000, nb_functions=3):
+    app = start_application()
+    from vistrails.db.services.io import save_vistrail_to_xml
+
+    directory = tempfile.mkdtemp(prefix='vt_benchmark_')
+    try:
+        filename = os.path.join(directory, 'vistrail.xml')
+        save_vistrail_to_xml(create_vistrail(nb_actions, nb_functions),
+                             filename)
+        app.finishSession()
+        print "%d actions, %d functions each, %dMB" % (
+                nb_actions, nb_functions,
+                os.path.getsize(filename) // (1024 * 1024))
+        for mode in ('eager', 'lazy'):
+            subprocess.check_call([sys.executable, __file__, '--measure',
+                                   mode, filename])
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(*sys.argv[2:4])
+    else:
+        main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,129 @@
+###############################################################################
+##
+## Copyright (C) 2014-2016, New York University.
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah.
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice,
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright
+##    notice, this list of conditions and the following disclaimer in the
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the New York University nor the names of its
+##    contributors may be used to endorse or promote products derived from
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""Times the computation of module signatures on a large generated pipeline.
+
+Compares computing every signature from scratch (no memoized parameter and
+function signatures, as before they were memoized) with recomputing them
+once memoized, for each available digest.
+
+usage: python benchmark_signatures.py [modules] [functions per module]
+"""
+
+from __future__ import division
+
+import sys
+
+from benchmark_utils import best_time, start_application
+
+
+def create_pipeline(nb_modules, nb_functions):
+    from vistrails.core.modules.module_registry import get_module_registry
+    from vistrails.core.system import get_vistrails_basic_pkg_id
+    from vistrails.core.vistrail.connection import Connection
+    from vistrails.core.vistrail.module import Module
+    from vistrails.core.vistrail.module_function import ModuleFunction
+    from vistrails.core.vistrail.module_param import ModuleParam
+    from vistrails.core.vistrail.pipeline import Pipeline
+    from vistrails.core.vistrail.port import Port
+    from vistrails.db.domain import IdScope
+
+    basic_pkg = get_vistrails_basic_pkg_id()
+    version = get_module_registry().get_package_by_name(basic_pkg).version
+    id_scope = IdScope()
+    pipeline = Pipeline()
+    previous = None
+    for i in xrange(nb_modules):
+        functions = [
+                ModuleFunction(id=id_scope.getNewId(ModuleFunction.vtType),
+                               pos=j,
+                               name='value',
+                               parameters=[ModuleParam(type='Integer',
+                                                       val=str(i + j))])
+                for j in xrange(nb_functions)]
+        module = Module(id=id_scope.getNewId(Module.vtType),
+                        name='Integer', package=basic_pkg,
+                        version=version, functions=functions)
+        pipeline.add_module(module)
+        if previous is not None:
+            source = Port(id=id_scope.getNewId(Port.vtType), type='source',
+                          moduleId=previous.id, moduleName='Integer',
+                          name='value')
+            destination = Port(id=id_scope.getNewId(Port.vtType),
+                               type='destination', moduleId=module.id,
+                               moduleName='Integer', name='value')
+            pipeline.add_connection(Connection(
+                    id=id_scope.getNewId(Connection.vtType),
+                    ports=[source, destination]))
+        previous = module
+    return pipeline
+
+
+def forget_memoized(pipeline):
+    for module in pipeline.module_list:
+        for function in module.functions:
+            function._signature = None
+            for param in function.params:
+                param._signature = None
+
+
+def main(nb_modules=5000, nb_functions=4):
+    app = start_application()
+    from vistrails.core.cache import utils
+
+    pipeline = create_pipeline(nb_modules, nb_functions)
+    print "%d modules, %d functions each" % (nb_modules, nb_functions)
+
+    def cold():
+        forget_memoized(pipeline)
+        pipeline.refresh_signatures()
+
+    def warm():
+        pipeline.refresh_signatures()
+
+    for name in sorted(utils.hash_functions):
+        utils.set_hash_function(name)
+        cold_time = best_time(cold)
+        warm()
+        warm_time = best_time(warm)
+        print "%-8s from scratch: %.3fs  memoized: %.3fs  (%.1fx)" % (
+                name, cold_time, warm_time, cold_time / warm_time)
+    utils.set_hash_function('sha1')
+
+    app.finishSession()
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
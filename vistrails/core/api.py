@@ -58,7 +58,7 @@ from vistrails.core.vistrail.vistrail import Vistrail as _Vistrail
 from vistrails.db.domain import IdScope
 
 
-__all__ = ['Vistrail', 'Pipeline', 'Module', 'Package',
+__all__ = ['Vistrail', 'Pipeline', 'PreparedPipeline', 'Module', 'Package',
            'ExecutionResults', 'ExecutionErrors', 'Function',
            'ipython_mode', 'load_vistrail', 'load_pipeline', 'load_package',
            'output_mode', 'run_vistrail',
@@ -378,36 +378,8 @@ class Pipeline(object):
                             input_url == 'http://www.vistrails.org/',
                             resolution=15)  # kwarg: only one equal sign
         """
-        sinks = set()
-        inputs = {}
-
+        sinks, inputs = self._read_execute_args(args, kwargs)
         reg = get_module_registry()
-        InputPort_desc = reg.get_descriptor_by_name(
-                get_vistrails_basic_pkg_id(),
-                'InputPort')
-
-        # Read args
-        for arg in args:
-            if isinstance(arg, ModuleValuePair):
-                if arg.module.id in inputs:
-                    raise ValueError(
-                            "Multiple values set for InputPort %r" %
-                            get_inputoutput_name(arg.module))
-                if not reg.is_descriptor_subclass(arg.module.module_descriptor,
-                                                  InputPort_desc):
-                    raise ValueError("Module %d is not an InputPort" %
-                                     arg.module.id)
-                inputs[arg.module.id] = arg.value
-            elif isinstance(arg, Module):
-                sinks.add(arg.module_id)
-
-        # Read kwargs
-        for key, value in kwargs.iteritems():
-            key = self.get_input(key)  # Might raise KeyError
-            if key.module_id in inputs:
-                raise ValueError("Multiple values set for InputPort %r" %
-                                 get_inputoutput_name(key.module))
-            inputs[key.module_id] = value
 
         reason = "API pipeline execution"
         sinks = sinks or None
@@ -485,6 +457,51 @@ class Pipeline(object):
         else:
             return ExecutionResults(self, result)
 
+    def _read_execute_args(self, args, kwargs):
+        """Gets the sinks and the input values from execute()'s arguments.
+        """
+        sinks = set()
+        inputs = {}
+
+        reg = get_module_registry()
+        InputPort_desc = reg.get_descriptor_by_name(
+                get_vistrails_basic_pkg_id(),
+                'InputPort')
+
+        # Read args
+        for arg in args:
+            if isinstance(arg, ModuleValuePair):
+                if arg.module.id in inputs:
+                    raise ValueError(
+                            "Multiple values set for InputPort %r" %
+                            get_inputoutput_name(arg.module))
+                if not reg.is_descriptor_subclass(arg.module.module_descriptor,
+                                                  InputPort_desc):
+                    raise ValueError("Module %d is not an InputPort" %
+                                     arg.module.id)
+                inputs[arg.module.id] = arg.value
+            elif isinstance(arg, Module):
+                sinks.add(arg.module_id)
+
+        # Read kwargs
+        for key, value in kwargs.iteritems():
+            key = self.get_input(key)  # Might raise KeyError
+            if key.module_id in inputs:
+                raise ValueError("Multiple values set for InputPort %r" %
+                                 get_inputoutput_name(key.module))
+            inputs[key.module_id] = value
+
+        return sinks, inputs
+
+    def prepare(self, *inputs):
+        """Sets up the pipeline to be executed many times.
+
+        Returns a PreparedPipeline whose execute() takes values for the given
+        InputPorts (names or Modules; all of them by default). See
+        PreparedPipeline.
+        """
+        return PreparedPipeline(self, inputs or None)
+
     def get_module(self, module_id):
         if isinstance(module_id, (int, long)):  # module id
             module = self.pipeline.modules[module_id]
@@ -646,6 +663,145 @@ class Pipeline(object):
         return self._html
 
 
+class PreparedPipeline(object):
+    """A Pipeline set up once to be executed many times with new inputs.
+
+    The constant modules feeding the InputPorts are added, and the pipeline
+    validated, when it is created; execute() only stores the new values in
+    these constants. Signatures upstream of the inputs that changed are kept,
+    so the interpreter only recomputes the modules downstream of them.
+
+    Executions change the prepared pipeline, so they shouldn't run
+    concurrently.
+
+    Only InputPorts with a single-type signature can be prepared; a
+    TypeError is raised for tuple signatures, which Pipeline.execute()
+    doesn't support either. Names that are not InputPorts, or were not
+    prepared, raise a ValueError.
+    """
+    def __init__(self, pipeline, inputs=None):
+        self.pipeline = pipeline
+
+        if inputs is None:
+            input_modules = pipeline._get_inputs_or_outputs(
+                    'InputPort').values()
+        else:
+            input_modules = []
+            for name in inputs:
+                if isinstance(name, Module):
+                    module = name
+                else:
+                    try:
+                        module = pipeline.get_input(name)
+                    except KeyError:
+                        raise ValueError("No InputPort module with name %r" %
+                                         name)
+                input_modules.append(module.module)
+
+        reg = get_module_registry()
+        id_scope = IdScope(1)
+        self._pipeline = pipeline.pipeline.do_copy(False, id_scope)
+        # Same as in Pipeline.execute(): new ids are negative
+        id_scope.getNewId = lambda t, g=id_scope.getNewId: -g(t)
+
+        create_module = \
+                VistrailController.create_module_from_descriptor_static
+        create_function = VistrailController.create_function_static
+        create_connection = VistrailController.create_connection_static
+        # InputPort module id -> (constant module id, parameter, sigstring)
+        self._slots = {}
+        for module in input_modules:
+            module = self._pipeline.modules[module.id]
+            if module.id in self._slots:
+                raise ValueError("InputPort %r given twice" %
+                                 get_inputoutput_name(module))
+            _, sigstrings, _, _, _ = get_port_spec_info(self._pipeline,
+                                                        module)
+            sigstrings = parse_port_spec_string(sigstrings)
+            if len(sigstrings) != 1:
+                raise TypeError("InputPort %r has a tuple signature %r, only "
+                                "single values are supported" % (
+                                    get_inputoutput_name(module),
+                                    sigstrings))
+
+            constant_desc = reg.get_descriptor_by_name(*sigstrings[0])
+            constant_mod = create_module(id_scope, constant_desc)
+            func = create_function(id_scope, constant_mod, 'value', [''])
+            constant_mod.add_function(func)
+            self._pipeline.add_module(constant_mod)
+            conn = create_connection(id_scope,
+                                     constant_mod, 'value',
+                                     module, 'ExternalPipe')
+            self._pipeline.db_add_connection(conn)
+            # add_module() stored a copy
+            constant_mod = self._pipeline.modules[constant_mod.id]
+            self._slots[module.id] = (constant_mod.id,
+                                      constant_mod.functions[0].params[0],
+                                      sigstrings[0])
+
+        self._pipeline.validate()
+        self._pipeline.compute_signatures()
+
+    @property
+    def inputs(self):
+        return [get_inputoutput_name(self._pipeline.modules[module_id])
+                for module_id in self._slots]
+
+    def execute(self, *args, **kwargs):
+        """Execute the pipeline with new input values.
+
+        Takes the same arguments as Pipeline.execute(). A value has to be
+        given for each of the prepared InputPorts.
+        """
+        try:
+            sinks, inputs = self.pipeline._read_execute_args(args, kwargs)
+        except KeyError, e:
+            raise ValueError(e.args[0])
+        for module_id in inputs:
+            if module_id not in self._slots:
+                raise ValueError("InputPort %r was not prepared" %
+                                 get_inputoutput_name(
+                                         self._pipeline.modules[module_id]))
+        for module_id in self._slots:
+            if module_id not in inputs:
+                raise ValueError("No value set for InputPort %r" %
+                                 get_inputoutput_name(
+                                         self._pipeline.modules[module_id]))
+
+        reg = get_module_registry()
+        changed = []
+        for module_id, value in inputs.iteritems():
+            constant_id, param, sigstring = self._slots[module_id]
+            if isinstance(value, (list, tuple)):
+                if len(value) != 1:
+                    raise TypeError("InputPort %r takes a single value, got "
+                                    "%d" % (get_inputoutput_name(
+                                                self._pipeline.modules[
+                                                    module_id]),
+                                            len(value)))
+                value, = value
+            value = reg.convert_port_val(value, sigstring, None)
+            if value != param.strValue:
+                param.strValue = value
+                changed.append(constant_id)
+        if changed:
+            self._pipeline.invalidate_signatures(changed)
+
+        interpreter = get_default_interpreter()
+        result = interpreter.execute(self._pipeline,
+                                     reason="API prepared pipeline execution",
+                                     sinks=sinks or None)
+
+        if result.errors:
+            raise ExecutionErrors(self.pipeline, result)
+        else:
+            return ExecutionResults(self.pipeline, result)
+
+    def __repr__(self):
+        return "<%s: inputs: %s>" % (self.__class__.__name__,
+                                     ", ".join(self.inputs))
+
+
 class ModuleClass(type):
     def __new__(cls, descriptor):
         return type.__new__(cls, descriptor.name, (object,), {})
@@ -972,3 +1128,103 @@ def run_vistrail(filename, version=None, *args, **kwargs):
     """Shortcut for load_vistrail(filename).execute(...)
     """
     return load_vistrail(filename, version).execute(*args, **kwargs)
+
+
+###############################################################################
+
+import unittest
+
+
+class TestPreparedPipeline(unittest.TestCase):
+    def setUp(self):
+        # The test suite already started an application
+        global is_initialized
+        self.was_initialized = is_initialized
+        is_initialized = True
+
+    def tearDown(self):
+        global is_initialized
+        is_initialized = self.was_initialized
+
+    @staticmethod
+    def create_pipeline():
+        """Creates a pipeline computing 'ab' + input, with a second InputPort
+        'pair' connected to a port with a tuple signature.
+        """
+        from vistrails.core.vistrail.port_spec import PortSpec
+
+        basic_pkg = get_vistrails_basic_pkg_id()
+        id_scope = IdScope()
+        pipeline = _Pipeline()
+
+        def add_module(module_name, **functions):
+            module = VistrailController.create_module_static(
+                    id_scope, basic_pkg, module_name)
+            for port, value in functions.iteritems():
+                module.add_function(VistrailController.create_function_static(
+                        id_scope, module, port, [value]))
+            pipeline.add_module(module)
+            return pipeline.modules[module.id]
+
+        def connect(src, src_port, dst, dst_port):
+            pipeline.add_connection(
+                    VistrailController.create_connection_static(
+                            id_scope, src, src_port, dst, dst_port))
+
+        upstream = add_module('ConcatenateString', str1='a', str2='b')
+        input_port = add_module('InputPort', name='input')
+        concat = add_module('ConcatenateString')
+        connect(upstream, 'value', concat, 'str1')
+        connect(input_port, 'InternalPipe', concat, 'str2')
+        output_port = add_module('OutputPort', name='output')
+        connect(concat, 'value', output_port, 'InternalPipe')
+
+        source = add_module('PythonSource')
+        source.add_port_spec(PortSpec(
+                id=id_scope.getNewId(PortSpec.vtType), name='pair',
+                type='input',
+                sigstring='(%s:Integer,%s:Integer)' % (basic_pkg, basic_pkg)))
+        pair_port = add_module('InputPort', name='pair')
+        connect(pair_port, 'InternalPipe', source, 'pair')
+        return pipeline, upstream.id, concat.id
+
+    def test_execute(self):
+        """Test that only the modules downstream of the input are run"""
+        from vistrails.core.modules.basic_modules import ConcatenateString
+
+        pipeline, upstream_id, concat_id = self.create_pipeline()
+        pipeline = Pipeline(pipeline)
+        executed = []
+        orig_compute = ConcatenateString.compute
+        def compute(module):
+            executed.append(module.moduleInfo['moduleId'])
+            orig_compute(module)
+        ConcatenateString.compute = compute
+        try:
+            prepared = pipeline.prepare('input')
+            self.assertEqual(prepared.inputs, ['input'])
+            result = prepared.execute(input='x')
+            self.assertEqual(result.output_port('output'), 'abx')
+            self.assertEqual(sorted(executed), sorted([upstream_id,
+                                                       concat_id]))
+
+            executed[:] = []
+            result = prepared.execute(input='y')
+            self.assertEqual(result.output_port('output'), 'aby')
+            self.assertEqual(executed, [concat_id])
+        finally:
+            ConcatenateString.compute = orig_compute
+
+    def test_errors(self):
+        """Test the errors for inputs that can't be prepared or set"""
+        pipeline = Pipeline(self.create_pipeline()[0])
+        self.assertRaises(ValueError, pipeline.prepare, 'missing')
+        self.assertRaises(ValueError, pipeline.prepare, 'input', 'input')
+        self.assertRaises(TypeError, pipeline.prepare, 'pair')
+        self.assertRaises(TypeError, pipeline.prepare)
+
+        prepared = pipeline.prepare('input')
+        self.assertRaises(ValueError, prepared.execute, missing='x')
+        self.assertRaises(ValueError, prepared.execute, pair=(1, 2))
+        self.assertRaises(ValueError, prepared.execute)
+        self.assertRaises(TypeError, prepared.execute, input=['x', 'y'])
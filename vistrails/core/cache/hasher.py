@@ -37,50 +37,67 @@
 from __future__ import division
 
 import unittest
+from vistrails.core.cache import utils
 from vistrails.core.cache.utils import hash_list
 
-try:
-    import hashlib
-    sha_hash = hashlib.sha1
-except ImportError:
-    import sha
-    sha_hash = sha.new
-
 ##############################################################################
 
 class Hasher(object):
+    """Computes the signatures of vistrail items.
+
+    The digest is utils.hash_function. Parameters and functions that have a
+    _signature attribute get their signature memoized there; parameters
+    reset it when they change, functions are checked against the signatures
+    of their parameters.
+
+    """
 
     @staticmethod
     def parameter_signature(p, constant_hasher_map={}):
-        k = (p.identifier, p.type, p.namespace)
-        custom_hasher = constant_hasher_map.get(k, None)
-        if custom_hasher:
-            return custom_hasher(p)
-        else:
-            hasher = sha_hash()
-            u = hasher.update
-            u(p.type)
-            u(p.identifier)
-            u(p.namespace or "")
-            u(p.strValue)
-            u(p.name)
-            u(p.evaluatedStrValue)
-            return hasher.digest()
+        if constant_hasher_map:
+            k = (p.identifier, p.type, p.namespace)
+            custom_hasher = constant_hasher_map.get(k, None)
+            if custom_hasher:
+                return custom_hasher(p)
+        hash_function = utils.hash_function
+        memo = getattr(p, '_signature', None)
+        if memo is not None and memo[0] is hash_function:
+            return memo[1]
+        hasher = hash_function()
+        u = hasher.update
+        u(p.type)
+        u(p.identifier)
+        u(p.namespace or "")
+        u(p.strValue)
+        u(p.name)
+        u(p.evaluatedStrValue)
+        sig = hasher.digest()
+        if hasattr(p, '_signature'):
+            p._signature = (hash_function, sig)
+        return sig
 
     @staticmethod
     def function_signature(function, constant_hasher_map={}):
-        hasher = sha_hash()
+        hash_function = utils.hash_function
+        param_sigs = [Hasher.parameter_signature(p, constant_hasher_map)
+                      for p in function.params]
+        key = (hash_function, function.name, function.returnType, param_sigs)
+        memo = getattr(function, '_signature', None)
+        if memo is not None and memo[0] == key:
+            return memo[1]
+        hasher = hash_function()
         u = hasher.update
         u(function.name)
         u(function.returnType)
-        u(hash_list(function.params,
-                    Hasher.parameter_signature,
-                    constant_hasher_map))
-        return hasher.digest()
+        u(Hasher.compound_signature(param_sigs))
+        sig = hasher.digest()
+        if hasattr(function, '_signature'):
+            function._signature = (key, sig)
+        return sig
 
     @staticmethod
     def control_param_signature(control_param, constant_hasher_map={}):
-        hasher = sha_hash()
+        hasher = utils.hash_function()
         u = hasher.update
         u(control_param.name)
         u(control_param.value)
@@ -88,7 +105,7 @@ class Hasher(object):
 
     @staticmethod
     def connection_signature(c):
-        hasher = sha_hash()
+        hasher = utils.hash_function()
         u = hasher.update
         u(c.source.name)
         u(c.destination.name)
@@ -96,7 +113,7 @@ class Hasher(object):
 
     @staticmethod
     def port_spec_signature(ps, constant_hasher_map={}):
-        hasher = sha_hash()
+        hasher = utils.hash_function()
         u = hasher.update
         u(ps.type)
         u(ps.name)
@@ -110,7 +127,7 @@ class Hasher(object):
         subpipelines
 
         """
-        hasher = sha_hash()
+        hasher = utils.hash_function()
         u = hasher.update
         u(Hasher.connection_signature(c))
         u(source_sig)
@@ -119,7 +136,7 @@ class Hasher(object):
 
     @staticmethod
     def module_signature(obj, constant_hasher_map={}):
-        hasher = sha_hash()
+        hasher = utils.hash_function()
         u = hasher.update
         u(obj.module_descriptor.name)
         u(obj.module_descriptor.package)
@@ -142,7 +159,7 @@ class Hasher(object):
         WARNING: For efficiency, upstream_sigs is mutated!
 
         """
-        hasher = sha_hash()
+        hasher = utils.hash_function()
         hasher.update(module_sig)
         upstream_sigs.sort()
         for pipeline_connection_sig in upstream_sigs:
@@ -156,7 +173,7 @@ class Hasher(object):
         signatures, assuming the list order is irrelevant
 
         """
-        hasher = sha_hash()
+        hasher = utils.hash_function()
         for h in sorted(sig_list):
             hasher.update(h)
         return hasher.digest()
@@ -191,3 +208,57 @@ class TestCacheHash(unittest.TestCase):
         api.add_connection(ps.id, 'b', so.id, 'value')
         # will fail if outputportspec is not hashed and cache is reused
         self.assertEqual(c.execute_current_workflow()[0][0].errors, {})
+
+    def test_memoized_signatures(self):
+        """Memoized signatures follow changes to parameters and functions."""
+        import copy
+        from vistrails.core.vistrail.module_function import ModuleFunction
+        from vistrails.core.vistrail.module_param import ModuleParam
+
+        def fresh_signature(function):
+            function = copy.copy(function)
+            function._signature = None
+            for p in function.params:
+                p._signature = None
+            return Hasher.function_signature(function)
+
+        param = ModuleParam(type='Float', val='1.0')
+        function = ModuleFunction(name='value', parameters=[param])
+        sig = Hasher.function_signature(function)
+        self.assertIsNotNone(param._signature)
+        self.assertEqual(Hasher.function_signature(function), sig)
+
+        param.strValue = '2.0'
+        self.assertIsNone(param._signature)
+        sig2 = Hasher.function_signature(function)
+        self.assertNotEqual(sig2, sig)
+        self.assertEqual(sig2, fresh_signature(function))
+
+        param.type = 'Integer'
+        self.assertEqual(Hasher.function_signature(function),
+                         fresh_signature(function))
+
+        function.params.append(ModuleParam(type='Float', val='3.0', pos=1))
+        sig3 = Hasher.function_signature(function)
+        self.assertNotEqual(sig3, sig2)
+        self.assertEqual(sig3, fresh_signature(function))
+
+        function.name = 'other'
+        self.assertEqual(Hasher.function_signature(function),
+                         fresh_signature(function))
+
+    def test_hash_function(self):
+        """Signatures use the selected digest."""
+        from vistrails.core.cache import utils
+        from vistrails.core.vistrail.module_param import ModuleParam
+
+        param = ModuleParam(type='String', val='abc')
+        sha1 = Hasher.parameter_signature(param)
+        utils.set_hash_function('md5')
+        try:
+            md5 = Hasher.parameter_signature(param)
+        finally:
+            utils.set_hash_function('sha1')
+        self.assertEqual(len(md5), 16)
+        self.assertEqual(Hasher.parameter_signature(param), sha1)
+        self.assertRaises(ValueError, utils.set_hash_function, 'nope')
@@ -0,0 +1,415 @@
+###############################################################################
+##
+## Copyright (C) 2014-2016, New York University.
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah.
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice,
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright
+##    notice, this list of conditions and the following disclaimer in the
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the New York University nor the names of its
+##    contributors may be used to endorse or promote products derived from
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""On-disk cache of module results, keyed by subpipeline signature.
+
+This is a second tier for the CachedInterpreter: the outputs of cacheable
+modules are pickled to a local directory, so that they survive restarts
+and can be shared by several VisTrails processes using the same directory.
+Files output by modules are stored once, under the hash of their content.
+"""
+
+from __future__ import division
+
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+import time
+
+from vistrails.core import debug
+from vistrails.core.cache.utils import sha_hash
+from vistrails.core.system import link_or_copy
+
+##############################################################################
+
+class UnsupportedValue(Exception):
+    """The value of an output port cannot be stored in the result cache."""
+
+
+class _StoredFile(object):
+    """Placeholder for a PathObject whose file is kept in the cache."""
+    def __init__(self, digest, basename):
+        self.digest = digest
+        self.basename = basename
+
+
+class CacheEntry(object):
+    def __init__(self, abs_name, time, size):
+        self.abs_name = abs_name
+        self.time = time
+        self.size = size
+
+
+class ResultCache(object):
+    """Stores the outputs of modules in a directory.
+
+    Results are pickled to 'results/<signature>', and the files referenced
+    by PathObject outputs are copied to 'files/<sha1 of content>'; they are
+    linked or copied out under their original name when loaded. Entries
+    are written to a temporary file and renamed, so that concurrent
+    processes never see partial entries. Once the directory grows above
+    max_size bytes, the least recently used entries are removed.
+    """
+
+    RESULTS_DIR = 'results'
+    FILES_DIR = 'files'
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        for subdir in (self.RESULTS_DIR, self.FILES_DIR):
+            path = os.path.join(directory, subdir)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._size = None
+
+    def _result_path(self, signature):
+        return os.path.join(self.directory, self.RESULTS_DIR, signature)
+
+    def _file_path(self, digest):
+        return os.path.join(self.directory, self.FILES_DIR, digest)
+
+    def _write_atomic(self, dest, write):
+        """Writes a file through write(fp), then renames it to dest."""
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest),
+                                   prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                write(fp)
+            if os.path.exists(dest):
+                # os.rename() doesn't replace files on Windows
+                os.remove(dest)
+            os.rename(tmp, dest)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return os.path.getsize(dest)
+
+    def _store_file(self, filename):
+        """Copies a file into the cache, returns its digest."""
+        hasher = sha_hash()
+        with open(filename, 'rb') as fp:
+            chunk = fp.read(self.BUFFER_SIZE)
+            while chunk:
+                hasher.update(chunk)
+                chunk = fp.read(self.BUFFER_SIZE)
+        digest = hasher.hexdigest()
+        dest = self._file_path(digest)
+        if os.path.exists(dest):
+            os.utime(dest, None)
+        else:
+            def write(fp):
+                with open(filename, 'rb') as src:
+                    shutil.copyfileobj(src, fp, self.BUFFER_SIZE)
+            self._add_size(self._write_atomic(dest, write))
+        return digest
+
+    def _to_storable(self, value):
+        """Converts an output value to something that can be pickled.
+
+        Raises UnsupportedValue if it can't be stored.
+        """
+        from vistrails.core.modules.basic_modules import PathObject
+        if value is None or isinstance(value, (bool, int, long, float,
+                                               basestring)):
+            return value
+        elif isinstance(value, list):
+            return [self._to_storable(v) for v in value]
+        elif isinstance(value, tuple):
+            return tuple(self._to_storable(v) for v in value)
+        elif isinstance(value, PathObject):
+            if not os.path.isfile(value.name):
+                raise UnsupportedValue("%r is not a file" % value.name)
+            return _StoredFile(self._store_file(value.name),
+                               os.path.basename(value.name))
+        elif type(value).__module__ == 'numpy':
+            if value.dtype.hasobject:
+                raise UnsupportedValue("numpy array of Python objects")
+            return value
+        raise UnsupportedValue("values of type %s can't be stored" %
+                               type(value).__name__)
+
+    def _from_storable(self, value, files, file_pool):
+        """Inverse of _to_storable(), records the paths of stored files.
+
+        Stored files are linked or copied into a new directory of file_pool,
+        under their original name, since the cache can evict them. Without a
+        file pool, the path inside the cache is used.
+        """
+        from vistrails.core.modules.basic_modules import PathObject
+        if isinstance(value, list):
+            return [self._from_storable(v, files, file_pool) for v in value]
+        elif isinstance(value, tuple):
+            return tuple(self._from_storable(v, files, file_pool)
+                         for v in value)
+        elif isinstance(value, _StoredFile):
+            path = self._file_path(value.digest)
+            if not os.path.isfile(path):
+                raise KeyError(value.digest)
+            files.append(path)
+            if file_pool is None:
+                return PathObject(path)
+            directory = file_pool.create_directory(prefix='vt_cached').name
+            restored = os.path.join(directory, value.basename)
+            link_or_copy(path, restored)
+            return PathObject(restored)
+        return value
+
+    def store(self, signature, outputs):
+        """store(signature: str, outputs: dict) -> bool
+
+        Stores the output values of a module under its signature. Returns
+        False (and stores nothing) if one of the values is not supported.
+        """
+        try:
+            storable = dict((port, self._to_storable(value))
+                            for port, value in outputs.iteritems())
+        except UnsupportedValue, e:
+            debug.debug("Not storing result %s: %s" % (signature, e))
+            return False
+        size = self._write_atomic(
+                self._result_path(signature),
+                lambda fp: pickle.dump(storable, fp, pickle.HIGHEST_PROTOCOL))
+        self._add_size(size)
+        self.stores += 1
+        return True
+
+    def load(self, signature, ports=(), file_pool=None):
+        """load(signature: str, ports: list of str, file_pool: FilePool)
+        -> dict or None
+
+        Returns the output values stored for the given signature, or None if
+        there are none or if they don't include all the requested ports.
+        Files are restored in file_pool, see _from_storable().
+        """
+        path = self._result_path(signature)
+        outputs = None
+        files = []
+        try:
+            with open(path, 'rb') as fp:
+                outputs = pickle.load(fp)
+            outputs = dict((port, self._from_storable(value, files,
+                                                      file_pool))
+                           for port, value in outputs.iteritems())
+        except (IOError, OSError):
+            outputs = None
+        except KeyError:
+            # A referenced file was evicted
+            outputs = None
+            self._remove(path)
+        except Exception, e:
+            debug.warning("Discarding corrupted cached result %s" %
+                          signature, e)
+            outputs = None
+            self._remove(path)
+        if outputs is None or any(port not in outputs for port in ports):
+            self.misses += 1
+            return None
+        for p in [path] + files:
+            try:
+                os.utime(p, None)
+            except OSError:
+                pass
+        self.hits += 1
+        return outputs
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        if self._size is not None:
+            self._size -= size
+
+    def _entries(self):
+        entries = []
+        for subdir in (self.RESULTS_DIR, self.FILES_DIR):
+            path = os.path.join(self.directory, subdir)
+            for name in os.listdir(path):
+                if name.startswith('.tmp_'):
+                    continue
+                abs_name = os.path.join(path, name)
+                try:
+                    statinfo = os.stat(abs_name)
+                except OSError:
+                    continue
+                entries.append(CacheEntry(abs_name, statinfo.st_mtime,
+                                          statinfo.st_size))
+        return entries
+
+    def size(self):
+        """size() -> int
+
+        Returns the total size of the cached results and files, in bytes.
+        """
+        if self._size is None:
+            self._size = sum(entry.size for entry in self._entries())
+        return self._size
+
+    def _add_size(self, size):
+        self.size()
+        self._size += size
+        if self.max_size and self._size > self.max_size:
+            self.remove_lru()
+
+    def remove_lru(self):
+        """remove_lru() -> None
+
+        Removes the least recently used entries until the cache is back
+        under 90% of its maximum size. The directory is scanned again, so
+        entries added by other processes are accounted for.
+        """
+        entries = self._entries()
+        entries.sort(key=lambda entry: entry.time)
+        self._size = sum(entry.size for entry in entries)
+        target = self.max_size * 0.9
+        debug.debug("Result cache has %d entries and %d bytes" % (
+                    len(entries), self._size))
+        for entry in entries:
+            if self._size <= target:
+                break
+            self._remove(entry.abs_name)
+
+    def clear(self):
+        """clear() -> None
+
+        Removes all the entries from the cache.
+        """
+        for entry in self._entries():
+            self._remove(entry.abs_name)
+        self._size = 0
+
+    def get_stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'size': self.size()}
+
+##############################################################################
+
+import unittest
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vt_results_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_roundtrip(self):
+        cache = ResultCache(self.directory)
+        self.assertTrue(cache.store('abc', {'value': [1, 2.5, u'three'],
+                                            'other': None}))
+        self.assertEqual(cache.load('abc', ['value']),
+                         {'value': [1, 2.5, u'three'], 'other': None})
+        self.assertIsNone(cache.load('abc', ['missing']))
+        self.assertIsNone(cache.load('def'))
+        self.assertEqual((cache.hits, cache.misses, cache.stores), (1, 2, 1))
+
+        # Another instance sees the same results
+        cache2 = ResultCache(self.directory)
+        self.assertEqual(cache2.load('abc')['value'], [1, 2.5, u'three'])
+
+    def test_unsupported(self):
+        cache = ResultCache(self.directory)
+        self.assertFalse(cache.store('abc', {'value': object()}))
+        self.assertIsNone(cache.load('abc'))
+
+    def test_files(self):
+        from vistrails.core.modules.basic_modules import PathObject
+        cache = ResultCache(self.directory)
+        src = os.path.join(self.directory, 'input.txt')
+        with open(src, 'wb') as fp:
+            fp.write('some data')
+        self.assertTrue(cache.store('abc', {'value': PathObject(src)}))
+        self.assertTrue(cache.store('def', {'value': PathObject(src)}))
+        os.remove(src)
+        for sig in ('abc', 'def'):
+            path = cache.load(sig)['value'].name
+            self.assertNotEqual(path, src)
+            with open(path, 'rb') as fp:
+                self.assertEqual(fp.read(), 'some data')
+        # Content is only stored once
+        self.assertEqual(len(os.listdir(os.path.join(self.directory,
+                                                     'files'))), 1)
+
+    def test_restored_files(self):
+        from vistrails.core.modules.basic_modules import PathObject
+        from vistrails.core.modules.module_utils import FilePool
+        cache = ResultCache(self.directory)
+        src = os.path.join(self.directory, 'input.txt')
+        with open(src, 'wb') as fp:
+            fp.write('some data')
+        self.assertTrue(cache.store('abc', {'value': PathObject(src)}))
+        file_pool = FilePool()
+        try:
+            path = cache.load('abc', file_pool=file_pool)['value'].name
+            self.assertTrue(path.startswith(file_pool.directory))
+            self.assertEqual(os.path.basename(path), 'input.txt')
+            # The restored file survives the cache
+            cache.clear()
+            with open(path, 'rb') as fp:
+                self.assertEqual(fp.read(), 'some data')
+        finally:
+            file_pool.cleanup()
+
+    def test_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("numpy is not available")
+        cache = ResultCache(self.directory)
+        self.assertTrue(cache.store('abc', {'value': numpy.arange(10)}))
+        self.assertTrue((cache.load('abc')['value'] ==
+                         numpy.arange(10)).all())
+
+    def test_eviction(self):
+        cache = ResultCache(self.directory, max_size=3000)
+        for i in xrange(5):
+            cache.store('sig%d' % i, {'value': 'x' * 1000})
+            # Make sure access times are different
+            t = time.time() - 100 + i
+            os.utime(cache._result_path('sig%d' % i), (t, t))
+        self.assertLessEqual(cache.size(), 3000)
+        self.assertIsNone(cache.load('sig0'))
+        self.assertIsNotNone(cache.load('sig4'))
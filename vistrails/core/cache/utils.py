@@ -45,9 +45,41 @@ except ImportError:
     sha_hash = sha.new
 
 ##############################################################################
+# Digest used for signatures
+
+hash_functions = {'sha1': sha_hash}
+try:
+    hash_functions['md5'] = hashlib.md5
+except NameError:
+    pass
+try:
+    import xxhash
+except ImportError:
+    pass
+else:
+    # Non-cryptographic, much faster on the short strings signatures are made
+    # of
+    hash_functions['xxhash'] = xxhash.xxh64
+
+hash_function = sha_hash
+
+def set_hash_function(name):
+    """set_hash_function(name: str) -> None
+    Selects the digest used for signatures, one of hash_functions.
+
+    Signatures computed with different digests can't be compared, so caches
+    of signatures have to be flushed after calling this.
+
+    """
+    global hash_function
+    try:
+        hash_function = hash_functions[name]
+    except KeyError:
+        raise ValueError("Unknown hash function %r, available: %s" % (
+                         name, ", ".join(sorted(hash_functions))))
 
 def hash_list(lst, hasher_f, constant_hasher_map={}):
-    hasher = sha_hash()
+    hasher = hash_function()
     hash_l = [hasher_f(el, constant_hasher_map) for el in lst]
     hash_l.sort()
     for hel in hash_l: hasher.update(hel)
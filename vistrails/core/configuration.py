@@ -63,7 +63,11 @@ _simple_documentation = """
 autoConnect: Automatically connect dragged in modules
 autoSave: Automatically save backup vistrails every two minutes
 batch: Run in batch mode instead of interactive mode
+batchProcesses: Number of processes running different vistrails in batch mode
 cache: Cache previous results so they may be used in future computations
+cacheMaxEntries: Maximum number of cached modules (0 for no limit)
+cacheMaxSize: Maximum size of cached results (MB, 0 for no limit)
+cachePolicy: Which cached modules to discard first (lru or lfu)
 customVersionColors: Allow setting custom colors for versions
 dataDir: Default data directory
 db: The name for the database to load the vistrail from
@@ -76,6 +80,8 @@ enablePackagesSilently: Automatically enable packages when needed
 errorLog: Write errors to a log file
 NoExecute: Do not execute specified workflows
 executionLog: Track execution provenance when running workflows
+executionThreads: Number of threads executing independent modules (0 to disable)
+explorationProcesses: Number of processes running parameter explorations in batch mode
 fileDir: Default vistrail directory
 fixedCustomVersionColorSaturation: Don't vary custom color with age
 fixedSpreadsheetCells: Draw spreadsheet cells at a fixed size
@@ -108,6 +114,8 @@ enableUsage: Enable sending anonymous usage statistics
 disableUsage: Disable sending anonymous usage statistics
 repositoryHTTPURL: Remote package repository URL
 repositoryLocalPath: Local package repository directory
+resultCacheDir: Directory where module results are persisted (disabled if unset)
+resultCacheSize: Maximum size of the persistent result cache (MB)
 rootDirectory: Directory that contains the VisTrails source code
 rpcConfig: Config file for server connection options
 rpcInstances: Number of other instances that vistrails should start
@@ -125,6 +133,7 @@ showSpreadsheetOnly: Hides the VisTrails main window
 showVariantErrors: Show error when variant input value doesn't match type during execution
 showVistrailsNews: Show news from VisTrails (once per message)
 showWindow: Show the main window
+signatureHash: Digest used to compute the signatures of modules for caching
 singleInstance: Do not allow more than one instance of VisTrails to run at once
 spreadsheetDumpCells: Defines the location for generated cells
 spreadsheetDumpPDF: Whether the spreadsheet should dump images in PDF format
@@ -162,10 +171,34 @@ batch: Boolean
 
     Run vistrails in batch mode instead of interactive mode.
 
+batchProcesses: Integer
+
+    Number of worker processes running the workflows of different vistrails
+    when executing in batch mode. Each vistrail is loaded and saved by a
+    single process. 1 runs everything in the VisTrails process.
+
 cache: Boolean
 
     Cache previous results so they may be used in future computations.
 
+cacheMaxEntries: Integer
+
+    The maximum number of modules kept in the execution cache. Once it is
+    exceeded after an execution, cached modules are discarded according to
+    cachePolicy. 0 means no limit.
+
+cacheMaxSize: Integer
+
+    The maximum estimated size (in MB) of the results kept in the execution
+    cache. Once it is exceeded after an execution, cached modules are
+    discarded according to cachePolicy. 0 means no limit.
+
+cachePolicy: String
+
+    Which cached modules get discarded first when the cache is over budget:
+    "lru" discards the least recently used ones, "lfu" the least frequently
+    used ones.
+
 customVersionColors: Boolean
 
     Allow setting custom colors for versions, and display these colors in the
@@ -219,6 +252,18 @@ executionLog: Boolean
 
     Track execution provenance when running workflows.
 
+executionThreads: Integer
+
+    If larger than 1, the modules of a workflow are scheduled as soon as
+    their upstream modules are done, and modules marked as thread-safe run
+    concurrently on that many threads. 0 runs the workflow sequentially.
+
+explorationProcesses: Integer
+
+    Number of worker processes executing the cells of a parameter
+    exploration when running without the GUI. 1 runs the cells one after
+    the other.
+
 fileDir: Path
 
     The location that VisTrails uses as a default directory for
@@ -371,6 +416,18 @@ reportUsage: Integer
 
     Report anonymous usage statistics to the developers
 
+resultCacheDir: Path
+
+    The directory where the results of cacheable modules are stored, so that
+    they can be reused after a restart or by other VisTrails processes
+    sharing the directory. The persistent cache is disabled if this is not
+    set.
+
+resultCacheSize: Integer
+
+    The maximum size (in MB) of the persistent result cache; least recently
+    used results are discarded when it is exceeded.
+
 enableUsage: Boolean
 
     Enable sending anonymous usage statistics
@@ -475,6 +532,12 @@ showWindow: Boolean
 
     Show the main VisTrails window.
 
+signatureHash: String
+
+    The digest used to compute the signatures identifying modules in the
+    cache: sha1, md5 or, if the xxhash library is installed, the faster
+    non-cryptographic xxhash.
+
 singleInstance: Boolean
 
     Whether or not VisTrails should only allow one instance to be
@@ -690,8 +753,22 @@ base_config = {
     [ConfigField('autoSave', True, bool, ConfigType.ON_OFF),
      ConfigField('dbDefault', False, bool, ConfigType.ON_OFF),
      ConfigField('cache', True, bool, ConfigType.ON_OFF),
+     ConfigField('cacheMaxEntries', 0, int, depends_on='cache'),
+     ConfigField('cacheMaxSize', 0, int, depends_on='cache'),
+     ConfigField('cachePolicy', "lru", str, widget_type="combo",
+                 widget_options={"allowed_values": ["lru", "lfu"],
+                                 "label": "Cache eviction policy",
+                                 "remap": {"lru": "Least Recently Used",
+                                           "lfu": "Least Frequently Used"}},
+                 depends_on='cache'),
+     ConfigField('resultCacheDir', None, ConfigPath, depends_on='cache'),
+     ConfigField('resultCacheSize', 1024, int, depends_on='cache'),
+     ConfigField('signatureHash', 'sha1', str, depends_on='cache'),
      ConfigField('stopOnError', True, bool, ConfigType.ON_OFF),
      ConfigField('executionLog', True, bool, ConfigType.ON_OFF),
+     ConfigField('executionThreads', 0, int),
+     ConfigField('explorationProcesses', 1, int),
+     ConfigField('batchProcesses', 1, int),
      ConfigField('errorLog', True, bool, ConfigType.ON_OFF),
      ConfigField('defaultFileType', system.vistrails_default_file_type(), str,
                  widget_type="combo",
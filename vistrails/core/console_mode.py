@@ -35,7 +35,7 @@
 ###############################################################################
 """ Module used when running  vistrails uninteractively """
 from __future__ import absolute_import, division
-import os.path
+import os
 import unittest
 
 from vistrails.core.application import is_running_gui
@@ -45,10 +45,13 @@ import vistrails.core.db.io
 from vistrails.core.db.io import load_vistrail
 from vistrails.core.db.locator import XMLFileLocator, ZIPFileLocator
 from vistrails.core import debug
+from vistrails.core.modules.vistrails_module import ModuleError
+from vistrails.core.param_explore import ParameterExplorationRunner
 import vistrails.core.interpreter.cached
 from vistrails.core.vistrail.job import Workflow as JobWorkflow
 import vistrails.core.vistrail.pipeline
-from vistrails.core.utils import VistrailsInternalError
+from vistrails.core.utils import VistrailsInternalError, fork_pool, \
+    worker_state
 from vistrails.core.vistrail.controller import VistrailController
 import vistrails.core.packagemanager
 import vistrails.core.system
@@ -66,96 +69,136 @@ def run_and_get_results(w_list, parameters='',
                            extra_info:dict)
     Run all workflows in w_list, and returns an interpreter result object.
     version can be a tag name or a version id.
+    Each vistrail is loaded once, and written once after its workflows ran.
     
     """
+    if not update_vistrail:
+        conf = get_vistrails_configuration()
+        if conf.has('thumbs'):
+            conf.thumbs.autoSave = False
+
+    result = [None] * len(w_list)
+    for locator, entries in group_by_locator(w_list):
+        for index, run in run_vistrail_workflows(locator, entries, parameters,
+                                                 update_vistrail, extra_info,
+                                                 reason):
+            result[index] = run
+    return result
+
+def group_by_locator(w_list):
+    """group_by_locator(w_list: list of (locator, version))
+                       -> list of (locator, list of (index, version))
+    Groups the entries of w_list that come from the same vistrail, keeping
+    their positions in w_list.
+
+    """
+    groups = []
+    for index, (locator, workflow) in enumerate(w_list):
+        for group_locator, entries in groups:
+            if group_locator == locator:
+                entries.append((index, workflow))
+                break
+        else:
+            groups.append((locator, [(index, workflow)]))
+    return groups
+
+def run_vistrail_workflows(locator, entries, parameters='',
+                           update_vistrail=True, extra_info=None,
+                           reason='Console Mode Execution'):
+    """run_vistrail_workflows(locator: locator,
+                              entries: list of (index, version),
+                              parameters: str, update_vistrail: boolean,
+                              extra_info: dict) -> list of (index, result)
+    Runs workflows of a single vistrail, sharing one controller, and
+    returns the interpreter result objects along with their indexes.
+
+    """
+    (v, abstractions , thumbnails, mashups)  = load_vistrail(locator)
+    controller = VistrailController(v, locator, abstractions, thumbnails,
+                                    mashups, auto_save=update_vistrail)
     elements = parameters.split("$&$")
-    aliases = {}
-    params = []
     result = []
-    for locator, workflow in w_list:
-        (v, abstractions , thumbnails, mashups)  = load_vistrail(locator)
-        controller = VistrailController(v, locator, abstractions, thumbnails,
-                                        mashups, auto_save=update_vistrail)
-        if isinstance(workflow, basestring):
-            version = v.get_version_number(workflow)
-        elif isinstance(workflow, (int, long)):
-            version = workflow
-        elif workflow is None:
-            version = controller.get_latest_version_in_graph()
-        else:
-            msg = "Invalid version tag or number: %s" % workflow
-            raise VistrailsInternalError(msg)
-        controller.change_selected_version(version)
-
-        for e in elements:
-            pos = e.find("=")
-            if pos != -1:
-                key = e[:pos].strip()
-                value = e[pos+1:].strip()
-            
-                if controller.current_pipeline.has_alias(key):
-                    aliases[key] = value
-                elif extra_info and 'mashup_id' in extra_info:
-                    # new-style mashups can have aliases not existing in pipeline
-                    for mashuptrail in mashups:
-                        if mashuptrail.vtVersion == version:
-                            mashup = mashuptrail.getMashup(extra_info['mashup_id'])
-                            c = mashup.getAliasByName(key).component
-                            params.append((c.vttype, c.vtid, value))
-
-        if not update_vistrail:
-            conf = get_vistrails_configuration()
-            if conf.has('thumbs'):
-                conf.thumbs.autoSave = False
-        
-        jobMonitor = controller.jobMonitor
-        current_workflow = jobMonitor.currentWorkflow()
-        if not current_workflow:
-            for job in jobMonitor.workflows.itervalues():
-                try:
-                    job_version = int(job.version)
-                except ValueError:
-                    try:
-                        job_version =  v.get_version_number(job.version)
-                    except KeyError:
-                        # this is a PE or mashup
-                        continue
-                if version == job_version:
-                    current_workflow = job
-                    jobMonitor.startWorkflow(job)
+    try:
+        for index, workflow in entries:
+            aliases = {}
+            params = []
+            if isinstance(workflow, basestring):
+                version = v.get_version_number(workflow)
+            elif isinstance(workflow, (int, long)):
+                version = workflow
+            elif workflow is None:
+                version = controller.get_latest_version_in_graph()
+            else:
+                msg = "Invalid version tag or number: %s" % workflow
+                raise VistrailsInternalError(msg)
+            controller.change_selected_version(version)
+
+            for e in elements:
+                pos = e.find("=")
+                if pos != -1:
+                    key = e[:pos].strip()
+                    value = e[pos+1:].strip()
+                
+                    if controller.current_pipeline.has_alias(key):
+                        aliases[key] = value
+                    elif extra_info and 'mashup_id' in extra_info:
+                        # new-style mashups can have aliases not existing in pipeline
+                        for mashuptrail in mashups:
+                            if mashuptrail.vtVersion == version:
+                                mashup = mashuptrail.getMashup(extra_info['mashup_id'])
+                                c = mashup.getAliasByName(key).component
+                                params.append((c.vttype, c.vtid, value))
+
+            jobMonitor = controller.jobMonitor
+            current_workflow = jobMonitor.currentWorkflow()
             if not current_workflow:
-                current_workflow = JobWorkflow(version)
-                jobMonitor.startWorkflow(current_workflow)
+                for job in jobMonitor.workflows.itervalues():
+                    try:
+                        job_version = int(job.version)
+                    except ValueError:
+                        try:
+                            job_version =  v.get_version_number(job.version)
+                        except KeyError:
+                            # this is a PE or mashup
+                            continue
+                    if version == job_version:
+                        current_workflow = job
+                        jobMonitor.startWorkflow(job)
+                if not current_workflow:
+                    current_workflow = JobWorkflow(version)
+                    jobMonitor.startWorkflow(current_workflow)
 
-        try:
-            (results, _) = \
-            controller.execute_current_workflow(custom_aliases=aliases,
-                                                custom_params=params,
-                                                extra_info=extra_info,
-                                                reason=reason)
-        finally:
-            jobMonitor.finishWorkflow()
-        new_version = controller.current_version
-        if new_version != version:
-            debug.log("Version '%s' (%s) was upgraded. The actual "
-                      "version executed was %s" % (
-                      workflow, version, new_version))
-        run = results[0]
-        run.workflow_info = (locator.name, new_version)
-        run.pipeline = controller.current_pipeline
-
-        if update_vistrail:
+            try:
+                (results, _) = \
+                controller.execute_current_workflow(custom_aliases=aliases,
+                                                    custom_params=params,
+                                                    extra_info=extra_info,
+                                                    reason=reason)
+            finally:
+                jobMonitor.finishWorkflow()
+            new_version = controller.current_version
+            if new_version != version:
+                debug.log("Version '%s' (%s) was upgraded. The actual "
+                          "version executed was %s" % (
+                          workflow, version, new_version))
+            run = results[0]
+            run.workflow_info = (locator.name, new_version)
+            run.pipeline = controller.current_pipeline
+
+            result.append((index, run))
+            if current_workflow.jobs:
+                if current_workflow.completed():
+                    run.job = "COMPLETED"
+                else:
+                    run.job = "RUNNING: %s" % current_workflow.id
+                    for job in current_workflow.jobs.itervalues():
+                        if not job.finished:
+                            run.job += "\n  %s %s %s" % (job.start, job.name, job.description())
+                print run.job
+    finally:
+        # the workflows that ran are saved even if one failed
+        if update_vistrail and result:
             controller.write_vistrail(locator)
-        result.append(run)
-        if current_workflow.jobs:
-            if current_workflow.completed():
-                run.job = "COMPLETED"
-            else:
-                run.job = "RUNNING: %s" % current_workflow.id
-                for job in current_workflow.jobs.itervalues():
-                    if not job.finished:
-                        run.job += "\n  %s %s %s" % (job.start, job.name, job.description())
-            print run.job
     return result
 
 ################################################################################
@@ -256,11 +299,21 @@ def get_vt_graph(vt_list, tree_info, pdf=False):
 ################################################################################
 
 def run(w_list, parameters='', update_vistrail=True,
-        extra_info=None, reason="Console Mode Execution"):
+        extra_info=None, reason="Console Mode Execution", processes=None):
     """run(w_list: list of (locator, version), parameters: str) -> boolean
     Run all workflows in w_list, version can be a tag name or a version id.
+    Without the GUI, different vistrails are run on the given number of
+    processes (defaults to the batchProcesses setting).
     Returns list of errors (empty list if there are no errors)
     """
+    if processes is None:
+        processes = get_vistrails_configuration().check('batchProcesses') or 1
+    groups = group_by_locator(w_list)
+    if (processes > 1 and len(groups) > 1 and hasattr(os, 'fork') and
+            not is_running_gui()):
+        return run_in_processes(groups, processes, parameters,
+                                update_vistrail, extra_info, reason)
+
     all_errors = []
     results = run_and_get_results(w_list, parameters,
                                   update_vistrail,extra_info, reason)
@@ -271,33 +324,95 @@ def run(w_list, parameters='', update_vistrail=True,
             all_errors.append(result.workflow_info + err)
     return all_errors
 
+def _run_group(group_index):
+    # the workers get the batch as (groups, arguments) by forking
+    groups, args = worker_state()
+    locator, entries = groups[group_index]
+    if not args[1]:
+        conf = get_vistrails_configuration()
+        if conf.has('thumbs'):
+            conf.thumbs.autoSave = False
+    result = []
+    for index, run in run_vistrail_workflows(locator, entries, *args):
+        # the modules the errors refer to can't be sent back
+        errors = [(run.workflow_info + (module_id,), str(error),
+                   getattr(error, 'errorTrace', None))
+                  for module_id, error in sorted(run.errors.iteritems())]
+        result.append((index, errors))
+    return result
+
+def run_in_processes(groups, processes, parameters='', update_vistrail=True,
+                     extra_info=None, reason="Console Mode Execution"):
+    """run_in_processes(groups: list of (locator, list of (index, version)),
+                        processes: int, parameters: str,
+                        update_vistrail: boolean, extra_info: dict) -> list
+    Runs the groups returned by group_by_locator() on a pool of forked
+    processes, each vistrail being handled by a single process. Returns
+    the errors like run() does, as ModuleErrors without their module.
+
+    """
+    batch = (groups, (parameters, update_vistrail, extra_info, reason))
+    results = []
+    with fork_pool(min(processes, len(groups)), batch) as pool:
+        for result in pool.imap_unordered(_run_group, xrange(len(groups))):
+            results.extend(result)
+    all_errors = []
+    for index, errors in sorted(results):
+        for info, msg, trace in errors:
+            all_errors.append(info + (ModuleError(None, msg,
+                                                  errorTrace=trace),))
+    return all_errors
+
 def run_parameter_exploration(locator, pe_id, extra_info = {},
-                              reason="Console Mode Parameter Exploration Execution"):
+                              reason="Console Mode Parameter Exploration Execution",
+                              processes=None):
     """run_parameter_exploration(w_list: (locator, version),
                                  pe_id: str/int,
-                                 reason: str) -> (pe_id, [error msg])
+                                 reason: str,
+                                 processes: int) -> (pe_id, [error msg])
     Run parameter exploration in w, and returns an interpreter result object.
     version can be a tag name or a version id.
+    Without the GUI, the cells run on the given number of processes
+    (defaults to the explorationProcesses setting).
     
     """
-    if is_running_gui():
-        from vistrails.gui.vistrail_controller import VistrailController as \
-             GUIVistrailController
-        try:
-            (v, abstractions , thumbnails, mashups)  = load_vistrail(locator)
+    try:
+        (v, abstractions , thumbnails, mashups)  = load_vistrail(locator)
+        if is_running_gui():
+            from vistrails.gui.vistrail_controller import VistrailController as \
+                 GUIVistrailController
             controller = GUIVistrailController(v, locator, abstractions, 
                                                thumbnails, mashups)
-            try:
-                pe_id = int(pe_id)
-                pe = controller.vistrail.get_paramexp(pe_id)
-            except ValueError:
-                pe = controller.vistrail.get_named_paramexp(pe_id)
-            controller.change_selected_version(pe.action_id)
+        else:
+            controller = VistrailController(v, locator, abstractions,
+                                            thumbnails, mashups,
+                                            auto_save=False)
+        try:
+            pe_id = int(pe_id)
+            pe = controller.vistrail.get_paramexp(pe_id)
+        except ValueError:
+            pe = controller.vistrail.get_named_paramexp(pe_id)
+        controller.change_selected_version(pe.action_id)
+        if is_running_gui():
             controller.executeParameterExploration(pe, extra_info=extra_info,
                                                    showProgress=False)
-        except Exception, e:
-            return (locator, pe_id,
-                    debug.format_exception(e), debug.format_exc())
+            return
+
+        if processes is None:
+            processes = get_vistrails_configuration().check(
+                    'explorationProcesses') or 1
+        runner = ParameterExplorationRunner(controller, pe, processes,
+                                            extra_info, reason)
+        errors = []
+        for cell in runner.run():
+            for module_id, error in sorted(cell['errors'].iteritems()):
+                errors.append("cell %s_%s_%s module %s: %s" % (
+                              cell['position'] + (module_id, error)))
+        if errors:
+            return (locator, pe_id, "\n".join(errors), "")
+    except Exception, e:
+        return (locator, pe_id,
+                debug.format_exception(e), debug.format_exc())
 
 def run_parameter_explorations(w_list, extra_info = {},
                        reason="Console Mode Parameter Exploration Execution"):
@@ -420,6 +535,47 @@ class TestConsoleMode(unittest.TestCase):
         result = run([(locator, "v2")], update_vistrail=False)
         self.assertEquals(len(result), 0)
 
+    def test_batch(self):
+        import vistrails.core.console_mode as console_mode
+        resources = os.path.join(vistrails.core.system.vistrails_root_directory(),
+                                 'tests', 'resources')
+        python_source = XMLFileLocator(os.path.join(resources,
+                                                    'pythonsource.xml'))
+        module_error = XMLFileLocator(os.path.join(resources,
+                                                   'dynamic_module_error.xml'))
+        w_list = [(python_source, "testPortsAndFail"),
+                  (module_error, "test"),
+                  (python_source, "test_simple_success")]
+        self.assertEqual(group_by_locator(w_list),
+                         [(python_source, [(0, "testPortsAndFail"),
+                                           (2, "test_simple_success")]),
+                          (module_error, [(1, "test")])])
+
+        loaded = []
+        original_load_vistrail = console_mode.load_vistrail
+        def counting_load_vistrail(locator, *args, **kwargs):
+            loaded.append(locator)
+            return original_load_vistrail(locator, *args, **kwargs)
+        console_mode.load_vistrail = counting_load_vistrail
+        try:
+            results = run_and_get_results(w_list, update_vistrail=False)
+        finally:
+            console_mode.load_vistrail = original_load_vistrail
+        self.assertEqual(loaded, [python_source, module_error])
+        self.assertEqual([r.workflow_info[0] for r in results],
+                         [python_source.name, module_error.name,
+                          python_source.name])
+        self.assertEqual(len(results[2].executed), 1)
+
+        errors = run(w_list, update_vistrail=False, processes=1)
+        self.assertNotEqual(len(errors), 0)
+        if hasattr(os, 'fork'):
+            forked = run(w_list, update_vistrail=False, processes=2)
+            self.assertEqual([e[:3] + (str(e[3]),) for e in forked],
+                             [e[:3] + (str(e[3]),) for e in errors])
+            for e in forked:
+                self.assertIsInstance(e[3], ModuleError)
+
     def test_ticket_73(self):
         # Tests serializing a custom-named module to disk
         locator = XMLFileLocator(vistrails.core.system.vistrails_root_directory() + 
@@ -62,8 +62,9 @@ class Bidict(dict):
     def __delitem__(self, key):
         v = self[key]
         dict.__delitem__(self, key)
-        # Might not be true if mapping was not bijective
-        if v in self.inverse:
+        # Might not be true if mapping was not bijective, in which case the
+        # inverse might point to another key that should be kept
+        if self.inverse.get(v) == key:
             del self.inverse[v]
 
     def __copy__(self):
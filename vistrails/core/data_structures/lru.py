@@ -0,0 +1,267 @@
+###############################################################################
+##
+## Copyright (C) 2014-2016, New York University.
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah.
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice,
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright
+##    notice, this list of conditions and the following disclaimer in the
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the New York University nor the names of its
+##    contributors may be used to endorse or promote products derived from
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+################################################################################
+
+from __future__ import division
+
+# Links of the list ordering entries from least to most recently used
+_PREV, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+
+class LRUCache(object):
+    """ Dictionary-like container holding at most a fixed number of
+    entries. Storing a new entry in a full cache evicts the least recently
+    used one. Keys listed in pinned are never evicted and don't count
+    toward the capacity.
+
+    Only __getitem__(), get() and __setitem__() count as uses; peek(),
+    __contains__() and iteration leave the order untouched.
+
+    """
+
+    def __init__(self, capacity, pinned=()):
+        """ LRUCache(capacity: int, pinned: iterable) -> LRUCache
+
+        """
+        self.capacity = capacity
+        self.pinned = set(pinned)
+        # Maps keys to links [prev, next, key, value] of a circular doubly
+        # linked list around self._root
+        self._links = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self._pinned_entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _unlink(self, link):
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+
+    def _append(self, link):
+        last = self._root[_PREV]
+        link[_PREV] = last
+        link[_NEXT] = self._root
+        last[_NEXT] = link
+        self._root[_PREV] = link
+
+    def _evict(self):
+        while len(self._links) > self.capacity:
+            link = self._root[_NEXT]
+            self._unlink(link)
+            del self._links[link[_KEY]]
+            self.evictions += 1
+
+    def _iterlinks(self):
+        link = self._root[_NEXT]
+        while link is not self._root:
+            yield link
+            link = link[_NEXT]
+
+    def __len__(self):
+        return len(self._links) + len(self._pinned_entries)
+
+    def __contains__(self, key):
+        return key in self._links or key in self._pinned_entries
+
+    def __iter__(self):
+        for key in self._pinned_entries:
+            yield key
+        for link in self._iterlinks():
+            yield link[_KEY]
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return list(self)
+
+    def iteritems(self):
+        for item in self._pinned_entries.iteritems():
+            yield item
+        for link in self._iterlinks():
+            yield link[_KEY], link[_VALUE]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def peek(self, key, default=None):
+        """ peek(key, default) -> value
+        Returns the value for key without marking it as used
+
+        """
+        try:
+            return self._pinned_entries[key]
+        except KeyError:
+            pass
+        link = self._links.get(key)
+        if link is None:
+            return default
+        return link[_VALUE]
+
+    def __getitem__(self, key):
+        try:
+            return self._pinned_entries[key]
+        except KeyError:
+            pass
+        link = self._links[key]
+        self._unlink(link)
+        self._append(link)
+        return link[_VALUE]
+
+    def get(self, key, default=None):
+        """ get(key, default) -> value
+        Returns the value for key, marking it as used, and updates the hit
+        and miss counters
+
+        """
+        try:
+            value = self[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.pinned:
+            self._pinned_entries[key] = value
+            return
+        link = self._links.get(key)
+        if link is not None:
+            self._unlink(link)
+            link[_VALUE] = value
+        else:
+            link = self._links[key] = [None, None, key, value]
+        self._append(link)
+        self._evict()
+
+    def __delitem__(self, key):
+        try:
+            del self._pinned_entries[key]
+        except KeyError:
+            self._unlink(self._links.pop(key))
+
+    def pop(self, key, *args):
+        if key in self._pinned_entries:
+            return self._pinned_entries.pop(key)
+        try:
+            link = self._links.pop(key)
+        except KeyError:
+            if args:
+                return args[0]
+            raise
+        self._unlink(link)
+        return link[_VALUE]
+
+    def clear(self):
+        self._links.clear()
+        self._root[:] = [self._root, self._root, None, None]
+        self._pinned_entries.clear()
+
+    def resize(self, capacity):
+        """ resize(capacity: int) -> None
+        Changes the capacity, evicting entries if needed
+
+        """
+        self.capacity = capacity
+        self._evict()
+
+################################################################################
+
+import unittest
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_eviction(self):
+        """Test that the least recently used entry is evicted"""
+        c = LRUCache(3)
+        for i in xrange(3):
+            c[i] = str(i)
+        self.assertEqual(c[0], '0')
+        c[3] = '3'
+        self.assertNotIn(1, c)
+        self.assertEqual(sorted(c.keys()), [0, 2, 3])
+        self.assertEqual(c.evictions, 1)
+        # peek doesn't count as a use
+        c.peek(2)
+        c[4] = '4'
+        self.assertNotIn(2, c)
+
+    def test_pinned(self):
+        """Test that pinned entries are never evicted"""
+        c = LRUCache(1, pinned=[0])
+        c[0] = 'root'
+        c[1] = 'a'
+        c[2] = 'b'
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c[0], 'root')
+        self.assertEqual(c.items(), [(0, 'root'), (2, 'b')])
+
+    def test_counters(self):
+        c = LRUCache(2)
+        c['a'] = 1
+        self.assertEqual(c.get('a'), 1)
+        self.assertIsNone(c.get('b'))
+        self.assertEqual((c.hits, c.misses), (1, 1))
+
+    def test_resize(self):
+        c = LRUCache(4)
+        for i in xrange(4):
+            c[i] = i
+        c.resize(2)
+        self.assertEqual(c.keys(), [2, 3])
+        del c[2]
+        self.assertEqual(c.pop(3), 3)
+        self.assertEqual(c.pop(3, None), None)
+        self.assertRaises(KeyError, c.pop, 3)
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c.keys(), [])
+
+    def test_update(self):
+        """Test that storing an existing key marks it as used"""
+        c = LRUCache(2)
+        c['a'] = 1
+        c['b'] = 2
+        c['a'] = 3
+        c['c'] = 4
+        self.assertEqual(c.items(), [('a', 3), ('c', 4)])
+        c.clear()
+        c['d'] = 5
+        self.assertEqual(c.items(), [('d', 5)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -38,6 +38,7 @@ from __future__ import division
 import base64
 import getpass
 import os.path
+import threading
 from vistrails.core import get_vistrails_application
 from vistrails.core.configuration import get_vistrails_configuration
 from vistrails.core.system import vistrails_default_file_type, get_elementtree_library, \
@@ -48,7 +49,8 @@ from vistrails.core.thumbnails import ThumbnailCache
 from vistrails.core import debug
 from vistrails.db.services.locator import XMLFileLocator as _XMLFileLocator, \
     DBLocator as _DBLocator, ZIPFileLocator as _ZIPFileLocator, \
-    BaseLocator as _BaseLocator, UntitledLocator as _UntitledLocator
+    BaseLocator as _BaseLocator, UntitledLocator as _UntitledLocator, \
+    DBCacheEntry
 from vistrails.db.services.io import SaveBundle, test_db_connection
 from vistrails.db import VistrailsDBException
 from vistrails.db.domain import DBWorkflow
@@ -204,6 +206,7 @@ class DBLocator(_DBLocator, CoreLocator):
             return get_vistrails_application().keyChain.get_key(key)
     
     keyChain = getKeyChain()
+    pipeline_lock = threading.Lock()
     
     def __init__(self, host, port, database, user, passwd, name=None,
                  **kwargs):
@@ -212,11 +215,16 @@ class DBLocator(_DBLocator, CoreLocator):
         self.__list = ExtConnectionList.getInstance(default_connections_file())
         self.ext_connection_id = -1
 
-    def load(self, klass=None):
+    def load(self, klass=None, read_only=False):
         from vistrails.core.vistrail.vistrail import Vistrail
         if klass is None:
             klass = Vistrail
-        save_bundle = _DBLocator.load(self, klass.vtType, ThumbnailCache.getInstance().get_directory())
+        save_bundle = _DBLocator.load(self, klass.vtType,
+                                      ThumbnailCache.getInstance().get_directory(),
+                                      read_only)
+        if read_only:
+            # Converted by prepare_cached()
+            return save_bundle
         if klass.vtType == DBWorkflow.vtType:
             wf = save_bundle
             klass = self.get_convert_klass(wf.vtType)
@@ -229,6 +237,46 @@ class DBLocator(_DBLocator, CoreLocator):
             obj.locator = self
         return save_bundle
 
+    def prepare_cached(self, obj):
+        if isinstance(obj, SaveBundle):
+            objs = obj.get_db_objs()
+        else:
+            objs = [obj]
+        for obj in objs:
+            klass = self.get_convert_klass(obj.vtType)
+            klass.convert(obj)
+            obj.locator = self
+
+    def get_pipeline(self, version):
+        """get_pipeline(version: int) -> Pipeline
+        Returns the pipeline for a version of the vistrail, materialized
+        once and shared between callers, which must not modify it.
+
+        """
+        vistrail = self.load(read_only=True).vistrail
+        key = self.get_cache_key('pipeline', version)
+        pipeline = self._get_cached_pipeline(key, vistrail)
+        if pipeline is not None:
+            return pipeline
+        # Materializing records checkpoints on the shared vistrail
+        with DBLocator.pipeline_lock:
+            pipeline = self._get_cached_pipeline(key, vistrail)
+            if pipeline is None:
+                pipeline = vistrail.getPipeline(version)
+                with _DBLocator.cache_lock:
+                    _DBLocator.pipeline_cache[key] = DBCacheEntry(
+                        pipeline, vistrail.db_last_modified)
+        return pipeline
+
+    @staticmethod
+    def _get_cached_pipeline(key, vistrail):
+        with _DBLocator.cache_lock:
+            entry = _DBLocator.pipeline_cache.get(key)
+        if (entry is not None and
+                entry.last_modified == vistrail.db_last_modified):
+            return entry.obj
+        return None
+
     def save(self, save_bundle):
         save_bundle = _DBLocator.save(self, save_bundle, False)
         for obj in save_bundle.get_db_objs():
@@ -788,3 +836,71 @@ class TestUsersGuideVTL(unittest.TestCase):
                             controller.vistrail.get_latest_version())
                         self.assertTrue(controller.current_pipeline.is_valid,
                                         "Latest pipeline is invalid: %s" % f)
+
+class TestDBLocatorCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from vistrails.core.data_structures.lru import LRUCache
+        self.testdir = tempfile.mkdtemp(prefix='vt_')
+        self.db = os.path.join(self.testdir, 'vistrails.db')
+        self.old_cache = _DBLocator.cache
+        self.old_pipeline_cache = _DBLocator.pipeline_cache
+        _DBLocator.cache = LRUCache(4)
+        _DBLocator.pipeline_cache = LRUCache(2)
+
+    def tearDown(self):
+        import shutil
+        _DBLocator.cache = self.old_cache
+        _DBLocator.pipeline_cache = self.old_pipeline_cache
+        DBLocator.pool.close()
+        shutil.rmtree(self.testdir)
+
+    def test_cache(self):
+        """Test sharing loaded vistrails and pipelines from the cache"""
+        from vistrails.core.vistrail.vistrail import Vistrail
+        bundle = FileLocator(os.path.join(vistrails_root_directory(),
+                                          'tests', 'resources',
+                                          'dummy_new.vt')).load()
+        locator = DBLocator('', 0, self.db, '', '', 'dummy',
+                            db_type='sqlite')
+        locator.save_as(bundle)
+
+        locator = DBLocator('', 0, self.db, '', '', obj_id=locator.obj_id,
+                            obj_type=Vistrail.vtType, db_type='sqlite')
+        vistrail = locator.load(read_only=True).vistrail
+        self.assertIsInstance(vistrail, Vistrail)
+        self.assertIs(locator.load(read_only=True).vistrail, vistrail)
+        copied = locator.load().vistrail
+        self.assertIsNot(copied, vistrail)
+        self.assertEqual(set(copied.actionMap), set(vistrail.actionMap))
+
+        version = vistrail.get_latest_version()
+        pipeline = locator.get_pipeline(version)
+        self.assertIs(locator.get_pipeline(version), pipeline)
+        stats = DBLocator.get_cache_stats()
+        self.assertEqual((stats['hits'], stats['reloads']), (5, 0))
+
+        # Saving makes a new copy current
+        locator.save(locator.load())
+        self.assertIsNot(locator.load(read_only=True).vistrail, vistrail)
+
+    def test_pipeline_cache(self):
+        """Test that cached pipelines don't evict the vistrail"""
+        from vistrails.core.vistrail.vistrail import Vistrail
+        bundle = FileLocator(os.path.join(vistrails_root_directory(),
+                                          'tests', 'resources',
+                                          'dummy_new.vt')).load()
+        locator = DBLocator('', 0, self.db, '', '', 'dummy',
+                            db_type='sqlite')
+        locator.save_as(bundle)
+
+        locator = DBLocator('', 0, self.db, '', '', obj_id=locator.obj_id,
+                            obj_type=Vistrail.vtType, db_type='sqlite')
+        vistrail = locator.load(read_only=True).vistrail
+        versions = sorted(vistrail.actionMap)[-4:]
+        pipelines = [locator.get_pipeline(v) for v in versions]
+        stats = DBLocator.get_cache_stats()
+        self.assertEqual((stats['size'], stats['pipelines']), (1, 2))
+        self.assertIs(locator.load(read_only=True).vistrail, vistrail)
+        self.assertIs(locator.get_pipeline(versions[-1]), pipelines[-1])
+        self.assertIsNot(locator.get_pipeline(versions[0]), pipelines[0])
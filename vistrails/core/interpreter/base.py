@@ -192,6 +192,7 @@ class BaseInterpreter(object):
                 info = pipeline.aliases[alias]
                 param = pipeline.db_get_object(info[0],info[1])
                 param.strValue = str(aliases[alias])
+                pipeline.invalidate_signatures([info[4]])
             except KeyError:
                 pass
                     
@@ -212,6 +213,11 @@ class BaseInterpreter(object):
                     param.strValue = str(strval)
                 except Exception, e:
                     debug.debug("Problem when updating params", e)
+                else:
+                    pipeline.invalidate_signatures(
+                            [m.id for m in pipeline.module_list
+                             if any(f.db_has_parameter_with_id(oId)
+                                    for f in m.functions)])
 
     def resolve_variables(self, vistrail_variables, pipeline):
         for m in pipeline.module_list:
@@ -223,6 +229,7 @@ class BaseInterpreter(object):
                 for func in m.functions:
                     if func.name == 'value':
                         func.params[0].strValue = strValue
+                pipeline.invalidate_signatures([m.id])
 
     def set_done_summon_hook(self, hook):
         """ set_done_summon_hook(hook: function(pipeline, objects)) -> None
@@ -40,7 +40,9 @@ import base64
 import copy
 import gc
 import cPickle as pickle
-
+import Queue
+import sys
+import threading
 import time
 
 from vistrails.core.common import InstanceObject, VistrailsInternalError
@@ -53,9 +55,10 @@ from vistrails.core.log.controller import DummyLogController
 from vistrails.core.modules.basic_modules import identifier as basic_pkg, \
                                                  Generator
 from vistrails.core.modules.module_registry import get_module_registry
-from vistrails.core.modules.vistrails_module import ModuleBreakpoint, \
-    ModuleConnector, ModuleError, ModuleErrors, ModuleHadError, \
-    ModuleSuspended, ModuleWasSuspended
+from vistrails.core.modules.vistrails_module import Module, \
+    ModuleBreakpoint, ModuleConnector, ModuleError, ModuleErrors, \
+    ModuleHadError, ModuleSuspended, ModuleWasSuspended, \
+    SynchronizedLogging, ThreadSafe
 from vistrails.core.reportusage import record_usage
 from vistrails.core.utils import DummyView
 import vistrails.core.system
@@ -198,14 +201,70 @@ class ViewUpdatingLogController(object):
 
 ###############################################################################
 
+def estimate_size(value):
+    """estimate_size(value) -> int
+
+    Returns a rough estimate of the memory used by value and the
+    containers, strings and arrays it references, in bytes. Objects
+    exposing a 'nbytes' attribute (such as numpy arrays) report their
+    buffer size; other objects are only counted shallowly.
+
+    """
+    size = 0
+    seen = set()
+    to_visit = [value]
+    while to_visit:
+        value = to_visit.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        try:
+            size += sys.getsizeof(value)
+        except TypeError:
+            pass
+        nbytes = getattr(value, 'nbytes', None)
+        if isinstance(nbytes, (int, long)):
+            size += nbytes
+        elif isinstance(value, dict):
+            to_visit.extend(value.iterkeys())
+            to_visit.extend(value.itervalues())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            to_visit.extend(value)
+    return size
+
+# Sort keys for the eviction policies: modules with the smallest key are
+# evicted first
+_eviction_policies = {
+    'lru': lambda interp, i: interp._cache_last_used[i],
+    'lfu': lambda interp, i: (interp._cache_use_count[i],
+                              interp._cache_last_used[i]),
+}
+
 Variant_desc = None
 InputPort_desc = None
 
 class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
 
+    # Cache budget; 0 means unbounded. These are set from the 'cacheMaxEntries',
+    # 'cacheMaxSize' and 'cachePolicy' configuration fields, see
+    # vistrails.core.interpreter.default
+    cache_max_entries = 0
+    cache_max_size = 0 # in bytes
+    cache_policy = 'lru'
+
+    # Optional vistrails.core.cache.results.ResultCache, set from the
+    # 'resultCacheDir' configuration field
+    result_cache = None
+
+    # Number of threads running independent modules, set from the
+    # 'executionThreads' configuration field; 0 or 1 executes sequentially
+    execution_threads = 0
+
     def __init__(self):
         vistrails.core.interpreter.base.BaseInterpreter.__init__(self)
         self.debugger = None
+        self._execution_depth = 0
+        self._logging_lock = None
         self.create()
 
     def create(self):
@@ -216,6 +275,11 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         self._objects = {}
         self.filePool = self._file_pool
         self._streams = []
+        self._cache_clock = 0
+        self._cache_last_used = {}
+        self._cache_use_count = {}
+        self._cache_sizes = {}
+        self.reset_cache_stats()
 
     def clear(self):
         self._file_pool.cleanup()
@@ -223,17 +287,22 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         for obj in self._objects.itervalues():
             obj.clear()
         self._objects = {}
+        self._cache_last_used = {}
+        self._cache_use_count = {}
+        self._cache_sizes = {}
 
     def __del__(self):
         self.clear()
 
     def clean_modules(self, modules_to_clean):
         """clean_modules(modules_to_clean: list of persistent module ids)
+        -> list of persistent module ids
 
         Removes modules from the persistent pipeline, and the modules that
-        depend on them."""
+        depend on them. Returns the ids of all the modules that were removed.
+        """
         if not modules_to_clean:
-            return
+            return []
         g = self._persistent_pipeline.graph
         modules_to_clean = (set(modules_to_clean) &
                             set(self._persistent_pipeline.modules.iterkeys()))
@@ -241,6 +310,101 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         for v in dependencies:
             self._persistent_pipeline.delete_module(v)
             del self._objects[v]
+            self._cache_last_used.pop(v, None)
+            self._cache_use_count.pop(v, None)
+            self._cache_sizes.pop(v, None)
+        return dependencies
+
+    def _touch_cached_module(self, persistent_id):
+        """Records a use of a module of the persistent pipeline."""
+        self._cache_clock += 1
+        self._cache_last_used[persistent_id] = self._cache_clock
+        self._cache_use_count[persistent_id] = \
+                self._cache_use_count.get(persistent_id, 0) + 1
+
+    def _cached_module_size(self, persistent_id):
+        """Returns the estimated size of the outputs of a cached module.
+
+        Sizes are only remembered once the module has produced outputs.
+        """
+        try:
+            return self._cache_sizes[persistent_id]
+        except KeyError:
+            outputs = self._objects[persistent_id].outputPorts
+            size = estimate_size(outputs)
+            if outputs:
+                self._cache_sizes[persistent_id] = size
+            return size
+
+    def reset_cache_stats(self):
+        """reset_cache_stats() -> None
+
+        Resets the hit, miss and eviction counters of the module cache.
+        """
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_evictions = 0
+
+    def get_cache_stats(self):
+        """get_cache_stats() -> dict
+
+        Returns the counters of the module cache: 'hits' and 'misses' are
+        the number of modules that were respectively reused from and added
+        to the persistent pipeline, 'evictions' the number of modules
+        removed to stay within the cache budget, 'entries' the number of
+        modules currently cached and 'size' the estimated size of their
+        outputs, in bytes.
+        """
+        return {'hits': self._cache_hits,
+                'misses': self._cache_misses,
+                'evictions': self._cache_evictions,
+                'entries': len(self._objects),
+                'size': sum(self._cached_module_size(i)
+                            for i in self._objects)}
+
+    def enforce_cache_limits(self, protected=()):
+        """enforce_cache_limits(protected: set of persistent module ids)
+        -> None
+
+        Evicts modules from the persistent pipeline, in the order given by
+        cache_policy, until the cache fits within cache_max_entries and
+        cache_max_size. Modules that depend on an evicted module are
+        removed with it through clean_modules(). Modules in protected are
+        never evicted, so the cache might stay over budget if these alone
+        exceed it.
+        """
+        max_entries = self.cache_max_entries
+        max_size = self.cache_max_size
+        if not max_entries and not max_size:
+            return
+        try:
+            policy = _eviction_policies[self.cache_policy]
+        except KeyError:
+            raise ValueError("Unknown cache eviction policy %r" %
+                             self.cache_policy)
+
+        def over_budget():
+            if max_entries and len(self._objects) > max_entries:
+                return True
+            return bool(max_size) and total_size[0] > max_size
+
+        total_size = [sum(self._cached_module_size(i)
+                          for i in self._objects)]
+        if not over_budget():
+            return
+        candidates = sorted((i for i in self._objects
+                             if i not in protected),
+                            key=lambda i: policy(self, i))
+        for i in candidates:
+            if not over_budget():
+                break
+            if i not in self._objects:
+                # Already removed as a dependency of an earlier victim
+                continue
+            for v in self._persistent_pipeline.graph \
+                    .vertices_topological_sort([i]):
+                total_size[0] -= self._cached_module_size(v)
+            self._cache_evictions += len(self.clean_modules([i]))
 
     def clean_non_cacheable_modules(self):
         """clean_non_cacheable_modules() -> None
@@ -264,6 +428,180 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
                    if mod.module_descriptor.identifier == identifier]
         self.clean_modules(modules)
 
+    def _non_cacheable_closure(self, persistent_ids):
+        """Returns the persistent modules among persistent_ids that are not
+        cacheable or depend on a module that isn't.
+        """
+        non_cacheable = [i for i in persistent_ids
+                         if not self._objects[i].is_cacheable()]
+        if not non_cacheable:
+            return set()
+        return set(self._persistent_pipeline.graph.vertices_topological_sort(
+                non_cacheable))
+
+    def restore_cached_results(self, new_ids, pipeline_ids):
+        """restore_cached_results(new_ids: list of persistent module ids,
+                                  pipeline_ids: list of persistent module ids)
+        -> None
+
+        Looks up the newly created modules in the persistent result cache
+        and marks those that were found as up-to-date. Modules are visited
+        downstream first, so modules whose consumers in the pipeline were
+        all restored are not loaded at all.
+        """
+        g = self._persistent_pipeline.graph
+        connections = self._persistent_pipeline.connections
+        pipeline_ids = set(pipeline_ids)
+        new_ids = set(new_ids)
+        excluded = self._non_cacheable_closure(pipeline_ids)
+        needed = set()
+        for i in reversed(g.vertices_topological_sort(new_ids)):
+            if i not in new_ids:
+                continue
+            consumers = set(dst for dst, _ in g.edges_from(i)
+                            if dst in pipeline_ids)
+            if consumers and not (consumers & needed):
+                # Everything downstream of this module is available
+                continue
+            obj = self._objects[i]
+            outputs = None
+            if i not in excluded:
+                # The ports read by connected modules have to be restored
+                ports = set(connections[c].source.name
+                            for _, c in g.edges_from(i))
+                ports.discard('self')
+                outputs = self.result_cache.load(obj.signature, ports,
+                                                 self.filePool)
+            if outputs is None:
+                needed.add(i)
+            else:
+                obj.outputPorts.update(outputs)
+                obj.upToDate = True
+                obj.restored_from_cache = True
+
+    def store_cached_results(self, persistent_ids):
+        """store_cached_results(persistent_ids: list of persistent module ids)
+        -> None
+
+        Stores the outputs of the given modules in the persistent result
+        cache, unless they are not cacheable, depend on a non-cacheable
+        module or were themselves restored from the cache.
+        """
+        excluded = self._non_cacheable_closure(persistent_ids)
+        for i in persistent_ids:
+            obj = self._objects[i]
+            if i in excluded or obj.restored_from_cache:
+                continue
+            self.result_cache.store(
+                    obj.signature,
+                    dict((port, value)
+                         for port, value in obj.outputPorts.iteritems()
+                         if port != 'self'))
+
+    def update_concurrently(self, sinks, update):
+        """update_concurrently(sinks: list of modules, update: callable)
+        -> bool
+
+        Updates the modules upstream of sinks as soon as their own upstream
+        modules are done, instead of pulling them recursively from the sinks.
+        ThreadSafe modules run on execution_threads threads, the others in
+        the calling thread. Modules that control how their upstream gets
+        updated (for instance, conditionals) are left to pull it as usual.
+        update(obj) is called for each module and returns True to stop the
+        execution; returns whether the execution was stopped.
+        """
+        def upstream(obj):
+            return [connector.obj
+                    for connectors in obj.inputPorts.itervalues()
+                    for connector in connectors]
+
+        def closure(objs):
+            seen = {}
+            to_visit = list(objs)
+            while to_visit:
+                obj = to_visit.pop()
+                if id(obj) not in seen:
+                    seen[id(obj)] = obj
+                    to_visit.extend(upstream(obj))
+            return seen
+
+        default_update_upstream = Module.update_upstream.im_func
+        scheduled = closure(sinks)
+        lazy = set()
+        for obj in scheduled.itervalues():
+            if (type(obj).update_upstream.im_func is not
+                    default_update_upstream or
+                    obj.restored_from_cache or obj.useJobCache()):
+                lazy.update(closure(upstream(obj)))
+        for i in lazy:
+            del scheduled[i]
+
+        waiting = {}
+        dependents = {}
+        in_pool = set()
+        for i, obj in scheduled.iteritems():
+            up = set(id(o) for o in upstream(obj))
+            waiting[i] = up & set(scheduled)
+            for j in waiting[i]:
+                dependents.setdefault(j, []).append(obj)
+            if isinstance(obj, ThreadSafe) and waiting[i] == up:
+                in_pool.add(i)
+        ready = [obj for i, obj in scheduled.iteritems() if not waiting[i]]
+
+        tasks = Queue.Queue()
+        results = Queue.Queue()
+        def worker():
+            while True:
+                obj = tasks.get()
+                if obj is None:
+                    return
+                try:
+                    results.put((obj, update(obj), None))
+                except BaseException:
+                    results.put((obj, True, sys.exc_info()))
+
+        threads = [threading.Thread(target=worker)
+                   for _ in xrange(self.execution_threads)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        stopped = False
+        error = None
+        running = 0
+        local = []
+        try:
+            while True:
+                if not stopped:
+                    for obj in ready:
+                        if id(obj) in in_pool:
+                            tasks.put(obj)
+                            running += 1
+                        else:
+                            local.append(obj)
+                    ready = []
+                if local and not stopped:
+                    obj = local.pop(0)
+                    stop, exc_info = update(obj), None
+                elif running:
+                    obj, stop, exc_info = results.get()
+                    running -= 1
+                else:
+                    break
+                if exc_info is not None and error is None:
+                    error = exc_info
+                stopped = stopped or stop
+                for dependent in dependents.get(id(obj), []):
+                    waiting[id(dependent)].discard(id(obj))
+                    if not waiting[id(dependent)]:
+                        ready.append(dependent)
+        finally:
+            for thread in threads:
+                tasks.put(None)
+        if error is not None:
+            raise error[0], error[1], error[2]
+        return stopped
+
     def make_connection(self, conn, src, dst):
         """make_connection(self, conn, src, dst)
         Builds a execution-time connection between modules.
@@ -428,6 +766,13 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
             dst = self._objects[conn.destinationId]
             self.make_connection(conn, src, dst)
 
+        if self.result_cache is not None:
+            self.restore_cached_results(
+                    [tmp_to_persistent_module_map[i]
+                     for i in module_added_set
+                     if tmp_to_persistent_module_map[i] not in to_delete],
+                    tmp_to_persistent_module_map.values())
+
         if self.done_summon_hook:
             self.done_summon_hook(self._persistent_pipeline, self._objects)
         for callable_ in done_summon_hooks:
@@ -477,6 +822,18 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
                 ids=pipeline.modules.keys(),
                 module_executed_hook=module_executed_hook)
 
+        # Only the top-level pipeline gets scheduled concurrently, but the
+        # logging of the pipelines it executes is synchronized with it
+        concurrent = (self.execution_threads > 1 and
+                      self._execution_depth == 1)
+        if concurrent:
+            self._logging_lock = threading.RLock()
+        if self._logging_lock is not None:
+            module_logging = SynchronizedLogging(logging_obj,
+                                                 self._logging_lock)
+        else:
+            module_logging = logging_obj
+
         # PARAMETER CHANGES SETUP
         parameter_changes = []
         def change_parameter(obj, name, value):
@@ -488,7 +845,7 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         # Update **all** modules in the current pipeline
         for i, obj in tmp_id_to_module_map.iteritems():
             obj.in_pipeline = True # set flag to indicate in pipeline
-            obj.logging = logging_obj
+            obj.logging = module_logging
             obj.change_parameter = make_change_parameter(obj)
             
             # Update object pipeline information
@@ -524,37 +881,50 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         self._streams.append(Generator.generators)
         Generator.generators = []
 
-        # Update new sinks
-        for obj in persistent_sinks:
+        def update(obj):
+            """Updates a module, logging its errors.
+
+            Returns whether the execution should stop.
+            """
             abort = False
             try:
                 obj.update()
-                continue
+                return False
             except ModuleWasSuspended:
-                continue
+                return False
             except ModuleHadError:
                 pass
             except AbortExecution:
-                break
+                return True
             except ModuleSuspended, ms:
                 ms.module.logging.end_update(ms.module, ms,
                                              was_suspended=True)
-                continue
+                return False
             except ModuleErrors, mes:
                 for me in mes.module_errors:
                     me.module.logging.end_update(me.module, me)
-                    logging_obj.signalError(me.module, me)
+                    module_logging.signalError(me.module, me)
                     abort = abort or me.abort
             except ModuleError, me:
                 me.module.logging.end_update(me.module, me, me.errorTrace)
-                logging_obj.signalError(me.module, me)
+                module_logging.signalError(me.module, me)
                 abort = me.abort
             except ModuleBreakpoint, mb:
                 mb.module.logging.end_update(mb.module)
-                logging_obj.signalError(mb.module, mb)
+                module_logging.signalError(mb.module, mb)
                 abort = True
-            if stop_on_error or abort:
-                break
+            return stop_on_error or abort
+
+        # Update new sinks
+        try:
+            if not (concurrent and
+                    self.update_concurrently(persistent_sinks, update)):
+                for obj in persistent_sinks:
+                    if update(obj):
+                        break
+        finally:
+            if concurrent:
+                self._logging_lock = None
 
         if Generator.generators:
             record_usage(generators=len(Generator.generators))
@@ -593,6 +963,13 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
 
         Generator.generators = self._streams.pop()
 
+        if self.result_cache is not None:
+            self.store_cached_results(
+                    [obj.id for obj in tmp_id_to_module_map.itervalues()
+                     if (obj.id in logging_obj.executed and
+                         obj.id not in logging_obj.errors and
+                         obj.id not in logging_obj.suspended)])
+
         if self.done_update_hook:
             self.done_update_hook(self._persistent_pipeline, self._objects)
                 
@@ -725,6 +1102,22 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         if len(kwargs) > 0:
             raise VistrailsInternalError('Wrong parameters passed '
                                          'to execute: %s' % kwargs)
+        self._execution_depth += 1
+        try:
+            return self._execute(pipeline, new_kwargs)
+        finally:
+            self._execution_depth -= 1
+
+    def _execute(self, pipeline, new_kwargs):
+        controller = new_kwargs['controller']
+        current_version = new_kwargs['current_version']
+        view = new_kwargs['view']
+        aliases = new_kwargs['aliases']
+        params = new_kwargs['params']
+        logger = new_kwargs['logger']
+        reason = new_kwargs['reason']
+        parent_exec = new_kwargs['parent_exec']
+
         self.clean_non_cacheable_modules()
 
         record_usage(execute=True)
@@ -761,6 +1154,11 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
             for (i, error) in errors.iteritems():
                 view.set_module_error(i, error.msg, error.errorTrace)
         self.finalize_pipeline(pipeline, *(res[:-1]), **new_kwargs)
+        if self._execution_depth == 1:
+            # Don't evict while an enclosing execution might still be using
+            # the persistent modules
+            self.enforce_cache_limits(set(obj.id
+                                          for obj in res[1].itervalues()))
         time_end = time.time()
 
         result = InstanceObject(objects=res[1],
@@ -810,7 +1208,7 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         connection_id_map = Bidict()
         modules_added = set()
         connections_added = set()
-        pipeline.refresh_signatures()
+        pipeline.compute_signatures()
         # we must traverse vertices in topological sort order
         verts = pipeline.graph.vertices_topological_sort()
         for new_module_id in verts:
@@ -825,10 +1223,13 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
                     base64.b16encode(new_sig).lower()
                 module_id_map[new_module_id] = persistent_id
                 modules_added.add(new_module_id)
+                self._cache_misses += 1
             else:
                 i = self._persistent_pipeline \
                         .subpipeline_id_from_signature(new_sig)
                 module_id_map[new_module_id] = i
+                self._cache_hits += 1
+            self._touch_cached_module(module_id_map[new_module_id])
         for connection in pipeline.connections.itervalues():
             new_sig = pipeline.connection_signature(connection.id)
             if not self._persistent_pipeline.has_connection_signature(new_sig):
@@ -859,7 +1260,7 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         object_map = {}
         module_id_map = {}
         connection_id_map = {}
-        pipeline.refresh_signatures()
+        pipeline.compute_signatures()
         # we must traverse vertices in topological sort order
         verts = pipeline.graph.vertices_topological_sort()
         for module_id in verts:
@@ -958,6 +1359,240 @@ class TestCachedInterpreter(unittest.TestCase):
         finally:
             StandardOutput.compute = old_compute
 
+    def test_in_place_changes(self):
+        """Test that parameters changed in place are not cache hits."""
+        from vistrails.core.modules.basic_modules import StandardOutput
+        old_compute = StandardOutput.compute
+        StandardOutput.compute = lambda s: None
+
+        try:
+            from vistrails.core.db.locator import XMLFileLocator
+            from vistrails.core.vistrail.controller import VistrailController
+            from vistrails.core.db.io import load_vistrail
+
+            locator = XMLFileLocator(
+                    vistrails.core.system.vistrails_root_directory() +
+                    '/tests/resources/dummy.xml')
+            (v, abstractions, thumbnails, mashups) = load_vistrail(locator)
+            controller = VistrailController(v, locator, abstractions,
+                                            thumbnails,  mashups)
+            n = v.get_version_number('int chain')
+            controller.change_selected_version(n)
+            controller.flush_delayed_actions()
+            p = controller.current_pipeline
+
+            view = DummyView()
+            interpreter = CachedInterpreter.get()
+            interpreter.execute(p, locator=v, current_version=n, view=view)
+            result = interpreter.execute(p, locator=v, current_version=n,
+                                         view=view)
+            # Only the non-cacheable modules
+            not_cached = len(result.modules_added)
+
+            param = [f for m in p.module_list
+                     for f in m.functions if f.params][0].params[0]
+            param.strValue = str(int(param.strValue) + 1000)
+            result = interpreter.execute(p, locator=v, current_version=n,
+                                         view=view)
+            self.assertGreater(len(result.modules_added), not_cached)
+        finally:
+            StandardOutput.compute = old_compute
+
+    def test_cache_limits(self):
+        """Test that the cache evicts modules to stay within budget."""
+        from vistrails.core.modules.basic_modules import StandardOutput
+        old_compute = StandardOutput.compute
+        StandardOutput.compute = lambda s: None
+
+        try:
+            from vistrails.core.db.locator import XMLFileLocator
+            from vistrails.core.vistrail.controller import VistrailController
+            from vistrails.core.db.io import load_vistrail
+
+            locator = XMLFileLocator(
+                    vistrails.core.system.vistrails_root_directory() +
+                    '/tests/resources/dummy.xml')
+            (v, abstractions, thumbnails, mashups) = load_vistrail(locator)
+            controller = VistrailController(v, locator, abstractions,
+                                            thumbnails, mashups)
+            pipelines = []
+            for tag in ('int chain', 'float chain'):
+                n = v.get_version_number(tag)
+                controller.change_selected_version(n)
+                controller.flush_delayed_actions()
+                pipelines.append((n, controller.current_pipeline))
+
+            interpreter = CachedInterpreter()
+            interpreter.cache_max_entries = 1
+            view = DummyView()
+            for n, pipeline in pipelines:
+                result = interpreter.execute(pipeline, locator=v,
+                                             current_version=n, view=view)
+                self.assertFalse(result.errors)
+            # Modules of the last pipeline are kept even though it exceeds
+            # the budget, the others got evicted
+            stats = interpreter.get_cache_stats()
+            self.assertEqual(stats['entries'], len(pipelines[1][1].modules))
+            self.assertGreater(stats['evictions'], 0)
+
+            # Running the evicted pipeline again recomputes it
+            n, pipeline = pipelines[0]
+            result = interpreter.execute(pipeline, locator=v,
+                                         current_version=n, view=view)
+            self.assertEqual(len(result.modules_added),
+                             len(pipeline.modules))
+            self.assertEqual(interpreter.get_cache_stats()['entries'],
+                             len(pipeline.modules))
+        finally:
+            StandardOutput.compute = old_compute
+
+    def test_result_cache(self):
+        """Test that results are reused from the persistent cache."""
+        import shutil
+        import tempfile
+        from vistrails.core.cache.results import ResultCache
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.vistrail.controller import VistrailController
+        from vistrails.core.db.io import load_vistrail
+        from vistrails.core.modules.basic_modules import StandardOutput
+
+        outputs = []
+        old_compute = StandardOutput.compute
+        StandardOutput.compute = lambda s: outputs.append(s.get_input('value'))
+        directory = tempfile.mkdtemp(prefix='vt_results_')
+        try:
+            locator = XMLFileLocator(
+                    vistrails.core.system.vistrails_root_directory() +
+                    '/tests/resources/dummy.xml')
+            (v, abstractions, thumbnails, mashups) = load_vistrail(locator)
+            controller = VistrailController(v, locator, abstractions,
+                                            thumbnails, mashups)
+            n = v.get_version_number('int chain')
+            controller.change_selected_version(n)
+            controller.flush_delayed_actions()
+            pipeline = controller.current_pipeline
+
+            stats = []
+            for i in xrange(2):
+                # A new interpreter, as if VisTrails had been restarted
+                interpreter = CachedInterpreter()
+                interpreter.result_cache = ResultCache(directory)
+                result = interpreter.execute(pipeline, locator=v,
+                                             current_version=n,
+                                             view=DummyView())
+                self.assertFalse(result.errors)
+                stats.append(interpreter.result_cache.get_stats())
+            self.assertEqual(stats[0]['hits'], 0)
+            self.assertGreater(stats[0]['stores'], 0)
+            self.assertGreater(stats[1]['hits'], 0)
+            self.assertEqual(stats[1]['stores'], 0)
+            self.assertEqual(len(outputs), 2)
+            self.assertEqual(outputs[0], outputs[1])
+        finally:
+            StandardOutput.compute = old_compute
+            shutil.rmtree(directory)
+
+    def test_result_cache_missing_port(self):
+        """Test that stored results missing a connected port are not used."""
+        import shutil
+        import tempfile
+        from vistrails.core.cache.results import ResultCache
+        from vistrails.core.modules.basic_modules import StandardOutput
+        from vistrails.core.system import get_vistrails_basic_pkg_id
+        from vistrails.core.vistrail.controller import VistrailController
+        from vistrails.core.vistrail.vistrail import Vistrail
+
+        basic_pkg = get_vistrails_basic_pkg_id()
+        controller = VistrailController(Vistrail(), None, auto_save=False)
+        controller.change_selected_version(0L)
+        string = controller.add_module(basic_pkg, 'String')
+        output = controller.add_module(basic_pkg, 'StandardOutput')
+        controller.update_function(string, 'value', ['abc'])
+        controller.add_connection(string.id, 'value_as_string',
+                                  output.id, 'value')
+        pipeline = controller.current_pipeline
+
+        outputs = []
+        old_compute = StandardOutput.compute
+        StandardOutput.compute = lambda s: outputs.append(s.get_input('value'))
+        directory = tempfile.mkdtemp(prefix='vt_results_')
+        try:
+            interpreter = CachedInterpreter()
+            interpreter.result_cache = ResultCache(directory)
+            result = interpreter.execute(pipeline, view=DummyView())
+            self.assertFalse(result.errors)
+
+            # Drops the output read by StandardOutput from the stored result
+            cache = ResultCache(directory)
+            signature = result.objects[string.id].signature
+            stored = cache.load(signature)
+            del stored['value_as_string']
+            cache.store(signature, stored)
+
+            interpreter = CachedInterpreter()
+            interpreter.result_cache = ResultCache(directory)
+            result = interpreter.execute(pipeline, view=DummyView())
+            self.assertFalse(result.errors)
+            self.assertIn(string.id, result.executed)
+            self.assertEqual(outputs, ['abc', 'abc'])
+        finally:
+            StandardOutput.compute = old_compute
+            shutil.rmtree(directory)
+
+    def test_concurrent_execution(self):
+        """Test that scheduling modules on threads gives the same results."""
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.vistrail.controller import VistrailController
+        from vistrails.core.db.io import load_vistrail
+        from vistrails.core.modules.basic_modules import StandardOutput
+        import vistrails.core.interpreter.cached as cached
+
+        outputs = []
+        old_compute = StandardOutput.compute
+        StandardOutput.compute = lambda s: outputs.append(s.get_input('value'))
+        # Runs every module on the threads, not only the ThreadSafe ones
+        old_thread_safe = cached.ThreadSafe
+        cached.ThreadSafe = object
+        try:
+            locator = XMLFileLocator(
+                    vistrails.core.system.vistrails_root_directory() +
+                    '/tests/resources/dummy.xml')
+            (v, abstractions, thumbnails, mashups) = load_vistrail(locator)
+            controller = VistrailController(v, locator, abstractions,
+                                            thumbnails, mashups)
+            n = v.get_version_number('int chain')
+            controller.change_selected_version(n)
+            controller.flush_delayed_actions()
+            pipeline = controller.current_pipeline
+
+            for threads in (0, 4):
+                interpreter = CachedInterpreter()
+                interpreter.execution_threads = threads
+                result = interpreter.execute(pipeline, locator=v,
+                                             current_version=n,
+                                             view=DummyView())
+                self.assertFalse(result.errors)
+                self.assertEqual(len(result.executed), len(pipeline.modules))
+                self.assertIsNone(interpreter._logging_lock)
+            self.assertEqual(len(outputs), 2)
+            self.assertEqual(outputs[0], outputs[1])
+        finally:
+            StandardOutput.compute = old_compute
+            cached.ThreadSafe = old_thread_safe
+
+    def test_estimate_size(self):
+        small = estimate_size([1, 2])
+        self.assertGreater(estimate_size([1, 2, 'a' * 1000]), small + 1000)
+        loop = []
+        loop.append(loop)
+        self.assertEqual(estimate_size(loop), sys.getsizeof(loop))
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("numpy is not available")
+        self.assertGreaterEqual(estimate_size({'value': numpy.zeros(1000)}),
+                                8000)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -35,8 +35,11 @@
 ###############################################################################
 from __future__ import division
 
+from vistrails.core.cache import utils as cache_utils
+from vistrails.core.cache.results import ResultCache
 import vistrails.core.interpreter.cached
 import vistrails.core.interpreter.noncached
+from vistrails.core import debug, system
 
 import unittest
 
@@ -53,8 +56,61 @@ def set_cache_configuration(field, value):
     else:
         set_default_interpreter(noncached_interpreter)
 
+def set_cache_limits_configuration(field, value):
+    if field == 'cacheMaxEntries':
+        cached_interpreter.cache_max_entries = value
+    elif field == 'cacheMaxSize':
+        cached_interpreter.cache_max_size = value * 1024 * 1024
+    elif field == 'cachePolicy':
+        cached_interpreter.cache_policy = value
+    else:
+        raise ValueError("Not a cache limit field: %r" % field)
+
+def set_execution_threads_configuration(field, value):
+    cached_interpreter.execution_threads = value
+
+def set_signature_hash_configuration(field, value):
+    try:
+        cache_utils.set_hash_function(value)
+    except ValueError, e:
+        debug.warning("Invalid signatureHash setting", e)
+        return
+    # Cached results are indexed by signatures computed with the old digest
+    cached_interpreter.flush()
+
+def make_result_cache_configuration(configuration):
+    def set_result_cache_configuration(field=None, value=None):
+        directory = system.get_vistrails_directory('resultCacheDir',
+                                                   configuration)
+        if directory is None:
+            cached_interpreter.result_cache = None
+        else:
+            max_size = getattr(configuration, 'resultCacheSize', 1024)
+            cached_interpreter.result_cache = ResultCache(
+                    directory, max_size * 1024 * 1024)
+    return set_result_cache_configuration
+
 def connect_to_configuration(configuration):
     configuration.subscribe('cache', set_cache_configuration)
+    for field in ('cacheMaxEntries', 'cacheMaxSize', 'cachePolicy'):
+        configuration.subscribe(field, set_cache_limits_configuration)
+        if configuration.check(field):
+            set_cache_limits_configuration(field, getattr(configuration,
+                                                          field))
+    set_result_cache_configuration = \
+            make_result_cache_configuration(configuration)
+    for field in ('resultCacheDir', 'resultCacheSize'):
+        configuration.subscribe(field, set_result_cache_configuration)
+    set_result_cache_configuration()
+    configuration.subscribe('executionThreads',
+                            set_execution_threads_configuration)
+    if configuration.check('executionThreads'):
+        set_execution_threads_configuration('executionThreads',
+                                            configuration.executionThreads)
+    configuration.subscribe('signatureHash', set_signature_hash_configuration)
+    if configuration.check('signatureHash'):
+        set_signature_hash_configuration('signatureHash',
+                                         configuration.signatureHash)
 
 def get_default_interpreter():
     """Returns an instance of the default interpreter class."""
@@ -531,6 +531,9 @@ class ModuleRegistry(DBRegistry):
     def set_defaults(self, other=None):
         self._root_descriptor = None
         self.signals = ModuleRegistrySignals()
+        # Incremented whenever modules or ports change, so that what was
+        # checked against the registry can be known to be outdated
+        self.generation = 0
         self.setup_indices()
         if other is None:
             # _constant_hasher_map stores callables for custom parameter
@@ -1270,6 +1273,7 @@ class ModuleRegistry(DBRegistry):
         if settings.ghost_namespace:
             descriptor.ghost_namespace = settings.ghost_namespace
                  
+        self.generation += 1
         self.signals.emit_new_module(descriptor)
         if self.is_abstraction(descriptor):
             self.signals.emit_new_abstraction(descriptor)
@@ -1502,6 +1506,7 @@ class ModuleRegistry(DBRegistry):
             raise InvalidPortSpec(descriptor, spec.name, spec.type, e)
 
         descriptor.add_port_spec(spec)
+        self.generation += 1
         if spec.type == 'input':
             self.signals.emit_new_input_port(descriptor.identifier,
                                              descriptor.name, spec.name, spec)
@@ -1701,6 +1706,7 @@ class ModuleRegistry(DBRegistry):
             self._conversions = dict()
             self._converters.remove(descriptor)
 
+        self.generation += 1
         self.signals.emit_deleted_module(descriptor)
         if self.is_abstraction(descriptor):
             self.signals.emit_deleted_abstraction(descriptor)
@@ -1748,10 +1754,12 @@ class ModuleRegistry(DBRegistry):
     def delete_input_port(self, descriptor, port_name):
         """ Just remove a name input port with all of its specs """
         descriptor.delete_input_port(port_name)
+        self.generation += 1
 
     def delete_output_port(self, descriptor, port_name):
         """ Just remove a name output port with all of its specs """
         descriptor.delete_output_port(port_name)
+        self.generation += 1
 
     def source_ports_from_descriptor(self, descriptor, sorted=True):
         ports = [p[1] for p in self.module_ports('output', descriptor)]
@@ -2149,6 +2157,7 @@ class ModuleRegistry(DBRegistry):
     def hide_module(self, descriptor):
         self.signals.emit_hide_module(descriptor)
     def update_module(self, old_descriptor, new_descriptor):
+        self.generation += 1
         self.signals.emit_module_updated(old_descriptor, new_descriptor)
 
     def expand_port_spec_string(self, p_string, cur_package=None, 
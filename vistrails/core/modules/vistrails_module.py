@@ -40,6 +40,8 @@ from base64 import b16encode, b16decode
 import copy
 from itertools import izip, product, chain
 import json
+import sys
+import threading
 import time
 import traceback
 import warnings
@@ -196,6 +198,31 @@ class DummyModuleLogging(object):
 
 _dummy_logging = DummyModuleLogging()
 
+class SynchronizedLogging(object):
+    """Forwards the method calls to a logging object while holding a lock.
+
+    This allows loop iterations running in different threads to share the
+    logging of the loop.
+    """
+    def __init__(self, logging, lock):
+        self._logging = logging
+        self._lock = lock
+
+    def begin_loop_execution(self, *args, **kwargs):
+        with self._lock:
+            loop = self._logging.begin_loop_execution(*args, **kwargs)
+        return SynchronizedLogging(loop, self._lock)
+
+    def __getattr__(self, name):
+        attr = getattr(self._logging, name)
+        if not callable(attr):
+            return attr
+        lock = self._lock
+        def synchronized(*args, **kwargs):
+            with lock:
+                return attr(*args, **kwargs)
+        return synchronized
+
 ################################################################################
 # Module
 
@@ -316,6 +343,11 @@ class Module(object):
         # used for the logging stuff
         self.computed = False
 
+        # restored_from_cache stores whether the outputs were loaded from
+        # the interpreter's persistent result cache, in which case the
+        # upstream modules don't need to run
+        self.restored_from_cache = False
+
         self.signature = None
 
         # stores whether the output of the module should be annotated in the
@@ -553,7 +585,7 @@ class Module(object):
         elif self.computed:
             return
         self.logging.begin_update(self)
-        if not self.setJobCache():
+        if not (self.restored_from_cache or self.setJobCache()):
             self.update_upstream()
         if self.upToDate:
             if not self.computed:
@@ -642,6 +674,78 @@ class Module(object):
             return self.control_params[ModuleControlParam.LOOP_KEY]
         return default
 
+    def get_iteration_workers(self):
+        """get_iteration_workers() -> int
+
+        Returns the number of threads that should run the iterations of
+        this module, set with the PARALLEL_KEY control parameter.
+
+        """
+        value = self.control_params.get(ModuleControlParam.PARALLEL_KEY, 1)
+        try:
+            return max(1, int(value))
+        except ValueError:
+            raise ModuleError(self, "Invalid number of parallel iterations: "
+                                    "%r" % value)
+
+    def begin_iterations(self, num_iterations):
+        """begin_iterations(num_iterations: int) -> (loop, logging)
+
+        Starts logging a loop over the iterations of this module. Returns the
+        loop logger and the logging object to use in the iterations, which
+        are synchronized if they are going to run concurrently.
+
+        """
+        loop = self.logging.begin_loop_execution(self, num_iterations)
+        logging = self.logging
+        if self.get_iteration_workers() > 1:
+            lock = threading.RLock()
+            loop = SynchronizedLogging(loop, lock)
+            logging = SynchronizedLogging(logging, lock)
+        return loop, logging
+
+    def map_iterations(self, function, num_iterations):
+        """map_iterations(function: callable, num_iterations: int) -> list
+
+        Calls function(i) for each iteration and returns the results in
+        order. The calls are made on get_iteration_workers() threads; if one
+        of them raises, no new iteration is started and the exception of the
+        first failed iteration is raised again.
+
+        """
+        workers = min(self.get_iteration_workers(), num_iterations)
+        if workers <= 1:
+            return [function(i) for i in xrange(num_iterations)]
+
+        results = [None] * num_iterations
+        errors = {}
+        next_iteration = iter(xrange(num_iterations))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if errors:
+                        return
+                    i = next(next_iteration, None)
+                if i is None:
+                    return
+                try:
+                    results[i] = function(i)
+                except BaseException:
+                    with lock:
+                        errors[i] = sys.exc_info()
+
+        threads = [threading.Thread(target=worker) for _ in xrange(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            exc_type, exc_value, tb = errors[min(errors)]
+            raise exc_type, exc_value, tb
+        return results
+
     def compute_all(self):
         """This method executes the module once for each input.
            Similarly to controlflow's fold.
@@ -673,15 +777,17 @@ class Module(object):
 
         elements, port_names = self.do_combine(combine_type, inputs, port_names)
         num_inputs = len(elements)
-        loop = self.logging.begin_loop_execution(self, num_inputs)
-        ## Update everything for each value inside the list
-        outputs = {}
-        for i in xrange(num_inputs):
-            self.logging.update_progress(self, float(i)/num_inputs)
+        loop, logging = self.begin_iterations(num_inputs)
+
+        def iteration(i):
+            logging.update_progress(self, float(i)/num_inputs)
             module = copy.copy(self)
             module.list_depth = self.list_depth - 1
             module.had_error = False
             module.was_suspended = False
+            module.logging = logging
+            # nested loops run in the thread of their iteration
+            module.control_params.pop(ModuleControlParam.PARALLEL_KEY, None)
 
             if not self.upToDate: # pragma: no partial
                 ## Type checking if first iteration and last iteration level
@@ -699,22 +805,29 @@ class Module(object):
             except ModuleSuspended, e:
                 e.loop_iteration = i
                 module.logging.end_update(module, e, was_suspended=True)
-                suspended.append(e)
                 loop.end_iteration(module)
-                continue
+                return e
 
             loop.end_iteration(module)
 
             ## Getting the result from the output port
+            outputs = {}
             for nameOutput in module.outputPorts:
                 if nameOutput == 'self':
                     continue
-                if nameOutput not in outputs:
-                    outputs[nameOutput] = []
-                output = module.get_output(nameOutput)
-                outputs[nameOutput].append(output)
+                outputs[nameOutput] = module.get_output(nameOutput)
 
-            self.logging.update_progress(self, i * 1.0 / num_inputs)
+            logging.update_progress(self, i * 1.0 / num_inputs)
+            return outputs
+
+        ## Update everything for each value inside the list
+        outputs = {}
+        for result in self.map_iterations(iteration, num_inputs):
+            if isinstance(result, ModuleSuspended):
+                suspended.append(result)
+                continue
+            for nameOutput, output in result.iteritems():
+                outputs.setdefault(nameOutput, []).append(output)
 
         if suspended:
             raise ModuleSuspended(
@@ -1648,6 +1761,15 @@ class NotCacheable(object):
 
 ################################################################################
 
+class ThreadSafe(object):
+    """ A mixin indicating that the module can be computed in a separate
+    thread, concurrently with other modules
+
+    """
+    pass
+
+################################################################################
+
 class Streaming(object):
     """ A mixin indicating support for streamable inputs
 
@@ -1880,3 +2002,50 @@ class TestImplicitLooping(unittest.TestCase):
 
     def test_list_custom(self):
         self.run_vt("test-list-custom.vt")
+
+    def test_parallel_iterations(self):
+        from vistrails.core.modules.basic_modules import PythonSource
+        from vistrails.tests.utils import execute, intercept_result
+        import urllib2
+
+        src = urllib2.quote('o = i * 2')
+        with intercept_result(PythonSource, 'o') as results:
+            self.assertFalse(execute([
+                    ('List', 'org.vistrails.vistrails.basic', [
+                        ('value', [('List', '[1, 2, 3, 4, 5, 6]')]),
+                    ]),
+                    ('PythonSource', 'org.vistrails.vistrails.basic', [
+                        ('source', [('String', src)]),
+                    ]),
+                ],
+                [
+                    (0, 'value', 1, 'i'),
+                ],
+                add_port_specs=[
+                    (1, 'input', 'i',
+                     'org.vistrails.vistrails.basic:Integer'),
+                    (1, 'output', 'o',
+                     'org.vistrails.vistrails.basic:Integer'),
+                ],
+                control_params=[
+                    (1, ModuleControlParam.PARALLEL_KEY, '4'),
+                ]))
+        self.assertEqual(results[-1], [2, 4, 6, 8, 10, 12])
+
+    def test_map_iterations(self):
+        module = Module()
+        module.control_params[ModuleControlParam.PARALLEL_KEY] = '4'
+        self.assertEqual(module.get_iteration_workers(), 4)
+        self.assertEqual(module.map_iterations(lambda i: i * i, 10),
+                         [i * i for i in xrange(10)])
+
+        def fail(i):
+            if i in (3, 7):
+                raise ValueError(i)
+            return i
+        with self.assertRaises(ValueError) as cm:
+            module.map_iterations(fail, 10)
+        self.assertEqual(cm.exception.args, (3,))
+
+        module.control_params[ModuleControlParam.PARALLEL_KEY] = 'four'
+        self.assertRaises(ModuleError, module.get_iteration_workers)
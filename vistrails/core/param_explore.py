@@ -39,9 +39,12 @@ This module handles Parameter Exploration in VisTrails
 from __future__ import division
 
 from vistrails.core import debug
+from vistrails.core.interpreter.default import get_default_interpreter
+from vistrails.core.utils import fork_pool, worker_state
 from vistrails.core.vistrail.module_function import ModuleFunction
 from vistrails.core.vistrail.module_param import ModuleParam
 import copy
+import os
 
 import unittest
 
@@ -176,6 +179,7 @@ class InterpolateDiscreteParam(object):
             p.strValue = str(v)
             f.params.append(p)
         m.functions.append(f)
+        pipeline.invalidate_signatures([m.id])
 
 class ActionBasedParameterExploration(object):
     """
@@ -209,38 +213,61 @@ class ActionBasedParameterExploration(object):
         """
         results = []
         resultActions = []
-        
-        def exploreDimension(pipeline, performedActions, dim):
-            """ exploreDimension(pipeline: Pipeline, performedActions: [actions],
-                                 dim: int) -> None
-            Start applying actions to the pipeline at dimension
-            dim. 'pipeline' will not be modified in the function
-            
-            """
-            if dim<0:
-                results.append(pipeline)
-                resultActions.append(performedActions)
-                return
-            currentActions = actions[dim]
+        for (pipeline, performedActions) in self.iterExplore(pipeline,
+                                                             actions,
+                                                             pre_actions):
+            results.append(pipeline)
+            resultActions.append(performedActions)
+        return (results, resultActions)
+
+    def cellCount(self, actions):
+        """ cellCount(actions: [action set]) -> int
+        Number of pipelines in the exploration, ignoring empty dimensions
+
+        """
+        count = 1
+        for currentActions in actions:
+            if len(currentActions)>0:
+                count *= len(currentActions)
+        return count
+
+    def cellActions(self, actions, pre_actions, index):
+        """ cellActions(actions: [action set], pre_actions: [action set],
+                        index: int) -> [actions]
+        Returns the actions leading to the index-th interpolated pipeline,
+        in the order explore() returns them (the first dimension varies
+        fastest)
+
+        """
+        actionSets = []
+        for currentActions in actions:
             if len(currentActions)==0:
-                # Ignore empty dimension
-                exploreDimension(pipeline, performedActions, dim-1)
-                return
-            for actionSet in currentActions:
-                currentPipeline = copy.copy(pipeline)
-                currentPeformedActions = copy.copy(performedActions)
-                for action in actionSet:
-                    currentPipeline.perform_action(action)
-                    currentPeformedActions.append(action)
-                exploreDimension(currentPipeline, currentPeformedActions, dim-1)
-        
+                continue
+            index, step = divmod(index, len(currentActions))
+            actionSets.append(currentActions[step])
+        performedActions = list(pre_actions)
+        for actionSet in reversed(actionSets):
+            performedActions.extend(actionSet)
+        return performedActions
+
+    def iterExplore(self, pipeline, actions, pre_actions=[]):
+        """ iterExplore(pipeline: Pipeline, actions: [action set],
+                        pre_actions: [action set]) -> iterator
+        Same as explore() but generates the (pipeline, actions) tuples one
+        at a time, so that only the pipeline being used is in memory
+
+        """
         # perform pre_actions
-        currentPipeline = copy.copy(pipeline)
+        basePipeline = copy.copy(pipeline)
         for action in pre_actions:
-            currentPipeline.perform_action(action)
-        
-        exploreDimension(currentPipeline, pre_actions, len(actions)-1)
-        return (results, resultActions)
+            basePipeline.perform_action(action)
+
+        for index in xrange(self.cellCount(actions)):
+            performedActions = self.cellActions(actions, pre_actions, index)
+            currentPipeline = copy.copy(basePipeline)
+            for action in performedActions[len(pre_actions):]:
+                currentPipeline.perform_action(action)
+            yield (currentPipeline, performedActions)
 
 def _pipelinePositions(sheetCount, rowCount, colCount,
                        pipelines):
@@ -254,13 +281,161 @@ def _pipelinePositions(sheetCount, rowCount, colCount,
 
     """
 
-    pipelinePositions = []
-    for pId in xrange(len(pipelines)):
-        col = pId % colCount
-        row = (pId // colCount) % rowCount
-        sheet = (pId // (colCount*rowCount)) % sheetCount
-        pipelinePositions.append((row, col, sheet))
-    return pipelinePositions
+    return [_cellPosition(pId, sheetCount, rowCount, colCount)
+            for pId in xrange(len(pipelines))]
+
+def _cellPosition(pId, sheetCount, rowCount, colCount):
+    """ _cellPosition(pId: int, sheetCount: int, rowCount: int,
+                      colCount: int) -> (row, col, sheet)
+    Position of the pId-th pipeline of a parameter exploration
+
+    """
+    col = pId % colCount
+    row = (pId // colCount) % rowCount
+    sheet = (pId // (colCount*rowCount)) % sheetCount
+    return (row, col, sheet)
+
+################################################################################
+
+def _executeCell(index):
+    # the workers get the runner by forking
+    return worker_state().executeCell(index)
+
+class ParameterExplorationRunner(object):
+    """
+    ParameterExplorationRunner executes a parameter exploration without
+    the GUI. The explored pipelines are generated one at a time and the
+    results are returned cell by cell as they are computed.
+
+    With more than one process, the first cell runs in this process and
+    the others on a pool of forked workers. The workers inherit the
+    interpreter cache filled by the first cell, so the upstream modules
+    the explored parameters don't affect are not computed again, and get
+    consecutive cells for the same reason.
+
+    """
+    def __init__(self, controller, pe, processes=1, extra_info=None,
+                 reason='Parameter Exploration'):
+        """ ParameterExplorationRunner(controller: VistrailController,
+                                       pe: ParameterExploration,
+                                       processes: int,
+                                       extra_info: dict,
+                                       reason: str)
+                                       -> ParameterExplorationRunner
+
+        """
+        self.controller = controller
+        self.processes = processes
+        self.extra_info = extra_info or {}
+        self.reason = reason
+        self.explorer = ActionBasedParameterExploration()
+
+        if pe.action_id != controller.current_version:
+            controller.change_selected_version(pe.action_id)
+        self.pipeline = controller.current_pipeline
+        explored = None
+        if self.pipeline:
+            explored = pe.collectParameterActions(self.pipeline)
+        if explored is None:
+            self.count = 0
+            return
+        self.actions, self.pre_actions, vistrail_vars = explored
+        self.count = self.explorer.cellCount(self.actions)
+        self.dims = [max(1, len(a)) for a in self.actions]
+        self.name = os.path.splitext(controller.name)[0] or 'untitled'
+
+        self.basePipeline = copy.copy(self.pipeline)
+        for action in self.pre_actions:
+            self.basePipeline.perform_action(action)
+
+        # remove vars used in pe
+        self.vistrail_variables = dict(
+                (v.uuid, v) for v in controller.get_vistrail_variables()
+                if v.uuid not in vistrail_vars)
+
+    def __len__(self):
+        return self.count
+
+    def cellPosition(self, index):
+        """ cellPosition(index: int) -> (row, col, sheet)
+
+        """
+        return _cellPosition(index, self.dims[2], self.dims[1], self.dims[0])
+
+    def executeCell(self, index, logger=None):
+        """ executeCell(index: int, logger: LogController) -> dict
+        Executes the index-th cell. The result has its 'index' and
+        'position', the 'errors' (message for each module id, None for
+        errors outside of the modules), the ids of the modules that
+        'executed' instead of coming from the cache, and the 'thumbnail'
+        the cell is dumped to if extra_info has a 'pathDumpCells'
+
+        """
+        position = self.cellPosition(index)
+        result = {'index': index,
+                  'position': position,
+                  'errors': {},
+                  'executed': [],
+                  'thumbnail': None}
+        try:
+            performedActions = self.explorer.cellActions(self.actions,
+                                                         self.pre_actions,
+                                                         index)
+            pipeline = copy.copy(self.basePipeline)
+            for action in performedActions[len(self.pre_actions):]:
+                pipeline.perform_action(action)
+
+            extra_info = dict(self.extra_info)
+            if 'pathDumpCells' in extra_info:
+                name = "%s_%s_%s_%s" % ((self.name,) + position)
+                extra_info['nameDumpCells'] = name
+                result['thumbnail'] = os.path.join(
+                        extra_info['pathDumpCells'], name)
+            kwargs = {'locator': self.controller.locator,
+                      'current_version': self.controller.current_version,
+                      'reason': '%s %s_%s_%s' % ((self.reason,) + position),
+                      'actions': performedActions,
+                      'extra_info': extra_info}
+            if logger is not None:
+                kwargs['logger'] = logger
+            if self.vistrail_variables:
+                kwargs['vistrail_variables'] = self.vistrail_variables.get
+
+            interpreter = get_default_interpreter()
+            run = interpreter.execute(pipeline, **kwargs)
+            for module_id, error in run.errors.iteritems():
+                result['errors'][module_id] = str(error)
+            result['executed'] = [module_id for module_id, executed
+                                  in run.executed.iteritems() if executed]
+        except Exception, e:
+            result['errors'][None] = debug.format_exception(e)
+        return result
+
+    def run(self):
+        """ run() -> iterator over dict
+        Executes all the cells, returning their results (see executeCell)
+        in order as soon as they are available
+
+        """
+        if not self.count:
+            return
+        logger = self.controller.get_logger()
+        # workers are forked, so they need the runner and its state
+        if self.processes <= 1 or self.count == 1 or not hasattr(os, 'fork'):
+            for index in xrange(self.count):
+                yield self.executeCell(index, logger)
+            return
+
+        yield self.executeCell(0, logger)
+
+        processes = min(self.processes, self.count-1)
+        # cells in the same row differ only by the first explored value
+        rowLength = ([len(a) for a in self.actions if len(a)>0] or [1])[0]
+        chunksize = max(1, min(rowLength, (self.count-1) // processes))
+        with fork_pool(processes, self) as pool:
+            for result in pool.imap(_executeCell, xrange(1, self.count),
+                                    chunksize):
+                yield result
 
 
 ################################################################################
@@ -283,5 +458,65 @@ class TestParameterExploration(unittest.TestCase):
                           (5, 5.0, 'two'),
                           (10, 10.0, 'three')])
 
+    def testRunner(self):
+        from vistrails.core.modules.basic_modules import StandardOutput
+        from vistrails.core.paramexplore.function import PEFunction
+        from vistrails.core.paramexplore.param import PEParam
+        from vistrails.core.paramexplore.paramexplore import \
+            ParameterExploration as PE
+        from vistrails.core.system import get_vistrails_basic_pkg_id
+        from vistrails.core.vistrail.controller import VistrailController
+        from vistrails.core.vistrail.vistrail import Vistrail
+
+        basic_pkg = get_vistrails_basic_pkg_id()
+        controller = VistrailController(Vistrail(), None, auto_save=False)
+        controller.change_selected_version(0L)
+        str1 = controller.add_module(basic_pkg, 'String')
+        str2 = controller.add_module(basic_pkg, 'String')
+        concat = controller.add_module(basic_pkg, 'ConcatenateString')
+        output = controller.add_module(basic_pkg, 'StandardOutput')
+        controller.add_connection(str1.id, 'value', concat.id, 'str1')
+        controller.add_connection(str2.id, 'value', concat.id, 'str2')
+        controller.add_connection(concat.id, 'value', output.id, 'value')
+
+        def pe_function(module, values, dim):
+            param = PEParam(pos=0, interpolator='List', value=repr(values),
+                            dimension=dim)
+            return PEFunction(module_id=module.id, port_name='value',
+                              parameters=[param])
+        pe = PE(action_id=controller.current_version, dims='[3, 2, 1, 1]',
+                layout='{}', functions=[pe_function(str1, ['a', 'b', 'c'], 0),
+                                        pe_function(str2, ['x', 'y'], 1)])
+        positions = [(0, 0, 0), (0, 1, 0), (0, 2, 0),
+                     (1, 0, 0), (1, 1, 0), (1, 2, 0)]
+
+        values = []
+        def compute(module):
+            values.append(module.get_input('value'))
+        orig_compute = StandardOutput.compute
+        StandardOutput.compute = compute
+        try:
+            runner = ParameterExplorationRunner(controller, pe)
+            self.assertEqual(len(runner), 6)
+            results = list(runner.run())
+            self.assertEqual(values, ['ax', 'bx', 'cx', 'ay', 'by', 'cy'])
+            self.assertEqual([r['position'] for r in results], positions)
+            self.assertEqual([r['errors'] for r in results], [{}] * 6)
+            # upstream of the second dimension comes from the cache
+            self.assertNotIn(str2.id, results[1]['executed'])
+
+            if hasattr(os, 'fork'):
+                values[:] = []
+                runner = ParameterExplorationRunner(controller, pe,
+                                                    processes=2)
+                results = list(runner.run())
+                # only the first cell runs in this process
+                self.assertEqual(values, ['ax'])
+                self.assertEqual([r['position'] for r in results],
+                                 positions)
+                self.assertEqual([r['errors'] for r in results], [{}] * 6)
+        finally:
+            StandardOutput.compute = orig_compute
+
 if __name__ == '__main__':
     unittest.main()
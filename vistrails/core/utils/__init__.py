@@ -44,12 +44,15 @@ from vistrails.core.utils.timemethod import time_method, time_call
 from vistrails.core.utils.tracemethod import trace_method, bump_trace, report_stack, \
      trace_method_options, trace_method_args
 from vistrails.core.utils.color import ColorByName
+import contextlib
 import copy
 from distutils.version import LooseVersion
 import errno
 import functools
 import itertools
+import multiprocessing
 import os
+import signal
 import sys
 import warnings
 import weakref
@@ -576,6 +579,56 @@ def long2bytes(nb, length=None):
         result += '\x00' * (length - len(result))
     return result
 
+################################################################################
+# Pools of forked worker processes
+
+# What the processes of fork_pool() get by forking, see worker_state()
+_worker_state = None
+
+def initialize_worker(initializer=None, *args):
+    """initialize_worker(initializer: callable, *args) -> None
+    Initializer of the pools of worker processes: interrupts are left to
+    the VisTrails process and the database connections inherited from it
+    are dropped, then initializer(*args) is called.
+
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The connections opened by the parent can't be shared
+    from vistrails.db.services.locator import DBLocator
+    DBLocator.pool.forget()
+    if initializer is not None:
+        initializer(*args)
+
+def worker_state():
+    """worker_state() -> object
+    The state given to the fork_pool() this worker process belongs to.
+
+    """
+    return _worker_state
+
+@contextlib.contextmanager
+def fork_pool(processes, state, initializer=None, *args):
+    """fork_pool(processes: int, state: object, initializer: callable,
+                 *args) -> context manager
+    Runs a pool of forked worker processes (see initialize_worker). The
+    workers get state from worker_state(), so it doesn't have to be
+    pickled. The pool is terminated if the block raises.
+
+    """
+    global _worker_state
+    _worker_state = state
+    pool = multiprocessing.Pool(processes, initializer=initialize_worker,
+                                initargs=(initializer,) + args)
+    try:
+        yield pool
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _worker_state = None
+
 ################################################################################
 
 class Chdir(object):
@@ -605,6 +658,10 @@ class _TestRegularFibo(object):
 class _TestMemoFibo(_TestRegularFibo):
     f = memo_method(_TestRegularFibo.f)
 
+def _test_worker(i):
+    from vistrails.db.services.locator import DBLocator
+    return worker_state()[i], len(DBLocator.pool._held)
+
 class TestCommon(unittest.TestCase):
     def test_append_to_dict_of_lists(self):
         f = {}
@@ -692,6 +749,20 @@ class TestCommon(unittest.TestCase):
         self.assertRaises(Exception, raise_exception)
         self.assertEquals(os.getcwd(), currentpath)
 
+    @unittest.skipIf(not hasattr(os, 'fork'), "needs fork")
+    def test_fork_pool(self):
+        from vistrails.db.services.locator import DBLocator
+        held = DBLocator.pool._held
+        DBLocator.pool._held = {'parent': []}
+        try:
+            with fork_pool(2, ['a', 'b', 'c']) as pool:
+                results = pool.map(_test_worker, xrange(3))
+        finally:
+            DBLocator.pool._held = held
+        # the workers see the state but not the parent's connections
+        self.assertEqual(results, [('a', 0), ('b', 0), ('c', 0)])
+        self.assertIsNone(worker_state())
+
     def test_deprecated(self):
         import re
         def canon_path(path):
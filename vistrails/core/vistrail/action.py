@@ -137,7 +137,12 @@ class Action(DBAction):
         _action.__class__ = Action
         for _annotation in _action.annotations:
             Annotation.convert(_annotation)
-        for _operation in _action.operations:
+        # Operations that weren't read yet get converted once they are
+        _action.db_transform_operations(Action.convert_operations)
+
+    @staticmethod
+    def convert_operations(_operations):
+        for _operation in _operations:
             if _operation.vtType == 'add':
                 AddOp.convert(_operation)
             elif _operation.vtType == 'change':
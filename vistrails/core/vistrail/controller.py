@@ -36,6 +36,7 @@
 from __future__ import division
 
 import copy
+import heapq
 from itertools import izip
 import os
 import uuid
@@ -49,6 +50,7 @@ import vistrails.core.db.io
 import vistrails.core.db.locator
 from vistrails.core import debug
 from vistrails.core.data_structures.graph import Graph
+from vistrails.core.data_structures.lru import LRUCache
 from vistrails.core.interpreter.default import get_default_interpreter
 from vistrails.core.vistrail.job import JobMonitor
 from vistrails.core.layout.workflow_layout import WorkflowLayout, \
@@ -94,7 +96,6 @@ from vistrails.db import VistrailsDBException
 from vistrails.db.domain import IdScope, DBWorkflowExec
 from vistrails.db.services.io import create_temp_folder, remove_temp_folder
 from vistrails.db.services.io import SaveBundle, open_vt_log_from_db
-from vistrails.db.services.vistrail import getSharedRoot
 from vistrails.core.utils import any
 
 
@@ -143,6 +144,10 @@ def parse_custom_color(color):
     return tuple(int(m.group(i)) for i in xrange(1, 4))
 
 class VistrailController(object):
+    # Number of materialized pipelines kept to speed up version switching
+    # (the empty pipeline for version 0 is always kept)
+    pipeline_cache_size = 32
+
     def __init__(self, vistrail=None, locator=None, abstractions=None, 
                  thumbnails=None, mashups=None, id_scope=None, 
                  set_log_on_vt=True, auto_save=True):
@@ -224,7 +229,8 @@ class VistrailController(object):
     current_pipeline = property(_get_current_pipeline, _set_current_pipeline)
 
     def flush_pipeline_cache(self):
-        self._pipelines = {0: Pipeline()}
+        self._pipelines = LRUCache(self.pipeline_cache_size, pinned=[0])
+        self._pipelines[0] = Pipeline()
 
     def logging_on(self):
         return get_vistrails_configuration().check('executionLog')
@@ -544,6 +550,7 @@ class VistrailController(object):
         start_version = self.current_version
         desc_key = Action.ANNOTATION_DESCRIPTION
         added_upgrade = False
+        added_versions = []
         should_migrate_tags = get_vistrails_configuration().check("migrateTags")
         for action in self._delayed_actions:
             self.vistrail.add_action(action, start_version,
@@ -557,6 +564,7 @@ class VistrailController(object):
             self.current_version = action.id
             start_version = action.id
             added_upgrade = True
+            added_versions.append(action.id)
         for pe in self._delayed_paramexps:
             pe.action_id = self.current_version
             self.vistrail.db_add_parameter_exploration(pe)
@@ -577,7 +585,7 @@ class VistrailController(object):
             if delay_update:
                 self.delayed_update = True
             else:
-                self.recompute_terse_graph()
+                self.update_terse_graph(added_versions)
                 self.invalidate_version_tree(False)
 
     def clear_delayed_actions(self):
@@ -622,7 +630,7 @@ class VistrailController(object):
                 self.vistrail.change_description(description, action.id)
             self.current_version = action.db_id
             self.set_changed(True)
-            self.recompute_terse_graph()
+            self.update_terse_graph([action.db_id])
             
     def create_module_from_descriptor(self, *args, **kwargs):
         return self.create_module_from_descriptor_static(self.id_scope,
@@ -2757,6 +2765,7 @@ class VistrailController(object):
             full = self._current_full_graph
         changed = False
         new_current_version = None
+        pruned = []
         for v in versions:
             if v!=0: # not root
                 highest = v
@@ -2772,11 +2781,12 @@ class VistrailController(object):
                     if highest == self.current_version:
                         new_current_version = full.parent(highest)
                 self.vistrail.pruneVersion(highest)
+                pruned.append(highest)
         if changed:
             self.set_changed(True)
         if new_current_version is not None:
             self.change_selected_version(new_current_version)
-        self.recompute_terse_graph()
+        self.update_terse_graph(pruned)
         self.invalidate_version_tree(False)
 
     def hide_versions_below(self, v=None):
@@ -2792,6 +2802,7 @@ class VistrailController(object):
         am = self.vistrail.actionMap
 
         changed = False
+        hidden = []
 
         while 1:
             try:
@@ -2803,6 +2814,7 @@ class VistrailController(object):
                         if (to in am) and \
                             not self.vistrail.is_pruned(to)]
             self.vistrail.hideVersion(current)
+            hidden.append(current)
             changed = True
 
             for child in children:
@@ -2810,7 +2822,7 @@ class VistrailController(object):
 
         if changed:
             self.set_changed(True)
-        self.recompute_terse_graph()
+        self.update_terse_graph(hidden)
         self.invalidate_version_tree(False, False)
 
     def show_all_versions(self):
@@ -2832,10 +2844,12 @@ class VistrailController(object):
         """
         full = self.vistrail.getVersionGraph()
         p = full.parent(v2)
+        expanded = []
         while p > v1:
             self.vistrail.expandVersion(p)
+            expanded.append(p)
             p = full.parent(p)
-        self.recompute_terse_graph()
+        self.update_terse_graph(expanded)
         self.invalidate_version_tree(False, True)
 
     def collapse_versions(self, v):
@@ -2856,6 +2870,7 @@ class VistrailController(object):
             # The target is an upgrade
             upgrades.add(int(ann.value))
 
+        collapsed = []
         while x:
             current = x.pop()
 
@@ -2879,13 +2894,14 @@ class VistrailController(object):
             if len(children) > 1:
                 break
             self.vistrail.collapseVersion(current)
+            collapsed.append(current)
 
             for child in children:
                 if (not child in tm and  # has no Tag
                     child != self.current_base_version): # not selected
                     x.append(child)
 
-        self.recompute_terse_graph()
+        self.update_terse_graph(collapsed)
         self.invalidate_version_tree(False, True)
 
     def expand_or_collapse_all_versions_below(self, v=None, expand=True):
@@ -2898,6 +2914,7 @@ class VistrailController(object):
 
         full = self.vistrail.getVersionGraph()
         x = [v]
+        changed = []
 
         am = self.vistrail.actionMap
 
@@ -2913,10 +2930,11 @@ class VistrailController(object):
                 self.vistrail.expandVersion(current)
             else:
                 self.vistrail.collapseVersion(current)
+            changed.append(current)
 
             for child in children:
                 x.append(child)
-        self.recompute_terse_graph()
+        self.update_terse_graph(changed)
         self.invalidate_version_tree(False, True)
 
     def expand_all_versions_below(self, v=None):
@@ -2942,26 +2960,14 @@ class VistrailController(object):
                                         'hideUpgrades', True)
         self.show_upgrades = show_upgrades
 
-        # get full version tree (including pruned nodes) this tree is
-        # kept updated all the time. This data is read only and should
-        # not be updated!
-        fullVersionTree = self.vistrail.tree.getVersionTree()
-
-        # create tersed tree
-        open_list = [(0, None, False, False)]  # Elements to be handled
-        tersedVersionTree = Graph()
-
-        # cache actionMap and tagMap because they're properties, sort
-        # of slow
+        # cache actionMap because it's a property, sort of slow
         am = self.vistrail.actionMap
-        tm = self.vistrail.get_tagMap()
-        last_n = self.vistrail.getLastActions(self.num_versions_always_shown)
 
         upgrades = set()
         upgrade_rev_map = {}
-        current_version = self.current_version
-        def rev_map(v):
-            return upgrade_rev_map.get(v, v)
+        # Map from upgrade to the version it upgrades, and back
+        upgrade_origins = {}
+        upgrade_targets = {}
 
         if not self.show_upgrades:
             # process upgrade annotations
@@ -2971,34 +2977,108 @@ class VistrailController(object):
                 # The target is an upgrade
                 upgrades.add(int(ann.value))
                 # Map from upgraded version to original
-                upgrade_rev_map[int(ann.value)] = ann.action_id
-
-            # Map current version
-            current_version = rev_map(current_version)
-
-            # Map tags
-            tm, orig_tm = {}, tm
-            for version, name in sorted(orig_tm.iteritems(),
-                                        key=lambda p: p[0]):
-                v = version
-                while v in upgrade_rev_map:
-                    v = upgrade_rev_map[v]
-                    if v in orig_tm:
-                        # Found another tag in upgrade chain, don't move tag
-                        v = version
-                        break
-                tm[v] = name
-            del orig_tm
+                upgrade_origins[int(ann.value)] = ann.action_id
+                upgrade_targets[ann.action_id] = int(ann.value)
 
             # Transitively flatten upgrade_rev_map
-            for k, v in upgrade_rev_map.iteritems():
-                while v in upgrade_rev_map:
-                    v = upgrade_rev_map[v]
+            for k, v in upgrade_origins.iteritems():
+                while v in upgrade_origins:
+                    v = upgrade_origins[v]
                 upgrade_rev_map[k] = v
 
+        self._upgrade_rev_map = upgrade_rev_map
+        self._terse_upgrades = upgrades
+        self._terse_upgrade_origins = upgrade_origins
+        self._terse_upgrade_targets = upgrade_targets
+
+        # Map tags
+        tm = {}
+        tag_positions = {}
+        orig_tm = self.vistrail.get_tagMap()
+        for version, name in orig_tm.iteritems():
+            v = self._terse_tag_position(version, orig_tm.__contains__)
+            tm[v] = name
+            tag_positions[version] = v
+        self._terse_tags = tm
+        self._terse_tag_positions = tag_positions
+
+        # Map current version
+        self._terse_current = upgrade_rev_map.get(self.current_version,
+                                                  self.current_version)
+
+        # same versions as getLastActions(), without sorting all of them
+        n = self.num_versions_always_shown
+        self._terse_latest = sorted(heapq.nlargest(n, am)) if n > 0 else []
+        self._terse_last_n = set(self._terse_latest[:-1])
+
+        self._terse_settings = self._get_terse_settings()
+        # Position of each version reached by the last walk, see
+        # _walk_terse_graph()
+        self._terse_state = {}
+        self._terse_children = {}
+
+        self._current_terse_graph = Graph()
+        self._current_full_graph = self.vistrail.tree.getVersionTree()
+        self._walk_terse_graph([(0, None, False, False)], set())
+
+    def _get_terse_settings(self):
+        return (self.show_upgrades, self.full_tree, self.refine, self.search,
+                self.num_versions_always_shown)
+
+    def _terse_tag_position(self, version, is_tagged):
+        """ Version a tag is displayed on: tags on upgrades are moved to
+        the original version, unless there is another tag in the upgrade
+        chain
+
+        """
+        v = version
+        while v in self._terse_upgrade_origins:
+            v = self._terse_upgrade_origins[v]
+            if is_tagged(v):
+                # Found another tag in upgrade chain, don't move tag
+                return version
+        return v
+
+    def _walk_terse_graph(self, open_list, dirty):
+        """ _walk_terse_graph(open_list: list, dirty: set) -> set
+        Walks down the version tree from the (version, parent, expandable,
+        collapsible) tuples in open_list, adding the versions to display to
+        the terse graph.
+
+        The position each version was reached with is recorded, and the
+        walk doesn't go below a version reached with the same position as
+        last time unless it is in dirty. Versions that are no longer
+        reached are removed from the terse graph. Returns the terse graph
+        vertices that got new outgoing edges.
+
+        """
+        # get full version tree (including pruned nodes) this tree is
+        # kept updated all the time. This data is read only and should
+        # not be updated!
+        fullVersionTree = self.vistrail.tree.getVersionTree()
+        tersedVersionTree = self._current_terse_graph
+
+        am = self.vistrail.actionMap
+        tm = self._terse_tags
+        last_n = self._terse_last_n
+        upgrades = self._terse_upgrades
+        current_version = self._terse_current
+        state = self._terse_state
+        terse_children = self._terse_children
+        new_edges = set()
+
         while open_list:
             current, parent, expandable, collapsible = open_list.pop()
 
+            position = (parent, expandable, collapsible)
+            if current not in dirty and state.get(current) == position:
+                continue
+            dirty.discard(current)
+            if current in tersedVersionTree.vertices:
+                for froom, edge_id in \
+                        tersedVersionTree.inverse_adjacency_list[current][:]:
+                    tersedVersionTree.delete_edge(froom, current, edge_id)
+
             # mount children list
             all_children = [
                 to for to, _ in fullVersionTree.adjacency_list[current]
@@ -3021,6 +3101,13 @@ class VistrailController(object):
                 else:
                     children.append(child)
 
+            # forget whatever was below the children that went away
+            for child in terse_children.get(current, ()):
+                if child not in children:
+                    self._drop_terse_subtree(child)
+            state[current] = position
+            terse_children[current] = children
+
             display = (self.full_tree or
                        current == 0 or                 # is root
                        current in tm or                # hasTag:
@@ -3028,6 +3115,7 @@ class VistrailController(object):
                        current == current_version or   # isCurrentVersion
                        len(children) != 1)             # leaf or branch
 
+            added = False
             if (display or am[current].expand):        # forced expansion
 
                 # yes it will!  this needs to be here because if we
@@ -3041,12 +3129,15 @@ class VistrailController(object):
                         current == current_version):
                     # add vertex...
                     tersedVersionTree.add_vertex(current, tm.get(current))
+                    tersedVersionTree.vertices[current] = tm.get(current)
+                    added = True
 
                     # ...and the parent
                     if parent is not None:
                         collapse_here = not collapsible and not display
                         tersedVersionTree.add_edge(parent, current,
                                                    (expandable, collapse_here))
+                        new_edges.add(parent)
                         collapsible = collapsible or collapse_here
 
                     # update the parent info that will be used by the
@@ -3059,16 +3150,158 @@ class VistrailController(object):
             else:
                 parentToChildren = parent
                 expandable = True
+            if not added and current in tersedVersionTree.vertices:
+                tersedVersionTree.delete_vertex(current)
 
             if collapsible and len(children) > 1:
                 collapsible = False
             for child in children:
                 open_list.append((child, parentToChildren,
                                   expandable, collapsible))
+        return new_edges
 
-        self._current_terse_graph = tersedVersionTree
-        self._current_full_graph = self.vistrail.tree.getVersionTree()
-        self._upgrade_rev_map = upgrade_rev_map
+    def _drop_terse_subtree(self, version):
+        """ Removes a version that is no longer reached, and everything
+        below it, from the terse graph
+
+        """
+        graph = self._current_terse_graph
+        open_list = [version]
+        while open_list:
+            v = open_list.pop()
+            if v not in self._terse_state:
+                continue
+            del self._terse_state[v]
+            open_list.extend(self._terse_children.pop(v, ()))
+            if v in graph.vertices:
+                graph.delete_vertex(v)
+
+    def update_terse_graph(self, versions):
+        """ update_terse_graph(versions: list of int) -> None
+        Updates the terse graph after the given versions were added,
+        tagged or untagged, pruned, hidden, expanded or collapsed, or
+        selected. Only the parts of the version tree around them are
+        walked again; the whole graph is recomputed if the display
+        settings changed since the last recompute_terse_graph()
+
+        """
+        show_upgrades = not getattr(get_vistrails_configuration(),
+                                    'hideUpgrades', True)
+        if (self._current_terse_graph is None or
+                getattr(self, '_terse_state', None) is None or
+                self.show_upgrades != show_upgrades or
+                self._terse_settings != self._get_terse_settings() or
+                (self.refine and self.search)):
+            # not self.recompute_terse_graph(): subclasses update their
+            # views once after update_terse_graph() returns
+            VistrailController.recompute_terse_graph(self)
+            return
+
+        am = self.vistrail.actionMap
+        changed = set(v for v in versions if v in am or v == 0)
+        versions = changed.difference([0])
+        changed.update(am[v].parent for v in versions)
+
+        # new upgrades
+        if not self.show_upgrades:
+            for v in versions:
+                parent = am[v].parent
+                if v in self._terse_upgrade_origins:
+                    continue
+                ann = self.vistrail.get_action_annotation(
+                        parent, Vistrail.UPGRADE_ANNOTATION)
+                if ann is not None and int(ann.value) == v:
+                    self._terse_upgrades.add(v)
+                    self._terse_upgrade_origins[v] = parent
+                    self._terse_upgrade_targets[parent] = v
+                    self._upgrade_rev_map[v] = \
+                            self._upgrade_rev_map.get(parent, parent)
+
+        # tags, including the ones further down the upgrade chains since
+        # they might have to stay where they are now
+        tags = set()
+        for v in changed:
+            while v is not None and v not in tags:
+                tags.add(v)
+                v = self._terse_upgrade_targets.get(v)
+        if any(self.vistrail.is_pruned(v) for v in versions):
+            # pruning removed the tags below
+            tags.update(self._terse_tag_positions)
+        tm = self._terse_tags
+        new_tags = []
+        for v in tags:
+            name = self.vistrail.get_tag(v)
+            old_position = self._terse_tag_positions.get(v)
+            if name:
+                position = self._terse_tag_position(v, self.vistrail.has_tag)
+            else:
+                position = None
+            if (old_position == position and
+                    (position is None or tm.get(position) == name)):
+                continue
+            if old_position is not None:
+                del self._terse_tag_positions[v]
+                del tm[old_position]
+                changed.add(old_position)
+            if position is not None:
+                new_tags.append((v, position, name))
+        for v, position, name in new_tags:
+            self._terse_tag_positions[v] = position
+            tm[position] = name
+            changed.add(position)
+
+        # current version
+        current_version = self._upgrade_rev_map.get(self.current_version,
+                                                    self.current_version)
+        if current_version != self._terse_current:
+            changed.update((self._terse_current, current_version))
+            self._terse_current = current_version
+
+        # latest versions
+        new_versions = versions.difference(self._terse_latest)
+        n = self.num_versions_always_shown
+        if new_versions and n > 0:
+            self._terse_latest = sorted(self._terse_latest +
+                                        list(new_versions))[-n:]
+            last_n = set(self._terse_latest[:-1])
+            changed.update(last_n.symmetric_difference(self._terse_last_n))
+            self._terse_last_n = last_n
+
+        # walk again from the closest versions that were reached last time,
+        # for each changed version and its parent
+        state = self._terse_state
+        dirty = set()
+        for v in changed:
+            if v not in am and v != 0:
+                continue
+            for v in (v, am[v].parent if v != 0 else 0):
+                while v not in state:
+                    v = am[v].parent
+                dirty.add(v)
+        ancestry = self.vistrail.ancestry
+        new_edges = set()
+        for v in sorted(dirty, key=ancestry.depth):
+            if v in dirty and v in state:
+                new_edges.update(self._walk_terse_graph([(v,) + state[v]],
+                                                        dirty))
+
+        # keep the children in the order a full walk would add them
+        graph = self._current_terse_graph
+        def walk_order(e1, e2):
+            if ancestry.precedes(e1[0], e2[0]):
+                return -1
+            return 1
+        for v in new_edges:
+            if v in graph.vertices:
+                graph.adjacency_list[v].sort(cmp=walk_order)
+
+    def discard_terse_graph_state(self):
+        """ discard_terse_graph_state() -> None
+        Makes the next update_terse_graph() recompute the whole terse
+        graph, for callers that changed it directly
+
+        """
+        self._terse_state = None
 
     def save_version_graph(self, filename, tersed=True, highlight=None):
         if tersed:
@@ -3701,6 +3934,29 @@ class VistrailController(object):
             cost += 1
         return cost
 
+    @staticmethod
+    def pipeline_copy_cost(pipeline):
+        """ pipeline_copy_cost(pipeline: Pipeline) -> int
+        Estimated cost of copying a pipeline, in the same unit as
+        version_path_costs() (one per module or connection)
+
+        """
+        if pipeline is None:
+            return 0
+        return len(pipeline.modules) + len(pipeline.connections)
+
+    def version_path_costs(self, version, sources):
+        """ version_path_costs(version: int, sources: list of int)
+               -> dict(int: int)
+        Estimated cost of turning the pipeline of each source version into
+        the pipeline of version, as the number of operations in the actions
+        on the path between them (through their common ancestor)
+
+        """
+        ancestry = self.vistrail.ancestry
+        return dict((source, ancestry.pathCost(source, version))
+                    for source in sources)
+
     def do_version_switch(self, new_version, report_all_errors=False,
                           do_validate=True, from_root=False):
         """ do_version_switch(new_version: int,
@@ -3958,8 +4214,11 @@ class VistrailController(object):
                 log = Log()
                 if isinstance(self.locator, vistrails.core.db.locator.DBLocator):
                     connection = self.locator.get_connection()
-                    db_log = open_vt_log_from_db(connection, 
-                                                 self.vistrail.db_id)
+                    try:
+                        db_log = open_vt_log_from_db(connection,
+                                                     self.vistrail.db_id)
+                    finally:
+                        self.locator.release_connection(connection)
                     Log.convert(db_log)
                     for workflow_exec in db_log.workflow_execs:
                         workflow_exec.db_id = \
@@ -4308,48 +4567,37 @@ class VistrailController(object):
         elif version in self._pipelines:
             result = copy.copy(self._pipelines[version])
         else:
-            # Find the closest upstream pipeline to the current one
-            cv = self._current_full_graph.inverse_immutable().closest_vertex
-            closest = cv(version, self._pipelines)
+            # Pick the cheapest pipeline to start from, among the cached
+            # ones and the current one, accounting for the cost of copying
+            # it and of applying the actions between the two versions
+            candidates = self._pipelines.keys()
+            use_current = (use_current and
+                           self.current_pipeline is not None and
+                           self.current_version not in self._pipelines)
             if use_current:
-                cost_to_closest_version = self.version_switch_cost(version,
-                                                                   closest)
-                # Now we have to decide between the closest pipeline
-                # to version and the current pipeline
-                shared_parent = getSharedRoot(self.vistrail,
-                                              [self.current_version,
-                                               version])
-                cost_common_to_old = self.version_switch_cost(
-                    self.current_version, shared_parent)
-                cost_common_to_new = self.version_switch_cost(version,
-                                                              shared_parent)
-                cost_to_current_version = cost_common_to_old + \
-                    cost_common_to_new
-            else:
-                cost_to_closest_version = 0
-                cost_to_current_version = 1
-            # FIXME I'm assuming copying the pipeline has zero cost.
-            # Formulate a better cost model
-            if cost_to_closest_version < cost_to_current_version:
-                if closest == 0:
-                    result = self.vistrail.getPipeline(version)
+                current_version = max(self.current_version, 0)
+                candidates.append(current_version)
+            costs = self.version_path_costs(version, candidates)
+            def total_cost(v):
+                if use_current and v == current_version:
+                    pipeline = self.current_pipeline
                 else:
-                    result = copy.copy(self._pipelines[closest])
-                    action = self.vistrail.general_action_chain(closest,
-                                                                version)
-                    result.perform_action(action)
+                    pipeline = self._pipelines.peek(v)
+                return costs[v] + self.pipeline_copy_cost(pipeline)
+            closest = min(candidates, key=lambda v: (total_cost(v), v))
+            if closest == 0:
+                result = self.vistrail.getPipeline(version)
             else:
-                action = \
-                    self.vistrail.general_action_chain(self.current_version,
-                                                       version)
-                if self.current_version == -1 or self.current_version == 0:
-                    result = Pipeline()
-                else:
+                if use_current and closest == current_version:
                     result = copy.copy(self.current_pipeline)
+                else:
+                    result = copy.copy(self._pipelines[closest])
+                action = self.vistrail.general_action_chain(closest,
+                                                            version)
                 result.perform_action(action)
 
-            if self._cache_pipelines and self.get_tag(long(version)):
-                # stash a copy for future use for tagged (and upgraded) pipelines
+            if self._cache_pipelines:
+                # stash a copy for future use
                 if do_validate:
                     try:
                         self.validate(result)
@@ -4561,3 +4809,108 @@ class TestTerseGraph(unittest.TestCase):
             13L: [(14L, (False, False)), (17L, (False, False))],
             4L: [], 6L: [], 10L: [], 14L: [], 17L: [],
         })
+
+    def test_update(self):
+        """Updates the tersed version tree incrementally"""
+        import random
+
+        controller = self.get_workflow('upgrades2.xml')
+        controller.recompute_terse_graph()
+        vistrail = controller.vistrail
+        rng = random.Random(3)
+
+        def check():
+            graph = controller._current_terse_graph
+            updated = (dict(graph.vertices),
+                       dict((v, list(edges))
+                            for v, edges in graph.adjacency_list.iteritems()))
+            controller.recompute_terse_graph()
+            graph = controller._current_terse_graph
+            self.assertEqual(updated,
+                             (graph.vertices, graph.adjacency_list))
+
+        for i in xrange(60):
+            versions = sorted(vistrail.getVersionGraph().vertices)
+            version = rng.choice(versions)
+            op = rng.choice(['add', 'add', 'add', 'tag', 'untag', 'select',
+                             'prune', 'expand', 'collapse'])
+            if op == 'add':
+                controller.current_version = version
+                controller.add_new_action(Action(
+                        id=vistrail.idScope.getNewId(Action.vtType),
+                        operations=[]))
+            elif op == 'tag':
+                vistrail.set_tag(version, 'tag %d' % i)
+                controller.update_terse_graph([version])
+            elif op == 'untag':
+                tags = vistrail.get_tagMap().keys()
+                if tags:
+                    version = rng.choice(tags)
+                    vistrail.set_tag(version, None)
+                    controller.update_terse_graph([version])
+            elif op == 'select':
+                controller.current_version = version
+                controller.update_terse_graph([])
+            elif op == 'prune':
+                controller.current_version = 0
+                controller.prune_versions([version])
+            elif op == 'expand':
+                controller.expand_all_versions_below(version)
+            elif op == 'collapse':
+                controller.collapse_versions(version)
+            if i % 3 == 2:
+                check()
+        check()
+
+
+class TestPipelineCache(unittest.TestCase):
+    @staticmethod
+    def summarize(pipeline):
+        modules = sorted((m.id, m.name,
+                          sorted((f.name, tuple(p.strValue for p in f.params))
+                                 for f in m.functions))
+                         for m in pipeline.module_list)
+        connections = sorted((c.source.moduleId, c.source.name,
+                              c.destination.moduleId, c.destination.name)
+                             for c in pipeline.connection_list)
+        return modules, connections
+
+    def get_controller(self):
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.system import vistrails_root_directory
+
+        locator = XMLFileLocator(vistrails_root_directory() +
+                                 '/tests/resources/dummy.xml')
+        return VistrailController(locator.load(), locator)
+
+    def test_untagged_versions(self):
+        """Switches between all versions, comparing with the full replay"""
+        controller = self.get_controller()
+        controller.pipeline_cache_size = 3
+        controller.flush_pipeline_cache()
+        versions = sorted(controller.vistrail.actionMap)
+        for version in versions + list(reversed(versions)):
+            pipeline = controller.get_pipeline(version, do_validate=False)
+            expected = controller.vistrail.getPipeline(version)
+            self.assertEqual(self.summarize(pipeline),
+                             self.summarize(expected))
+            self.assertIn(version, controller._pipelines)
+            self.assertLessEqual(len(controller._pipelines), 4)
+        # The cached pipeline is a copy
+        pipeline.clear()
+        self.assertEqual(
+                self.summarize(controller.get_pipeline(version,
+                                                       do_validate=False)),
+                self.summarize(controller.vistrail.getPipeline(version)))
+
+    def test_path_costs(self):
+        controller = self.get_controller()
+        am = controller.vistrail.actionMap
+        version = max(am)
+        parent = am[version].parent
+        costs = controller.version_path_costs(version, [0, version, parent])
+        self.assertEqual(costs[version], 0)
+        self.assertEqual(costs[parent], len(am[version].operations))
+        self.assertEqual(costs[0],
+                         sum(len(a.operations)
+                             for a in controller.vistrail.actionChain(version)))
@@ -49,6 +49,7 @@ class ModuleControlParam(DBControlParameter):
     WHILE_OUTPUT_KEY = 'while_output' # output port for forwarded value
     WHILE_MAX_KEY = 'while_max' # Max iterations
     WHILE_DELAY_KEY = 'while_delay' # delay between iterations
+    PARALLEL_KEY = 'parallel_workers' # Threads running loop iterations
     CACHE_KEY = 'cache' # Turn caching on/off for this module (not implemented)
     JOB_CACHE_KEY = 'job_cache' # Always persist output values to disk
 
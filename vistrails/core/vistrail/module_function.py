@@ -89,6 +89,7 @@ class ModuleFunction(DBFunction):
         cp = DBFunction.do_copy(self, new_ids, id_scope, id_remap)
         cp.__class__ = ModuleFunction
         cp.set_defaults(self)
+        cp._signature = self._signature
         return cp
 
     @staticmethod
@@ -103,6 +104,9 @@ class ModuleFunction(DBFunction):
     ##########################################################################
     # Properties
 
+    # Signature memoized by Hasher, along with what it was computed from
+    _signature = None
+
     id = DBFunction.db_pos
     pos = DBFunction.db_pos
     real_id = DBFunction.db_id
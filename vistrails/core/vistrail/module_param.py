@@ -111,6 +111,7 @@ class ModuleParam(DBParameter):
         cp.evaluatedStrValue = self.evaluatedStrValue
         cp.queryMethod = self.queryMethod
         cp._port_spec_item = self._port_spec_item
+        cp._signature = self._signature
 
         # cp.identifier = self.identifier
         # cp.namespace = self.namespace
@@ -138,12 +139,33 @@ class ModuleParam(DBParameter):
 
     ##########################################################################
 
+    # Signature memoized by Hasher, reset when a field it covers changes
+    _signature = None
+
+    def _signed_property(db_property):
+        def setter(self, value):
+            db_property.fset(self, value)
+            self._signature = None
+        return property(db_property.fget, setter)
+    db_name = _signed_property(DBParameter.db_name)
+    db_type = _signed_property(DBParameter.db_type)
+    db_val = _signed_property(DBParameter.db_val)
+    del _signed_property
+
+    def _get_evaluatedStrValue(self):
+        return self._evaluatedStrValue
+    def _set_evaluatedStrValue(self, value):
+        self._evaluatedStrValue = value
+        self._signature = None
+    evaluatedStrValue = property(_get_evaluatedStrValue,
+                                 _set_evaluatedStrValue)
+
     id = DBParameter.db_pos
     pos = DBParameter.db_pos
     real_id = DBParameter.db_id
-    name = DBParameter.db_name
-    typeStr = DBParameter.db_type
-    strValue = DBParameter.db_val
+    name = db_name
+    typeStr = db_type
+    strValue = db_val
     alias = DBParameter.db_alias
 
     def parse_db_type(self):
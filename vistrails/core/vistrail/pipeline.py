@@ -147,6 +147,16 @@ class Pipeline(DBWorkflow):
             self._module_signatures = \
                 Bidict([(k,copy.copy(v))
                         for (k,v) in other._module_signatures.iteritems()])
+        self._parent_modules = {}
+        if other is None:
+            self._validated_with = None
+            self._unvalidated_modules = set()
+            self._unvalidated_connections = set()
+        else:
+            self._validated_with = other._validated_with
+            self._unvalidated_modules = set(other._unvalidated_modules)
+            self._unvalidated_connections = \
+                set(other._unvalidated_connections)
 
         self.graph = Graph()
         for module in self.module_list:
@@ -262,6 +272,10 @@ class Pipeline(DBWorkflow):
         self._subpipeline_signatures = Bidict()
         self._module_signatures = Bidict()
         self._connection_signatures = Bidict()
+        self._parent_modules = {}
+        self._validated_with = None
+        self._unvalidated_modules = set()
+        self._unvalidated_connections = set()
 
     def get_tmp_id(self, type):
         """get_tmp_id(type: str) -> long
@@ -348,6 +362,15 @@ class Pipeline(DBWorkflow):
                     (op.vtType, op.what)
                 raise VistrailsInternalError(msg)
 
+        # Modules, connections and ports invalidate the signatures they
+        # affect themselves; other objects are part of a module's signature
+        if what in self.SIGNATURE_OBJECTS:
+            module_id = self.get_parent_module_id(op.parentObjType,
+                                                  op.parentObjId)
+            if module_id is not None:
+                self.invalidate_signatures([module_id])
+                self._unvalidated_modules.add(module_id)
+
         if op.vtType == 'add':
             f(op.data, op.parentObjType, op.parentObjId)
         elif op.vtType == 'delete':
@@ -355,6 +378,37 @@ class Pipeline(DBWorkflow):
         elif op.vtType == 'change':
             f(op.oldObjId, op.data, op.parentObjType, op.parentObjId)
 
+    # Objects that are part of the signature of the module they belong to
+    SIGNATURE_OBJECTS = set([ModuleFunction.vtType, ModuleParam.vtType,
+                             ModuleControlParam.vtType, PortSpec.vtType,
+                             'portSpecItem'])
+
+    def get_parent_module_id(self, parent_type, parent_id):
+        """get_parent_module_id(parent_type: str, parent_id: int) -> int
+        Returns the id of the module an object belongs to, given its parent,
+        or None if it can't be found.
+
+        """
+        if parent_type in (Module.vtType, Abstraction.vtType, Group.vtType):
+            return parent_id
+        elif parent_type == ModuleFunction.vtType:
+            has_child = Module.db_has_function_with_id
+        elif parent_type == PortSpec.vtType:
+            has_child = Module.db_has_portSpec_with_id
+        else:
+            return None
+        key = (parent_type, parent_id)
+        module_id = self._parent_modules.get(key)
+        if (module_id is None or module_id not in self.modules or
+                not has_child(self.modules[module_id], parent_id)):
+            module_id = None
+            for module in self.module_list:
+                if has_child(module, parent_id):
+                    module_id = module.id
+                    self._parent_modules[key] = module_id
+                    break
+        return module_id
+
     def add_module(self, m, *args):
         """add_module(m: Module) -> None 
         Add new module to pipeline
@@ -367,13 +421,17 @@ class Pipeline(DBWorkflow):
 #             m.abstraction = self.abstraction_map[m.abstraction_id]
         self.db_add_object(m)
         self.graph.add_vertex(m.id)
+        self.invalidate_signatures([m.id])
+        self._unvalidated_modules.add(m.id)
 
     def change_module(self, old_id, m, *args):
         if not self.has_module_with_id(old_id):
             raise VistrailsInternalError("module %s doesn't exist" % old_id)
+        self.invalidate_signatures([old_id])
         self.db_change_object(old_id, m)
         self.graph.delete_vertex(old_id)
         self.graph.add_vertex(m.id)
+        self._unvalidated_modules.add(m.id)
 
     def delete_module(self, id, *args):
         """delete_module(id:int) -> None 
@@ -383,6 +441,8 @@ class Pipeline(DBWorkflow):
         if not self.has_module_with_id(id):
             raise VistrailsInternalError("id missing in modules")
 
+        self.invalidate_signatures([id])
+
         # we're hiding the necessary operations by doing this!
         for (_, conn_id) in self.graph.adjacency_list[id][:]:
             self.delete_connection(conn_id)
@@ -392,10 +452,6 @@ class Pipeline(DBWorkflow):
         # self.modules.pop(id)
         self.db_delete_object(id, Module.vtType)
         self.graph.delete_vertex(id)
-        if id in self._module_signatures:
-            del self._module_signatures[id]
-        if id in self._subpipeline_signatures:
-            del self._subpipeline_signatures[id]
 
     def add_connection(self, c, *args):
         """add_connection(c: Connection) -> None 
@@ -409,6 +465,8 @@ class Pipeline(DBWorkflow):
         if c.source is not None and c.destination is not None:
             assert(c.sourceId != c.destinationId)        
             self.graph.add_edge(c.sourceId, c.destinationId, c.id)
+            self.invalidate_signatures([c.destinationId])
+            self._unvalidated_connections.add(c.id)
             self.ensure_connection_specs([c.id])
 
             source_name = c.source.name
@@ -433,6 +491,8 @@ class Pipeline(DBWorkflow):
 
         old_conn = self.connections[old_id]
         if old_conn.source is not None and old_conn.destination is not None:
+            self.invalidate_signatures([old_conn.destinationId])
+            self._unvalidated_modules.add(old_conn.destinationId)
             self.graph.delete_edge(old_conn.sourceId, old_conn.destinationId,
                                    old_conn.id)
             if self.graph.out_degree(old_conn.sourceId) < 1:
@@ -449,6 +509,8 @@ class Pipeline(DBWorkflow):
         if c.source is not None and c.destination is not None:
             assert(c.sourceId != c.destinationId)
             self.graph.add_edge(c.sourceId, c.destinationId, c.id)
+            self.invalidate_signatures([c.destinationId])
+            self._unvalidated_connections.add(c.id)
             self.ensure_connection_specs([c.id])
             self.modules[c.sourceId].connected_output_ports.add(c.source.name)
             self.modules[c.destinationId].connected_input_ports.add(
@@ -463,6 +525,9 @@ class Pipeline(DBWorkflow):
         if not self.has_connection_with_id(id):
             raise VistrailsInternalError("id %s missing in connections" % id)
         conn = self.connections[id]
+        if conn.source is not None and conn.destination is not None:
+            self.invalidate_signatures([conn.destinationId])
+            self._unvalidated_modules.add(conn.destinationId)
         # self.connections.pop(id)
         self.db_delete_object(id, 'connection')
         if conn.source is not None and conn.destination is not None and \
@@ -519,6 +584,8 @@ class Pipeline(DBWorkflow):
             self.graph.add_edge(connection.sourceId, 
                                 connection.destinationId, 
                                 connection.id)
+            self.invalidate_signatures([connection.destinationId])
+            self._unvalidated_connections.add(connection.id)
             c = connection
             source_name = c.source.name
             output_ports = self.modules[c.sourceId].connected_output_ports
@@ -535,6 +602,8 @@ class Pipeline(DBWorkflow):
     def delete_port(self, port_id, port_type, parent_type, parent_id):
         conn = self.connections[parent_id]
         if len(conn.ports) >= 2:
+            self.invalidate_signatures([conn.destinationId])
+            self._unvalidated_modules.add(conn.destinationId)
             self.graph.delete_edge(conn.sourceId, 
                                    conn.destinationId, 
                                    conn.id)
@@ -552,6 +621,8 @@ class Pipeline(DBWorkflow):
     def change_port(self, old_port_id, port, parent_type, parent_id):
         connection = self.connections[parent_id]
         if len(connection.ports) >= 2:
+            self.invalidate_signatures([connection.destinationId])
+            self._unvalidated_modules.add(connection.destinationId)
             source_list = self.graph.adjacency_list[connection.sourceId]
             source_list.remove((connection.destinationId, connection.id))
             dest_list = \
@@ -559,6 +630,8 @@ class Pipeline(DBWorkflow):
             dest_list.remove((connection.sourceId, connection.id))
         self.db_change_object(old_port_id, port, parent_type, parent_id)
         if len(connection.ports) >= 2:
+            self.invalidate_signatures([connection.destinationId])
+            self._unvalidated_connections.add(connection.id)
             source_list = self.graph.adjacency_list[connection.sourceId]
             source_list.append((connection.destinationId, connection.id))
             dest_list = \
@@ -679,6 +752,7 @@ class Pipeline(DBWorkflow):
                 # FIXME: check if a change parameter action needs to be generated
                 parameter = self.db_get_object(what, oId)
                 parameter.strValue = str(value)
+                self.invalidate_signatures([mId])
             else:
                 raise VistrailsInternalError("only parameters are supported")
         
@@ -771,28 +845,45 @@ class Pipeline(DBWorkflow):
 
     # Subpipelines
 
-    def subpipeline_signature(self, module_id, visited_ids=None):
+    def subpipeline_signature(self, module_id):
         """subpipeline_signature(module_id): string
-        Returns the signature for the subpipeline whose sink id is module_id."""
-        if visited_ids is None:
-            visited_ids = set([module_id])
-        elif module_id in visited_ids:
-            raise CycleInPipeline()
+        Returns the signature for the subpipeline whose sink id is module_id.
+
+        Missing upstream signatures are computed first, iteratively, so that
+        long chains don't hit the recursion limit."""
         try:
             return self._subpipeline_signatures[module_id]
         except KeyError:
-            upstream_sigs = [(self.subpipeline_signature(
-                                      m,
-                                      visited_ids | set([module_id])) +
-                              Hasher.connection_signature(
-                                      self.connections[edge_id]))
-                             for (m, edge_id) in
-                             self.graph.edges_to(module_id)]
-            module_sig = self.module_signature(module_id)
-            sig = Hasher.subpipeline_signature(module_sig,
-                                               upstream_sigs)
-            self._subpipeline_signatures[module_id] = sig
-            return sig
+            pass
+        signatures = self._subpipeline_signatures
+        # Depth-first traversal; a module is computed when it is popped the
+        # second time, once all its upstream modules are done
+        in_progress = set()
+        stack = [(module_id, False)]
+        while stack:
+            m, upstream_done = stack.pop()
+            if upstream_done:
+                in_progress.discard(m)
+                upstream_sigs = [(signatures[u] +
+                                  Hasher.connection_signature(
+                                          self.connections[edge_id]))
+                                 for (u, edge_id) in self.graph.edges_to(m)]
+                signatures[m] = Hasher.subpipeline_signature(
+                        self.module_signature(m),
+                        upstream_sigs)
+                continue
+            if m in signatures:
+                continue
+            if m in in_progress:
+                raise CycleInPipeline()
+            in_progress.add(m)
+            stack.append((m, True))
+            for (u, edge_id) in self.graph.edges_to(m):
+                if u not in signatures:
+                    if u in in_progress:
+                        raise CycleInPipeline()
+                    stack.append((u, False))
+        return signatures[module_id]
 
     def subpipeline_id_from_signature(self, signature):
         """subpipeline_id_from_signature(sig): int
@@ -826,11 +917,43 @@ class Pipeline(DBWorkflow):
         return signature in self._connection_signatures.inverse
 
     def refresh_signatures(self):
-        self._connection_signatures = {}
-        self._subpipeline_signatures = {}
-        self._module_signatures = {}
+        self._connection_signatures = Bidict()
+        self._subpipeline_signatures = Bidict()
+        self._module_signatures = Bidict()
         self.compute_signatures()
 
+    def invalidate_signatures(self, module_ids):
+        """invalidate_signatures(module_ids: list of int) -> None
+        Forgets the signatures that depend on the given modules: their own
+        signatures, and the subpipeline and connection signatures of the
+        modules downstream of them.
+
+        Operations performed on the pipeline call this; modules changed
+        directly are found by check_module_signatures()."""
+        subpipeline_signatures = self._subpipeline_signatures
+        connection_signatures = self._connection_signatures
+        to_visit = []
+        for module_id in module_ids:
+            if module_id in self._module_signatures:
+                del self._module_signatures[module_id]
+            to_visit.append(module_id)
+        seeds = set(module_ids)
+        while to_visit:
+            module_id = to_visit.pop()
+            if module_id in subpipeline_signatures:
+                del subpipeline_signatures[module_id]
+            elif module_id not in seeds:
+                # Nothing downstream can have been computed without it
+                continue
+            seeds.discard(module_id)
+            if module_id not in self.graph.vertices:
+                continue
+            for (_, edge_id) in self.graph.edges_to(module_id):
+                if edge_id in connection_signatures:
+                    del connection_signatures[edge_id]
+            for (downstream_id, _) in self.graph.edges_from(module_id):
+                to_visit.append(downstream_id)
+
     def compute_signatures(self):
         """compute_signatures(): compute all module and subpipeline signatures
         for this pipeline."""
@@ -839,6 +962,35 @@ class Pipeline(DBWorkflow):
         for c in self.connections.iterkeys():
             self.connection_signature(c)
 
+    def check_module_signatures(self):
+        """check_module_signatures() -> list of int
+        Finds the modules that were changed in place since their signature
+        was computed, e.g. by setting a parameter's value directly, by
+        computing their signature again. Their signatures are invalidated,
+        and they are validated again.
+
+        validate() calls this, so that executions never use stale
+        signatures; the memoized signatures of unchanged functions and
+        parameters keep it cheap."""
+        registry = get_module_registry()
+        signatures = self._module_signatures
+        changed = []
+        for module_id in list(signatures):
+            module = self.modules.get(module_id)
+            if module is None:
+                continue
+            try:
+                if registry.module_signature(self, module) == \
+                        signatures[module_id]:
+                    continue
+            except Exception:
+                pass
+            changed.append(module_id)
+        if changed:
+            self.invalidate_signatures(changed)
+            self._unvalidated_modules.update(changed)
+        return changed
+
     ##########################################################################
     # Registry-related
 
@@ -846,22 +998,63 @@ class Pipeline(DBWorkflow):
         # want to check entire pipeline and reconcile it with the
         # registry - if anything fails, generate invalid pipeline with
         # the errors
+
+        # Modules changed in place are checked again as well
+        self.check_module_signatures()
+
+        # If the pipeline was valid for the same registry and variables,
+        # only the modules and connections changed since then are checked
+        # again, along with their neighbors
+        registry = get_module_registry()
+        validated_with = (registry, registry.generation,
+                          frozenset(var.uuid for var in vistrail_vars))
+        if (self._validated_with is not None and
+                self._validated_with[0] is registry and
+                self._validated_with[1:] == validated_with[1:]):
+            module_ids = [m_id for m_id in self._unvalidated_modules
+                          if m_id in self.modules]
+            connection_ids = set(c_id
+                                 for c_id in self._unvalidated_connections
+                                 if c_id in self.connections)
+            if not module_ids and not connection_ids:
+                self.is_valid = True
+                return True
+            for m_id in module_ids:
+                connection_ids.update(c_id for (_, c_id)
+                                      in self.graph.edges_to(m_id))
+                connection_ids.update(c_id for (_, c_id)
+                                      in self.graph.edges_from(m_id))
+            # Cycles and list depths only change downstream of these
+            changed_ids = set(module_ids)
+            changed_ids.update(self.connections[c_id].destinationId
+                               for c_id in connection_ids)
+            changed_ids = [m_id for m_id in changed_ids
+                           if m_id in self.graph.vertices]
+            modules = [self.modules[m_id] for m_id in module_ids]
+        else:
+            module_ids = connection_ids = changed_ids = None
+            modules = self.modules.values()
+        self._validated_with = None
+
         exceptions = set()
         try:
-            self.ensure_modules_are_on_registry()
+            self.ensure_modules_are_on_registry(module_ids)
         except InvalidPipeline, e:
             exceptions.update(e.get_exception_set())
 
         # check for cycles
         try:
-            self.graph.dfs(raise_if_cyclic=True)
+            if changed_ids is None:
+                self.graph.dfs(raise_if_cyclic=True)
+            elif changed_ids:
+                self.graph.dfs(changed_ids, raise_if_cyclic=True)
         except GraphContainsCycles, e:
             exceptions.add(e)
 
         # do this before we check connection specs because it is
         # possible that a subpipeline invalidates the module, meaning
         # we shouldn't check the connection specs
-        for module in self.modules.itervalues():
+        for module in modules:
             if module.is_valid and (module.is_group() or 
                                     module.is_abstraction()):
                 try:
@@ -882,23 +1075,23 @@ class Pipeline(DBWorkflow):
                     except Exception:
                         pass
         try:
-            self.ensure_port_specs()
+            self.ensure_port_specs(module_ids)
         except InvalidPipeline, e:
             exceptions.update(e.get_exception_set())
         try:
-            self.ensure_connection_specs()
+            self.ensure_connection_specs(connection_ids)
         except InvalidPipeline, e:
             exceptions.update(e.get_exception_set())
         try:
-            self.ensure_functions()
+            self.ensure_functions(module_ids)
         except InvalidPipeline, e:
             exceptions.update(e.get_exception_set())
         try:
-            self.ensure_vistrail_variables(vistrail_vars)
+            self.ensure_vistrail_variables(vistrail_vars, module_ids)
         except InvalidPipeline, e:
             exceptions.update(e.get_exception_set())
         
-        self.check_subworkflow_versions()
+        self.check_subworkflow_versions(module_ids)
         
         if len(exceptions) > 0:
             if raise_exception:
@@ -907,11 +1100,28 @@ class Pipeline(DBWorkflow):
                 self.is_valid = False
                 return False
 
-        self.mark_list_depth()
+        self.mark_list_depth(changed_ids)
+
+        # The signatures are what check_module_signatures() compares with to
+        # find the modules changed in place
+        for m_id in (module_ids if module_ids is not None
+                     else self.modules.keys()):
+            try:
+                self.module_signature(m_id)
+            except Exception:
+                pass
 
+        self._validated_with = validated_with
+        self._unvalidated_modules.clear()
+        self._unvalidated_connections.clear()
         self.is_valid = True
         return True
 
+    def _get_modules(self, module_ids=None):
+        if module_ids is None:
+            return self.modules.itervalues()
+        return (self.modules[m_id] for m_id in module_ids)
+
     def ensure_old_modules_have_package_names(self):
         """ensure_old_modules_have_package_names()
 
@@ -1012,10 +1222,10 @@ class Pipeline(DBWorkflow):
         if len(exceptions) > 0:
             raise InvalidPipeline(exceptions, self)
 
-    def ensure_functions(self):
+    def ensure_functions(self, module_ids=None):
         exceptions = set()
         reg = get_module_registry()
-        for module in self.modules.itervalues():
+        for module in self._get_modules(module_ids):
             for function in module.functions:
                 is_valid = True
                 if module.is_valid and not module.has_port_spec(function.name, 
@@ -1055,10 +1265,10 @@ class Pipeline(DBWorkflow):
         if len(exceptions) > 0:
             raise InvalidPipeline(exceptions, self)
         
-    def ensure_vistrail_variables(self, vistrail_vars):
+    def ensure_vistrail_variables(self, vistrail_vars, module_ids=None):
         var_uuids = [var.uuid for var in vistrail_vars]
         exceptions = set()
-        for module in self.modules.itervalues():
+        for module in self._get_modules(module_ids):
             if module.is_vistrail_var():
                 # first check if value is already set
                 # (used by parameter explorations)
@@ -1078,9 +1288,9 @@ class Pipeline(DBWorkflow):
         if len(exceptions) > 0:
             raise InvalidPipeline(exceptions, self)
 
-    def ensure_port_specs(self):
+    def ensure_port_specs(self, module_ids=None):
         exceptions = set()
-        for module in self.modules.itervalues():
+        for module in self._get_modules(module_ids):
             # if module.is_valid:
             try:
                 for port_spec in module.port_specs.itervalues():
@@ -1104,9 +1314,9 @@ class Pipeline(DBWorkflow):
         if len(exceptions) > 0:
             raise InvalidPipeline(exceptions, self)
 
-    def check_subworkflow_versions(self):
+    def check_subworkflow_versions(self, module_ids=None):
         reg = get_module_registry()
-        for module in self.modules.itervalues():
+        for module in self._get_modules(module_ids):
             if module.is_valid and module.is_abstraction():
                 module.check_latest_version()
 
@@ -1125,10 +1335,14 @@ class Pipeline(DBWorkflow):
         """
         from vistrails.core.modules.basic_modules import List, Variant
 
-        # TODO: module_ids is currently ignored, this is potentially suboptimal
         result = []
+        if module_ids is not None:
+            module_ids = [m_id for m_id in module_ids
+                          if m_id in self.graph.vertices]
+            if not module_ids:
+                return result
         # Might raise GraphContainsCycles
-        for module_id in self.graph.vertices_topological_sort():
+        for module_id in self.graph.vertices_topological_sort(module_ids):
             module = self.get_module_by_id(module_id)
             module.list_depth = 0
             ports = []
@@ -1435,6 +1649,19 @@ class TestPipeline(unittest.TestCase):
                             connections=[c1])
         return pipeline
 
+    def create_connection(self, id_scope, source, destination):
+        c = Connection()
+        c.sourceId = source.id
+        c.destinationId = destination.id
+        c.source.id = id_scope.getNewId(Port.vtType)
+        c.destination.id = id_scope.getNewId(Port.vtType)
+        c.source.name = 'value'
+        c.source.moduleName = 'PythonCalc'
+        c.destination.name = 'value1'
+        c.destination.moduleName = 'PythonCalc'
+        c.id = id_scope.getNewId(Connection.vtType)
+        return c
+
     def setUp(self):
         self.pipeline = self.create_default_pipeline()
         self.sink_id = 2
@@ -1457,6 +1684,144 @@ class TestPipeline(unittest.TestCase):
         self.assertNotEquals(c_sig_size_before, c_sig_size_after)
         self.assertNotEquals(p_sig_size_before, p_sig_size_after)
 
+    def create_chain(self, length, id_scope=None):
+        if id_scope is None:
+            id_scope = IdScope()
+        desc = get_module_registry().get_descriptor_by_name(
+                'org.vistrails.vistrails.pythoncalc', 'PythonCalc')
+        p = Pipeline()
+        prev = None
+        for i in xrange(length):
+            m = Module(id=id_scope.getNewId(Module.vtType),
+                       name=desc.name,
+                       package=desc.identifier,
+                       version=desc.package_version)
+            p.add_module(m)
+            if prev is not None:
+                p.add_connection(self.create_connection(id_scope, prev, m))
+            prev = m
+        return p
+
+    def test_long_chain_signature(self):
+        """Signatures of long chains are computed without recursing."""
+        p = self.create_chain(3000)
+        p.compute_signatures()
+        self.assertEqual(len(p._subpipeline_signatures), 3000)
+
+    def test_incremental_signatures(self):
+        """Changing a parameter only invalidates the downstream modules."""
+        from vistrails.core.db.action import create_action
+        p = self.create_default_pipeline()
+        p.compute_signatures()
+        param = ModuleParam(id=-1, type='Float', val='3.0')
+        function = ModuleFunction(id=3, name='value2', parameters=[param])
+        action = create_action([('add', function, Module.vtType, 0)])
+        p.perform_action(action)
+        self.assertEqual(sorted(p._subpipeline_signatures.keys()), [1])
+        self.assertEqual(p._connection_signatures, {})
+        p.compute_signatures()
+        incremental = (dict(p._module_signatures),
+                       dict(p._subpipeline_signatures),
+                       dict(p._connection_signatures))
+        p.refresh_signatures()
+        self.assertEqual(incremental,
+                         (p._module_signatures,
+                          p._subpipeline_signatures,
+                          p._connection_signatures))
+
+    def test_in_place_signatures(self):
+        """Modules changed in place get new signatures."""
+        p = self.create_default_pipeline()
+        p.compute_signatures()
+        self.assertEqual(p.check_module_signatures(), [])
+        p.modules[0].functions[0].params[0].strValue = '3.0'
+        self.assertEqual(p.check_module_signatures(), [0])
+        p.compute_signatures()
+        incremental = (dict(p._module_signatures),
+                       dict(p._subpipeline_signatures),
+                       dict(p._connection_signatures))
+        p.refresh_signatures()
+        self.assertEqual(incremental,
+                         (p._module_signatures,
+                          p._subpipeline_signatures,
+                          p._connection_signatures))
+
+        param = ModuleParam(type='Float', val='1.0')
+        p.modules[1].functions.append(
+                ModuleFunction(id=3, name='value2', parameters=[param]))
+        self.assertEqual(p.check_module_signatures(), [1])
+        self.assertEqual(sorted(p._subpipeline_signatures.keys()), [0])
+
+    def test_in_place_validation(self):
+        """Modules changed in place are validated again."""
+        p = self.create_chain(3)
+        p.validate()
+        checked = []
+        def ensure_functions(module_ids=None):
+            checked.append(module_ids)
+        p.ensure_functions = ensure_functions
+        param = ModuleParam(type='String', val='+')
+        p.modules[1].functions.append(
+                ModuleFunction(id=0, name='op', parameters=[param]))
+        self.assertTrue(p.validate())
+        self.assertEqual(checked, [[1]])
+        param.strValue = '-'
+        self.assertTrue(p.validate())
+        self.assertEqual(checked, [[1], [1]])
+        self.assertTrue(p.validate())
+        self.assertEqual(checked, [[1], [1]])
+
+    def test_cycle_signature(self):
+        p = self.create_default_pipeline()
+        p.add_connection(self.create_connection(IdScope(2), p.modules[2],
+                                                p.modules[0]))
+        self.assertRaises(CycleInPipeline, p.compute_signatures)
+
+    def test_incremental_validation(self):
+        """Only changed modules are validated again."""
+        p = self.create_chain(3)
+        p.validate()
+        checked = []
+        def ensure_functions(module_ids=None):
+            checked.append(module_ids)
+        p.ensure_functions = ensure_functions
+        self.assertTrue(p.validate())
+        self.assertEqual(checked, [])
+
+        m = Module(id=3, name='PythonCalc',
+                   package='org.vistrails.vistrails.pythoncalc',
+                   version=p.modules[0].version)
+        p.add_module(m)
+        p.add_connection(self.create_connection(IdScope(2), p.modules[2], m))
+        self.assertTrue(p.validate())
+        self.assertEqual(checked, [[3]])
+        self.assertTrue(p.modules[3].is_valid)
+        self.assertTrue(p.connections[2].destination.is_valid)
+
+        # Validation is complete again once the registry changes
+        get_module_registry().generation += 1
+        self.assertTrue(p.validate())
+        self.assertEqual(checked, [[3], None])
+
+    def test_incremental_validation_errors(self):
+        p = self.create_chain(3)
+        p.validate()
+        p.add_connection(self.create_connection(IdScope(2), p.modules[2],
+                                                p.modules[0]))
+        with self.assertRaises(InvalidPipeline) as cm:
+            p.validate()
+        self.assertEqual([type(e) for e in cm.exception.get_exception_set()],
+                         [GraphContainsCycles])
+        p.delete_connection(2)
+
+        m = Module(id=3, name='NotAModule',
+                   package='org.vistrails.vistrails.pythoncalc',
+                   version=p.modules[0].version)
+        p.add_module(m)
+        self.assertFalse(p.validate(False))
+        p.delete_module(3)
+        self.assertTrue(p.validate())
+
     def test_delete_connections(self):
         p = self.create_default_pipeline()
         p.delete_connection(0)
@@ -127,6 +127,8 @@ class Vistrail(DBVistrail):
         # add all versions to the trees
         for action in sorted(self.actions, key=lambda a: a.id):
             self.tree.addVersion(action.id, action.prevId)
+        # common ancestor index, filled in as versions are queried or added
+        self.ancestry = VersionAncestry(self)
 
     @staticmethod
     def convert(_vistrail):
@@ -411,38 +413,17 @@ class Vistrail(DBVistrail):
         """
         if (v1<=0 or v2<=0):
             return 0
-        
-        t1 = set()
-        t1.add(v1)
-        t = self.actionMap[v1].parent
-        while  t != 0:
-            t1.add(t)
-            t = self.actionMap[t].parent
-        
-        t = v2
-        while t != 0:
-            if t in t1:
-                return t
-            t = self.actionMap[t].parent
-        return 0
+        return self.ancestry.commonAncestor(v1, v2)
     
     def getLastCommonVersion(self, v):
         """getLastCommonVersion(v: Vistrail) -> int
         Returns the last version that is common to this vistrail and v
         
         """
-        # TODO:  There HAS to be a better way to do this...
-        common = []
-        for action in self.actionMap:
-            if(v.hasVersion(action.timestep)):
-                common.append(action.timestep)
-                
-        timestep = 0
-        for time in common:
-            if time > timestep:
-                timestep = time
-
-        return timestep
+        common = set(self.actionMap).intersection(v.actionMap)
+        if not common:
+            return 0
+        return max(common)
 
     def general_action_chain(self, v1, v2):
         """general_action_chain(v1, v2): Returns an action that turns
@@ -548,6 +529,7 @@ class Vistrail(DBVistrail):
 
         # signal to update explicit tree
         self.tree.addVersion(action.id, action.prevId)
+        self.ancestry.addVersion(action.id, action.prevId)
 
     def hasTag(self, tag):
         """ hasTag(tag) -> boolean 
@@ -938,19 +920,20 @@ class Vistrail(DBVistrail):
         result = Graph()
         result.add_vertex(0)
 
-        # the sorting is for the display using graphviz
-        # we want to always add nodes from left to right
-        for action in sorted(self.actionMap.itervalues(), 
-                             key=lambda x: x.timestep):
-            # We need to check the presence of the parent's timestep
-            # on the graph because it might have been previously
-            # pruned. Remember that pruning is only marked for the
-            # topmost invisible action.
-            if (action.parent in result.vertices and
-                not self.is_pruned(action.id)):
-                result.add_edge(action.parent,
-                                action.timestep,
-                               0)
+        tree = self.tree.getVersionTree()
+        am = self.actionMap
+        # Walk down from the root, not going below pruned versions.
+        # Remember that pruning is only marked for the topmost invisible
+        # action. The sorting is for the display using graphviz: we want
+        # to always add nodes from left to right
+        open_list = [0]
+        while open_list:
+            version = open_list.pop()
+            children = sorted(to for to, _ in tree.adjacency_list[version]
+                              if to in am and not self.is_pruned(to))
+            for child in children:
+                result.add_edge(version, child, 0)
+            open_list.extend(children)
         return result
 
     def getDate(self):
@@ -969,14 +952,17 @@ class Vistrail(DBVistrail):
         Add a version into the prunedVersion set
         
         """
-        tagMap = self.get_tagMap()
         if version!=0: # not root
-            def delete_tag(version):
-                if version in tagMap:
-                    # delete tag
-                    self.set_tag(version, '')
-            current_graph = self.getVersionGraph()
-            current_graph.dfs(vertex_set=[version], enter_vertex=delete_tag)
+            # delete the tags of the versions that become invisible
+            tree = self.tree.getVersionTree()
+            am = self.actionMap
+            open_list = [version]
+            while open_list:
+                v = open_list.pop()
+                if self.has_tag(v):
+                    self.set_tag(v, '')
+                open_list.extend(to for to, _ in tree.adjacency_list[v]
+                                 if to in am and not self.is_pruned(to))
             self.set_prune(version, str(True))
 
             # self.prunedVersions.add(version)
@@ -1039,7 +1025,10 @@ class Vistrail(DBVistrail):
                 log = open_log_from_xml(self.db_log_filename, True)
         if isinstance(self.locator, vistrails.core.db.locator.DBLocator):
             connection = self.locator.get_connection()
-            log = open_vt_log_from_db(connection, self.db_id)
+            try:
+                log = open_vt_log_from_db(connection, self.db_id)
+            finally:
+                self.locator.release_connection(connection)
         Log.convert(log)
         return log
     
@@ -1160,6 +1149,173 @@ class ExplicitExpandedVersionTree(object):
         
 ##############################################################################
 
+class VersionAncestry(object):
+    """
+    Binary lifting index over the version tree of a vistrail, answering
+    common ancestor and path length queries in O(log n).
+
+    Versions are indexed as they are added, or on first use if they were
+    added behind the vistrail's back (db_add_action). Since pruning only
+    hides versions, the tree itself never changes; if an indexed version
+    disappears or changes parent anyway, the index is rebuilt.
+    """
+    def __init__(self, vistrail):
+        self.vistrail = vistrail
+        self.clear()
+
+    def clear(self):
+        self._parent = {0: 0}
+        # number of actions between the root and each version
+        self._depth = {0: 0}
+        # number of operations between the root and each version
+        self._cost = {0: 0}
+        # _jumps[v][k] is the ancestor of v 2**k levels up
+        self._jumps = {0: []}
+
+    def __contains__(self, version):
+        return version in self._depth
+
+    def addVersion(self, id, prevId):
+        """ addVersion(id: int, prevId: int) -> None
+        Indexes a new version if its parent is already indexed; otherwise
+        it will be indexed when first queried
+
+        """
+        if prevId in self._depth:
+            self._add(id, prevId)
+
+    def _add(self, version, parent):
+        action = self.vistrail.actionMap[version]
+        depth = self._depth[parent] + 1
+        jumps = [parent]
+        k = 0
+        while (2 << k) <= depth:
+            jumps.append(self._jumps[jumps[k]][k])
+            k += 1
+        self._parent[version] = parent
+        self._depth[version] = depth
+        # Counts the operations without loading them if they were read lazily
+        self._cost[version] = (self._cost[parent] +
+                               len(action.db_get_operation_ids()))
+        self._jumps[version] = jumps
+
+    def _check(self, version):
+        """ Makes sure version is indexed, walking up to the first indexed
+        ancestor if needed
+
+        """
+        action_map = self.vistrail.actionMap
+        if version in self._depth:
+            if version == 0:
+                return
+            action = action_map.get(version)
+            if action is not None and action.parent == self._parent[version]:
+                return
+            self.clear()
+        path = []
+        while version not in self._depth:
+            path.append(version)
+            version = action_map[version].parent
+        for v in reversed(path):
+            self._add(v, action_map[v].parent)
+
+    def depth(self, version):
+        """ depth(version: int) -> int
+        Number of actions between the root and version
+
+        """
+        self._check(version)
+        return self._depth[version]
+
+    def ancestor(self, version, depth):
+        """ ancestor(version: int, depth: int) -> int
+        Returns the ancestor of version at the given depth
+
+        """
+        self._check(version)
+        if not 0 <= depth <= self._depth[version]:
+            raise ValueError("Version %d has no ancestor at depth %d" %
+                             (version, depth))
+        return self._lift(version, self._depth[version] - depth)
+
+    def _lift(self, version, distance):
+        k = 0
+        while distance:
+            if distance & 1:
+                version = self._jumps[version][k]
+            distance >>= 1
+            k += 1
+        return version
+
+    def commonAncestor(self, v1, v2):
+        """ commonAncestor(v1: int, v2: int) -> int
+        Returns the lowest version that is an ancestor of both v1 and v2
+        (a version is its own ancestor)
+
+        """
+        self._check(v1)
+        self._check(v2)
+        d1 = self._depth[v1]
+        d2 = self._depth[v2]
+        if d1 > d2:
+            v1 = self._lift(v1, d1 - d2)
+        elif d2 > d1:
+            v2 = self._lift(v2, d2 - d1)
+        if v1 == v2:
+            return v1
+        k = len(self._jumps[v1]) - 1
+        while k >= 0:
+            j1 = self._jumps[v1]
+            if k < len(j1) and j1[k] != self._jumps[v2][k]:
+                v1 = j1[k]
+                v2 = self._jumps[v2][k]
+            k -= 1
+        return self._parent[v1]
+
+    def isAncestor(self, ancestor, version):
+        """ isAncestor(ancestor: int, version: int) -> bool
+        Returns True if ancestor is on the path from the root to version
+
+        """
+        self._check(ancestor)
+        self._check(version)
+        distance = self._depth[version] - self._depth[ancestor]
+        return distance >= 0 and self._lift(version, distance) == ancestor
+
+    def precedes(self, v1, v2):
+        """ precedes(v1: int, v2: int) -> bool
+        Returns True if v1 comes before v2 in a depth-first walk of the
+        tree that visits children by increasing version
+
+        """
+        common = self.commonAncestor(v1, v2)
+        if common == v1:
+            return v1 != v2
+        elif common == v2:
+            return False
+        depth = self._depth[common] + 1
+        return (self._lift(v1, self._depth[v1] - depth) <
+                self._lift(v2, self._depth[v2] - depth))
+
+    def pathLength(self, v1, v2):
+        """ pathLength(v1: int, v2: int) -> int
+        Number of actions on the path between v1 and v2
+
+        """
+        common = self.commonAncestor(v1, v2)
+        return (self._depth[v1] + self._depth[v2] -
+                2 * self._depth[common])
+
+    def pathCost(self, v1, v2):
+        """ pathCost(v1: int, v2: int) -> int
+        Number of operations in the actions on the path between v1 and v2
+
+        """
+        common = self.commonAncestor(v1, v2)
+        return self._cost[v1] + self._cost[v2] - 2 * self._cost[common]
+
+##############################################################################
+
 class VersionAlreadyTagged(Exception):
     def __str__(self):
         return "Version is already tagged"
@@ -1277,6 +1433,104 @@ class TestVistrail(unittest.TestCase):
         v.get_pipeline_diff_with_connections(v1,v2)
         v.get_pipeline_diff_with_connections(v1,v3)
 
+    def test_ancestry(self):
+        from vistrails.core.db.locator import XMLFileLocator
+        import vistrails.core.system
+        v = XMLFileLocator(vistrails.core.system.vistrails_root_directory() +
+                           '/tests/resources/dummy.xml').load()
+        def path(version):
+            result = [version]
+            while version != 0:
+                version = v.actionMap[version].parent
+                result.append(version)
+            return result
+        versions = [0] + sorted(v.actionMap)
+        for v1 in versions:
+            path1 = path(v1)
+            for v2 in versions:
+                path2 = path(v2)
+                common = max(set(path1).intersection(path2))
+                self.assertEqual(v.ancestry.commonAncestor(v1, v2), common)
+                self.assertEqual(v.ancestry.pathLength(v1, v2),
+                                 path1.index(common) + path2.index(common))
+                self.assertEqual(v.ancestry.isAncestor(v1, v2), v1 in path2)
+        cost = sum(len(v.actionMap[a].operations) for a in path(41)[:-1])
+        self.assertEqual(v.ancestry.pathCost(0, 41), cost)
+        self.assertEqual(v.ancestry.ancestor(41, 0), 0)
+        self.assertEqual(v.ancestry.ancestor(41, v.ancestry.depth(41)), 41)
+
+    def test_ancestry_lazy(self):
+        from vistrails.core.db.locator import XMLFileLocator
+        import vistrails.core.system
+        import os
+        import tempfile
+        v = XMLFileLocator(vistrails.core.system.vistrails_root_directory() +
+                           '/tests/resources/dummy.xml').load()
+        (fd, filename) = tempfile.mkstemp(prefix='vt_', suffix='.xml')
+        os.close(fd)
+        try:
+            XMLFileLocator(filename).save(v)
+            lazy = XMLFileLocator(filename).load()
+        finally:
+            os.unlink(filename)
+        self.assertTrue(any(not a.db_operations_loaded()
+                            for a in lazy.actionMap.itervalues()))
+        self.assertEqual(lazy.ancestry.pathCost(0, 41),
+                         v.ancestry.pathCost(0, 41))
+        self.assertTrue(all(not a.db_operations_loaded()
+                            for a in lazy.actionMap.itervalues()
+                            if a.db_get_operation_ids()))
+
+    def test_ancestry_add(self):
+        v = self.create_vistrail()
+        first = v.get_tag_str('first action').action_id
+        second = v.get_tag_str('second action').action_id
+        self.assertEqual(v.getFirstCommonVersion(first, second), first)
+        # added through the db layer, bypassing addVersion
+        action = Action(id=v.idScope.getNewId(Action.vtType),
+                        prevId=first, operations=[])
+        v.db_add_action(action)
+        self.assertEqual(v.getFirstCommonVersion(action.id, second), first)
+        self.assertEqual(v.ancestry.pathLength(action.id, second), 2)
+        self.assertEqual(v.ancestry.pathCost(action.id, second),
+                         len(v.actionMap[second].operations))
+        branch = Action(operations=[])
+        v.add_action(branch, action.id)
+        self.assertIn(branch.id, v.ancestry)
+        self.assertEqual(v.getFirstCommonVersion(branch.id, second), first)
+        self.assertEqual(v.getFirstCommonVersion(branch.id, action.id),
+                         action.id)
+
+    def test_ancestry_random(self):
+        """compares common ancestors with walking the parents"""
+        import random
+        rng = random.Random(4)
+        v = Vistrail()
+        trunk = 0
+        for i in xrange(300):
+            if rng.random() < 0.8:
+                parent = trunk
+            else:
+                parent = rng.choice([0] + v.actionMap.keys())
+            action = Action(id=v.idScope.getNewId(Action.vtType),
+                            operations=[])
+            v.add_action(action, parent)
+            if parent == trunk:
+                trunk = action.id
+
+        def walk(v1, v2):
+            ancestors = set()
+            while v1 != 0:
+                ancestors.add(v1)
+                v1 = v.actionMap[v1].parent
+            while v2 != 0 and v2 not in ancestors:
+                v2 = v.actionMap[v2].parent
+            return v2
+        versions = v.actionMap.keys()
+        for i in xrange(500):
+            v1, v2 = rng.choice(versions), rng.choice(versions)
+            self.assertEqual(v.getFirstCommonVersion(v1, v2), walk(v1, v2))
+
     def test_empty_action_chain(self):
         """Tests calling action chain on empty version."""
         v = Vistrail()
@@ -37,7 +37,8 @@ from __future__ import division, with_statement
 
 from vistrails.core import debug
 from vistrails.core.bundles import py_import
-from vistrails.core.system import get_elementtree_library, strftime
+from vistrails.core.system import get_elementtree_library, strftime, \
+    time_strptime
 from vistrails.core.utils import Chdir
 from vistrails.core.mashup.mashup_trail import Mashuptrail
 from vistrails.core.modules.sub_module import get_cur_abs_namespace,\
@@ -46,16 +47,21 @@ from vistrails.core.modules.sub_module import get_cur_abs_namespace,\
 import vistrails.core.requirements
 
 from datetime import datetime
+import mmap
 import os.path
+import re
 import shutil
+import sqlite3
 import tempfile
+import threading
+import time
 import copy
 import warnings
 import zipfile
 
 from vistrails.db import VistrailsDBException
 from vistrails.db.domain import DBVistrail, DBWorkflow, DBLog, DBAbstraction, DBGroup, \
-    DBRegistry, DBWorkflowExec, DBOpmGraph, DBProvDocument, DBAnnotation, \
+    DBAction, DBRegistry, DBWorkflowExec, DBOpmGraph, DBProvDocument, DBAnnotation, \
     DBMashuptrail, DBStartup
 import vistrails.db.services.abstraction
 import vistrails.db.services.log
@@ -73,9 +79,20 @@ import vistrails.core.system
 ElementTree = get_elementtree_library()
 
 CONNECT_TIMEOUT = 15
+# Connections kept open per database by a ConnectionPool
+POOL_SIZE = 8
+# Seconds after which an idle pooled connection is pinged before reuse
+POOL_IDLE_TIMEOUT = 60
+
+# Changes appended to an autosaved vistrail are stored in journal/1...
+JOURNAL_PREFIX = 'journal/'
+# Number of journal entries after which an autosave writes a new file
+MAX_JOURNAL_SIZE = 32
 
 _db_lib = None
-def get_db_lib():
+def get_db_lib(db_connection=None):
+    if isinstance(db_connection, SQLiteConnection):
+        return sqlite3
     global _db_lib
     if _db_lib is None:
         MySQLdb = py_import('MySQLdb', {
@@ -91,6 +108,64 @@ def set_db_lib(lib):
     _db_lib = lib
 
 
+def _sqlite_now():
+    return strftime(datetime.now(), '%Y-%m-%d %H:%M:%S')
+
+def _sqlite_datetime(value):
+    return datetime(*time_strptime(value[:19], '%Y-%m-%d %H:%M:%S')[0:6])
+
+sqlite3.register_converter('datetime', _sqlite_datetime)
+
+class SQLiteCursor(sqlite3.Cursor):
+    """Cursor accepting the MySQL statements built by the DAOs.
+
+    Placeholders use the 'format' paramstyle and SELECT ... FOR UPDATE is
+    not needed since SQLite locks the whole database when writing.
+
+    """
+    @staticmethod
+    def translate(statement, parameters):
+        if parameters is not None:
+            statement = statement.replace('%s', '?')
+        if statement.endswith(' FOR UPDATE;'):
+            statement = statement[:-len(' FOR UPDATE;')] + ';'
+        return statement
+
+    def execute(self, statement, parameters=None):
+        statement = self.translate(statement, parameters)
+        if parameters is None:
+            return sqlite3.Cursor.execute(self, statement)
+        return sqlite3.Cursor.execute(self, statement, parameters)
+
+    def executemany(self, statement, seq_of_parameters):
+        statement = self.translate(statement, ())
+        return sqlite3.Cursor.executemany(self, statement, seq_of_parameters)
+
+class SQLiteConnection(sqlite3.Connection):
+    """Connection to an embedded SQLite database.
+
+    Provides the parts of the MySQLdb connection interface used by the
+    persistence layer. Transactions are started by the first write and
+    end with commit(), so each save is a single transaction.
+
+    """
+    def cursor(self, factory=SQLiteCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+    def begin(self):
+        pass
+
+    def ping(self):
+        try:
+            sqlite3.Connection.execute(self, "SELECT 1;")
+        except sqlite3.ProgrammingError, e:
+            # the connection was closed
+            raise sqlite3.OperationalError(*e.args)
+
+def is_sqlite_connection(db_connection):
+    return isinstance(db_connection, SQLiteConnection)
+
+
 class SaveBundle(object):
     """Transient bundle of objects to be saved or loaded.
        The bundle type MUST be specified in the constructor; it should be
@@ -167,17 +242,90 @@ class SaveBundle(object):
         
         return cp
 
-def format_prepared_statement(statement):
-    """format_prepared_statement(statement: str) -> str
-    Formats a prepared statement for compatibility with the currently
-    loaded database library's paramstyle.
+class ZipJournalState(object):
+    """Records what an autosaved vistrail file contains after it was
+    opened or written.
+
+    The next autosave of the vistrail to the same file uses it to append
+    the new actions as a journal entry, instead of writing a new file.
+
+    """
+
+    def __init__(self, filename, actions, journal_size=0, appended=0):
+        self.filename = filename
+        # action id -> what _get_action_state() returned for it
+        self.actions = actions
+        # Entries and bytes appended since the file was written
+        self.journal_size = journal_size
+        self.appended = appended
+        stat = os.stat(filename)
+        self.file_stat = (stat.st_size, stat.st_mtime)
+
+    @staticmethod
+    def from_zip(filename, z):
+        """from_zip(filename: str, z: ZipFile) -> ZipJournalState
+        Builds the state of a file. The caller sets actions.
+
+        """
+        journal_size = 0
+        appended = 0
+        for info in z.infolist():
+            if info.filename.startswith(JOURNAL_PREFIX):
+                appended += info.compress_size
+                journal_size += 1
+        return ZipJournalState(filename, {}, journal_size, appended)
+
+    def can_append(self, filename, vistrail):
+        """can_append(filename: str, vistrail: DBVistrail) -> bool
+        Checks that saving vistrail to filename can append to the file.
+
+        """
+        if (filename != self.filename or
+                self.journal_size >= MAX_JOURNAL_SIZE or
+                self.appended * 2 > self.file_stat[0]):
+            return False
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        if (stat.st_size, stat.st_mtime) != self.file_stat:
+            return False
+        # Removed actions can only be dropped, and changed actions only be
+        # replaced, by writing a new file
+        actions = vistrail.db_actions_id_index
+        for action_id, state in self.actions.iteritems():
+            action = actions.get(action_id)
+            if action is None or _get_action_state(action) != state:
+                return False
+        return True
+
+def _get_action_state(action):
+    """_get_action_state(action: DBAction) -> tuple
+    Returns what can change in an action after it was added, that is
+    everything but its operations.
+
+    """
+    return (action.db_prevId, action.db_date, action.db_session,
+            action.db_user,
+            tuple(sorted((a.db_id, a.db_key, a.db_value)
+                         for a in action.db_annotations)))
+
+def _get_action_states(vistrail):
+    """_get_action_states(vistrail: DBVistrail) -> dict"""
+    return dict((action.db_id, _get_action_state(action))
+                for action in vistrail.db_actions)
+
+def format_prepared_statement(statement, db_connection=None):
+    """format_prepared_statement(statement: str, db_connection) -> str
+    Formats a prepared statement for compatibility with the paramstyle of
+    the connection's database library.
 
     Currently only supports 'qmark' and 'format' paramstyles.
     May be expanded later to allow for more compatibility options
     on input and output.  See PEP 249 for more info.
 
     """
-    style = get_db_lib().paramstyle
+    style = get_db_lib(db_connection).paramstyle
     if style == 'format':
         return statement.replace("?", "%s")
     elif style == 'qmark':
@@ -185,10 +333,16 @@ def format_prepared_statement(statement):
     return statement
 
 def open_db_connection(config):
+    """open_db_connection(config: dict) -> connection
+    Opens a MySQL connection, or a SQLite one if config['db_type'] is
+    'sqlite', in which case config['db'] is the database file.
 
+    """
     if config is None:
         msg = "You need to provide valid config dictionary"
         raise VistrailsDBException(msg)
+    if config.get('db_type') == 'sqlite':
+        return open_sqlite_connection(config['db'])
     if 'connect_timeout' not in config:
         config['connect_timeout'] = CONNECT_TIMEOUT
     try:
@@ -201,6 +355,34 @@ def open_db_connection(config):
         msg = "cannot open connection (%d: %s)" % (e.args[0], e.args[1])
         raise VistrailsDBException(msg)
 
+def open_sqlite_connection(filename):
+    """open_sqlite_connection(filename: str) -> SQLiteConnection
+    Opens a SQLite database in WAL mode, creating the tables if the file
+    is new.
+
+    """
+    try:
+        # A ConnectionPool only lets one thread at a time use a connection
+        db_connection = sqlite3.connect(filename, timeout=CONNECT_TIMEOUT,
+                                        detect_types=sqlite3.PARSE_DECLTYPES,
+                                        factory=SQLiteConnection,
+                                        check_same_thread=False)
+        db_connection.text_factory = str
+        db_connection.create_function('NOW', 0, _sqlite_now)
+        c = db_connection.cursor()
+        c.execute("PRAGMA journal_mode=WAL;")
+        c.execute("PRAGMA synchronous=NORMAL;")
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                  "AND name = 'vistrails_version';")
+        is_new = not c.fetchall()
+        c.close()
+    except sqlite3.Error, e:
+        msg = "cannot open connection (%s)" % e
+        raise VistrailsDBException(msg)
+    if is_new:
+        setup_db_tables(db_connection)
+    return db_connection
+
 def close_db_connection(db_connection):
     if db_connection is not None:
         db_connection.close()
@@ -211,6 +393,9 @@ def test_db_connection(config):
     
     """
     #print "Testing config", config
+    if config.get('db_type') == 'sqlite':
+        close_db_connection(open_db_connection(config))
+        return
     if 'connect_timeout' not in config:
         config['connect_timeout'] = CONNECT_TIMEOUT
     try:
@@ -231,10 +416,139 @@ def ping_db_connection(db_connection):
     """
     try:
         db_connection.ping()
-    except get_db_lib().OperationalError:
+    except get_db_lib(db_connection).OperationalError:
         return False
     return True
     
+class ConnectionPool(object):
+    """Bounded pool of database connections checked out per thread.
+
+    acquire() hands the calling thread a connection that no other thread
+    uses until it has been given back by as many calls to release().
+    Connections held by threads that have exited are taken back when the
+    pool is full. Idle connections are only pinged if they were unused
+    for more than idle_timeout seconds.
+
+    """
+    def __init__(self, max_size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Condition()
+        # config key -> [(connection, time of last use)]
+        self._idle = {}
+        # (config key, thread) -> [connection, checkout count]
+        self._held = {}
+        # config key -> number of open connections
+        self._size = {}
+
+    @staticmethod
+    def _get_key(config):
+        return tuple(sorted((k, v) for k, v in config.iteritems()
+                            if k != 'connect_timeout'))
+
+    def acquire(self, config):
+        key = self._get_key(config)
+        thread = threading.current_thread()
+        while True:
+            connection = None
+            with self._lock:
+                held = self._held.get((key, thread))
+                if held is not None:
+                    held[1] += 1
+                    return held[0]
+                while True:
+                    idle = self._idle.get(key)
+                    if idle:
+                        connection, last_used = idle.pop()
+                        break
+                    elif self._size.get(key, 0) < self.max_size:
+                        self._size[key] = self._size.get(key, 0) + 1
+                        break
+                    elif not self._reclaim(key):
+                        self._lock.wait()
+            if connection is None:
+                try:
+                    connection = open_db_connection(dict(config))
+                except Exception:
+                    self._discard(key, None)
+                    raise
+            elif (time.time() - last_used > self.idle_timeout and
+                    not ping_db_connection(connection)):
+                self._discard(key, connection)
+                continue
+            with self._lock:
+                self._held[(key, thread)] = [connection, 1]
+            return connection
+
+    def release(self, connection):
+        thread = threading.current_thread()
+        with self._lock:
+            for (key, held_by), held in self._held.iteritems():
+                if held_by is thread and held[0] is connection:
+                    held[1] -= 1
+                    if held[1] == 0:
+                        del self._held[(key, held_by)]
+                        self._idle.setdefault(key, []).append(
+                                (connection, time.time()))
+                        self._lock.notify()
+                    return
+
+    def _reclaim(self, key):
+        """Takes back the connections of exited threads, with the lock held.
+        """
+        reclaimed = False
+        for (k, thread), held in self._held.items():
+            if k == key and not thread.is_alive():
+                del self._held[(k, thread)]
+                # Checked with a ping before it is used again
+                self._idle.setdefault(key, []).append((held[0], 0))
+                reclaimed = True
+        return reclaimed
+
+    def _discard(self, key, connection):
+        if connection is not None:
+            try:
+                close_db_connection(connection)
+            except Exception:
+                pass
+        with self._lock:
+            self._size[key] -= 1
+            self._lock.notify()
+
+    def configure(self, max_size=None, idle_timeout=None):
+        with self._lock:
+            if max_size is not None:
+                self.max_size = max_size
+            if idle_timeout is not None:
+                self.idle_timeout = idle_timeout
+            self._lock.notify_all()
+
+    def close(self):
+        """Closes the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            for key, connections in idle.iteritems():
+                self._size[key] -= len(connections)
+        for connections in idle.itervalues():
+            for connection, _ in connections:
+                close_db_connection(connection)
+
+    def forget(self):
+        """Drops all the connections without closing them.
+
+        Used in forked processes, where the connections belong to the
+        parent: closing them from the child would close the parent's.
+        """
+        with self._lock:
+            _forgotten_connections.append((self._idle, self._held))
+            self._idle = {}
+            self._held = {}
+            self._size = {}
+
+# Connections dropped by ConnectionPool.forget(), kept so they are never
+# closed by garbage collection
+_forgotten_connections = []
+
 def translate_to_tbl_name(obj_type):
     map = {DBVistrail.vtType: 'vistrail',
            DBWorkflow.vtType: 'workflow',
@@ -289,7 +603,7 @@ def get_db_object_list(config, obj_type):
         c.close()
         close_db_connection(db)
         
-    except get_db_lib().Error, e:
+    except get_db_lib(db).Error, e:
         msg = "Couldn't get list of vistrails objects from db (%d : %s)" % \
             (e.args[0], e.args[1])
         raise VistrailsDBException(msg)
@@ -309,7 +623,7 @@ def get_db_object_modification_time(db_connection, obj_id, obj_type):
         db_connection.commit()
         time = c.fetchall()[0][0]
         c.close()
-    except get_db_lib().Error, e:
+    except get_db_lib(db_connection).Error, e:
         msg = "Couldn't get object modification time from db (%d : %s)" % \
             (e.args[0], e.args[1])
         raise VistrailsDBException(msg)
@@ -328,7 +642,7 @@ def get_db_object_version(db_connection, obj_id, obj_type):
         c.execute(command % (translate_to_tbl_name(obj_type), obj_id))
         version = c.fetchall()[0][0]
         c.close()
-    except get_db_lib().Error, e:
+    except get_db_lib(db_connection).Error, e:
         msg = "Couldn't get object version from db (%d : %s)" % \
             (e.args[0], e.args[1])
         raise VistrailsDBException(msg)
@@ -345,7 +659,7 @@ def get_db_version(db_connection):
         c.execute(command)
         version = c.fetchall()[0][0]
         c.close()
-    except get_db_lib().Error, e:
+    except get_db_lib(db_connection).Error, e:
         # just return None if we hit an error
         return None
     return version
@@ -375,7 +689,7 @@ def get_db_id_from_name(db_connection, obj_type, name):
         else:
             c.close()
             return int(rows[0][0])
-    except get_db_lib().Error, e:
+    except get_db_lib(db_connection).Error, e:
         c.close()
         msg = "Connection error when trying to get db id from name"
         raise VistrailsDBException(msg)
@@ -406,7 +720,7 @@ def get_db_abstraction_modification_time(db_connection, abstraction):
                              id_value))
         modtime = c.fetchall()[0][0]
         c.close()
-    except get_db_lib().Error, e:
+    except get_db_lib(db_connection).Error, e:
         msg = "Couldn't get modification time from db (%d : %s)" % \
             (e.args[0], e.args[1])
         raise VistrailsDBException(msg)
@@ -443,7 +757,7 @@ def get_db_ids_from_vistrail(db_connection, vt_id, id_key):
         c.execute(command%(translate_to_tbl_name(DBAnnotation.vtType), id_key, vt_id))
         abs_ids = c.fetchall()
         c.close()
-    except get_db_lib().Error, e:
+    except get_db_lib(db_connection).Error, e:
         msg = "Couldn't get object ids from db (%d : %s)" % \
             (e.args[0], e.args[1])
         raise VistrailsDBException(msg)
@@ -480,17 +794,31 @@ def get_matching_abstraction_id(db_connection, abstraction):
         if len(result) > 0:
             #print 'got result:', result
             id = result[0][0]
-    except get_db_lib().Error, e:
+    except get_db_lib(db_connection).Error, e:
         msg = "Couldn't get object modification time from db (%d : %s)" % \
             (e.args[0], e.args[1])
         raise VistrailsDBException(msg)
     return id
 
+def _sqlite_schema_statements(cmd):
+    """_sqlite_schema_statements(cmd: str) -> list
+    Translates a statement from the MySQL schema files for SQLite.
+
+    """
+    if cmd.startswith('DROP TABLE IF EXISTS '):
+        tables = cmd[len('DROP TABLE IF EXISTS '):-1].split(',')
+        return ['DROP TABLE IF EXISTS %s;' % t.strip() for t in tables]
+    cmd = cmd.replace('int not null auto_increment primary key',
+                      'integer primary key autoincrement')
+    cmd = re.sub(r'\)\s*engine=\w+\s*;$', ');', cmd)
+    return [cmd]
+
 def setup_db_tables(db_connection, version=None, old_version=None):
     if version is None:
         version = currentVersion
     if old_version is None:
         old_version = version
+    is_sqlite = is_sqlite_connection(db_connection)
     try:
         def execute_file(c, f):
             cmd = ""
@@ -511,12 +839,15 @@ def setup_db_tables(db_connection, version=None, old_version=None):
                 else:
                     ending = None
                 if ending and ending[-1] == ';':
-                    # FIXME engine stuff switch for MySQLdb, sqlite3
                     cmd = cmd.rstrip()
 #                     if cmd.endswith(engine_str):
 #                         cmd = cmd[:-len(engine_str)] + ';'
                     #print cmd
-                    c.execute(cmd)
+                    if is_sqlite:
+                        for statement in _sqlite_schema_statements(cmd):
+                            c.execute(statement)
+                    else:
+                        c.execute(cmd)
                     cmd = ""
 
         # delete tables
@@ -537,8 +868,18 @@ def setup_db_tables(db_connection, version=None, old_version=None):
 #         db_script = f.read()
 #         c.execute(db_script)
         f.close()
+        if is_sqlite:
+            # Entities are loaded by selecting on their id and type
+            c.execute("SELECT name FROM sqlite_master WHERE type = 'table';")
+            for (table,) in c.fetchall():
+                c.execute("PRAGMA table_info(%s);" % table)
+                columns = set(row[1] for row in c.fetchall())
+                if 'entity_id' in columns and 'entity_type' in columns:
+                    c.execute("CREATE INDEX %s_entity_idx ON "
+                              "%s(entity_id, entity_type);" % (table, table))
+            db_connection.commit()
         c.close()
-    except get_db_lib().Error, e:
+    except get_db_lib(db_connection).Error, e:
         raise VistrailsDBException("unable to create tables: " + str(e))
 
 ##############################################################################
@@ -574,6 +915,47 @@ def save_to_xml(obj, filename, version=None):
         raise VistrailsDBException("cannot save object of type "
                                    "'%s' to xml" % type)
 
+def open_temporary(filename, type):
+    """open_temporary(filename: str, type: str) -> DBVistrail or other
+
+    Opens a backup written by save_temporary(), or an XML file.
+
+    """
+    if type == DBVistrail.vtType and zipfile.is_zipfile(filename):
+        return open_vistrail_from_zip_journal(filename)
+    return open_from_xml(filename, type)
+
+def save_temporary(obj, filename):
+    """save_temporary(obj, filename: str) -> None
+
+    Writes a backup of obj. Vistrails are written to a zip file, to which
+    the following backups only append the changes as journal entries.
+
+    """
+    if obj.vtType == DBVistrail.vtType:
+        state = obj.db_temporary_state
+        if state is not None and state.can_append(filename, obj):
+            obj.db_temporary_state = append_to_vistrail_journal(
+                    obj, filename, state, _get_zip_compression(filename))
+            return
+    new_filename = filename + '.tmp'
+    # Write the new backup before deleting the old one
+    if obj.vtType == DBVistrail.vtType:
+        save_vistrail_to_zip_journal(obj, new_filename)
+    else:
+        save_to_xml(obj, new_filename)
+    if os.path.isfile(filename):
+        os.unlink(filename)
+    os.rename(new_filename, filename)
+    if obj.vtType == DBVistrail.vtType:
+        z = zipfile.ZipFile(filename)
+        try:
+            state = ZipJournalState.from_zip(filename, z)
+        finally:
+            z.close()
+        state.actions = _get_action_states(obj)
+        obj.db_temporary_state = state
+
 def open_bundle_from_zip_xml(bundle_type, filename):
     if bundle_type == DBVistrail.vtType:
         return open_vistrail_bundle_from_zip_xml(filename)
@@ -584,7 +966,8 @@ def open_bundle_from_zip_xml(bundle_type, filename):
 def save_bundle_to_zip_xml(save_bundle, filename, tmp_dir=None, version=None):
     bundle_type = save_bundle.bundle_type
     if bundle_type == DBVistrail.vtType:
-        return save_vistrail_bundle_to_zip_xml(save_bundle, filename, tmp_dir, version)
+        return save_vistrail_bundle_to_zip_xml(save_bundle, filename, tmp_dir,
+                                               version)
     elif bundle_type == DBLog.vtType:
         return save_log_bundle_to_xml(save_bundle, filename, version)
     elif bundle_type == DBWorkflow.vtType:
@@ -682,13 +1065,132 @@ def unserialize(str, obj_type):
 ##############################################################################
 # Vistrail I/O
 
+def _xml_tag(node):
+    if node.tag[0] == "{":
+        return node.tag.split("}")[1]
+    return node.tag
+
+def _operations_loader(vistrail, xml_daos, nodes):
+    def load():
+        operations = []
+        for node in nodes:
+            operation = xml_daos[_xml_tag(node)].fromXML(node)
+            if operation.vtType == 'add' or operation.vtType == 'change':
+                if operation.db_data is None:
+                    if operation.vtType == 'change':
+                        operation.db_objectId = operation.db_oldObjId
+                else:
+                    vistrail.db_add_object(operation.db_data)
+            operations.append(operation)
+        return operations
+    return load
+
+def _read_lazy_actions(source, action_dao, lazy_actions):
+    """_read_lazy_actions(source, action_dao, lazy_actions) -> Element
+    Parses a vistrail element, appending its actions to lazy_actions, and
+    returns the element without them.
+
+    """
+    operation_tags = set(['add', 'change', 'delete'])
+    root = None
+    depth = 0
+    for event, node in ElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = node
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1 or _xml_tag(node) != DBAction.vtType:
+            continue
+        operation_nodes = []
+        operation_ids = []
+        for child in list(node):
+            what = _xml_tag(child)
+            if what not in operation_tags:
+                continue
+            node.remove(child)
+            if what == 'add':
+                obj_id = action_dao.convertFromStr(child.get('objectId'),
+                                                   'long')
+            elif what == 'change':
+                obj_id = action_dao.convertFromStr(child.get('newObjId'),
+                                                   'long')
+            else:
+                obj_id = None
+            operation_ids.append(
+                    (action_dao.convertFromStr(child.get('id'), 'long'),
+                     child.get('what') if obj_id is not None else None,
+                     obj_id))
+            operation_nodes.append(child)
+        lazy_actions.append((action_dao.fromXML(node),
+                             operation_nodes,
+                             operation_ids))
+        root.remove(node)
+    if root is None or _xml_tag(root) != DBVistrail.vtType:
+        return None
+    return root
+
+def read_vistrail_from_xml(source, daoList, journal=()):
+    """read_vistrail_from_xml(source, daoList, journal: list) -> DBVistrail
+
+    Reads a vistrail in the current format incrementally. Actions are read
+    as they are parsed, but their operations are only kept as XML elements,
+    and turned into objects when they are first accessed.
+
+    source and the journal entries are filenames or file objects. Each
+    journal entry holds the actions added since the previous entry, along
+    with all the other children of the vistrail, which replace the
+    previous ones.
+
+    """
+    xml_daos = daoList['xml']
+    action_dao = xml_daos[DBAction.vtType]
+    lazy_actions = []
+    root = _read_lazy_actions(source, action_dao, lazy_actions)
+    if root is None:
+        return None
+    for entry in journal:
+        entry_root = _read_lazy_actions(entry, action_dao, lazy_actions)
+        if entry_root is None:
+            raise VistrailsDBException("Invalid vistrail journal entry")
+        for key, value in entry_root.items():
+            root.set(key, value)
+        for child in list(root):
+            root.remove(child)
+        for child in list(entry_root):
+            root.append(child)
+    vistrail = xml_daos[DBVistrail.vtType].fromXML(root)
+    for action, operation_nodes, operation_ids in lazy_actions:
+        if operation_ids:
+            action.db_set_operations_loader(
+                    _operations_loader(vistrail, xml_daos, operation_nodes),
+                    operation_ids)
+        vistrail.db_add_action(action)
+    return vistrail
+
+def get_version_for_xml_file(source):
+    """get_version_for_xml_file(source) -> str
+    Reads the version from the root element without parsing the file.
+    source is a filename or a file object.
+
+    """
+    if isinstance(source, basestring):
+        with open(source, 'rb') as f:
+            return get_version_for_xml_file(f)
+    for event, node in ElementTree.iterparse(source, events=('start',)):
+        return get_version_for_xml(node)
+    raise VistrailsDBException("Cannot find version information")
+
 def open_vistrail_from_xml(filename):
     """open_vistrail_from_xml(filename) -> Vistrail"""
-    tree = ElementTree.parse(filename)
-    version = get_version_for_xml(tree.getroot())
+    version = get_version_for_xml_file(filename)
     try:
         daoList = getVersionDAO(version)
-        vistrail = daoList.open_from_xml(filename, DBVistrail.vtType, tree)
+        if version == currentVersion:
+            vistrail = read_vistrail_from_xml(filename, daoList)
+        else:
+            vistrail = daoList.open_from_xml(filename, DBVistrail.vtType)
         if vistrail is None:
             raise VistrailsDBException("Couldn't read vistrail from XML")
         vistrail = translate_vistrail(vistrail, version)
@@ -702,6 +1204,69 @@ def open_vistrail_from_xml(filename):
 
     return vistrail
 
+def open_vistrail_from_zip_journal(filename):
+    """open_vistrail_from_zip_journal(filename: str) -> DBVistrail
+    Opens a vistrail written by save_vistrail_to_zip_journal(), along with
+    the journal entries appended to it.
+
+    """
+    z = zipfile.ZipFile(filename)
+    try:
+        members = dict((info.filename, info) for info in z.infolist())
+        if 'vistrail' not in members:
+            raise VistrailsDBException("zip file does not contain vistrail")
+        vistrail = read_vistrail_from_xml(
+                z.open(members['vistrail']), getVersionDAO(currentVersion),
+                [z.open(members[name]) for name in _get_journal(members)])
+        if vistrail is None:
+            raise VistrailsDBException("Couldn't read vistrail from XML")
+        vistrails.db.services.vistrail.update_id_scope(vistrail)
+        state = ZipJournalState.from_zip(filename, z)
+    finally:
+        z.close()
+    state.actions = _get_action_states(vistrail)
+    vistrail.db_temporary_state = state
+    return vistrail
+
+def save_vistrail_to_zip_journal(vistrail, filename):
+    """save_vistrail_to_zip_journal(vistrail: DBVistrail, filename: str)
+         -> None
+    Writes vistrail in the current version to a zip file, that
+    append_to_vistrail_journal() can then append journal entries to.
+
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='vt_journal')
+    try:
+        xml_fname = os.path.join(tmp_dir, 'vistrail')
+        save_vistrail_to_xml(vistrail, xml_fname)
+        z = zipfile.ZipFile(filename, 'w', _get_zip_compression(filename))
+        try:
+            z.write(xml_fname, 'vistrail')
+        finally:
+            z.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def _get_journal(members):
+    """_get_journal(members: dict) -> list
+    Returns the names of the journal entries among the members of a zip
+    file, in the order they were appended.
+
+    """
+    return sorted((name for name in members
+                   if name.startswith(JOURNAL_PREFIX)),
+                  key=lambda name: int(name[len(JOURNAL_PREFIX):]))
+
+def _get_zip_compression(filename):
+    try:
+        import zlib
+    except ImportError:
+        warnings.warn("zlib unavailable, cannot compress %s" % filename,
+                      UserWarning)
+        return zipfile.ZIP_STORED
+    else:
+        return zipfile.ZIP_DEFLATED
+
 def open_vistrail_bundle_from_zip_xml(filename):
     """open_vistrail_bundle_from_zip_xml(filename) -> SaveBundle
     Open a vistrail from a zip compressed format.
@@ -710,14 +1275,14 @@ def open_vistrail_bundle_from_zip_xml(filename):
     abstractions inside archive have prefix 'abstraction_',
     and thumbnails inside archive are '.png' files in 'thumbs' dir
 
+    The vistrail and the mashups are read directly from the archive. The
+    other members are extracted, since they are used as files.
+
     """
-    vt_save_dir = tempfile.mkdtemp(prefix='vt_save')
+    from vistrails.core.packagemanager import get_package_manager
+    pm = get_package_manager()
 
-    z = zipfile.ZipFile(filename)
-    try:
-        z.extractall(vt_save_dir)
-    finally:
-        z.close()
+    vt_save_dir = tempfile.mkdtemp(prefix='vt_save')
 
     vistrail = None
     log = None
@@ -727,39 +1292,48 @@ def open_vistrail_bundle_from_zip_xml(filename):
     thumbnail_files = []
     mashups = []
     try:
-        for root, dirs, files in os.walk(vt_save_dir):
-            for fname in files:
-                if fname == 'vistrail' and root == vt_save_dir:
-                    vistrail = open_vistrail_from_xml(os.path.join(root, fname))
-                elif fname == 'log' and root == vt_save_dir:
+        z = zipfile.ZipFile(filename)
+        try:
+            for info in z.infolist():
+                root, _, fname = info.filename.rpartition('/')
+                if not fname:
+                    # Directory entry
+                    continue
+                if fname == 'vistrail' and not root:
+                    version = get_version_for_xml_file(z.open(info))
+                    if version == currentVersion:
+                        vistrail = read_vistrail_from_xml(
+                                z.open(info), getVersionDAO(currentVersion))
+                        if vistrail is None:
+                            raise VistrailsDBException("Couldn't read "
+                                                       "vistrail from XML")
+                        vistrails.db.services.vistrail.update_id_scope(
+                                vistrail)
+                    else:
+                        # Extracted to be translated
+                        vistrail = open_vistrail_from_xml(
+                                z.extract(info, vt_save_dir))
+                elif fname == 'log' and not root:
                     # FIXME read log to get execution info
                     # right now, just ignore the file
-                    log = None 
-                    log_fname = os.path.join(root, fname)
-                    # log = open_log_from_xml(os.path.join(root, fname))
+                    log = None
+                    log_fname = z.extract(info, vt_save_dir)
+                    # log = open_log_from_xml(log_fname)
                     # objs.append(DBLog.vtType, log)
                 elif fname.startswith('abstraction_'):
-                    abstraction_file = os.path.join(root, fname)
-                    abstraction_files.append(abstraction_file)
-                elif (fname.endswith('.png') and
-                      root == os.path.join(vt_save_dir,'thumbs')):
-                    thumbnail_file = os.path.join(root, fname)
-                    thumbnail_files.append(thumbnail_file)
-                elif root == os.path.join(vt_save_dir,'mashups'):
-                    mashup_file = os.path.join(root, fname)
-                    mashup = open_mashuptrail_from_xml(mashup_file)
-                    mashups.append(mashup)
+                    abstraction_files.append(z.extract(info, vt_save_dir))
+                elif fname.endswith('.png') and root == 'thumbs':
+                    thumbnail_files.append(z.extract(info, vt_save_dir))
+                elif root == 'mashups':
+                    mashups.append(open_mashuptrail_from_xml(z.open(info)))
+                elif any(package.can_handle_vt_file(fname)
+                         for package in pm.enabled_package_list()):
+                    z.extract(info, vt_save_dir)
                 else:
-                    handled = False
-                    from vistrails.core.packagemanager import get_package_manager
-                    pm = get_package_manager()
-                    for package in pm.enabled_package_list():
-                        if package.can_handle_vt_file(fname):
-                            handled = True
-                            continue
-                    if not handled:
-                        unknown_files.append(os.path.join(root, fname))
-    except OSError, e:
+                    unknown_files.append(info.filename)
+        finally:
+            z.close()
+    except (OSError, IOError, zipfile.BadZipfile), e:
         raise VistrailsDBException("Error when reading vt file")
     if len(unknown_files) > 0:
         raise VistrailsDBException("Unknown files in vt file: %s" % \
@@ -769,8 +1343,6 @@ def open_vistrail_bundle_from_zip_xml(filename):
     vistrail.db_log_filename = log_fname
 
     # call package hooks
-    from vistrails.core.packagemanager import get_package_manager
-    pm = get_package_manager()
     for package in pm.enabled_package_list():
         package.loadVistrailFileHook(vistrail, vt_save_dir)
 
@@ -974,18 +1546,10 @@ def save_vistrail_bundle_to_zip_xml(save_bundle, filename, vt_save_dir=None, ver
             package.saveVistrailFileHook(save_bundle.vistrail, vt_save_dir)
     except Exception, e:
         debug.warning("Could not call package hooks", str(e))
+
     tmp_zip_dir = tempfile.mkdtemp(prefix='vt_zip')
     tmp_zip_file = os.path.join(tmp_zip_dir, "vt.zip")
-
-    try:
-        import zlib
-    except ImportError:
-        warnings.warn("zlib unavailable, cannot compress %s" % filename,
-                      UserWarning)
-        compression = zipfile.ZIP_STORED
-    else:
-        compression = zipfile.ZIP_DEFLATED
-    z = zipfile.ZipFile(tmp_zip_file, 'w', compression)
+    z = zipfile.ZipFile(tmp_zip_file, 'w', _get_zip_compression(filename))
     try:
         with Chdir(vt_save_dir):
             # zip current directory
@@ -1003,6 +1567,42 @@ def save_vistrail_bundle_to_zip_xml(save_bundle, filename, vt_save_dir=None, ver
                              mashups=saved_mashups)
     return (save_bundle, vt_save_dir)
 
+def append_to_vistrail_journal(vistrail, filename, state,
+                               compression=zipfile.ZIP_DEFLATED):
+    """append_to_vistrail_journal(vistrail: DBVistrail, filename: str,
+                                  state: ZipJournalState,
+                                  compression: int) -> ZipJournalState
+
+    Appends a journal entry to a file written by
+    save_vistrail_to_zip_journal(), with the actions added since state was
+    recorded and the other children of the vistrail. Returns the new state.
+
+    """
+    new_actions = [action for action in vistrail.db_actions
+                   if action.db_id not in state.actions]
+    entry = DBVistrail(
+            id=vistrail.db_id, version=currentVersion, name=vistrail.db_name,
+            actions=new_actions, tags=vistrail.db_tags,
+            annotations=vistrail.db_annotations,
+            controlParameters=vistrail.db_controlParameters,
+            vistrailVariables=vistrail.db_vistrailVariables,
+            parameter_explorations=vistrail.db_parameter_explorations,
+            actionAnnotations=vistrail.db_actionAnnotations)
+    node = getVersionDAO(currentVersion).write_xml_object(entry)
+    node.set('version', currentVersion)
+
+    journal_size = state.journal_size + 1
+    z = zipfile.ZipFile(filename, 'a', compression)
+    try:
+        start = len(z.infolist())
+        z.writestr('%s%d' % (JOURNAL_PREFIX, journal_size),
+                   ElementTree.tostring(node))
+        appended = sum(info.compress_size for info in z.infolist()[start:])
+    finally:
+        z.close()
+    return ZipJournalState(filename, _get_action_states(vistrail),
+                           journal_size, state.appended + appended)
+
 def save_vistrail_bundle_to_db(save_bundle, db_connection, do_copy=False, version=None):
     if save_bundle.vistrail is None:
         raise VistrailsDBException('save_vistrail_bundle_to_db failed, '
@@ -1195,30 +1795,163 @@ def get_saved_workflows(vistrail, db_connection):
 ##############################################################################
 # Logging I/O
 
+_workflow_exec_tag = re.compile(
+        r'<workflowExec((?:\s+[\w:.-]+\s*=\s*"[^"]*")*)\s*/?>')
+_xml_attribute = re.compile(r'([\w:.-]+)\s*=\s*"([^"]*)"')
+
+class LogIndexEntry(object):
+    """Position and attributes of a workflow execution in a log file.
+
+    """
+    __slots__ = ['id', 'offset', 'end', 'parent_version', 'ts_start',
+                 'ts_end', 'completed', 'user', 'version']
+
+    def __init__(self, id, offset, attributes):
+        self.id = id
+        self.offset = offset
+        self.end = None
+        parent_version = attributes.get('parentVersion')
+        self.parent_version = \
+            long(parent_version) if parent_version else None
+        self.ts_start = attributes.get('tsStart')
+        self.ts_end = attributes.get('tsEnd')
+        completed = attributes.get('completed')
+        self.completed = int(completed) if completed else None
+        self.user = attributes.get('user')
+        self.version = attributes.get('version')
+
+class LogIndex(object):
+    """Index of the workflow executions of a log written by appending them.
+
+    The file is scanned for the start tags of the executions without
+    parsing them, then the executions are read one by one. Only the part
+    of the file written since the last scan is scanned again. Ids are
+    assigned in the order of the file, as open_log_from_xml() does.
+
+    """
+
+    _indexes = {}
+
+    @staticmethod
+    def get(filename):
+        """get(filename: str) -> LogIndex
+        Returns the up-to-date index of a log file.
+
+        """
+        filename = os.path.abspath(filename)
+        try:
+            index = LogIndex._indexes[filename]
+        except KeyError:
+            index = LogIndex._indexes[filename] = LogIndex(filename)
+        index.update()
+        return index
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = []
+        self.size = 0
+        self.mtime = None
+        # Start tag of the last execution, to detect rewritten files
+        self._last_tag = None
+
+    def update(self):
+        """update() -> None
+        Scans what was appended to the file since the last update.
+
+        """
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            stat = None
+        if stat is None or stat.st_size < self.size:
+            self._reset()
+        if stat is None or (stat.st_size, stat.st_mtime) == \
+                (self.size, self.mtime):
+            return
+        with open(self.filename, 'rb') as f:
+            if self.entries:
+                f.seek(self.entries[-1].offset)
+                if f.read(len(self._last_tag)) != self._last_tag:
+                    self._reset()
+            if stat.st_size > 0:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    self._scan(data, stat.st_size)
+                finally:
+                    data.close()
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+    def _reset(self):
+        self.entries = []
+        self.size = 0
+        self._last_tag = None
+
+    def _scan(self, data, size):
+        last_tag = self._last_tag
+        for match in _workflow_exec_tag.finditer(data, self.size):
+            if self.entries:
+                self.entries[-1].end = match.start()
+            attributes = dict(_xml_attribute.findall(match.group(1)))
+            self.entries.append(LogIndexEntry(len(self.entries) + 1,
+                                              match.start(), attributes))
+            last_tag = match.group(0)
+        self._last_tag = last_tag
+        if self.entries:
+            self.entries[-1].end = size
+
+    def find(self, parent_version=None, start=None, end=None):
+        """find(parent_version: long, start: datetime, end: datetime)
+              -> [LogIndexEntry]
+        Returns the executions of a version, that started in [start, end).
+
+        """
+        if start is not None:
+            start = strftime(start, '%Y-%m-%d %H:%M:%S')
+        if end is not None:
+            end = strftime(end, '%Y-%m-%d %H:%M:%S')
+        return [entry for entry in self.entries
+                if (parent_version is None or
+                    entry.parent_version == parent_version) and
+                   (start is None or entry.ts_start >= start) and
+                   (end is None or entry.ts_start < end)]
+
+    def read_workflow_execs(self, entries):
+        """read_workflow_execs(entries: [LogIndexEntry])
+              -> [DBWorkflowExec]
+
+        """
+        workflow_execs = []
+        with open(self.filename, 'rb') as f:
+            for entry in entries:
+                f.seek(entry.offset)
+                node = ElementTree.fromstring(f.read(entry.end -
+                                                     entry.offset))
+                workflow_exec = _read_appended_workflow_exec(node)
+                workflow_exec.db_id = entry.id
+                workflow_execs.append(workflow_exec)
+        return workflow_execs
+
+def _read_appended_workflow_exec(node):
+    version = get_version_for_xml(node)
+    daoList = getVersionDAO(version)
+    workflow_exec = \
+        daoList.read_xml_object(DBWorkflowExec.vtType, node)
+    if version != currentVersion:
+        # if version is wrong, dump this into a dummy log object, 
+        # then translate, then get workflow_exec back
+        log = DBLog()
+        translate_log(log, currentVersion, version)
+        log.db_add_workflow_exec(workflow_exec)
+        log = translate_log(log, version)
+        workflow_exec = log.db_workflow_execs[0]
+    return workflow_exec
+
 def open_log_from_xml(filename, was_appended=False):
     """open_log_from_xml(filename) -> DBLog"""
     if was_appended:
-        parser = ElementTree.XMLTreeBuilder()
-        parser.feed("<log>\n")
-        f = open(filename, "rb")
-        parser.feed(f.read())
-        parser.feed("</log>\n")
-        root = parser.close()
-        workflow_execs = []
-        for node in root:
-            version = get_version_for_xml(node)
-            daoList = getVersionDAO(version)
-            workflow_exec = \
-                daoList.read_xml_object(DBWorkflowExec.vtType, node)
-            if version != currentVersion:
-                # if version is wrong, dump this into a dummy log object, 
-                # then translate, then get workflow_exec back
-                log = DBLog()
-                translate_log(log, currentVersion, version)
-                log.db_add_workflow_exec(workflow_exec)
-                log = translate_log(log, version)
-                workflow_exec = log.db_workflow_execs[0]
-            workflow_execs.append(workflow_exec)
+        index = LogIndex.get(filename)
+        workflow_execs = index.read_workflow_execs(index.entries)
         log = DBLog(workflow_execs=workflow_execs)
         vistrails.db.services.log.update_ids(log)
     else:
@@ -1230,6 +1963,19 @@ def open_log_from_xml(filename, was_appended=False):
         vistrails.db.services.log.update_id_scope(log)
     return log
 
+def open_workflow_execs_from_xml(filename, parent_version=None, start=None,
+                                 end=None):
+    """open_workflow_execs_from_xml(filename: str, parent_version: long,
+                                    start: datetime, end: datetime)
+          -> [DBWorkflowExec]
+
+    Reads the executions of a version that started in [start, end) from a
+    log written by appending, without reading the others.
+
+    """
+    index = LogIndex.get(filename)
+    return index.read_workflow_execs(index.find(parent_version, start, end))
+
 def open_log_from_db(db_connection, id, lock=False, version=None):
     """open_log_from_db(db_connection, id : long: lock: bool, version: str) 
          -> DBLog 
@@ -1258,7 +2004,7 @@ def open_vt_log_from_db(db_connection, vt_id, version=None):
             res = c.execute("SELECT id FROM log_tbl WHERE vistrail_id=%s;", (vt_id,))
             ids = [i[0] for i in c.fetchall()]
             c.close()
-        except get_db_lib().Error, e:
+        except get_db_lib(db_connection).Error, e:
             debug.critical("Error getting log id:s %d: %s" % (e.args[0], e.args[1]))
     log = DBLog()
     if hasattr(dao_list, 'open_many_from_db'): # does not exist pre 1.0.2
@@ -1535,13 +2281,13 @@ def open_thumbnails_from_db(db_connection, obj_type, obj_id, tmp_dir=None):
     SELECT a.value
     FROM action_annotation a
     WHERE a.akey = '__thumb__' AND a.entity_id = ? AND a.entity_type = ?
-    """)
+    """, db_connection)
     try:
         c = db_connection.cursor()
         c.execute(prepared_statement, (obj_id, obj_type))
         file_names = [file_name for (file_name,) in c.fetchall()]
         c.close()
-    except get_db_lib().Error, e:
+    except get_db_lib(db_connection).Error, e:
         msg = "Couldn't get thumbnails list from db (%d : %s)" % \
             (e.args[0], e.args[1])
         raise VistrailsDBException(msg)
@@ -1553,13 +2299,13 @@ def open_thumbnails_from_db(db_connection, obj_type, obj_id, tmp_dir=None):
         SELECT t.image_bytes
         FROM thumbnail t
         WHERE t.file_name = ?
-        """)
+        """, db_connection)
         try:
             c = db_connection.cursor()
             c.execute(prepared_statement, (file_name,))
             row = c.fetchone()
             c.close()
-        except get_db_lib().Error, e:
+        except get_db_lib(db_connection).Error, e:
             msg = "Couldn't get thumbnail from db (%d : %s)" % \
                 (e.args[0], e.args[1])
             raise VistrailsDBException(msg)
@@ -1605,7 +2351,7 @@ def save_thumbnails_to_db(absfnames, db_connection):
         c.execute(statement % sql_in_token)
         db_file_names = [file_name for (file_name,) in c.fetchall()]
         c.close()
-    except get_db_lib().Error, e:
+    except get_db_lib(db_connection).Error, e:
         msg = "Couldn't check which thumbnails already exist in db (%d : %s)" % \
             (e.args[0], e.args[1])
         raise VistrailsDBException(msg)
@@ -1616,7 +2362,7 @@ def save_thumbnails_to_db(absfnames, db_connection):
     """
     INSERT INTO thumbnail(file_name, image_bytes, last_modified)
     VALUES (?, ?, ?)
-    """)
+    """, db_connection)
     try:
         c = db_connection.cursor()
         for absfname in insert_absfnames:
@@ -1629,7 +2375,7 @@ def save_thumbnails_to_db(absfnames, db_connection):
     except IOError, e:
         msg = "Couldn't read thumbnail file for writing to db: %s" % absfname
         raise VistrailsDBException(msg)
-    except get_db_lib().Error, e:
+    except get_db_lib(db_connection).Error, e:
         msg = "Couldn't insert thumbnail into db (%d : %s)" % \
             (e.args[0], e.args[1])
         raise VistrailsDBException(msg)
@@ -1794,16 +2540,15 @@ def get_current_time(db_connection=None):
     if db_connection is not None:
         try:
             c = db_connection.cursor()
-            # FIXME MySQL versus sqlite3
+            # NOW() is defined for SQLite by open_sqlite_connection()
             c.execute("SELECT NOW();")
-            # c.execute("SELECT DATETIME('NOW');")
             row = c.fetchone()
             if row:
-                # FIXME MySQL versus sqlite3
                 timestamp = row[0]
-                # timestamp = strptime(row[0], '%Y-%m-%d %H:%M:%S')
+                if isinstance(timestamp, basestring):
+                    timestamp = _sqlite_datetime(timestamp)
             c.close()
-        except get_db_lib().Error, e:
+        except get_db_lib(db_connection).Error, e:
             debug.critical("Logger Error %d: %s" % (e.args[0], e.args[1]))
 
     return timestamp
@@ -1881,3 +2626,351 @@ class TestDBIO(unittest.TestCase):
                 self.fail(str(e))
         finally:
             os.rmdir(testdir)
+
+    def test_lazy_operations(self):
+        """test reading operations only when they are accessed"""
+        vistrail = open_vistrail_from_xml(
+            os.path.join(vistrails.core.system.vistrails_root_directory(),
+                         'tests/resources/dummy_new.xml'))
+        (fd, filename) = tempfile.mkstemp(prefix='vt_', suffix='.xml')
+        os.close(fd)
+        try:
+            save_vistrail_to_xml(vistrail, filename)
+            lazy_vistrail = open_vistrail_from_xml(filename)
+        finally:
+            os.unlink(filename)
+        self.assertEqual(vistrail.idScope.ids, lazy_vistrail.idScope.ids)
+        lazy_actions = sorted(lazy_vistrail.db_actions, key=lambda a: a.db_id)
+        unloaded = [a for a in lazy_actions if a.db_get_operation_ids()]
+        self.assertTrue(len(unloaded) > 1)
+        self.assertFalse(any(a.db_operations_loaded() for a in unloaded))
+
+        # Loading one action leaves the others alone
+        unloaded[-1].db_operations
+        self.assertEqual([a.db_operations_loaded() for a in unloaded],
+                         [False] * (len(unloaded) - 1) + [True])
+
+        actions = sorted(vistrail.db_actions, key=lambda a: a.db_id)
+        self.assertEqual(len(actions), len(lazy_actions))
+        for action, lazy_action in zip(actions, lazy_actions):
+            self.assertEqual([(op.vtType, op.db_id, op.db_what)
+                              for op in action.db_operations],
+                             [(op.vtType, op.db_id, op.db_what)
+                              for op in lazy_action.db_operations])
+        self.assertEqual(set(vistrail.db_objects),
+                         set(lazy_vistrail.db_objects))
+
+    def open_lazy_vistrail(self):
+        vistrail = open_vistrail_from_xml(
+            os.path.join(vistrails.core.system.vistrails_root_directory(),
+                         'tests/resources/dummy_new.xml'))
+        (fd, filename) = tempfile.mkstemp(prefix='vt_', suffix='.xml')
+        os.close(fd)
+        try:
+            save_vistrail_to_xml(vistrail, filename)
+            return open_vistrail_from_xml(filename)
+        finally:
+            os.unlink(filename)
+
+    def test_lazy_object_lookup(self):
+        """test looking objects up only loads the action adding them"""
+        vistrail = self.open_lazy_vistrail()
+        unloaded = [a for a in vistrail.db_actions
+                    if a.db_get_operation_ids()]
+        (op_id, what, obj_id) = [ids
+                                 for ids in unloaded[0].db_get_operation_ids()
+                                 if ids[1] is not None][0]
+
+        # Missing objects don't load anything
+        self.assertIsNone(vistrail.db_get_object('module', -1))
+        self.assertFalse(any(a.db_operations_loaded() for a in unloaded))
+
+        self.assertIsNotNone(vistrail.db_get_object(what, obj_id))
+        self.assertEqual([a.db_operations_loaded() for a in unloaded],
+                         [True] + [False] * (len(unloaded) - 1))
+
+    def test_lazy_operations_failure(self):
+        """test a failing operation loader can be retried"""
+        vistrail = self.open_lazy_vistrail()
+        action = [a for a in vistrail.db_actions
+                  if a.db_get_operation_ids()][0]
+        loader = action._operations_loader
+        calls = []
+        def failing_loader():
+            calls.append(None)
+            if len(calls) == 1:
+                raise IOError("simulated failure")
+            return loader()
+        action._operations_loader = failing_loader
+        with self.assertRaises(IOError):
+            action.db_operations
+        self.assertFalse(action.db_operations_loaded())
+        self.assertTrue(len(action.db_operations) > 0)
+        self.assertTrue(action.db_operations_loaded())
+
+    def test_open_bundle_from_zip(self):
+        """test reading a vt file without extracting the vistrail"""
+        testdir = tempfile.mkdtemp(prefix='vt_')
+        filename = os.path.join(testdir, 'jobs.vt')
+        save_dirs = []
+        try:
+            (save_bundle, vt_save_dir) = open_bundle_from_zip_xml(
+                DBVistrail.vtType,
+                os.path.join(vistrails.core.system.vistrails_root_directory(),
+                             'tests/resources/jobs.vt'))
+            save_dirs.append(vt_save_dir)
+            self.assertEqual(len(save_bundle.mashups), 1)
+            # Only the members used as files are extracted
+            self.assertEqual(os.listdir(vt_save_dir), ['log'])
+            self.assertEqual(save_bundle.vistrail.db_log_filename,
+                             os.path.join(vt_save_dir, 'log'))
+
+            save_bundle_to_zip_xml(save_bundle, filename, vt_save_dir)
+            (new_bundle, new_save_dir) = open_bundle_from_zip_xml(
+                DBVistrail.vtType, filename)
+            save_dirs.append(new_save_dir)
+            self.assertEqual(set(save_bundle.vistrail.db_actions_id_index),
+                             set(new_bundle.vistrail.db_actions_id_index))
+            self.assertEqual([m.id for m in save_bundle.mashups],
+                             [m.id for m in new_bundle.mashups])
+        finally:
+            for save_dir in save_dirs:
+                close_zip_xml(save_dir)
+            shutil.rmtree(testdir)
+
+    def test_save_temporary(self):
+        """test autosaving a vistrail by appending to the backup"""
+        from vistrails.db.domain import DBAdd, DBModule
+
+        testdir = tempfile.mkdtemp(prefix='vt_')
+        filename = os.path.join(testdir, 'dummy_new_tmp')
+        try:
+            vistrail = open_vistrail_from_xml(
+                os.path.join(vistrails.core.system.vistrails_root_directory(),
+                             'tests/resources/dummy_new.xml'))
+            # Backups written as XML by older versions can still be read
+            save_to_xml(vistrail, filename)
+            self.assertEqual(
+                set(open_temporary(filename,
+                                   DBVistrail.vtType).db_actions_id_index),
+                set(vistrail.db_actions_id_index))
+
+            save_temporary(vistrail, filename)
+            self.assertTrue(zipfile.is_zipfile(filename))
+            id_scope = vistrail.idScope
+            module = DBModule(id=id_scope.getNewId(DBModule.vtType),
+                              name='String', cache=1,
+                              package='org.vistrails.vistrails.basic',
+                              version='1.6')
+            action = DBAction(
+                id=id_scope.getNewId(DBAction.vtType),
+                prevId=max(vistrail.db_actions_id_index),
+                operations=[DBAdd(id=id_scope.getNewId(DBAdd.vtType),
+                                  what=DBModule.vtType,
+                                  objectId=module.db_id, data=module)])
+            vistrail.db_add_action(action)
+            save_temporary(vistrail, filename)
+            z = zipfile.ZipFile(filename)
+            try:
+                names = z.namelist()
+            finally:
+                z.close()
+            self.assertEqual(sorted(names), [JOURNAL_PREFIX + '1', 'vistrail'])
+
+            new_vistrail = open_temporary(filename, DBVistrail.vtType)
+            self.assertEqual(set(vistrail.db_actions_id_index),
+                             set(new_vistrail.db_actions_id_index))
+            new_action = new_vistrail.db_actions_id_index[action.db_id]
+            self.assertEqual(new_action.db_operations[0].db_data.db_id,
+                             module.db_id)
+            # The opened backup is appended to as well
+            new_vistrail.db_add_annotation(DBAnnotation(
+                id=new_vistrail.idScope.getNewId(DBAnnotation.vtType),
+                key='__test__', value='autosaved'))
+            save_temporary(new_vistrail, filename)
+            self.assertEqual(new_vistrail.db_temporary_state.journal_size, 2)
+            self.assertEqual(
+                open_temporary(filename, DBVistrail.vtType)
+                    .db_get_annotation_by_key('__test__').db_value,
+                'autosaved')
+        finally:
+            shutil.rmtree(testdir)
+
+    def test_sqlite(self):
+        """test saving and loading from a SQLite database"""
+        from vistrails.db.domain import DBAdd, DBGroup, DBModule, DBWorkflow
+
+        testdir = tempfile.mkdtemp(prefix='vt_')
+        config = {'db_type': 'sqlite',
+                  'db': os.path.join(testdir, 'vistrails.db')}
+        db_connection = open_db_connection(config)
+        try:
+            c = db_connection.cursor()
+            c.execute("PRAGMA journal_mode;")
+            self.assertEqual(c.fetchone()[0], 'wal')
+            c.close()
+            self.assertTrue(ping_db_connection(db_connection))
+
+            vistrail = open_vistrail_from_xml(
+                os.path.join(vistrails.core.system.vistrails_root_directory(),
+                             'tests/resources/dummy_new.xml'))
+            vistrail.db_name = 'dummy'
+            vistrail = save_vistrail_to_db(vistrail, db_connection, True)
+            self.assertIsNotNone(vistrail.db_id)
+            self.assertEqual(get_db_id_from_name(db_connection,
+                                                 DBVistrail.vtType, 'dummy'),
+                             vistrail.db_id)
+
+            # Save again with a new action
+            id_scope = vistrail.idScope
+            module = DBModule(id=id_scope.getNewId(DBModule.vtType),
+                              name='String', cache=1,
+                              package='org.vistrails.vistrails.basic',
+                              version='1.6')
+            vistrail.db_add_action(DBAction(
+                id=id_scope.getNewId(DBAction.vtType),
+                prevId=max(vistrail.db_actions_id_index),
+                operations=[DBAdd(id=id_scope.getNewId(DBAdd.vtType),
+                                  what=DBModule.vtType,
+                                  objectId=module.db_id, data=module)]))
+            vistrail = save_vistrail_to_db(vistrail, db_connection)
+
+            new_vistrail = open_vistrail_from_db(db_connection, vistrail.db_id)
+            self.assertEqual(set(vistrail.db_actions_id_index),
+                             set(new_vistrail.db_actions_id_index))
+            self.assertEqual(set(vistrail.db_objects) |
+                                 set([(DBModule.vtType, module.db_id)]),
+                             set(new_vistrail.db_objects))
+            self.assertEqual(vistrail.db_last_modified,
+                             new_vistrail.db_last_modified)
+
+            # Groups are read one level of nesting at a time
+            def group(id, name, modules):
+                return DBGroup(id=id, name=name, cache=1,
+                               package='org.vistrails.vistrails.basic',
+                               version='1.6',
+                               workflow=DBWorkflow(id=id, name=name,
+                                                   modules=modules))
+            def string(id):
+                return DBModule(id=id, name='String', cache=1,
+                                package='org.vistrails.vistrails.basic',
+                                version='1.6')
+            inner = group(id_scope.getNewId(DBModule.vtType), 'inner',
+                          [string(1)])
+            groups = [group(id_scope.getNewId(DBModule.vtType), 'outer',
+                            [string(1), inner]),
+                      group(id_scope.getNewId(DBModule.vtType), 'other',
+                            [string(1)])]
+            group_action = DBAction(
+                id=id_scope.getNewId(DBAction.vtType),
+                prevId=max(vistrail.db_actions_id_index),
+                operations=[DBAdd(id=id_scope.getNewId(DBAdd.vtType),
+                                  what=DBGroup.vtType,
+                                  objectId=g.db_id, data=g)
+                            for g in groups])
+            vistrail.db_add_action(group_action)
+            vistrail = save_vistrail_to_db(vistrail, db_connection)
+            new_vistrail = open_vistrail_from_db(db_connection, vistrail.db_id)
+            def contents(workflow):
+                return sorted((m.db_name,
+                               contents(m.db_workflow)
+                               if m.vtType == DBGroup.vtType else None)
+                              for m in workflow.db_modules)
+            new_action = new_vistrail.db_actions_id_index[group_action.db_id]
+            self.assertEqual(
+                sorted((op.db_data.db_name, contents(op.db_data.db_workflow))
+                       for op in new_action.db_operations),
+                [('other', [('String', None)]),
+                 ('outer', [('String', None),
+                            ('inner', [('String', None)])])])
+
+            log = self.create_log([1, 2])
+            for i, workflow_exec in enumerate(log.db_workflow_execs):
+                workflow_exec.db_id = i + 1
+            log.db_vistrail_id = vistrail.db_id
+            log = save_log_to_db(log, db_connection, True)
+            new_log = open_log_from_db(db_connection, log.db_id)
+            self.assertEqual(sorted(e.db_parent_version
+                                    for e in new_log.db_workflow_execs),
+                             [1, 2])
+        finally:
+            close_db_connection(db_connection)
+            shutil.rmtree(testdir)
+
+    def test_connection_pool(self):
+        """test checking out pooled connections per thread"""
+        testdir = tempfile.mkdtemp(prefix='vt_')
+        config = {'db_type': 'sqlite',
+                  'db': os.path.join(testdir, 'vistrails.db')}
+        pool = ConnectionPool(max_size=1, idle_timeout=3600)
+        try:
+            connection = pool.acquire(config)
+            self.assertIs(pool.acquire(config), connection)
+            pool.release(connection)
+
+            # The connection is held until released as many times
+            acquired = []
+            thread = threading.Thread(
+                    target=lambda: acquired.append(pool.acquire(config)))
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+            pool.release(connection)
+            thread.join()
+            self.assertEqual(acquired, [connection])
+
+            # The thread exited without releasing it
+            self.assertIs(pool.acquire(config), connection)
+            pool.release(connection)
+
+            # Idle connections are only checked after the timeout
+            close_db_connection(connection)
+            self.assertIs(pool.acquire(config), connection)
+            pool.release(connection)
+            pool.configure(idle_timeout=0)
+            new_connection = pool.acquire(config)
+            self.assertIsNot(new_connection, connection)
+            self.assertTrue(ping_db_connection(new_connection))
+            pool.release(new_connection)
+        finally:
+            pool.close()
+            shutil.rmtree(testdir)
+
+    def create_log(self, parent_versions):
+        from vistrails.db.domain import DBWorkflowExec
+        return DBLog(workflow_execs=[
+            DBWorkflowExec(id=-1, parent_version=version, completed=1,
+                           user='test', ts_start=datetime(2015, 1, i + 1),
+                           ts_end=datetime(2015, 1, i + 1, 1))
+            for i, version in enumerate(parent_versions)])
+
+    def test_log_index(self):
+        """test reading executions from an appended log"""
+        (fd, filename) = tempfile.mkstemp(prefix='vt_', suffix='.xml')
+        os.close(fd)
+        try:
+            save_log_to_xml(self.create_log([3, 4, 3]), filename,
+                            do_append=True)
+            index = LogIndex.get(filename)
+            self.assertEqual([(e.id, e.parent_version) for e in index.entries],
+                             [(1, 3), (2, 4), (3, 3)])
+            workflow_execs = open_workflow_execs_from_xml(filename, 3)
+            self.assertEqual([e.db_id for e in workflow_execs], [1, 3])
+
+            # Only the appended part is scanned
+            end = index.entries[-1].end
+            save_log_to_xml(self.create_log([5]), filename, do_append=True)
+            self.assertIs(LogIndex.get(filename), index)
+            self.assertEqual(index.entries[2].end, end)
+            self.assertEqual([(e.id, e.parent_version) for e in index.entries],
+                             [(1, 3), (2, 4), (3, 3), (4, 5)])
+            self.assertEqual(
+                [e.id for e in index.find(start=datetime(2015, 1, 2),
+                                          end=datetime(2015, 1, 4))],
+                [2, 3])
+            log = open_log_from_xml(filename, True)
+            self.assertEqual([(e.db_id, e.db_parent_version)
+                              for e in log.db_workflow_execs],
+                             [(1, 3), (2, 4), (3, 3), (4, 5)])
+        finally:
+            os.unlink(filename)
@@ -36,16 +36,20 @@
 from __future__ import division
 
 from datetime import datetime, date
+import errno
 import hashlib
 import locale
 import os.path
 import re
 import sys
+import threading
+import time
 import urllib
 import urlparse
 import uuid
 
 import vistrails.core.system
+from vistrails.core.data_structures.lru import LRUCache
 from vistrails.db.services import io
 from vistrails.db.services.io import SaveBundle
 from vistrails.db.domain import DBVistrail, DBWorkflow
@@ -239,6 +243,8 @@ class BaseLocator(object):
             args['mashup'] = parsed_dict['mashup'][0]
         if 'workflow_exec' in parsed_dict:
             args['workflow_exec'] = parsed_dict['workflow_exec'][0]
+        if 'db_type' in parsed_dict:
+            args['db_type'] = parsed_dict['db_type'][0]
         return args
 
     @staticmethod
@@ -262,6 +268,8 @@ class BaseLocator(object):
             generate_dict['mashup'] = args['mashup']
         if 'workflow_exec' in args and args['workflow_exec']:
             generate_dict['workflow_exec'] = args['workflow_exec']
+        if 'db_type' in args and args['db_type'] != 'mysql':
+            generate_dict['db_type'] = args['db_type']
         return urllib.urlencode(generate_dict)
 
 
@@ -307,7 +315,12 @@ class SaveTemporariesMixin(object):
         auto_save_dir = os.path.join(dot_vistrails, "autosave")
         if not os.path.exists(auto_save_dir):
             # !!! we assume dot_vistrails exists !!!
-            os.mkdir(auto_save_dir)
+            try:
+                os.mkdir(auto_save_dir)
+            except OSError, e:
+                # another process might have created it
+                if e.errno != errno.EEXIST:
+                    raise
         if not os.path.isdir(auto_save_dir):
             raise VistrailsDBException('Auto-save path "%s" is not a '
                                        'directory' % auto_save_dir)
@@ -326,12 +339,7 @@ class SaveTemporariesMixin(object):
         """ Writes a backup file to disk
         """
         temp_fname = self.encode_name(self.get_temp_basename())
-        new_temp_fname = temp_fname + '.tmp'
-        # Write a temporary backup before deleting the old one
-        io.save_to_xml(obj, new_temp_fname)
-        if os.path.isfile(temp_fname):
-            os.unlink(temp_fname)
-        os.rename(new_temp_fname, temp_fname)
+        io.save_temporary(obj, temp_fname)
 
     def clean_temporaries(self):
         """_remove_temporaries() -> None
@@ -375,7 +383,7 @@ class UntitledLocator(SaveTemporariesMixin, BaseLocator):
     def load(self, type):
         fname = self.get_temporary()
         if fname:
-            obj = io.open_from_xml(fname, type)
+            obj = io.open_temporary(fname, type)
         else:
             obj = DBVistrail()
         obj.locator = self
@@ -471,7 +479,7 @@ class XMLFileLocator(SaveTemporariesMixin, BaseLocator):
     def load(self, type):
         fname = self.get_temporary()
         if fname:
-            obj = io.open_from_xml(fname, type)
+            obj = io.open_temporary(fname, type)
         else:
             obj = io.open_from_xml(self._name, type)
         obj.locator = self
@@ -610,7 +618,7 @@ class XMLFileLocator(SaveTemporariesMixin, BaseLocator):
 
 class ZIPFileLocator(XMLFileLocator):
     """Files are compressed in zip format. The temporaries are
-    still in xml"""
+    written by io.save_temporary()"""
     def __init__(self, filename, **kwargs):
         XMLFileLocator.__init__(self, filename, **kwargs)
         self.tmp_dir = None
@@ -619,7 +627,7 @@ class ZIPFileLocator(XMLFileLocator):
         fname = self.get_temporary()
         if fname:
             from vistrails.db.domain import DBVistrail
-            obj = io.open_from_xml(fname, type)
+            obj = io.open_temporary(fname, type)
             return SaveBundle(DBVistrail.vtType, obj)
         else:
             (save_bundle, tmp_dir) = io.open_bundle_from_zip_xml(type, self._name)
@@ -699,11 +707,31 @@ class ZIPFileLocator(XMLFileLocator):
 # class URLLocator(ZIPFileLocator):
 #     def load(self, type):
         
+class DBCacheEntry(object):
+    """An object loaded from a database, with the modification time it was
+    loaded at and the last time that was checked.
+
+    """
+    __slots__ = ('obj', 'last_modified', 'checked')
+
+    def __init__(self, obj, last_modified):
+        self.obj = obj
+        self.last_modified = last_modified
+        self.checked = time.time()
+
 class DBLocator(BaseLocator):
-    cache = {}
-    cache_timestamps = {}
-    connections = {}
-    cache_connections = {}
+    # Loaded bundles and workflows by (database, object type, object id)
+    cache = LRUCache(32)
+    # Materialized pipelines by (database, vistrail id, 'pipeline', version)
+    # so that they don't evict the bundles
+    pipeline_cache = LRUCache(128)
+    cache_lock = threading.Lock()
+    # Seconds during which cached objects are used without checking their
+    # modification time in the database
+    cache_check_interval = 0
+    # Cached objects found to be out of date
+    cache_reloads = 0
+    pool = io.ConnectionPool()
         
     def __init__(self, host, port, database, user, passwd, name=None,
                  **kwargs):
@@ -713,11 +741,12 @@ class DBLocator(BaseLocator):
         self._user = user
         self._passwd = passwd
         self._name = name
-        self._hash = ''
         self.kwargs = kwargs
         self._obj_id = self.kwargs.get('obj_id', None)
         self._obj_type = self.kwargs.get('obj_type', None)
         self._conn_id = self.kwargs.get('connection_id', None)
+        # 'sqlite' makes database the path of a SQLite file
+        self._db_type = self.kwargs.get('db_type', 'mysql')
         self._vnode = self.kwargs.get('version_node', None)
         self._vtag = self.kwargs.get('version_tag', None)
         self._mshptrail = self.kwargs.get('mashuptrail', None)
@@ -739,6 +768,10 @@ class DBLocator(BaseLocator):
         return self._db
     db = property(_get_db)
     
+    def _get_db_type(self):
+        return self._db_type
+    db_type = property(_get_db_type)
+
     def _get_obj_id(self):
         return self._obj_id
     obj_id = property(_get_obj_id)
@@ -774,68 +807,73 @@ class DBLocator(BaseLocator):
         return hashlib.sha224(xml_string).hexdigest()
     
     def is_valid(self):
-        if self._conn_id is not None \
-                and self._conn_id in DBLocator.connections:
-            return True
         try:
-            self.get_connection()
+            self.release_connection(self.get_connection())
         except Exception:
             return False
         return True
-        
+
+    def get_config(self):
+        if self._db_type == 'sqlite':
+            return {'db_type': 'sqlite', 'db': self._db}
+        return {'host': self._host,
+                'port': self._port,
+                'db': self._db,
+                'user': self._user,
+                'passwd': self._passwd}
+
     def get_connection(self):
-        if self._conn_id is not None \
-                and DBLocator.connections.has_key(self._conn_id):
-            connection = DBLocator.connections[self._conn_id]
-            if io.ping_db_connection(connection):
-                return connection
-        else:
-            if self._conn_id is None:
-                if DBLocator.cache_connections.has_key(self._hash):
-                    connection = DBLocator.cache_connections[self._hash]
-                    if io.ping_db_connection(connection):
-                        debug.log("Reusing cached connection")
-                        return connection
-
-                if len(DBLocator.connections.keys()) == 0:
-                    self._conn_id = 1
-                else:
-                    self._conn_id = max(DBLocator.connections.keys()) + 1
-        config = {'host': self._host,
-                  'port': self._port,
-                  'db': self._db,
-                  'user': self._user,
-                  'passwd': self._passwd}
-        #print "config:", config
-        connection = io.open_db_connection(config)
-            
-        DBLocator.connections[self._conn_id] = connection
-        DBLocator.cache_connections[self._hash] = connection
-        return connection
-
-    def load(self, type, tmp_dir=None):
-        self._hash = self.hash()
-        #print "LLoad Big|type", type
-        if DBLocator.cache.has_key(self._hash):
-            save_bundle = DBLocator.cache[self._hash]
-            obj = save_bundle.get_primary_obj()
+        """get_connection() -> connection
+        Checks out a pooled connection for the current thread. It is not
+        used by other threads until it is given back with
+        release_connection() or the thread exits.
 
-            ts = self.get_db_modification_time(obj.vtType)
-            #debug.log("cached time: %s, db time: %s"%(DBLocator.cache_timestamps[self._hash],ts))
-            if DBLocator.cache_timestamps[self._hash] == ts:
-                #debug.log("using cached vistrail")
-                self._name = obj.db_name
-                # If thumbnail cache was cleared, get thumbs from db
-                if tmp_dir is not None:
-                    for absfname in save_bundle.thumbnails:
-                        if not os.path.isfile(absfname):
-                            save_bundle.thumbnails = io.open_thumbnails_from_db(self.get_connection(), type, self.obj_id, tmp_dir)
-                            break
-                return save_bundle
-        #debug.log("loading vistrail from db")
+        """
+        return DBLocator.pool.acquire(self.get_config())
+
+    def release_connection(self, connection):
+        DBLocator.pool.release(connection)
+
+    def load(self, type, tmp_dir=None, read_only=False):
+        """load(type: str, tmp_dir: str, read_only: bool) -> SaveBundle
+        Loads the object, using the cache if it is still current. A
+        read_only load returns the cached object itself, which callers
+        must not modify; other loads return a copy.
+
+        """
         connection = self.get_connection()
+        try:
+            return self._load(connection, type, tmp_dir, read_only)
+        finally:
+            self.release_connection(connection)
+
+    def _load(self, connection, type, tmp_dir, read_only):
+        cached = self.get_cached(type)
+        if cached is not None:
+            if type == DBWorkflow.vtType:
+                return cached if read_only else cached.do_copy()
+            self._name = cached.get_primary_obj().db_name
+            # If thumbnail cache was cleared, get thumbs from db
+            if tmp_dir is not None:
+                for absfname in cached.thumbnails:
+                    if not os.path.isfile(absfname):
+                        # Read-only loads share the cached bundle, so it is
+                        # replaced instead of changed
+                        cached = SaveBundle(
+                            cached.bundle_type, *cached.get_db_objs(),
+                            abstractions=cached.abstractions,
+                            mashups=cached.mashups,
+                            thumbnails=io.open_thumbnails_from_db(
+                                connection, type, self.obj_id, tmp_dir))
+                        self.replace_cached(type, cached)
+                        break
+            return cached if read_only else cached.do_copy()
+        #debug.log("loading vistrail from db")
         if type == DBWorkflow.vtType:
-            return io.open_from_db(connection, type, self.obj_id)
+            workflow = io.open_from_db(connection, type, self.obj_id)
+            self.set_cached(type, workflow if read_only else workflow.do_copy(),
+                            workflow.db_last_modified)
+            return workflow
         save_bundle = io.open_bundle_from_db(type, connection, self.obj_id, tmp_dir)
         primary_obj = save_bundle.get_primary_obj()
         self._name = primary_obj.db_name
@@ -843,27 +881,101 @@ class DBLocator(BaseLocator):
         for obj in save_bundle.get_db_objs():
             obj.locator = self
         
-        _hash = self.hash()
-        DBLocator.cache[self._hash] = save_bundle.do_copy()
-        DBLocator.cache_timestamps[self._hash] = primary_obj.db_last_modified
+        self.set_cached(type,
+                        save_bundle if read_only else save_bundle.do_copy(),
+                        primary_obj.db_last_modified)
         return save_bundle
 
     def save(self, save_bundle, do_copy=False, version=None):
         connection = self.get_connection()
-        for obj in save_bundle.get_db_objs():
-            obj.db_name = self._name
-        save_bundle = io.save_bundle_to_db(save_bundle, connection, do_copy, version)
+        try:
+            for obj in save_bundle.get_db_objs():
+                obj.db_name = self._name
+            save_bundle = io.save_bundle_to_db(save_bundle, connection,
+                                               do_copy, version)
+        finally:
+            self.release_connection(connection)
         primary_obj = save_bundle.get_primary_obj()
         self._obj_id = primary_obj.db_id
         self._obj_type = primary_obj.vtType
         for obj in save_bundle.get_db_objs():
             obj.locator = self
         #update the cache with a copy of the new bundle
-        self._hash = self.hash()
-        DBLocator.cache[self._hash] = save_bundle.do_copy()
-        DBLocator.cache_timestamps[self._hash] = primary_obj.db_last_modified
+        self.set_cached(primary_obj.vtType, save_bundle.do_copy(),
+                        primary_obj.db_last_modified)
         return save_bundle
 
+    def get_cache_key(self, *args):
+        return (self._db_type, self._host, self._port, self._db,
+                long(self._obj_id)) + args
+
+    def get_cached(self, obj_type):
+        """get_cached(obj_type: str) -> SaveBundle or DBWorkflow
+        Returns the cached object if it is still current, checking its
+        modification time at most every cache_check_interval seconds.
+
+        """
+        key = self.get_cache_key(obj_type)
+        with DBLocator.cache_lock:
+            entry = DBLocator.cache.get(key)
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry.checked >= DBLocator.cache_check_interval:
+            if self.get_db_modification_time(obj_type) != entry.last_modified:
+                with DBLocator.cache_lock:
+                    DBLocator.cache.pop(key, None)
+                    DBLocator.cache_reloads += 1
+                return None
+            entry.checked = now
+        return entry.obj
+
+    def set_cached(self, obj_type, obj, last_modified):
+        self.prepare_cached(obj)
+        with DBLocator.cache_lock:
+            DBLocator.cache[self.get_cache_key(obj_type)] = \
+                DBCacheEntry(obj, last_modified)
+
+    def replace_cached(self, obj_type, obj):
+        """replace_cached(obj_type: str, obj: SaveBundle or DBWorkflow)
+             -> None
+        Replaces a cached object with an updated one, that was loaded at the
+        same modification time.
+
+        """
+        with DBLocator.cache_lock:
+            entry = DBLocator.cache.peek(self.get_cache_key(obj_type))
+            if entry is not None:
+                entry.obj = obj
+
+    def prepare_cached(self, obj):
+        """prepare_cached(obj: SaveBundle or DBWorkflow) -> None
+        Called on objects before they are cached and shared between
+        read-only loads.
+
+        """
+        pass
+
+    @staticmethod
+    def configure_cache(size=None, check_interval=None, pipeline_size=None):
+        with DBLocator.cache_lock:
+            if size is not None:
+                DBLocator.cache.resize(size)
+            if pipeline_size is not None:
+                DBLocator.pipeline_cache.resize(pipeline_size)
+            if check_interval is not None:
+                DBLocator.cache_check_interval = check_interval
+
+    @staticmethod
+    def get_cache_stats():
+        with DBLocator.cache_lock:
+            return {'size': len(DBLocator.cache),
+                    'pipelines': len(DBLocator.pipeline_cache),
+                    'hits': DBLocator.cache.hits,
+                    'misses': DBLocator.cache.misses,
+                    'evictions': DBLocator.cache.evictions,
+                    'reloads': DBLocator.cache_reloads}
+
     def get_db_modification_time(self, obj_type=None):
         if obj_type is None:
             if self.obj_type is None:
@@ -871,9 +983,13 @@ class DBLocator(BaseLocator):
             else:
                 obj_type = self.obj_type
 
-        ts = io.get_db_object_modification_time(self.get_connection(),
-                                                self.obj_id,
-                                                obj_type)
+        connection = self.get_connection()
+        try:
+            ts = io.get_db_object_modification_time(connection,
+                                                    self.obj_id,
+                                                    obj_type)
+        finally:
+            self.release_connection(connection)
         ts = datetime(*time_strptime(str(ts).strip(), '%Y-%m-%d %H:%M:%S')[0:6])
         return ts
         
@@ -967,6 +1083,8 @@ class DBLocator(BaseLocator):
         node.set('db', str(self._db))
         node.set('vt_id', str(self._obj_id))
         node.set('user', str(self._user))
+        if self._db_type != 'mysql':
+            node.set('db_type', self._db_type)
         if include_name:
             childnode = ElementTree.SubElement(node,'name')
             childnode.text = str(self._name)
@@ -1022,6 +1140,7 @@ class DBLocator(BaseLocator):
             vt_id = convert_from_str(data, 'str')
             data = node.get('user')
             user = convert_from_str(data, 'str')
+            db_type = node.get('db_type', 'mysql')
             passwd = ""
             name = None
             if include_name:
@@ -1029,7 +1148,8 @@ class DBLocator(BaseLocator):
                     if child.tag == 'name':
                         name = str(child.text).strip(" \n\t")
             return DBLocator(host, port, database,
-                             user, passwd, name, obj_id=vt_id, obj_type='vistrail')
+                             user, passwd, name, obj_id=vt_id, obj_type='vistrail',
+                             db_type=db_type)
         else:
             return None
 
@@ -1047,6 +1167,7 @@ vistrail_name="%s"/>' % ( self._host, self._port, self._db,
         return (self._host == other._host and
                 self._port == other._port and
                 self._db == other._db and
+                self._db_type == other._db_type and
                 self._user == other._user and
                 #self._name == other._name and
                 long(self._obj_id) == long(other._obj_id) and
@@ -1204,6 +1325,14 @@ class TestLocators(unittest.TestCase):
         self.assertEqual(loc._db, "vistrails")
         self.assertEqual(loc.to_url(), loc_str)
 
+    def test_sqlite_db(self):
+        loc = DBLocator('', 0, '/tmp/vistrails.db', '', '', obj_id=1,
+                        obj_type='vistrail', db_type='sqlite')
+        self.assertEqual(loc.db_type, 'sqlite')
+        self.assertEqual(DBLocator.from_xml(loc.to_xml()), loc)
+        self.assertEqual(BaseLocator.from_url(loc.to_url()).db_type,
+                         'sqlite')
+
     def test_parse_bad_url(self):
         loc_str = "http://blah.com/"
         loc = BaseLocator.from_url(loc_str)
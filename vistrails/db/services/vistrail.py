@@ -70,14 +70,79 @@ def update_id_scope(vistrail):
             for annotation in action.db_annotations:
                 vistrail.idScope.updateBeginId('annotation', annotation.db_id+1)
 
+# Number of actions between two checkpoints on a path of the version tree
+CHECKPOINT_INTERVAL = 50
+
+class VersionCheckpoint(object):
+    """The current operations at a version, stored so that materializing
+    one of its descendants doesn't need to replay the actions from the root.
+
+    """
+    __slots__ = ('action', 'depth', 'operations')
+
+    def __init__(self, action, depth, operations):
+        self.action = action
+        self.depth = depth
+        self.operations = operations
+
+def clearCheckpoints(vistrail):
+    vistrail._version_checkpoints = {}
+
+def getCheckpointedOperationDict(vistrail, version, interval=None):
+    """getCheckpointedOperationDict(vistrail, version, interval) -> dict
+
+    Returns the same dictionary as
+    getCurrentOperationDict(getActionChain(vistrail, version)), but only
+    replays the actions following the closest ancestor that has a
+    checkpoint. New checkpoints are recorded every 'interval' actions from
+    the root (CHECKPOINT_INTERVAL by default) on the replayed path.
+
+    """
+    if interval is None:
+        interval = CHECKPOINT_INTERVAL
+    checkpoints = getattr(vistrail, '_version_checkpoints', None)
+    if checkpoints is None:
+        checkpoints = vistrail._version_checkpoints = {}
+
+    actions = []
+    start = None
+    currentId = version
+    while currentId > 0:
+        action = vistrail.db_get_action_by_id(currentId)
+        checkpoint = checkpoints.get(currentId)
+        if checkpoint is not None:
+            if checkpoint.action is action:
+                start = checkpoint
+                break
+            # The action was replaced since the checkpoint was recorded
+            checkpoints.pop(currentId, None)
+        actions.append(action)
+        currentId = action.db_prevId
+    actions.reverse()
+
+    if start is None:
+        operations = {}
+        depth = 0
+    else:
+        operations = dict(start.operations)
+        depth = start.depth
+    for action in actions:
+        getCurrentOperationDict([action], operations)
+        depth += 1
+        if depth % interval == 0:
+            checkpoints[action.db_id] = VersionCheckpoint(action, depth,
+                                                          dict(operations))
+    return operations
+
 def materializeWorkflow(vistrail, version):
     # construct path up through tree and perform each action
     if vistrail.db_has_action_with_id(version):
         workflow = DBWorkflow()
         #for action in getActionChain(vistrail, version):
         #    oldPerformAction(action, workflow)
-        performActions(getActionChain(vistrail, version), 
-                            workflow)
+        operations = getCheckpointedOperationDict(vistrail, version).values()
+        operations.sort(key=lambda x: x.db_id)
+        performAdds(operations, workflow)
         workflow.db_id = version
         workflow.db_vistrailId = vistrail.db_id
         return workflow
@@ -706,14 +771,17 @@ def addAndFixActions(startDict, actions):
     return curDict
 
 def fixActions(vistrail, v, actions):
-    startingChain = getActionChain(vistrail, v)
-    startingDict = getCurrentOperationDict(startingChain)
+    startingDict = getCheckpointedOperationDict(vistrail, v)
     addAndFixActions(startingDict, actions)
     
 ################################################################################
 # Diff methods
 
 def getSharedRoot(vistrail, versions):
+    # use the common ancestor index kept by core vistrails if there is one
+    ancestry = getattr(vistrail, 'ancestry', None)
+    if ancestry is not None:
+        return reduce(ancestry.commonAncestor, versions)
     # base case is 0
     current = copy.copy(versions)
     while 0 not in current:
@@ -1634,5 +1702,28 @@ class TestDBVistrailService(unittest.TestCase):
         # test parameter change inequality
         assert heuristicModuleMatch(module1, module5) == 0
 
+    def test_checkpoints(self):
+        from vistrails.core.db.io import load_vistrail
+        from vistrails.core.db.locator import FileLocator
+        locator = FileLocator(vistrails.core.system.vistrails_root_directory() +
+                              '/tests/resources/dummy.xml')
+        vistrail = load_vistrail(locator)[0]
+        clearCheckpoints(vistrail)
+        versions = sorted(vistrail.actionMap.iterkeys())
+        for interval in (1, 2, 3):
+            for version in versions:
+                expected = getCurrentOperationDict(
+                        getActionChain(vistrail, version))
+                self.assertEqual(
+                        getCheckpointedOperationDict(vistrail, version,
+                                                     interval),
+                        expected)
+                # Checkpoints are only reused if the action is unchanged
+                self.assertTrue(all(
+                        vistrail.db_get_action_by_id(v) is c.action
+                        for v, c in vistrail._version_checkpoints.iteritems()))
+            clearCheckpoints(vistrail)
+        self.assertEqual(getCheckpointedOperationDict(vistrail, 0), {})
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,123 @@
+###############################################################################
+##
+## Copyright (C) 2014-2016, New York University.
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah.
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice,
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright
+##    notice, this list of conditions and the following disclaimer in the
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the New York University nor the names of its
+##    contributors may be used to endorse or promote products derived from
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+from __future__ import division
+
+from auto_gen import DBAction as _DBAction
+
+class DBAction(_DBAction):
+    """Action whose operations can be read when they are first accessed.
+
+    Readers call db_set_operations_loader() with a function returning the
+    operations, along with the ids they need to set up the id scope of the
+    vistrail without loading them.
+
+    """
+
+    _operations_loader = None
+    _operation_ids = None
+
+    def db_set_operations_loader(self, loader, operation_ids):
+        """db_set_operations_loader(loader: callable,
+                                    operation_ids: list) -> None
+        operation_ids lists (id, what, new object id) for each operation;
+        what and the object id are None for deletes.
+
+        """
+        self._operations_loader = loader
+        self._operation_ids = operation_ids
+
+    def db_operations_loaded(self):
+        return self._operations_loader is None
+
+    def db_get_operation_ids(self):
+        if self._operations_loader is not None:
+            return self._operation_ids
+        operation_ids = []
+        for operation in self._db_operations:
+            if operation.vtType == 'add':
+                obj_id = operation.db_objectId
+            elif operation.vtType == 'change':
+                obj_id = operation.db_newObjId
+            else:
+                operation_ids.append((operation.db_id, None, None))
+                continue
+            operation_ids.append((operation.db_id, operation.db_what, obj_id))
+        return operation_ids
+
+    def db_transform_operations(self, f):
+        """db_transform_operations(f: callable) -> None
+        Calls f with the list of operations, now or once they are loaded.
+
+        """
+        loader = self._operations_loader
+        if loader is None:
+            f(self._db_operations)
+        else:
+            def load():
+                operations = loader()
+                f(operations)
+                return operations
+            self._operations_loader = load
+
+    def _load_operations(self):
+        # Keep the loader until it succeeds so that a failure can be retried
+        operations = self._operations_loader()
+        self._operations_loader = None
+        self._operation_ids = None
+        self.__dict__['_db_operations'] = operations
+        self.__dict__['db_operations_id_index'] = \
+            dict((v.db_id, v) for v in operations)
+
+    # The attributes the generated code uses, loading the operations first
+    def _get_operations(self):
+        if self._operations_loader is not None:
+            self._load_operations()
+        return self.__dict__['_db_operations']
+    def _set_operations(self, operations):
+        self._operations_loader = None
+        self._operation_ids = None
+        self.__dict__['_db_operations'] = operations
+    _db_operations = property(_get_operations, _set_operations)
+
+    def _get_operations_id_index(self):
+        if self._operations_loader is not None:
+            self._load_operations()
+        return self.__dict__['db_operations_id_index']
+    def _set_operations_id_index(self, index):
+        self.__dict__['db_operations_id_index'] = index
+    db_operations_id_index = property(_get_operations_id_index,
+                                      _set_operations_id_index)
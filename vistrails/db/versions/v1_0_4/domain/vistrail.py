@@ -41,6 +41,7 @@ import hashlib
 from auto_gen import DBVistrail as _DBVistrail
 from auto_gen import DBAdd, DBChange, DBDelete, DBAbstraction, DBGroup, \
     DBModule, DBAnnotation, DBActionAnnotation, DBParameterExploration
+from action import DBAction
 from id_scope import IdScope
 
 class DBVistrail(_DBVistrail):
@@ -57,10 +58,13 @@ class DBVistrail(_DBVistrail):
         self.idScope.setBeginId('action', 1)
         self.idScope.setBeginId(DBParameterExploration.vtType, 1)
         self.db_objects = {}
+        self.db_unloaded_objects = None
 
         # keep a reference to the current logging information here
         self.db_log_filename = None
         self.log = None
+        # what the autosaved temporary file of this vistrail holds
+        self.db_temporary_state = None
 
     def __copy__(self):
         return DBVistrail.do_copy(self)
@@ -68,10 +72,15 @@ class DBVistrail(_DBVistrail):
     def do_copy(self, new_ids=False, id_scope=None, id_remap=None):
         cp = _DBVistrail.do_copy(self, new_ids, id_scope, id_remap)
         cp.__class__ = DBVistrail
+        for action in cp.db_actions:
+            if not isinstance(action, DBAction):
+                action.__class__ = DBAction
         
         cp.idScope = copy.copy(self.idScope)
         cp.db_objects = copy.copy(self.db_objects)
+        cp.db_unloaded_objects = None
         cp.db_log_filename = self.db_log_filename
+        cp.db_temporary_state = None
         if self.log is not None:
             cp.log = copy.copy(self.log)
         else:
@@ -84,6 +93,9 @@ class DBVistrail(_DBVistrail):
         if new_obj is None:
             new_obj = DBVistrail()
         new_obj = _DBVistrail.update_version(old_obj, trans_dict, new_obj)
+        for action in new_obj.db_actions:
+            if not isinstance(action, DBAction):
+                action.__class__ = DBAction
         new_obj.update_id_scope()
         if hasattr(old_obj, 'db_log_filename'):
             new_obj.db_log_filename = old_obj.db_log_filename
@@ -106,6 +118,16 @@ class DBVistrail(_DBVistrail):
             self.idScope.updateBeginId('action', action.db_id+1)
             if action.db_session is not None:
                 self.idScope.updateBeginId('session', action.db_session + 1)
+            if not action.db_operations_loaded():
+                # The reader registers the objects when it loads them
+                for (op_id, what, obj_id) in action.db_get_operation_ids():
+                    self.idScope.updateBeginId('operation', op_id+1)
+                    if what is not None:
+                        self.idScope.updateBeginId(what, obj_id+1)
+                for annotation in action.db_annotations:
+                    self.idScope.updateBeginId('annotation',
+                                               annotation.db_id+1)
+                continue
             for operation in action.db_operations:
                 self.idScope.updateBeginId('operation', operation.db_id+1)
                 if operation.vtType == 'add' or operation.vtType == 'change':
@@ -131,12 +153,52 @@ class DBVistrail(_DBVistrail):
         self.db_objects[(obj.vtType, obj.db_id)] = obj
 
     def db_get_object(self, type, id):
-        return self.db_objects.get((type, id), None)
+        obj = self.db_objects.get((type, id), None)
+        if obj is None:
+            action = self.db_find_unloaded_action(type, id)
+            if action is not None:
+                action.db_operations
+                obj = self.db_objects.get((type, id), None)
+        return obj
+
+    def db_find_unloaded_action(self, type, id):
+        """db_find_unloaded_action(type: str, id: long) -> DBAction
+        Returns the action whose operations, not loaded yet, add the
+        object, using an index of the operation ids given by the reader.
+
+        """
+        if self.db_unloaded_objects is None:
+            self.db_unloaded_objects = {}
+            for action in self.db_actions:
+                if action.db_operations_loaded():
+                    continue
+                for (op_id, what, obj_id) in action.db_get_operation_ids():
+                    if what is not None:
+                        self.db_unloaded_objects[(what, obj_id)] = action
+        action = self.db_unloaded_objects.get((type, id), None)
+        if action is None or action.db_operations_loaded():
+            return None
+        return action
+
+    def db_load_operations(self):
+        """db_load_operations() -> bool
+        Loads the operations of the actions that were read lazily. Returns
+        whether there were any.
+
+        """
+        loaded = False
+        for action in self.db_actions:
+            if not action.db_operations_loaded():
+                action.db_operations
+                loaded = True
+        return loaded
 
     def db_update_object(self, obj, **kwargs):
         # want to swap out old object with a new version
         # need this for updating aliases...
         # hack it using setattr...
+        if (obj.vtType, obj.db_id) not in self.db_objects:
+            self.db_get_object(obj.vtType, obj.db_id)
         real_obj = self.db_objects[(obj.vtType, obj.db_id)]
         for (k, v) in kwargs.iteritems():
             if hasattr(real_obj, k):
@@ -51,6 +51,10 @@ ElementTree = get_elementtree_library()
 
 
 class DAOList(dict):
+    # Number of entities whose rows are read by the same SELECT statements,
+    # which keeps their lists of ids within the limits of the databases
+    ENTITY_BATCH_SIZE = 400
+
     def __init__(self):
         self['xml'] = XMLDAOListBase()
         self['sql'] = SQLDAOListBase()
@@ -106,7 +110,6 @@ class DAOList(dict):
 
     def open_from_db(self, db_connection, vtType, id=None, lock=False, 
                      global_props=None):
-        all_objects = {}
         if global_props is None:
             global_props = {}
         if id is not None:
@@ -124,59 +127,8 @@ class DAOList(dict):
                                        "id '%s' exist in the database" % \
                                            (vtType, id))
         
-        all_objects.update(res_objects)
         res = res_objects.values()[0]
-        global_props = {'entity_id': res.db_id,
-                        'entity_type': res.vtType}
-
-        # collect all commands so that they can be executed together
-        # daoList should contain (dao_type, dao, dbCommand) values
-        daoList = []
-        # dbCommandList should contain dbCommand values
-        dbCommandList = []
-        
-        # generate SELECT statements
-        for dao_type, dao in self['sql'].iteritems():
-            if dao_type in root_set:
-                continue
-
-            daoList.append([dao_type, dao, None])
-            dbCommand = dao.get_sql_select(db_connection, global_props, lock)
-            dbCommandList.append(dbCommand)
-            
-        # Exacute all select statements
-        results = self['sql'][vtType].executeSQLGroup(db_connection,
-                                                      dbCommandList, True)
-
-        # add result to correct dao
-        for i in xrange(len(daoList)):
-            daoList[i][2] = results[i]
-        
-        # process results
-        for dao_type, dao, data in daoList:
-            current_objs = dao.process_sql_columns(data, global_props)
-            all_objects.update(current_objs)
-
-            if dao_type == DBGroup.vtType:
-                for key, obj in current_objs.iteritems():
-                    new_props = {'parent_id': key[1],
-                                 'entity_id': global_props['entity_id'],
-                                 'entity_type': global_props['entity_type']}
-                    res_obj = self.open_from_db(db_connection, 
-                                                DBWorkflow.vtType, 
-                                                None, lock, new_props)
-                    res_dict = {}
-                    res_dict[(res_obj.vtType, res_obj.db_id)] = res_obj
-                    all_objects.update(res_dict)
-
-        for key, obj in all_objects.iteritems():
-            if key[0] == vtType and key[1] == id:
-                continue
-            self['sql'][obj.vtType].from_sql_fast(obj, all_objects)
-        for obj in all_objects.itervalues():
-            obj.is_dirty = False
-            obj.is_new = False
-
+        self.open_children_from_db(db_connection, [res], lock)
         return res
 
     def open_many_from_db(self, db_connection, vtType, ids, lock=False):
@@ -185,86 +137,95 @@ class DAOList(dict):
         """
 
         log_dao = self['sql'][vtType]
-        # loop through ids and build SELECT statements
-        selects = [log_dao.get_sql_select(db_connection, {'id': id}, lock)
-                   for id in ids]
-        # Execute all SELECT statements for main objects
-        results = log_dao.executeSQLGroup(db_connection, selects, True)
-
-        # list of final objects
+        res_objects = {}
+        for i in xrange(0, len(ids), self.ENTITY_BATCH_SIZE):
+            res_objects.update(log_dao.get_sql_columns(
+                    db_connection, {'id': list(ids[i:i+self.ENTITY_BATCH_SIZE])},
+                    lock))
         objects = []
-        # list of selects
-        selects = []
-        # list of children id:all_objects_dict
-        all_objects_dict = {}
-        # process each result and extract child SELECTS
-        # daoList should contain (id, dao_type, dao, result) values
-        daoList = []
-        # selects should contain dbCommand values
-        selects = []
-        global_props = {}
-        for id, data in zip(ids, results):
-            res_objects = log_dao.process_sql_columns(data, global_props)
-            if len(res_objects) > 1:
-                raise VistrailsDBException("More than object of type '%s' and "
-                                           "id '%s' exist in the database" % \
-                                               (vtType, id))
-            elif len(res_objects) <= 0:
+        for id in ids:
+            if (vtType, id) not in res_objects:
                 raise VistrailsDBException("No objects of type '%s' and "
                                            "id '%s' exist in the database" % \
                                                (vtType, id))
-            all_objects = {}
-            all_objects_dict[id] = all_objects
-            all_objects.update(res_objects)
-            objects.append(res_objects.values()[0])
-            # collect all commands so that they can be executed together
-        
-            # generate SELECT statements for children
-            for dao_type, dao in self['sql'].iteritems():
-                if dao_type in root_set:
-                    continue
-    
-                daoList.append([id, dao_type, dao, None])
-                dbCommand = dao.get_sql_select(db_connection, global_props, lock)
-                selects.append(dbCommand)
-
-        # Execute all child select statements
-        results = self['sql'][vtType].executeSQLGroup(db_connection,
-                                                      selects, True)
-        for i in xrange(len(daoList)):
-            daoList[i][3] = results[i]
-
-        # process results
-        for id, dao_type, dao, data in daoList:
-            all_objects = all_objects_dict[id]
-            current_objs = dao.process_sql_columns(data, global_props)
-            all_objects.update(current_objs)
-
-            if dao_type == DBGroup.vtType:
-                for key, obj in current_objs.iteritems():
-                    new_props = {'parent_id': key[1],
-                                 'entity_id': global_props['entity_id'],
-                                 'entity_type': global_props['entity_type']}
-                    res_obj = self.open_from_db(db_connection, 
-                                                DBWorkflow.vtType, 
-                                                None, lock, new_props)
-                    res_dict = {}
-                    res_dict[(res_obj.vtType, res_obj.db_id)] = res_obj
-                    all_objects.update(res_dict)
+            objects.append(res_objects[(vtType, id)])
+        self.open_children_from_db(db_connection, objects, lock)
+        return objects
 
-        
-        for id, all_objects in all_objects_dict.iteritems():
+    def open_children_from_db(self, db_connection, roots, lock=False):
+        """ Loads the children of the root objects from their entities.
+            The rows of all the entities are read with one SELECT statement
+            per table, and the workflows of groups are read the same way,
+            one level of nesting at a time.
+        """
+        # (entity_id, entity_type) -> {(vtType, id): obj} for each entity
+        entities = {}
+        level = dict(((obj.db_id, obj.vtType), obj) for obj in roots)
+        while level:
+            for (id, vtType), obj in level.iteritems():
+                entities[(id, vtType)] = {(vtType, id): obj}
+            groups = set()
+            keys = sorted(level)
+            for i in xrange(0, len(keys), self.ENTITY_BATCH_SIZE):
+                batch = keys[i:i+self.ENTITY_BATCH_SIZE]
+                global_props = {'entity_id': sorted(set(e[0] for e in batch)),
+                                'entity_type': sorted(set(e[1] for e in batch))}
+                # collect all commands so that they can be executed together
+                daoList = []
+                dbCommandList = []
+                for dao_type, dao in self['sql'].iteritems():
+                    if dao_type in root_set:
+                        continue
+                    daoList.append(dao)
+                    dbCommandList.append(dao.get_sql_select(db_connection,
+                                                            global_props,
+                                                            lock))
+                results = self['sql'][DBWorkflow.vtType].executeSQLGroup(
+                    db_connection, dbCommandList, True)
+                for dao, data in zip(daoList, results):
+                    if len(batch) > 1:
+                        # ids are only unique within an entity, so the rows
+                        # can't go in the same dictionary
+                        chunks = [[row] for row in data]
+                    else:
+                        chunks = [data]
+                    for chunk in chunks:
+                        for key, obj in dao.process_sql_columns(
+                                chunk, global_props).iteritems():
+                            entity = (obj.db_entity_id, obj.db_entity_type)
+                            if entity not in level:
+                                # matched by the lists but not in the batch
+                                continue
+                            entities[entity][key] = obj
+                            if key[0] == DBGroup.vtType:
+                                groups.add((entity, key[1]))
+
+            # the workflows of the groups are the entities of the next level
+            level = {}
+            groups = sorted(groups)
+            for i in xrange(0, len(groups), self.ENTITY_BATCH_SIZE):
+                batch = set(groups[i:i+self.ENTITY_BATCH_SIZE])
+                global_props = {
+                    'parent_id': sorted(set(g[1] for g in batch)),
+                    'entity_id': sorted(set(g[0][0] for g in batch)),
+                    'entity_type': sorted(set(g[0][1] for g in batch))}
+                workflows = self['sql'][DBWorkflow.vtType].get_sql_columns(
+                    db_connection, global_props, lock)
+                for key, workflow in workflows.iteritems():
+                    entity = (workflow.db_entity_id, workflow.db_entity_type)
+                    if (entity, workflow.db_group) not in batch:
+                        continue
+                    entities[entity][key] = workflow
+                    level[(workflow.db_id, DBWorkflow.vtType)] = workflow
+
+        for (id, vtType), all_objects in entities.iteritems():
             for key, obj in all_objects.iteritems():
-                if key[0] == vtType and key[1] == id:
-                    continue
-                self['sql'][obj.vtType].from_sql_fast(obj, all_objects)
-        for id, dao_type, dao, data in daoList:
-            all_objects = all_objects_dict[id]
-            for obj in all_objects.itervalues():
+                # the root of an entity is added to its parent with the
+                # objects of the parent's entity
+                if key != (vtType, id):
+                    self['sql'][obj.vtType].from_sql_fast(obj, all_objects)
                 obj.is_dirty = False
                 obj.is_new = False
-    
-        return objects
 
     def save_to_db(self, db_connection, obj, do_copy=False, global_props=None):
         if do_copy == 'with_ids':
@@ -41,7 +41,7 @@ from datetime import date, datetime
 from vistrails.core import debug
 from vistrails.core.system import strftime, time_strptime
 from vistrails.db import VistrailsDBException
-from vistrails.db.services.io import get_db_lib
+from vistrails.db.services.io import get_db_lib, is_sqlite_connection
 
 class SQLDAO:
     def __init__(self):
@@ -137,9 +137,16 @@ class SQLDAO:
         whereClause = ''
         values = []
         for column, value in whereMap.iteritems():
-            whereStr += '%s%s = %%s' % \
-                        (whereClause, column)
-            values.append(value)
+            if isinstance(value, (list, tuple)):
+                # selects the rows of several objects at once
+                whereStr += '%s%s IN (%s)' % \
+                            (whereClause, column,
+                             ', '.join(['%s'] * len(value)))
+                values.extend(value)
+            else:
+                whereStr += '%s%s = %%s' % \
+                            (whereClause, column)
+                values.append(value)
             whereClause = ' AND '
         dbCommand = """SELECT %s FROM %s WHERE %s""" % \
                     (columnStr, table, whereStr)
@@ -222,6 +229,8 @@ class SQLDAO:
         """ Executes a command consisting of multiple SELECT statements
             It returns a list of results from the SELECT statements
         """
+        if is_sqlite_connection(db):
+            return self.executeSQLMany(db, dbCommandList, isFetch)
         data = []
         # break up into bundles
         BUNDLE_SIZE = 10000
@@ -253,6 +262,41 @@ class SQLDAO:
             n += BUNDLE_SIZE
         return data
 
+    def executeSQLMany(self, db, dbCommandList, isFetch):
+        """ Executes a list of prepared statements on a SQLite connection
+            Writes using the same statement are sent with a single
+            executemany(); the result for each INSERT is its row id
+        """
+        cur = db.cursor()
+        try:
+            if isFetch:
+                data = []
+                for dbCommand, values in dbCommandList:
+                    cur.execute(dbCommand, values)
+                    data.append(cur.fetchall())
+                return data
+
+            groups = {}
+            for i, (dbCommand, values) in enumerate(dbCommandList):
+                groups.setdefault(dbCommand, []).append(i)
+            data = [None] * len(dbCommandList)
+            for dbCommand, indices in groups.iteritems():
+                cur.executemany(dbCommand,
+                                [dbCommandList[i][1] for i in indices])
+                if dbCommand.startswith('INSERT'):
+                    # The database is locked for the transaction, so the
+                    # rows of a batch get consecutive ids
+                    cur.execute('SELECT last_insert_rowid();')
+                    lastId = cur.fetchone()[0] - len(indices)
+                    for n, i in enumerate(indices):
+                        data[i] = lastId + n + 1
+        except Exception, e:
+            raise VistrailsDBException('Command failed: %s -- """ %s """' %
+                                       (e, dbCommand))
+        finally:
+            cur.close()
+        return data
+
     def start_transaction(self, db):
         db.begin()
 
@@ -36,8 +36,8 @@
 """ This is the application for vistrails when running as a server. """
 from __future__ import division
 
-import Queue
 import base64
+import bisect
 import hashlib
 import inspect
 import sys
@@ -46,8 +46,10 @@ import logging.handlers
 import os
 import re
 import shutil
+import signal
 import subprocess
 import tempfile
+import threading
 import time
 import traceback
 import urllib
@@ -117,32 +119,355 @@ class ThreadedXMLRPCServer(SocketServer.ThreadingMixIn,
     related objects because they won't be in the main thread."""
 ################################################################################
 
+class TimeoutTransport(xmlrpclib.Transport):
+    """Transport that gives up on unresponsive instances, used by health
+    probes so that a hung instance does not block the dispatcher."""
+    def __init__(self, timeout, use_datetime=0):
+        xmlrpclib.Transport.__init__(self, use_datetime)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = xmlrpclib.Transport.make_connection(self, host)
+        conn.timeout = self.timeout
+        return conn
+
+def _signal_process(process, sig):
+    """Sends sig to the process group led by process if there is one, or to
+    process itself."""
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, sig)
+            return
+        except OSError:
+            pass
+    try:
+        process.send_signal(sig)
+    except OSError:
+        # it has already exited
+        pass
+
+def stop_process(process, timeout):
+    """stop_process(process: subprocess.Popen, timeout: float) -> None
+    Terminates an instance and waits for it to exit, killing it if it is
+    still running after timeout seconds.
+    """
+    if process.poll() is not None:
+        return
+    _signal_process(process, signal.SIGTERM)
+    deadline = time.time() + timeout
+    while process.poll() is None:
+        if time.time() >= deadline:
+            _signal_process(process, getattr(signal, 'SIGKILL',
+                                             signal.SIGTERM))
+            process.wait()
+            return
+        time.sleep(0.1)
+
+class InstanceDispatcher(object):
+    """Routes forwarded requests to the other VisTrails instances.
+
+    Each instance runs one request at a time. Requests for the same vistrail
+    go to the same instance when it is free (consistent hashing on the key)
+    so that its caches stay warm, otherwise to the least loaded healthy
+    instance. Instances that fail, or that are still busy with a request
+    after request_timeout seconds, are probed with try_ping and handed to
+    restart_callback if they stay down.
+    """
+    REPLICAS = 16
+
+    def __init__(self, instances, logger, restart_callback=None,
+                 probe_interval=30, probe_timeout=5, restart_delay=60,
+                 capacity=1, request_timeout=600):
+        self.logger = logger
+        self.restart_callback = restart_callback
+        self.restart_delay = restart_delay
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.capacity = capacity
+        self.request_timeout = request_timeout
+        self.condition = threading.Condition()
+        self.waiting = 0
+        self.instances = []
+        self.state = {}
+        self.ring = []
+        for uri in instances:
+            try:
+                if request_timeout is not None:
+                    # a hung request fails instead of blocking its thread
+                    proxy = xmlrpclib.ServerProxy(
+                        uri, transport=TimeoutTransport(request_timeout))
+                else:
+                    proxy = xmlrpclib.ServerProxy(uri)
+            except Exception, e:
+                self.logger.error("Error when instantiating proxy %s" % uri)
+                self.logger.error(str(e))
+                continue
+            self.instances.append(uri)
+            self.state[uri] = {'proxy': proxy,
+                               'in_flight': 0,
+                               # start times of the requests in flight
+                               'started': [],
+                               'healthy': True,
+                               'last_probe': time.time(),
+                               'restarted_at': 0,
+                               'requests': 0,
+                               'failures': 0,
+                               'restarts': 0}
+            for i in xrange(self.REPLICAS):
+                self.ring.append((self._hash("%s#%d" % (uri, i)), uri))
+            self.logger.info("Instantiated client for %s" % uri)
+        self.ring.sort()
+
+    @staticmethod
+    def _hash(key):
+        return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+    def _preferred(self, key):
+        """Returns the instances in ring order starting at key."""
+        if not self.ring:
+            return []
+        h = self._hash(key)
+        start = bisect.bisect(self.ring, (h, ''))
+        result = []
+        for i in xrange(len(self.ring)):
+            uri = self.ring[(start + i) % len(self.ring)][1]
+            if uri not in result:
+                result.append(uri)
+        return result
+
+    def _choose(self, key):
+        free = [uri for uri in self.instances
+                if self.state[uri]['healthy'] and
+                self.state[uri]['in_flight'] < self.capacity]
+        if not free:
+            return None
+        if key is not None:
+            uri = self._preferred(key)[0]
+            if uri in free:
+                return uri
+        return min(free, key=lambda uri: self.state[uri]['in_flight'])
+
+    def acquire(self, key=None, timeout=None):
+        """acquire(key: str, timeout: float) -> (uri, proxy)
+        Blocks until an instance is available. Returns (None, None) if the
+        timeout expires or no instance is healthy.
+        """
+        self.probe()
+        deadline = None if timeout is None else time.time() + timeout
+        self.condition.acquire()
+        try:
+            self.waiting += 1
+            try:
+                while True:
+                    uri = self._choose(key)
+                    if uri is not None:
+                        state = self.state[uri]
+                        state['in_flight'] += 1
+                        state['started'].append(time.time())
+                        state['requests'] += 1
+                        return uri, state['proxy']
+                    if not any(self.state[u]['healthy']
+                               for u in self.instances):
+                        return None, None
+                    if deadline is None:
+                        # wake up now and then so restarted instances are seen
+                        self.condition.wait(max(self.probe_interval, 1))
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return None, None
+                        self.condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+        finally:
+            self.condition.release()
+
+    def acquire_all(self):
+        """acquire_all() -> list of (uri, proxy) or None
+        Reserves every healthy instance if they are all idle.
+        """
+        self.condition.acquire()
+        try:
+            healthy = [uri for uri in self.instances
+                       if self.state[uri]['healthy']]
+            if any(self.state[uri]['in_flight'] for uri in healthy):
+                return None
+            now = time.time()
+            for uri in healthy:
+                self.state[uri]['in_flight'] += 1
+                self.state[uri]['started'].append(now)
+                self.state[uri]['requests'] += 1
+            return [(uri, self.state[uri]['proxy']) for uri in healthy]
+        finally:
+            self.condition.release()
+
+    def release(self, uri, failed=False):
+        """release(uri: str, failed: bool) -> None
+        Returns an instance to the pool. A failed instance is taken out of
+        rotation until it answers a probe again.
+        """
+        self.condition.acquire()
+        try:
+            state = self.state[uri]
+            state['in_flight'] -= 1
+            # which request finished isn't known, this keeps the most recent
+            # start times
+            del state['started'][0]
+            if failed:
+                state['failures'] += 1
+                state['healthy'] = False
+                state['last_probe'] = 0
+            self.condition.notify_all()
+        finally:
+            self.condition.release()
+        if failed:
+            self.logger.error("Instance %s failed, taking it out of "
+                              "rotation" % uri)
+            self.probe(uri)
+
+    def ping(self, uri):
+        try:
+            proxy = xmlrpclib.ServerProxy(
+                uri, transport=TimeoutTransport(self.probe_timeout))
+            return proxy.try_ping() == 1
+        except Exception:
+            return False
+
+    def _is_hung(self, uri, now):
+        """Tells whether an instance has been running a request for more
+        than request_timeout."""
+        started = self.state[uri]['started']
+        return (self.request_timeout is not None and started and
+                now - started[0] >= self.request_timeout)
+
+    def probe(self, uri=None):
+        """probe(uri: str) -> None
+        Pings instances whose last probe is older than probe_interval and
+        that are idle or hung (or the given instance) and restarts the ones
+        that do not answer.
+        """
+        now = time.time()
+        self.condition.acquire()
+        try:
+            if uri is not None:
+                due = [uri]
+            else:
+                due = [u for u in self.instances
+                       if (self.state[u]['in_flight'] == 0 or
+                           self._is_hung(u, now)) and
+                       now - self.state[u]['last_probe'] >= self.probe_interval]
+            for u in due:
+                self.state[u]['last_probe'] = now
+        finally:
+            self.condition.release()
+        for u in due:
+            alive = self.ping(u)
+            restart = False
+            self.condition.acquire()
+            try:
+                state = self.state[u]
+                was_healthy = state['healthy']
+                state['healthy'] = alive
+                if alive and not was_healthy:
+                    self.logger.info("Instance %s is back in rotation" % u)
+                    self.condition.notify_all()
+                elif (not alive and self.restart_callback is not None and
+                      now - state['restarted_at'] >= self.restart_delay):
+                    # give a restarted instance time to come up
+                    state['restarted_at'] = now
+                    state['restarts'] += 1
+                    restart = True
+            finally:
+                self.condition.release()
+            if restart:
+                self.logger.error("Instance %s is not responding, "
+                                  "restarting it" % u)
+                try:
+                    self.restart_callback(u)
+                except Exception, e:
+                    self.logger.error("Couldn't restart instance %s" % u)
+                    self.logger.error(str(e))
+
+    def get_stats(self):
+        """get_stats() -> dict
+        Queue depth and per-instance load and health.
+        """
+        self.condition.acquire()
+        try:
+            instances = {}
+            for uri in self.instances:
+                state = self.state[uri]
+                instances[uri] = dict((k, v) for k, v in state.iteritems()
+                                      if k not in ('proxy', 'last_probe',
+                                                   'restarted_at', 'started'))
+            return {'waiting': self.waiting,
+                    'in_flight': sum(self.state[uri]['in_flight']
+                                     for uri in self.instances),
+                    'instances': instances}
+        finally:
+            self.condition.release()
+
+################################################################################
+
 class RequestHandler(object):
     """This class will handle all the requests sent to the server.
     Add new methods here and they will be exposed through the XML-RPC interface
     """
-    def __init__(self, logger, instances):
+    # Returned by forward() when the request has to run in this instance
+    RUN_LOCALLY = object()
+
+    def __init__(self, logger, instances, restart_callback=None):
         self.server_logger = logger
         self.instances = instances
-        self.proxies_queue = None
-        self.instantiate_proxies()
+        self.dispatcher = None
+        self.instantiate_proxies(restart_callback)
 
     #proxies
-    def instantiate_proxies(self):
-        """instantiate_proxies() -> None
+    def instantiate_proxies(self, restart_callback=None):
+        """instantiate_proxies(restart_callback: callable) -> None
         If this server started other instances of VisTrails, this will create
-        the client proxies to connect to them.
+        the dispatcher that forwards requests to them.
         """
         if len(self.instances) > 0:
-            self.proxies_queue = Queue.Queue()
-            for uri in self.instances:
-                try:
-                    proxy = xmlrpclib.ServerProxy(uri)
-                    self.proxies_queue.put(proxy)
-                    self.server_logger.info("Instantiated client for %s" % uri)
-                except Exception, e:
-                    self.server_logger.error("Error when instantiating proxy %s" % uri)
-                    self.server_logger.error(str(e))
+            self.dispatcher = InstanceDispatcher(self.instances,
+                                                 self.server_logger,
+                                                 restart_callback)
+
+    @staticmethod
+    def routing_key(host, port, db_name, vt_id):
+        return "%s_%s_%s_%s" % (host, port, db_name, vt_id)
+
+    def forward(self, key, method, *args):
+        """forward(key: str, method: str, *args) -> result or RUN_LOCALLY
+        Runs method on another instance chosen for key. Returns RUN_LOCALLY
+        if no instance is available, in which case the request runs here.
+        Errors raised by the remote method (xmlrpclib.Fault) keep the
+        instance in rotation; transport errors take it out.
+        """
+        uri, proxy = self.dispatcher.acquire(key)
+        if uri is None:
+            self.server_logger.info("No instance available, running locally")
+            return self.RUN_LOCALLY
+        failed = False
+        try:
+            self.server_logger.info("Sending request to %s" % uri)
+            return getattr(proxy, method)(*args)
+        except xmlrpclib.Fault:
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.dispatcher.release(uri, failed)
+
+    def get_instance_stats(self):
+        """get_instance_stats() -> (dict, int)
+        Queue depth, load and health of the other instances.
+        """
+        if self.dispatcher is None:
+            return ({'waiting': 0, 'in_flight': 0, 'instances': {}}, 1)
+        return (self.dispatcher.get_stats(), 1)
+
     #utils
     def memory_usage(self):
         """memory_usage() -> dict
@@ -202,8 +527,7 @@ class RequestHandler(object):
                                 obj_type=None,
                                 connection_id=None)
 
-            v = locator.load().vistrail
-            p = v.getPipeline(long(version))
+            p = locator.get_pipeline(long(version))
 
             if p:
                 result = []
@@ -331,19 +655,15 @@ class RequestHandler(object):
         self.server_logger.info("Request: get_server_packages()")
 
         messages = []
-        if self.proxies_queue is not None:
+        if self.dispatcher is not None:
             # collect all proxies:
-            proxies = []
-            while len(proxies) < len(self.instances):
-                self.server_logger.info("Proxies: %s Instances: %s" % (len(proxies), len(self.instances)))
-                if self.proxies_queue.empty():
-                    for p in  proxies:
-                        self.proxies_queue.put(p)
-                    return [[[],
-                        "Not all vistrail instances are free, please try again."], 1]
-                proxies.append(self.proxies_queue.get())
-            for proxy in proxies:
+            proxies = self.dispatcher.acquire_all()
+            if proxies is None:
+                return [[[],
+                    "Not all vistrail instances are free, please try again."], 1]
+            for uri, proxy in proxies:
                 result, s = 'Please contact the server admin', 0
+                failed = False
                 try:
                     if codepath and status is not None:
                         result, s = proxy.get_server_packages(codepath, status)
@@ -357,8 +677,12 @@ class RequestHandler(object):
                            "Error message: %s\n") % (err.url, err.headers,
                                                  err.errcode, err.errmsg)
                     self.server_logger.error(err_msg)
+                    failed = True
+                except Exception, e:
+                    self.server_logger.error(str(e))
+                    failed = True
                 finally:
-                    self.proxies_queue.put(proxy)
+                    self.dispatcher.release(uri, failed)
                 if s == 0:
                     messages.append('An error occurred: %s' % result)
                 else:
@@ -564,7 +888,7 @@ class RequestHandler(object):
                                 obj_id=int(vt_id),
                                 obj_type=None,
                                 connection_id=None)
-            (vistrail, _, _, _)  = io.load_vistrail(locator)
+            vistrail = locator.load(read_only=True).vistrail
 
             # get server packages
             local_packages = [x.identifier for x in \
@@ -576,7 +900,7 @@ class RequestHandler(object):
 
             # find runnable workflows
             for version_id, version_tag in vistrail.get_tagMap().iteritems():
-                pipeline = vistrail.getPipeline(version_id)
+                pipeline = locator.get_pipeline(version_id)
                 workflow_packages = set()
                 on_repo = True
                 has_python_source = False
@@ -703,7 +1027,19 @@ class RequestHandler(object):
         return ("Doesnt have working workflow.", 1)
 
     #medleys
-    
+
+    @staticmethod
+    def medley_database(extra_info):
+        """medley_database(extra_info: dict) -> (str, int, str)
+        Returns the host, port and name of the database holding the vistrail
+        of a medley, from the request's extra_info or the configuration.
+        """
+        if extra_info is None:
+            extra_info = {}
+        return (extra_info.get('host', db_host),
+                int(extra_info.get('port', db_port)),
+                extra_info.get('db_name', db_database))
+
     def executeMedley(self, xml_medley, extra_info=None):
         self.server_logger.info("executeMedley request received")
         try:
@@ -723,19 +1059,23 @@ class RequestHandler(object):
             subdir = hashlib.sha224(xml_string).hexdigest()
             path_to_images = \
                os.path.join(media_dir, 'medleys/images', subdir)
+            host, port, db_name = self.medley_database(extra_info)
             if (not self.path_exists_and_not_empty(path_to_images) and
-                self.proxies_queue is not None):
+                self.dispatcher is not None):
                 #this server can send requests to other instances
-                proxy = self.proxies_queue.get()
+                key = None
+                if medley is not None and medley._type == 'vistrail':
+                    key = self.routing_key(host, port, db_name, medley._vtid)
                 try:
-                    self.server_logger.info("Sending request to %s" % proxy)
                     if extra_info is not None:
-                        result = proxy.executeMedley(xml_medley, extra_info)
+                        result = self.forward(key, 'executeMedley',
+                                              xml_medley, extra_info)
                     else:
-                        result = proxy.executeMedley(xml_medley)
-                    self.proxies_queue.put(proxy)
-                    self.server_logger.info("returning %s"% result)
-                    return result
+                        result = self.forward(key, 'executeMedley',
+                                              xml_medley)
+                    if result is not self.RUN_LOCALLY:
+                        self.server_logger.info("returning %s"% result)
+                        return result
                 except Exception, e:
                     self.server_logger.error(str(e))
                     return (str(e), 0)
@@ -752,9 +1092,9 @@ class RequestHandler(object):
                     os.mkdir(extra_info['pathDumpCells'])
                 
                 if medley._type == 'vistrail':
-                    locator = DBLocator(host=db_host,
-                                        port=3306,
-                                        database='vistrails',
+                    locator = DBLocator(host=host,
+                                        port=port,
+                                        database=db_name,
                                         user=db_write_user,
                                         passwd=db_write_pass,
                                         obj_id=medley._vtid,
@@ -913,7 +1253,6 @@ class RequestHandler(object):
 
         self.server_logger.info("path_exists_and_not_empty? %s" % self.path_exists_and_not_empty(path_to_figures))
         self.server_logger.info("build_always? %s" % build_always)
-        self.server_logger.info(str(self.proxies_queue))
 
         if not is_local:
             # use same hashing as on crowdlabs webserver
@@ -922,18 +1261,18 @@ class RequestHandler(object):
             path_to_figures = os.path.join(media_dir, "photos", "wf_execution", dest_version)
 
         if ((not self.path_exists_and_not_empty(path_to_figures) or 
-             build_always) and self.proxies_queue is not None):
+             build_always) and self.dispatcher is not None):
             self.server_logger.info("will forward request")
             #this server can send requests to other instances
-            proxy = self.proxies_queue.get()
             try:
-                self.server_logger.info("Sending request to %s" % proxy)
-                result = proxy.run_from_db(host, port, db_name, vt_id,
-                                           path_to_figures, version, pdf, vt_tag,
-                                           build_always, parameters, is_local)
-                self.proxies_queue.put(proxy)
-                self.server_logger.info("returning %s" % result)
-                return result
+                result = self.forward(
+                        self.routing_key(host, port, db_name, vt_id),
+                        'run_from_db', host, port, db_name, vt_id,
+                        path_to_figures, version, pdf, vt_tag,
+                        build_always, parameters, is_local)
+                if result is not self.RUN_LOCALLY:
+                    self.server_logger.info("returning %s" % result)
+                    return result
             except xmlrpclib.ProtocolError, err:
                 err_msg = ("A protocol error occurred\n"
                            "URL: %s\n"
@@ -1054,8 +1393,7 @@ class RequestHandler(object):
                                 obj_type=None,
                                 connection_id=None)
 
-            v = locator.load().vistrail
-            p = v.getPipeline(long(version))
+            p = locator.get_pipeline(long(version))
 
             if p:
                 result = []
@@ -1097,7 +1435,7 @@ class RequestHandler(object):
                                 obj_type=None,
                                 connection_id=None)
 
-            (v, _ , _, _)  = io.load_vistrail(locator)
+            v = locator.load(read_only=True).vistrail
             if v.has_tag_str(vt_tag):
                 version = v.get_tag_str(vt_tag).action_id
             self.server_logger.info("Answer: %s" % version)
@@ -1131,7 +1469,7 @@ class RequestHandler(object):
                                 obj_type=None,
                                 connection_id=None)
 
-            (v, _ , _, _)  = io.load_vistrail(locator)
+            v = locator.load(read_only=True).vistrail
             result = io.serialize(v)
             return (result, 1)
         except xmlrpclib.ProtocolError, err:
@@ -1161,8 +1499,7 @@ class RequestHandler(object):
                                 obj_type=None,
                                 connection_id=None)
 
-            (v, _ , _, _)  = io.load_vistrail(locator)
-            p = v.getPipeline(long(version))
+            p = locator.get_pipeline(long(version))
             if p:
                 result = io.serialize(p)
                 self.server_logger.info("success")
@@ -1201,14 +1538,16 @@ class RequestHandler(object):
             filename = os.path.join(filepath,base_fname)
             if ((not os.path.exists(filepath) or
                 os.path.exists(filepath) and not os.path.exists(filename))
-                and self.proxies_queue is not None):
+                and self.dispatcher is not None):
                 #this server can send requests to other instances
-                proxy = self.proxies_queue.get()
                 try:
-                    result = proxy.get_wf_graph_pdf(host,port,db_name, vt_id, version, is_local)
-                    self.proxies_queue.put(proxy)
-                    self.server_logger.info("get_wf_graph_pdf returning %s"% result)
-                    return result
+                    result = self.forward(
+                            self.routing_key(host, port, db_name, vt_id),
+                            'get_wf_graph_pdf', host, port, db_name, vt_id,
+                            version, is_local)
+                    if result is not self.RUN_LOCALLY:
+                        self.server_logger.info("get_wf_graph_pdf returning %s"% result)
+                        return result
                 except xmlrpclib.ProtocolError, err:
                     err_msg = ("A protocol error occurred\n"
                                "URL: %s\n"
@@ -1285,15 +1624,16 @@ class RequestHandler(object):
             filename = os.path.join(filepath,base_fname)
             if ((not os.path.exists(filepath) or
                 os.path.exists(filepath) and not os.path.exists(filename))
-                and self.proxies_queue is not None):
+                and self.dispatcher is not None):
                 #this server can send requests to other instances
-                proxy = self.proxies_queue.get()
                 try:
-                    self.server_logger.info("Sending request to %s" % proxy)
-                    result = proxy.get_wf_graph_png(host, port, db_name, vt_id, version, is_local)
-                    self.proxies_queue.put(proxy)
-                    self.server_logger.info("returning %s" % result)
-                    return result
+                    result = self.forward(
+                            self.routing_key(host, port, db_name, vt_id),
+                            'get_wf_graph_png', host, port, db_name, vt_id,
+                            version, is_local)
+                    if result is not self.RUN_LOCALLY:
+                        self.server_logger.info("returning %s" % result)
+                        return result
                 except xmlrpclib.ProtocolError, err:
                     err_msg = ("A protocol error occurred\n"
                                "URL: %s\n"
@@ -1385,15 +1725,16 @@ class RequestHandler(object):
             if ((not os.path.exists(filepath) or
                 (os.path.exists(filepath) and not os.path.exists(filename)) or
                  self._is_image_stale(filename, host, port, db_name, vt_id)) and 
-                self.proxies_queue is not None):
+                self.dispatcher is not None):
                 #this server can send requests to other instances
-                proxy = self.proxies_queue.get()
                 try:
-                    self.server_logger.info("Sending request to %s" % proxy)
-                    result = proxy.get_vt_graph_png(host, port, db_name, vt_id, is_local)
-                    self.proxies_queue.put(proxy)
-                    self.server_logger.info("returning %s" % result)
-                    return result
+                    result = self.forward(
+                            self.routing_key(host, port, db_name, vt_id),
+                            'get_vt_graph_png', host, port, db_name, vt_id,
+                            is_local)
+                    if result is not self.RUN_LOCALLY:
+                        self.server_logger.info("returning %s" % result)
+                        return result
                 except xmlrpclib.ProtocolError, err:
                     err_msg = ("A protocol error occurred\n"
                                "URL: %s\n"
@@ -1474,15 +1815,16 @@ class RequestHandler(object):
             if ((not os.path.exists(filepath) or
                 (os.path.exists(filepath) and not os.path.exists(filename)) or
                  self._is_image_stale(filename, host, port, db_name, vt_id)) and 
-                self.proxies_queue is not None):
+                self.dispatcher is not None):
                 #this server can send requests to other instances
-                proxy = self.proxies_queue.get()
                 try:
-                    self.server_logger.info("Sending request to %s" % proxy)
-                    result = proxy.get_vt_graph_pdf(host, port, db_name, vt_id, is_local)
-                    self.proxies_queue.put(proxy)
-                    self.server_logger.info("returning %s" % result)
-                    return result
+                    result = self.forward(
+                            self.routing_key(host, port, db_name, vt_id),
+                            'get_vt_graph_pdf', host, port, db_name, vt_id,
+                            is_local)
+                    if result is not self.RUN_LOCALLY:
+                        self.server_logger.info("returning %s" % result)
+                        return result
                 except xmlrpclib.ProtocolError, err:
                     err_msg = ("A protocol error occurred\n"
                                "URL: %s\n"
@@ -1718,7 +2060,7 @@ class RequestHandler(object):
                                 connection_id=None)
 
             result = []
-            v = locator.load().vistrail
+            v = locator.load(read_only=True).vistrail
             for elem, tag in v.get_tagMap().iteritems():
                 action_map = v.actionMap[long(elem)]
                 thumbnail_fname = ""
@@ -2075,6 +2417,9 @@ class VistrailsServerSingleton(VistrailsApplicationInterface,
     there will be only one instance of the application during VisTrails
 
     """
+    # seconds an instance has to exit before it is killed
+    STOP_TIMEOUT = 30
+
     def __call__(self):
         """ __call__() -> VistrailsServerSingleton
         Return self for calling method
@@ -2115,9 +2460,11 @@ class VistrailsServerSingleton(VistrailsApplicationInterface,
         If parameters are missing, write them in and raise error.
         If file doesn't exist, create one and raise error. """
 
-        global accessList, db_host, db_read_user, db_read_pass, db_write_user, db_write_pass, media_dir, script_file, virtual_display
+        global accessList, db_host, db_port, db_database, db_read_user, db_read_pass, db_write_user, db_write_pass, media_dir, script_file, virtual_display
         accessList = []
         db_host = ''
+        db_port = 3306
+        db_database = 'vistrails'
         db_read_user = ''
         db_read_pass = ''
         db_write_user = ''
@@ -2156,6 +2503,12 @@ class VistrailsServerSingleton(VistrailsApplicationInterface,
             config.set("database", "host", "")
             has_changed = True
 
+        # optional, used when requests don't name the database
+        if config.has_option("database", "port"):
+            db_port = config.getint("database", "port")
+        if config.has_option("database", "database"):
+            db_database = config.get("database", "database")
+
         if config.has_option("database", "read_user"):
             db_read_user = config.get("database", "read_user")
         else:
@@ -2180,6 +2533,27 @@ class VistrailsServerSingleton(VistrailsApplicationInterface,
             config.set("database", "write_password", "")
             has_changed = True
 
+        # optional connection pool settings
+        if config.has_option("database", "pool_size"):
+            DBLocator.pool.configure(
+                    max_size=config.getint("database", "pool_size"))
+        if config.has_option("database", "pool_idle_timeout"):
+            DBLocator.pool.configure(
+                    idle_timeout=config.getint("database",
+                                               "pool_idle_timeout"))
+        # optional cache settings for loaded vistrails and workflows
+        if config.has_option("database", "cache_size"):
+            DBLocator.configure_cache(
+                    size=config.getint("database", "cache_size"))
+        if config.has_option("database", "pipeline_cache_size"):
+            DBLocator.configure_cache(
+                    pipeline_size=config.getint("database",
+                                                "pipeline_cache_size"))
+        if config.has_option("database", "cache_check_interval"):
+            DBLocator.configure_cache(
+                    check_interval=config.getfloat("database",
+                                                   "cache_check_interval"))
+
         if not config.has_section("media"):
             config.add_section("media")
             has_changed = True
@@ -2257,6 +2631,8 @@ class VistrailsServerSingleton(VistrailsApplicationInterface,
 
     def start_other_instances(self, number):
         self.others = []
+        self.other_displays = {}
+        self.other_processes = {}
         host = self.temp_configuration.check('rpcServer')
         port = self.temp_configuration.check('rpcPort')
         virt_disp = int(virtual_display)
@@ -2264,15 +2640,47 @@ class VistrailsServerSingleton(VistrailsApplicationInterface,
             port += 1   # each instance needs one port space for now
                         #later we might need 2 (normal requests and status requests)
             virt_disp += 1
-            args = [script_file,":%s"%virt_disp,host,str(port),'0', '0']
-            try:
-                subprocess.Popen(args)
+            uri = "http://%s:%s"%(host,port)
+            process = self.start_instance(host, port, virt_disp)
+            if process is not None:
                 time.sleep(20)
-                self.others.append("http://%s:%s"%(host,port))
-            except Exception, e:
-                self.server_logger.error(("Couldn't start the instance on display:"
-                                          "%s port: %s") % (virtual_display, port))
-                self.server_logger.error(str(e))
+                self.others.append(uri)
+                self.other_displays[uri] = (host, port, virt_disp)
+                self.other_processes[uri] = process
+
+    def start_instance(self, host, port, virt_disp):
+        """start_instance(host: str, port: int, virt_disp: int)
+             -> subprocess.Popen
+        Runs the instance script in a new process group, so that stopping
+        it also stops the instance it started. Returns None if it couldn't
+        be started.
+        """
+        args = [script_file,":%s"%virt_disp,host,str(port),'0', '0']
+        kwargs = {}
+        if hasattr(os, 'setsid'):
+            kwargs['preexec_fn'] = os.setsid
+        try:
+            return subprocess.Popen(args, **kwargs)
+        except Exception, e:
+            self.server_logger.error(("Couldn't start the instance on display:"
+                                      "%s port: %s") % (virt_disp, port))
+            self.server_logger.error(str(e))
+            return None
+
+    def restart_instance(self, uri):
+        """restart_instance(uri: str) -> None
+        Stops the process of an instance that stopped responding and starts
+        a new one. The dispatcher puts it back in rotation once it answers a
+        probe.
+        """
+        if uri in self.other_displays:
+            process = self.other_processes.pop(uri, None)
+            if process is not None:
+                # the new process can't listen on the port until this exits
+                stop_process(process, self.STOP_TIMEOUT)
+            process = self.start_instance(*self.other_displays[uri])
+            if process is not None:
+                self.other_processes[uri] = process
 
     def stop_other_instances(self):
         script = os.path.join(system.vistrails_root_directory(), "stop_vistrails_server.py")
@@ -2314,7 +2722,8 @@ class VistrailsServerSingleton(VistrailsApplicationInterface,
             self.server_logger.info("    singlethreaded instance")
         #self.rpcserver.register_introspection_functions()
         self.rpcserver.register_instance(RequestHandler(self.server_logger,
-                                                        self.others))
+                                                        self.others,
+                                                        self.restart_instance))
         if self.pingserver:
             self.pingserver.register_instance(RequestHandler(
                                                       self.server_logger, []))
@@ -2366,3 +2775,111 @@ def stop_server():
     VistrailsServer.save_configuration()
     VistrailsServer.destroy()
     VistrailsServer.deleteLater()
+
+################################################################################
+
+import unittest
+
+class DiscardHandler(logging.Handler):
+    """Logging handler that drops the records (logging.NullHandler only
+    exists from Python 2.7)."""
+    def emit(self, record):
+        pass
+
+class FakeDispatcher(InstanceDispatcher):
+    """Dispatcher whose instances answer pings as told by alive."""
+    def __init__(self, instances, **kwargs):
+        logger = logging.getLogger('vistrails.test.dispatcher')
+        logger.addHandler(DiscardHandler())
+        logger.propagate = False
+        self.restarted = []
+        InstanceDispatcher.__init__(self, instances, logger,
+                                    self.restarted.append, **kwargs)
+        self.alive = dict((uri, True) for uri in instances)
+        self.pinged = []
+
+    def ping(self, uri):
+        self.pinged.append(uri)
+        return self.alive[uri]
+
+class TestInstanceDispatcher(unittest.TestCase):
+    instances = ['http://localhost:%d' % port for port in (8081, 8082, 8083)]
+
+    def test_routing(self):
+        dispatcher = FakeDispatcher(self.instances)
+        uri, proxy = dispatcher.acquire('vt_1')
+        self.assertEqual(uri, dispatcher._preferred('vt_1')[0])
+        dispatcher.release(uri)
+        # requests for the same vistrail go to the same instance
+        self.assertEqual(dispatcher.acquire('vt_1')[0], uri)
+        # or to another one while it is busy
+        other, proxy = dispatcher.acquire('vt_1')
+        self.assertNotEqual(other, uri)
+        self.assertEqual(dispatcher.acquire_all(), None)
+        dispatcher.acquire()
+        self.assertEqual(dispatcher.acquire('vt_1', timeout=0.01),
+                         (None, None))
+        stats = dispatcher.get_stats()
+        self.assertEqual(stats['in_flight'], 3)
+        self.assertEqual(stats['waiting'], 0)
+
+    def test_failed_instance(self):
+        dispatcher = FakeDispatcher(self.instances, restart_delay=0)
+        uri, proxy = dispatcher.acquire('vt_1')
+        dispatcher.alive[uri] = False
+        dispatcher.release(uri, failed=True)
+        self.assertEqual(dispatcher.pinged, [uri])
+        self.assertEqual(dispatcher.restarted, [uri])
+        # it is out of rotation until it answers a probe again
+        self.assertNotEqual(dispatcher.acquire('vt_1')[0], uri)
+        dispatcher.alive[uri] = True
+        dispatcher.probe(uri)
+        self.assertTrue(dispatcher.state[uri]['healthy'])
+
+    def test_probe_busy(self):
+        dispatcher = FakeDispatcher(self.instances, probe_interval=0,
+                                    restart_delay=0, request_timeout=60)
+        uri, proxy = dispatcher.acquire('vt_1')
+        dispatcher.alive[uri] = False
+        dispatcher.pinged = []
+        # busy instances are left alone
+        dispatcher.probe()
+        self.assertNotIn(uri, dispatcher.pinged)
+        # until their request has been running for request_timeout
+        dispatcher.state[uri]['started'][0] -= 120
+        dispatcher.probe()
+        self.assertIn(uri, dispatcher.pinged)
+        self.assertEqual(dispatcher.restarted, [uri])
+        self.assertFalse(dispatcher.state[uri]['healthy'])
+        dispatcher.release(uri, failed=True)
+        self.assertEqual(dispatcher.state[uri]['in_flight'], 0)
+        self.assertEqual(dispatcher.state[uri]['started'], [])
+
+    def test_stop_process(self):
+        process = subprocess.Popen(
+            [sys.executable, '-c',
+             'import signal, time\n'
+             'signal.signal(signal.SIGTERM, signal.SIG_IGN)\n'
+             'time.sleep(60)\n'])
+        time.sleep(0.5)
+        stop_process(process, 0.5)
+        # it ignored SIGTERM, so it was killed
+        self.assertIsNotNone(process.poll())
+
+    def test_restart_instance(self):
+        uri = self.instances[0]
+        started = []
+        class FakeServer(object):
+            STOP_TIMEOUT = 5
+            def start_instance(self, host, port, virt_disp):
+                started.append(old.poll() is not None)
+                return None
+        old = subprocess.Popen([sys.executable, '-c',
+                                'import time; time.sleep(60)'])
+        server = FakeServer()
+        server.other_displays = {uri: ('localhost', 8081, 1)}
+        server.other_processes = {uri: old}
+        VistrailsServerSingleton.restart_instance.im_func(server, uri)
+        # the old process had exited when the new one was started
+        self.assertEqual(started, [True])
+        self.assertEqual(server.other_processes, {})
@@ -105,6 +105,16 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         self.portCombiner = QPortCombineTreeWidget()
         self.layout().addWidget(self.portCombiner)
         self.portCombiner.setVisible(False)
+
+        layout = QtGui.QHBoxLayout()
+        layout.addWidget(QtGui.QLabel("Parallel iterations:"))
+        layout.setStretch(0, 0)
+        self.parallelEdit = QtGui.QLineEdit()
+        self.parallelEdit.setValidator(QtGui.QIntValidator(self))
+        self.parallelEdit.setToolTip('Number of threads executing the iterations of a loop concurrently (default=1)')
+        layout.addWidget(self.parallelEdit)
+        layout.setStretch(1, 1)
+        self.layout().addLayout(layout)
         
         whileLayout = QtGui.QVBoxLayout()
 
@@ -201,6 +211,7 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         self.customButton.toggled.connect(self.stateChanged)
         self.customButton.toggled.connect(self.customToggled)
         self.portCombiner.itemChanged.connect(self.stateChanged)
+        self.parallelEdit.textChanged.connect(self.stateChanged)
         self.whileButton.toggled.connect(self.stateChanged)
         self.whileButton.toggled.connect(self.whileToggled)
         self.condEdit.textChanged.connect(self.stateChanged)
@@ -292,6 +303,7 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
             self.pairwiseButton.setEnabled(False)
             self.cartesianButton.setEnabled(False)
             self.customButton.setEnabled(False)
+            self.parallelEdit.setEnabled(False)
             self.whileButton.setEnabled(False)
             self.condEdit.setVisible(False)
             self.maxEdit.setVisible(False)
@@ -314,6 +326,8 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         self.cartesianButton.setEnabled(True)
         self.cartesianButton.setChecked(True)
         self.customButton.setEnabled(True)
+        self.parallelEdit.setEnabled(True)
+        self.parallelEdit.setText('')
 
         self.whileButton.setEnabled(True)
         self.whileButton.setChecked(False)
@@ -339,6 +353,9 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
             self.portCombiner.setVisible(type not in ['pairwise', 'cartesian'])
             if type not in ['pairwise', 'cartesian']:
                 self.portCombiner.setValue(type)
+        if module.has_control_parameter_with_name(ModuleControlParam.PARALLEL_KEY):
+            workers = module.get_control_parameter_by_name(ModuleControlParam.PARALLEL_KEY).value
+            self.parallelEdit.setText(workers)
         if module.has_control_parameter_with_name(ModuleControlParam.WHILE_COND_KEY) or \
            module.has_control_parameter_with_name(ModuleControlParam.WHILE_MAX_KEY):
             self.whileButton.setChecked(True)
@@ -373,6 +390,8 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         else:
             value = self.portCombiner.getValue()
         values.append((ModuleControlParam.LOOP_KEY, value))
+        values.append((ModuleControlParam.PARALLEL_KEY,
+                       self.parallelEdit.text()))
         _while = self.whileButton.isChecked()
         values.append((ModuleControlParam.WHILE_COND_KEY,
                        _while and self.condEdit.text()))
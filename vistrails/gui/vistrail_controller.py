@@ -349,7 +349,6 @@ class VistrailController(QtCore.QObject, BaseController):
         if action is not None:
             BaseController.add_new_action(self, action, description)
             self.emit(QtCore.SIGNAL("new_action"), action)
-            self.recompute_terse_graph()
 
     ##########################################################################
 
@@ -659,6 +658,11 @@ class VistrailController(QtCore.QObject, BaseController):
         self._current_graph_layout.layout_from(self.vistrail,
                                                self._current_terse_graph)
 
+    def update_terse_graph(self, versions):
+        BaseController.update_terse_graph(self, versions)
+        self._current_graph_layout.layout_from(self.vistrail,
+                                               self._current_terse_graph)
+
     def refine_graph(self, step=1.0):
         """ refine_graph(step: float in [0,1]) -> (Graph, Graph)        
         Refine the graph of the current vistrail based the search
@@ -709,10 +713,10 @@ class VistrailController(QtCore.QObject, BaseController):
                 # we're going from one boring node to another,
                 # so just rename the node on the terse graph
                 self._current_terse_graph.rename_vertex(current, new_version)
+                self.discard_terse_graph_state()
                 self.replace_unnamed_node_in_version_tree(current, new_version)
             else:
-                # bail, for now
-                self.recompute_terse_graph()
+                self.update_terse_graph([current, new_version])
                 self.invalidate_version_tree(False)
         
 
@@ -784,7 +788,7 @@ class VistrailController(QtCore.QObject, BaseController):
             self.vistrail.addTag(tag, self.current_base_version)
 
         self.set_changed(True)
-        self.recompute_terse_graph()
+        self.update_terse_graph([tag_version, self.current_base_version])
         self.invalidate_version_tree(False)
         return True
 
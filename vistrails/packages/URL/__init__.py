@@ -42,8 +42,23 @@ without its associated data.
 This package uses a local cache, inside the per-user VisTrails directory. This
 way, files that haven't been changed do not need to be downloaded again. The
 check is performed efficiently using HTTP headers.
+
+Configuration:
+    cache_max_size: maximum size of the local cache, in megabytes; the least
+        recently used files get removed when it is exceeded. 0 means no limit.
+    trust_cache: number of seconds during which a downloaded file is used
+        without checking with the server whether it changed. 0 means always
+        check.
+    download_threads: number of files DownloadFiles downloads at the same
+        time.
 """
 
 from __future__ import division
 
+from vistrails.core.configuration import ConfigurationObject
+
 from identifiers import *
+
+configuration = ConfigurationObject(cache_max_size=0,
+                                    trust_cache=0,
+                                    download_threads=4)
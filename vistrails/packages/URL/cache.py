@@ -0,0 +1,461 @@
+###############################################################################
+##
+## Copyright (C) 2014-2016, New York University.
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah.
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice,
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright
+##    notice, this list of conditions and the following disclaimer in the
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the New York University nor the names of its
+##    contributors may be used to endorse or promote products derived from
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Local cache of downloaded files.
+
+Downloaded contents are stored once, under their SHA-1 hash, in the 'objects'
+directory. A small JSON metadata file, named after the URL, records which
+object holds the current version of that URL, along with the HTTP headers
+used to revalidate it and when it was last used. Interrupted downloads are
+kept in the 'partial' directory so that they can be resumed.
+
+The total size of the objects can be bounded, in which case the entries that
+were used the least recently are evicted. Entries being downloaded or copied
+out of the cache are pinned, so that they are not evicted meanwhile.
+"""
+
+from __future__ import division
+
+import errno
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib
+import urlparse
+
+try:
+    import hashlib
+    sha_hash = hashlib.sha1
+except ImportError:
+    import sha
+    sha_hash = sha.new
+
+from vistrails.core import debug
+from vistrails.core.system import systemType
+
+
+MAX_CACHE_FILENAME = 100
+
+_re_extension = re.compile(r'^\.[A-Za-z0-9_]{1,10}$')
+
+
+def cache_filename(url):
+    url = urllib.quote_plus(url)
+    if len(url) <= MAX_CACHE_FILENAME:
+        return url
+    else:
+        hasher = sha_hash()
+        hasher.update(url)
+        return url[:MAX_CACHE_FILENAME - 41] + "_" + hasher.hexdigest()
+
+
+def url_extension(url):
+    """Returns the extension of the file a URL points to, if it has one.
+
+    Objects keep it, so that readers relying on it still work.
+    """
+    ext = os.path.splitext(urlparse.urlparse(url).path)[1]
+    if _re_extension.match(ext):
+        return ext
+    return ''
+
+
+def file_digest(filename):
+    """Returns the SHA-1 hash of a file's contents, as hexadecimal.
+    """
+    hasher = sha_hash()
+    with open(filename, 'rb') as fp:
+        chunk = fp.read(1024 * 1024)
+        while chunk:
+            hasher.update(chunk)
+            chunk = fp.read(1024 * 1024)
+    return hasher.hexdigest()
+
+
+def replace_file(src, dst):
+    """Moves a file over another one, atomically where possible.
+    """
+    if systemType in ['Windows', 'Microsoft'] and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def _makedirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class DownloadCache(object):
+    """A size-bounded, content-addressed cache of downloaded files.
+
+    max_size is in bytes, 0 means unbounded. Entries that were checked with
+    the server less than trust_time seconds ago are used directly, without
+    revalidating them.
+    """
+    def __init__(self, directory, max_size=0, trust_time=0):
+        self.directory = directory
+        self.max_size = max_size
+        self.trust_time = trust_time
+        self.objects_directory = os.path.join(directory, 'objects')
+        self.partial_directory = os.path.join(directory, 'partial')
+        _makedirs(self.objects_directory)
+        _makedirs(self.partial_directory)
+
+        self._lock = threading.Lock()
+        self._url_locks = {}
+        self._pinned = {}
+
+    def lock(self, url):
+        """Returns the lock to hold while downloading a URL.
+        """
+        with self._lock:
+            try:
+                return self._url_locks[url]
+            except KeyError:
+                lock = self._url_locks[url] = threading.Lock()
+                return lock
+
+    def pin(self, url):
+        """Prevents the entry for a URL from being evicted, until unpin().
+
+        Pins are counted, so a URL can be pinned by several users.
+        """
+        with self._lock:
+            self._pinned[url] = self._pinned.get(url, 0) + 1
+
+    def unpin(self, url):
+        with self._lock:
+            if self._pinned[url] == 1:
+                del self._pinned[url]
+            else:
+                self._pinned[url] -= 1
+
+    def _meta_filename(self, url):
+        return os.path.join(self.directory, cache_filename(url) + '.meta')
+
+    def object_filename(self, entry):
+        return os.path.join(self.objects_directory,
+                            entry['digest'] + entry.get('extension', ''))
+
+    def lookup(self, url):
+        """Returns the metadata of the cached version of a URL, or None.
+        """
+        try:
+            with open(self._meta_filename(url), 'rb') as fp:
+                entry = json.load(fp)
+        except (IOError, ValueError):
+            return None
+        if (entry.get('url') != url or
+                not os.path.isfile(self.object_filename(entry))):
+            return None
+        return entry
+
+    def is_trusted(self, entry):
+        """Whether an entry can be used without revalidating it.
+        """
+        return (self.trust_time > 0 and
+                time.time() - entry.get('checked', 0) < self.trust_time)
+
+    def _write_meta(self, filename, entry):
+        fd, temp_filename = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                             prefix='.meta_')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                json.dump(entry, fp)
+            replace_file(temp_filename, filename)
+        except (IOError, OSError), e:
+            debug.warning("Unable to write download cache metadata: %s" % e)
+            try:
+                os.remove(temp_filename)
+            except OSError:
+                pass
+
+    def touch(self, url, entry, checked=False):
+        """Records that an entry was used, and possibly revalidated.
+        """
+        now = time.time()
+        entry['used'] = now
+        if checked:
+            entry['checked'] = now
+        self._write_meta(self._meta_filename(url), entry)
+
+    def partial_filename(self, url):
+        return os.path.join(self.partial_directory, cache_filename(url))
+
+    def get_partial(self, url):
+        """Returns the size and validators of an interrupted download.
+
+        Returns (size, validators) where validators is a dict with the
+        'etag' and 'last_modified' headers, or None.
+        """
+        filename = self.partial_filename(url)
+        try:
+            with open(filename + '.meta', 'rb') as fp:
+                validators = json.load(fp)
+            size = os.path.getsize(filename)
+        except (IOError, OSError, ValueError):
+            return None
+        if validators.get('url') != url or size == 0:
+            return None
+        return size, validators
+
+    def set_partial(self, url, validators):
+        """Records the validators for an interrupted download.
+        """
+        validators = dict(validators, url=url)
+        self._write_meta(self.partial_filename(url) + '.meta', validators)
+
+    def remove_partial(self, url):
+        filename = self.partial_filename(url)
+        for name in (filename, filename + '.meta'):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+    def store(self, url, filename, digest, headers={}):
+        """Adds a downloaded file to the cache.
+
+        The file is moved into the cache; if an object with the same contents
+        exists, it is reused. Returns the metadata of the new entry.
+        """
+        entry = {'url': url,
+                 'digest': digest,
+                 'extension': url_extension(url),
+                 'size': os.path.getsize(filename),
+                 'etag': headers.get('etag'),
+                 'last_modified': headers.get('last_modified')}
+        object_filename = self.object_filename(entry)
+        with self._lock:
+            previous = self.lookup(url)
+            if os.path.isfile(object_filename):
+                os.remove(filename)
+            else:
+                replace_file(filename, object_filename)
+            self.touch(url, entry, checked=True)
+            # Removes the previous version if nothing else refers to it
+            if previous is not None:
+                previous_filename = self.object_filename(previous)
+                name = os.path.basename(previous_filename)
+                if (previous_filename != object_filename and
+                        name not in self._references(self.entries())):
+                    try:
+                        os.remove(previous_filename)
+                    except OSError:
+                        pass
+        self.evict(keep=url)
+        return entry
+
+    def entries(self):
+        """Returns the metadata of all the entries in the cache.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.meta'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'rb') as fp:
+                    entry = json.load(fp)
+            except (IOError, ValueError):
+                continue
+            entry['meta_filename'] = os.path.join(self.directory, name)
+            entries.append(entry)
+        return entries
+
+    def size(self):
+        """Returns the total size of the objects in the cache.
+        """
+        total = 0
+        for name in os.listdir(self.objects_directory):
+            try:
+                total += os.path.getsize(os.path.join(self.objects_directory,
+                                                      name))
+            except OSError:
+                pass
+        return total
+
+    def _references(self, entries):
+        """Counts the entries referring to each object.
+        """
+        referenced = {}
+        for entry in entries:
+            name = os.path.basename(self.object_filename(entry))
+            referenced[name] = referenced.get(name, 0) + 1
+        return referenced
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries to get under max_size.
+
+        The entry for the URL keep and the pinned entries are never removed.
+        Objects are removed once no entry refers to them anymore.
+        """
+        if not self.max_size:
+            return
+        with self._lock:
+            total = self.size()
+            if total <= self.max_size:
+                return
+            entries = self.entries()
+            referenced = self._references(entries)
+            entries.sort(key=lambda e: e.get('used', 0))
+            for entry in entries:
+                if total <= self.max_size:
+                    break
+                url = entry.get('url')
+                if url == keep or url in self._pinned:
+                    continue
+                try:
+                    os.remove(entry['meta_filename'])
+                except OSError:
+                    continue
+                filename = self.object_filename(entry)
+                name = os.path.basename(filename)
+                referenced[name] -= 1
+                if not referenced[name]:
+                    try:
+                        size = os.path.getsize(filename)
+                        os.remove(filename)
+                    except OSError:
+                        pass
+                    else:
+                        total -= size
+
+    def clear(self):
+        """Removes all the entries and objects from the cache.
+        """
+        with self._lock:
+            for entry in self.entries():
+                try:
+                    os.remove(entry['meta_filename'])
+                except OSError:
+                    pass
+            for directory in (self.objects_directory,
+                              self.partial_directory):
+                for name in os.listdir(directory):
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError:
+                        pass
+
+
+###############################################################################
+
+import unittest
+
+
+class TestDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vt_test_cache_')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def add(self, cache, url, contents):
+        fd, filename = tempfile.mkstemp(dir=cache.partial_directory)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(contents)
+        return cache.store(url, filename, file_digest(filename))
+
+    def test_content_addressed(self):
+        """Same contents from different URLs are stored once."""
+        cache = DownloadCache(self.directory)
+        entry1 = self.add(cache, 'http://a/data.csv', 'contents')
+        entry2 = self.add(cache, 'http://b/other.csv', 'contents')
+        self.assertEqual(cache.object_filename(entry1),
+                         cache.object_filename(entry2))
+        self.assertTrue(cache.object_filename(entry1).endswith('.csv'))
+        self.assertEqual(os.listdir(cache.objects_directory),
+                         [os.path.basename(cache.object_filename(entry1))])
+
+        # A new version replaces the object, which isn't used anymore
+        entry3 = self.add(cache, 'http://a/data.csv', 'new contents')
+        self.assertEqual(cache.lookup('http://a/data.csv')['digest'],
+                         entry3['digest'])
+        self.assertEqual(len(os.listdir(cache.objects_directory)), 2)
+        self.add(cache, 'http://b/other.csv', 'new contents')
+        self.assertEqual(len(os.listdir(cache.objects_directory)), 1)
+
+    def test_eviction(self):
+        """Least recently used entries are removed."""
+        cache = DownloadCache(self.directory, max_size=25)
+        for i, url in enumerate(['http://a', 'http://b', 'http://c']):
+            self.add(cache, url, str(i) * 10)
+        self.assertIsNone(cache.lookup('http://a'))
+        self.assertIsNotNone(cache.lookup('http://b'))
+        self.assertIsNotNone(cache.lookup('http://c'))
+        self.assertEqual(cache.size(), 20)
+
+        # Using b makes c the least recently used
+        entry = cache.lookup('http://b')
+        entry['used'] = time.time() + 1
+        cache._write_meta(cache._meta_filename('http://b'), entry)
+        self.add(cache, 'http://d', 'd' * 10)
+        self.assertIsNotNone(cache.lookup('http://b'))
+        self.assertIsNone(cache.lookup('http://c'))
+        self.assertIsNotNone(cache.lookup('http://d'))
+
+    def test_pinned(self):
+        """Pinned entries are not evicted."""
+        cache = DownloadCache(self.directory, max_size=25)
+        self.add(cache, 'http://a', 'a' * 10)
+        cache.pin('http://a')
+        cache.pin('http://a')
+        self.add(cache, 'http://b', 'b' * 10)
+        self.add(cache, 'http://c', 'c' * 10)
+        self.assertIsNotNone(cache.lookup('http://a'))
+        self.assertIsNone(cache.lookup('http://b'))
+        cache.unpin('http://a')
+        self.add(cache, 'http://d', 'd' * 10)
+        self.assertIsNotNone(cache.lookup('http://a'))
+        cache.unpin('http://a')
+        self.add(cache, 'http://e', 'e' * 10)
+        self.assertIsNone(cache.lookup('http://a'))
+
+    def test_trust(self):
+        cache = DownloadCache(self.directory, trust_time=60)
+        entry = self.add(cache, 'http://a', 'a')
+        self.assertTrue(cache.is_trusted(entry))
+        entry['checked'] -= 120
+        self.assertFalse(cache.is_trusted(entry))
+        cache.trust_time = 0
+        self.assertFalse(cache.is_trusted(cache.lookup('http://a')))
@@ -46,29 +46,27 @@ check is performed efficiently using HTTP headers.
 
 from __future__ import division
 
-from datetime import datetime
 import email.utils
+from multiprocessing.pool import ThreadPool
 import os
 import re
+import tempfile
+import time
 import urllib
 import urllib2
 
-try:
-    import hashlib
-    sha_hash = hashlib.sha1
-except ImportError:
-    import sha
-    sha_hash = sha.new
-
 from vistrails.core.bundles.pyimport import py_import
 from vistrails.core import debug
 import vistrails.core.modules.basic_modules
 from vistrails.core.modules.basic_modules import PathObject
 import vistrails.core.modules.module_registry
-from vistrails.core.modules.vistrails_module import Module, ModuleError
-from vistrails.core.system import current_dot_vistrails, strptime
+from vistrails.core.modules.vistrails_module import Module, ModuleError, \
+    ThreadSafe
+from vistrails.core.system import current_dot_vistrails
 from vistrails.core.upgradeworkflow import UpgradeWorkflowHandler
 
+from .cache import MAX_CACHE_FILENAME, DownloadCache, cache_filename, \
+    file_digest, sha_hash
 from .identifiers import identifier
 from .http_directory import download_directory
 from .https_if_available import build_opener
@@ -76,36 +74,37 @@ from .https_if_available import build_opener
 
 package_directory = None
 
-MAX_CACHE_FILENAME = 100
-
-
-###############################################################################
+download_cache = None
 
-def cache_filename(url):
-    url = urllib.quote_plus(url)
-    if len(url) <= MAX_CACHE_FILENAME:
-        return url
-    else:
-        hasher = sha_hash()
-        hasher.update(url)
-        return url[:MAX_CACHE_FILENAME - 41] + "_" + hasher.hexdigest()
+# Bounds for the size of the chunks read from the network; it adapts to the
+# speed of the connection, so that progress is still reported regularly
+MIN_CHUNKSIZE = 16 * 1024
+INITIAL_CHUNKSIZE = 64 * 1024
+MAX_CHUNKSIZE = 4 * 1024 * 1024
 
 
 ###############################################################################
 
 class Downloader(object):
-    def __init__(self, url, module, insecure):
+    def __init__(self, url, module, insecure, cache=None):
         self.url = url
         self.module = module
         self.opener = build_opener(insecure=insecure)
+        self.cache = cache if cache is not None else download_cache
+        self.report_progress = True
+        self.resumable = False
 
-    def execute(self):
+    def execute(self, file_pool=None):
         """ Tries to download a file from url.
 
         Returns the path to the local file.
         """
-        self.local_filename = os.path.join(package_directory,
-                                           cache_filename(self.url))
+        return execute_pinned(self, file_pool)
+
+    def _execute(self):
+        self.entry = self.cache.lookup(self.url)
+        if self.entry is not None and self.cache.is_trusted(self.entry):
+            return self.use_cached()
 
         # Before download
         self.pre_download()
@@ -114,29 +113,37 @@ class Downloader(object):
         try:
             response = self.send_request()
         except urllib2.URLError, e:
-            if self.is_in_local_cache:
+            if self.entry is not None:
                 debug.warning("A network error occurred. DownloadFile will "
                               "use a cached version of the file")
-                return self.local_filename
+                return self.use_cached()
             else:
                 raise ModuleError(
                         self.module,
                         "Network error: %s" % debug.format_exception(e))
         if response is None:
-            return self.local_filename
+            return self.use_cached(checked=True)
 
         # Read response headers
         self.size_header = None
         if not self.read_headers(response):
-            return self.local_filename
+            return self.use_cached(checked=True)
 
         # Download
-        self.download(response)
+        self.entry = self.download(response)
 
         # Post download
         self.post_download(response)
 
-        return self.local_filename
+        return self.cache.object_filename(self.entry)
+
+    def use_cached(self, checked=False):
+        self.cache.touch(self.url, self.entry, checked)
+        return self.cache.object_filename(self.entry)
+
+    def update_progress(self, progress):
+        if self.report_progress:
+            self.module.logging.update_progress(self.module, progress)
 
     def pre_download(self):
         pass
@@ -147,117 +154,168 @@ class Downloader(object):
     def read_headers(self, response):
         return True
 
+    def resume_offset(self, response):
+        """Returns the position in the partial file where the response starts.
+        """
+        return 0
+
+    def validators(self):
+        """Returns the headers that identify the version being downloaded.
+        """
+        return {}
+
     def download(self, response):
+        """Reads the response into the cache, and returns the new entry.
+        """
+        partial_filename = self.cache.partial_filename(self.url)
+        hasher = sha_hash()
+        offset = self.resume_offset(response)
+        if offset:
+            # Resumes an interrupted download
+            with open(partial_filename, 'rb') as fp:
+                remaining = offset
+                while remaining:
+                    chunk = fp.read(min(remaining, MAX_CHUNKSIZE))
+                    if not chunk:
+                        raise ModuleError(self.module,
+                                          "Partial download is truncated")
+                    hasher.update(chunk)
+                    remaining -= len(chunk)
+            fp = open(partial_filename, 'r+b')
+            fp.seek(offset)
+            fp.truncate()
+        else:
+            fp = open(partial_filename, 'wb')
+
         try:
-            dl_size = 0
-            CHUNKSIZE = 4096
-            f2 = open(self.local_filename, 'wb')
-            while True:
-                if self.size_header is not None:
-                    self.module.logging.update_progress(
-                            self.module,
-                            dl_size * 1.0/self.size_header)
-                chunk = response.read(CHUNKSIZE)
-                if not chunk:
-                    break
-                dl_size += len(chunk)
-                f2.write(chunk)
-            f2.close()
+            dl_size = offset
+            chunksize = INITIAL_CHUNKSIZE
+            with fp:
+                while True:
+                    if self.size_header is not None:
+                        self.update_progress(
+                                dl_size * 1.0/(offset + self.size_header))
+                    start = time.time()
+                    chunk = response.read(chunksize)
+                    if not chunk:
+                        break
+                    # Reads larger chunks from fast connections, smaller ones
+                    # from slow connections
+                    elapsed = time.time() - start
+                    if len(chunk) == chunksize and elapsed < 0.1:
+                        chunksize = min(chunksize * 2, MAX_CHUNKSIZE)
+                    elif elapsed > 0.5:
+                        chunksize = max(chunksize // 2, MIN_CHUNKSIZE)
+                    dl_size += len(chunk)
+                    hasher.update(chunk)
+                    fp.write(chunk)
             response.close()
+            if (self.size_header is not None and
+                    dl_size != offset + self.size_header):
+                raise IOError("Connection closed after %d of %d bytes" % (
+                              dl_size, offset + self.size_header))
 
         except Exception, e:
-            try:
-                os.unlink(self.local_filename)
-            except OSError:
-                pass
+            # The partial file is kept if the download can be resumed
+            if not self.resumable:
+                self.cache.remove_partial(self.url)
             raise ModuleError(
                     self.module,
                     "Error retrieving URL: %s" % debug.format_exception(e))
 
+        entry = self.cache.store(self.url, partial_filename,
+                                 hasher.hexdigest(), self.validators())
+        self.cache.remove_partial(self.url)
+        return entry
+
     def post_download(self, response):
         pass
 
-    @property
-    def is_in_local_cache(self):
-        return os.path.isfile(self.local_filename)
-
 
 class HTTPDownloader(Downloader):
     def pre_download(self):
-        # Get ETag from disk
-        try:
-            with open(self.local_filename + '.etag') as etag_file:
-                self.etag = etag_file.read()
-        except IOError:
-            self.etag = None
+        self.partial = self.cache.get_partial(self.url)
 
     def send_request(self):
-        try:
-            request = urllib2.Request(self.url)
-            if self.etag is not None:
+        request = urllib2.Request(self.url)
+        if self.entry is not None:
+            if self.entry.get('etag'):
                 request.add_header(
                     'If-None-Match',
-                    self.etag)
-            try:
-                mtime = email.utils.formatdate(
-                        os.path.getmtime(self.local_filename),
-                        usegmt=True)
+                    self.entry['etag'])
+            if self.entry.get('last_modified'):
                 request.add_header(
                     'If-Modified-Since',
-                    mtime)
-            except OSError:
-                pass
+                    self.entry['last_modified'])
+        if self.partial is not None:
+            size, validators = self.partial
+            validator = (validators.get('etag') or
+                         validators.get('last_modified'))
+            if validator:
+                request.add_header('Range', 'bytes=%d-' % size)
+                request.add_header('If-Range', validator)
+        try:
             return self.opener.open(request)
         except urllib2.HTTPError, e:
             if e.code == 304:
                 # Not modified
                 return None
+            elif e.code == 416 and self.partial is not None:
+                # Can't resume, download the whole file again
+                self.cache.remove_partial(self.url)
+                self.partial = None
+                return self.send_request()
             raise
 
     def read_headers(self, response):
+        headers = response.headers
+        self.mod_header = headers.get('last-modified') or None
+        self.etag_header = headers.get('etag') or None
         try:
-            self.mod_header = response.headers['last-modified']
-        except KeyError:
-            self.mod_header = None
-        try:
-            size_header = response.headers['content-length']
+            size_header = headers['content-length']
             if not size_header:
                 raise ValueError
             self.size_header = int(size_header)
         except (KeyError, ValueError):
             self.size_header = None
+        if response.getcode() != 206 and not self._is_outdated():
+            # The server ignored our conditional request
+            response.close()
+            return False
         return True
 
     def _is_outdated(self):
-        local_time = datetime.utcfromtimestamp(
-                os.path.getmtime(self.local_filename))
-        try:
-            remote_time = strptime(self.mod_header,
-                                   "%a, %d %b %Y %H:%M:%S %Z")
-        except ValueError:
-            try:
-                remote_time = strptime(self.mod_header,
-                                       "%a, %d %B %Y %H:%M:%S %Z")
-            except ValueError:
-                # unable to parse last-modified header, download file again
-                debug.warning("Unable to parse Last-Modified header, "
-                              "downloading file")
-                return True
-        return remote_time > local_time
+        if self.entry is None:
+            return True
+        if self.etag_header is not None:
+            return self.etag_header != self.entry.get('etag')
+        if self.mod_header is not None:
+            return self.mod_header != self.entry.get('last_modified')
+        return True
 
-    def download(self, response):
-        if (not self.is_in_local_cache or
-                not self.mod_header or self._is_outdated()):
-            Downloader.download(self, response)
+    def validators(self):
+        return {'etag': self.etag_header,
+                'last_modified': self.mod_header}
 
-    def post_download(self, response):
-        try:
-            etag = response.headers['ETag']
-        except KeyError:
-            pass
-        else:
-            with open(self.local_filename + '.etag', 'w') as etag_file:
-                etag = etag_file.write(etag)
+    def resume_offset(self, response):
+        if self.partial is None or response.getcode() != 206:
+            return 0
+        content_range = response.headers.get('content-range', '')
+        m = re.match(r'^bytes ([0-9]+)-', content_range)
+        if m is None or int(m.group(1)) > self.partial[0]:
+            raise ModuleError(self.module,
+                              "Invalid Content-Range: %r" % content_range)
+        return int(m.group(1))
+
+    def download(self, response):
+        # Downloads can be resumed if the server accepts byte ranges and sends
+        # a validator to check that the file didn't change in between
+        if ((response.getcode() == 206 or
+                response.headers.get('accept-ranges') == 'bytes') and
+                (self.etag_header or self.mod_header)):
+            self.resumable = True
+            self.cache.set_partial(self.url, self.validators())
+        return Downloader.download(self, response)
 
 
 class SSHDownloader(object):
@@ -298,11 +356,15 @@ class SSHDownloader(object):
             '$'
             )
 
-    def __init__(self, url, module, insecure):
+    def __init__(self, url, module, insecure, cache=None):
         self.url = url
         self.module = module
+        self.cache = cache if cache is not None else download_cache
+
+    def execute(self, file_pool=None):
+        return execute_pinned(self, file_pool)
 
-    def execute(self):
+    def _execute(self):
         # Parse URL
         password = None
         portnum = None
@@ -338,9 +400,6 @@ class SSHDownloader(object):
         scp = py_import('scp', {
                 'pip': 'scp'})
 
-        local_filename = os.path.join(package_directory,
-                                      cache_filename(self.url))
-
         ssh = paramiko.SSHClient()
         ssh.load_system_host_keys()
         try:
@@ -350,8 +409,38 @@ class SSHDownloader(object):
             raise ModuleError(self.module, debug.format_exception(e))
         client = scp.SCPClient(ssh.get_transport())
 
-        client.get(path, local_filename)
-        return local_filename
+        fd, local_filename = tempfile.mkstemp(
+                dir=self.cache.partial_directory)
+        os.close(fd)
+        try:
+            client.get(path, local_filename)
+            entry = self.cache.store(self.url, local_filename,
+                                     file_digest(local_filename))
+        except Exception:
+            if os.path.exists(local_filename):
+                os.remove(local_filename)
+            raise
+        return self.cache.object_filename(entry)
+
+
+def execute_pinned(downloader, file_pool=None):
+    """Runs a downloader with its URL locked and pinned in the cache.
+
+    If file_pool is given, the file is linked or copied into it, so that it
+    outlives its cache entry; otherwise, the path inside the cache is
+    returned, and the file can be evicted once other files are downloaded.
+    """
+    cache = downloader.cache
+    with cache.lock(downloader.url):
+        cache.pin(downloader.url)
+        try:
+            local_filename = downloader._execute()
+            if file_pool is not None:
+                local_filename = file_pool.make_local_copy(
+                        local_filename).name
+            return local_filename
+        finally:
+            cache.unpin(downloader.url)
 
 
 downloaders = {
@@ -361,7 +450,49 @@ downloaders = {
     'scp': SSHDownloader}
 
 
-class DownloadFile(Module):
+def download_url(url, module, insecure, report_progress=True, cache=None,
+                 file_pool=None):
+    """Downloads a file using the downloader for its scheme.
+
+    Returns the path to the local file, in file_pool if it is given (see
+    execute_pinned()).
+    """
+    scheme = urllib2.splittype(url)[0]
+    DL = downloaders.get(scheme, Downloader)
+    downloader = DL(url, module, insecure, cache)
+    downloader.report_progress = report_progress
+    return downloader.execute(file_pool)
+
+
+def download_urls(urls, module, insecure, threads, cache=None,
+                  file_pool=None):
+    """Downloads several files concurrently, using threads.
+
+    Returns the paths to the local files, in the same order as urls. Each
+    file is put in file_pool as soon as it is downloaded, so that the next
+    downloads can't evict it.
+    """
+    urls = list(urls)
+    if not urls:
+        return []
+    pool = ThreadPool(max(1, min(threads, len(urls))))
+    try:
+        local_filenames = []
+        for local_filename in pool.imap(
+                lambda url: download_url(url, module, insecure,
+                                         report_progress=False, cache=cache,
+                                         file_pool=file_pool),
+                urls):
+            local_filenames.append(local_filename)
+            module.logging.update_progress(
+                    module,
+                    len(local_filenames) * 1.0/len(urls))
+        return local_filenames
+    finally:
+        pool.terminate()
+
+
+class DownloadFile(ThreadSafe, Module):
     """ Downloads file from URL.
 
     This modules downloads a remote file. It tries to cache files on the local
@@ -398,14 +529,33 @@ class DownloadFile(Module):
     def download(self, url, insecure):
         """ Tries to download a file from url.
 
-        Returns the path to the local file.
+        Returns the path to the local file, which is kept in the file pool
+        of the interpreter since the cache might evict it.
         """
-        scheme = urllib2.splittype(url)[0]
-        DL = downloaders.get(scheme, Downloader)
-        return DL(url, self, insecure).execute()
+        return download_url(url, self, insecure,
+                            file_pool=self.interpreter.filePool)
 
 
-class HTTPDirectory(Module):
+class DownloadFiles(ThreadSafe, Module):
+    """ Downloads a list of files from their URLs.
+
+    The files are downloaded concurrently, using the same local cache as
+    DownloadFile; the 'download_threads' package setting controls how many
+    are downloaded at the same time.
+    """
+
+    def compute(self):
+        urls = self.get_input('urls')
+        insecure = self.get_input('insecure')
+        local_filenames = download_urls(urls, self, insecure,
+                                        configuration.download_threads,
+                                        file_pool=self.interpreter.filePool)
+        self.set_output('local_filenames', local_filenames)
+        self.set_output('files', [PathObject(local_filename)
+                                  for local_filename in local_filenames])
+
+
+class HTTPDirectory(ThreadSafe, Module):
     """Downloads a whole directory recursively from a URL
     """
 
@@ -451,6 +601,16 @@ def initialize(*args, **keywords):
     reg.add_output_port(DownloadFile, "local_filename",
                         (basic.String, 'local filename'), optional=True)
 
+    reg.add_module(DownloadFiles)
+    reg.add_input_port(DownloadFiles, 'urls', (basic.List, 'URLs'))
+    reg.add_input_port(DownloadFiles, 'insecure',
+                       (basic.Boolean, "Allow invalid SSL certificates"),
+                       optional=True, defaults="['False']")
+    reg.add_output_port(DownloadFiles, 'files',
+                        (basic.List, 'local File objects'))
+    reg.add_output_port(DownloadFiles, 'local_filenames',
+                        (basic.List, 'local filenames'), optional=True)
+
     reg.add_module(HTTPDirectory)
     reg.add_input_port(HTTPDirectory, 'url', (basic.String, "URL"))
     reg.add_input_port(HTTPDirectory, 'insecure',
@@ -481,56 +641,49 @@ def initialize(*args, **keywords):
             raise RuntimeError("Failed to create cache directory: %s" %
                                package_directory, e)
 
-    # Migrate files to new naming scheme: max 100 characters, with a hash if
-    # it's too long
-    handled = set()
-
-    def move(old, new):
-        if os.path.exists(new):
-            os.remove(new)
-            handled.add(new)
-        os.rename(old, new)
-        handled.add(old)
-
-        old += '.etag'
-        new += '.etag'
-        if os.path.exists(new):
-            os.remove(new)
-            handled.add(new)
-        if os.path.exists(old):
-            os.rename(old, new)
-            handled.add(old)
-
-    renamed = 0
-    for old_name in sorted(os.listdir(package_directory)):
-        old_filename = os.path.join(package_directory, old_name)
-        if old_filename in handled:
+    global download_cache
+    download_cache = DownloadCache(
+            package_directory,
+            max_size=configuration.cache_max_size * 1024 * 1024,
+            trust_time=configuration.trust_cache)
+
+    migrate_cache(download_cache)
+
+
+def migrate_cache(cache):
+    """Moves the files downloaded by previous versions into the cache.
+
+    They used to be stored directly in the package directory, named after
+    their URL, with their ETag in a separate file.
+    """
+    moved = 0
+    for name in sorted(os.listdir(cache.directory)):
+        filename = os.path.join(cache.directory, name)
+        if (name.endswith('.meta') or name.endswith('.etag') or
+                name.startswith('.') or not os.path.isfile(filename)):
             continue
-        if len(old_name) > MAX_CACHE_FILENAME:
-            hasher = sha_hash()
-            hasher.update(old_name)
-            new_name = (old_name[:MAX_CACHE_FILENAME - 41] +
-                        '_' + hasher.hexdigest())
-            new_filename = os.path.join(package_directory, new_name)
-            if os.path.exists(new_filename):
-                oldtime = os.path.getmtime(old_filename)
-                newtime = os.path.getmtime(new_filename)
-                if oldtime > newtime:
-                    move(old_filename, new_filename)
-                    renamed += 1
-                else:
-                    os.remove(old_filename)
-                    handled.add(old_filename)
-                    if os.path.exists(old_filename + '.etag'):
-                        os.remove(old_filename + '.etag')
-                        handled.add(old_filename + '.etag')
-            else:
-                move(old_filename, new_filename)
-                renamed += 1
-        else:
-            handled.add(old_filename + '.etag')
-    if renamed:
-        debug.warning("Renamed %d downloaded cache files" % renamed)
+        url = urllib.unquote_plus(name)
+        etag = None
+        if os.path.exists(filename + '.etag'):
+            with open(filename + '.etag', 'rb') as fp:
+                etag = fp.read() or None
+            os.remove(filename + '.etag')
+        if (len(name) == MAX_CACHE_FILENAME or
+                urllib.quote_plus(url) != name):
+            # Hashed name, the URL can't be recovered
+            os.remove(filename)
+            continue
+        mtime = os.path.getmtime(filename)
+        entry = cache.store(
+                url, filename, file_digest(filename),
+                {'etag': etag,
+                 'last_modified': email.utils.formatdate(mtime, usegmt=True)})
+        # Revalidates it next time it is used
+        entry['checked'] = 0
+        cache.touch(url, entry)
+        moved += 1
+    if moved:
+        debug.warning("Moved %d downloaded files to the new cache" % moved)
 
 
 def handle_module_upgrade_request(controller, module_id, pipeline):
@@ -612,6 +765,168 @@ class TestDownloadFile(unittest.TestCase):
             ]))
 
 
+class TestLocalServer(unittest.TestCase):
+    """Downloads files from a local HTTP server.
+    """
+    @classmethod
+    def setUpClass(cls):
+        import BaseHTTPServer
+        import threading
+
+        cls.files = {}
+        cls.requests = []
+        cls.truncate = None
+
+        test = cls
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                test.requests.append((self.path, dict(self.headers)))
+                contents, etag = test.files[self.path]
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                start = 0
+                m = re.match(r'^bytes=([0-9]+)-$',
+                             self.headers.get('Range', ''))
+                if m is not None and self.headers.get('If-Range') == etag:
+                    start = int(m.group(1))
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes %d-%d/%d' % (
+                                     start, len(contents) - 1, len(contents)))
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Length', len(contents) - start)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('ETag', etag)
+                self.end_headers()
+                body = contents[start:]
+                if test.truncate is not None:
+                    body = body[:test.truncate]
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        cls.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        cls.base_url = 'http://127.0.0.1:%d' % cls.server.server_port
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vt_test_download_')
+        self.cache = DownloadCache(self.directory)
+        self.files.clear()
+        del self.requests[:]
+        TestLocalServer.truncate = None
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def download(self, path):
+        return download_url(self.base_url + path, DownloadFile(), False,
+                            report_progress=False, cache=self.cache)
+
+    def test_revalidate(self):
+        """Downloads a file, then revalidates it or trusts the cache."""
+        self.files['/data.txt'] = ('some data', '"v1"')
+        filename = self.download('/data.txt')
+        with open(filename, 'rb') as fp:
+            self.assertEqual(fp.read(), 'some data')
+
+        # Not modified
+        self.assertEqual(self.download('/data.txt'), filename)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.requests[1][1].get('if-none-match'), '"v1"')
+
+        # Trusting the cache skips the request
+        self.cache.trust_time = 60
+        self.files['/data.txt'] = ('new data', '"v2"')
+        self.assertEqual(self.download('/data.txt'), filename)
+        self.assertEqual(len(self.requests), 2)
+
+        # Modified
+        self.cache.trust_time = 0
+        filename = self.download('/data.txt')
+        with open(filename, 'rb') as fp:
+            self.assertEqual(fp.read(), 'new data')
+
+    def test_resume(self):
+        """Resumes an interrupted download."""
+        contents = ''.join(chr(i % 256) for i in xrange(200000))
+        self.files['/big.bin'] = (contents, '"big"')
+        TestLocalServer.truncate = 50000
+        with self.assertRaises(ModuleError):
+            self.download('/big.bin')
+        self.assertEqual(self.cache.get_partial(self.base_url + '/big.bin'),
+                         (50000, {'url': self.base_url + '/big.bin',
+                                  'etag': '"big"',
+                                  'last_modified': None}))
+
+        TestLocalServer.truncate = None
+        filename = self.download('/big.bin')
+        self.assertEqual(self.requests[-1][1].get('range'), 'bytes=50000-')
+        with open(filename, 'rb') as fp:
+            self.assertEqual(fp.read(), contents)
+        self.assertIsNone(self.cache.get_partial(self.base_url + '/big.bin'))
+        self.assertEqual(self.cache.lookup(self.base_url + '/big.bin')
+                         ['digest'],
+                         sha_hash(contents).hexdigest())
+
+    def test_concurrent(self):
+        """Downloads a batch of files on multiple threads."""
+        paths = ['/file%d.txt' % i for i in xrange(10)]
+        for i, path in enumerate(paths):
+            self.files[path] = ('file %d' % i, '"%d"' % i)
+        filenames = download_urls([self.base_url + path for path in paths],
+                                  DownloadFile(), False, 4, self.cache)
+        for i, filename in enumerate(filenames):
+            with open(filename, 'rb') as fp:
+                self.assertEqual(fp.read(), 'file %d' % i)
+        self.assertEqual(len(self.requests), 10)
+
+    def test_batch_eviction(self):
+        """Downloads a batch of files larger than the cache."""
+        from vistrails.core.modules.module_utils import FilePool
+
+        paths = ['/file%d.txt' % i for i in xrange(10)]
+        for i, path in enumerate(paths):
+            self.files[path] = ('file %d' % i * 10, '"%d"' % i)
+        self.cache.max_size = 200
+        file_pool = FilePool()
+        try:
+            filenames = download_urls(
+                    [self.base_url + path for path in paths],
+                    DownloadFile(), False, 4, self.cache, file_pool)
+            self.assertTrue(self.cache.size() <= 200)
+            for i, filename in enumerate(filenames):
+                self.assertTrue(filename.startswith(file_pool.directory))
+                self.assertTrue(filename.endswith('.txt'))
+                with open(filename, 'rb') as fp:
+                    self.assertEqual(fp.read(), 'file %d' % i * 10)
+
+            # A new version replaces the cached object, not the earlier file
+            self.files[paths[-1]] = ('new', '"new"')
+            filename = download_url(self.base_url + paths[-1],
+                                    DownloadFile(), False,
+                                    report_progress=False, cache=self.cache,
+                                    file_pool=file_pool)
+            with open(filename, 'rb') as fp:
+                self.assertEqual(fp.read(), 'new')
+            with open(filenames[-1], 'rb') as fp:
+                self.assertEqual(fp.read(), 'file 9' * 10)
+        finally:
+            file_pool.cleanup()
+
+
 class TestHTTPDirectory(unittest.TestCase):
     def test_download(self):
         url = 'http://www.vistrails.org/testing/httpdirectory/test/'
@@ -36,6 +36,7 @@
 from __future__ import division
 
 import copy
+from itertools import izip
 
 from vistrails.core.modules.vistrails_module import Module, ModuleError, \
     InvalidOutput, ModuleSuspended, ModuleWasSuspended
@@ -150,17 +151,27 @@ class FoldWithModule(Fold):
             element_is_iter = True
             inputList = rawInputList
         suspended = []
-        loop = self.logging.begin_loop_execution(self, len(inputList))
-        ## Update everything for each value inside the list
-        for i, element in enumerate(inputList):
-            self.logging.update_progress(self, float(i)/len(inputList))
-            if element_is_iter:
-                self.element = element
-            else:
-                self.element = element[0]
-            do_operation = True
+        loop, logging = self.begin_iterations(len(inputList))
+
+        # The copies made by the iterations share the upstream modules of the
+        # function modules; these are updated once here so that concurrent
+        # iterations don't update them at the same time
+        if self.get_iteration_workers() > 1:
+            for connector in self.inputPorts.get('FunctionPort'):
+                try:
+                    connector.obj.update_upstream()
+                except ModuleSuspended:
+                    # Reported by each iteration
+                    pass
+
+        def iteration(i):
+            element = inputList[i]
+            logging.update_progress(self, float(i)/len(inputList))
+            elementResult = None
+            element_suspended = []
             for connector in self.inputPorts.get('FunctionPort'):
                 module = copy.copy(connector.obj)
+                module.logging = logging
 
                 if not self.upToDate: # pragma: no branch
                     ## Type checking
@@ -177,8 +188,7 @@ class FoldWithModule(Fold):
                 try:
                     module.update()
                 except ModuleSuspended, e:
-                    suspended.append(e)
-                    do_operation = False
+                    element_suspended.append(e)
                     loop.end_iteration(module)
                     continue
 
@@ -188,11 +198,26 @@ class FoldWithModule(Fold):
                 if nameOutput not in module.outputPorts:
                     raise ModuleError(module,
                                       'Invalid output port: %s' % nameOutput)
-                self.elementResult = module.get_output(nameOutput)
-            if do_operation:
-                self.operation()
+                elementResult = module.get_output(nameOutput)
 
-            self.logging.update_progress(self, i * 1.0 / len(inputList))
+            logging.update_progress(self, i * 1.0 / len(inputList))
+            return element_suspended, elementResult
+
+        ## Update everything for each value inside the list
+        # The iterations might run concurrently, but the operation is applied
+        # to their results in order
+        results = self.map_iterations(iteration, len(inputList))
+        for element, (element_suspended, elementResult) in izip(inputList,
+                                                                results):
+            if element_is_iter:
+                self.element = element
+            else:
+                self.element = element[0]
+            if element_suspended:
+                suspended.extend(element_suspended)
+            else:
+                self.elementResult = elementResult
+                self.operation()
 
         if suspended:
             raise ModuleSuspended(
@@ -125,6 +125,7 @@ class Or(Fold):
 import unittest
 import urllib2
 
+from vistrails.core.vistrail.module_control_param import ModuleControlParam
 from vistrails.tests.utils import intercept_result, execute
 
 
@@ -205,6 +206,68 @@ class TestMap(unittest.TestCase):
                 ]))
         self.assertEqual(results, [[3, 11, 1]])
 
+    def test_parallel(self):
+        src = urllib2.quote('import time\ntime.sleep(0.01 * (5 - i))\n'
+                            'o = i * 2')
+        with intercept_result(Map, 'Result') as results:
+            self.assertFalse(execute([
+                    ('PythonSource', 'org.vistrails.vistrails.basic', [
+                        ('source', [('String', src)]),
+                    ]),
+                    ('Map', 'org.vistrails.vistrails.control_flow', [
+                        ('InputPort', [('List', "['i']")]),
+                        ('OutputPort', [('String', 'o')]),
+                        ('InputList', [('List', '[1, 2, 3, 4, 5]')]),
+                    ]),
+                ],
+                [
+                    (0, 'self', 1, 'FunctionPort'),
+                ],
+                add_port_specs=[
+                    (0, 'input', 'i',
+                     'org.vistrails.vistrails.basic:Integer'),
+                    (0, 'output', 'o',
+                     'org.vistrails.vistrails.basic:Integer'),
+                ],
+                control_params=[
+                    (1, ModuleControlParam.PARALLEL_KEY, '3'),
+                ]))
+        self.assertEqual(results, [[2, 4, 6, 8, 10]])
+
+    def test_parallel_upstream(self):
+        src = urllib2.quote('import time\ntime.sleep(0.01 * (5 - i))\n'
+                            'o = i + j')
+        with intercept_result(Map, 'Result') as results:
+            self.assertFalse(execute([
+                    ('PythonSource', 'org.vistrails.vistrails.basic', [
+                        ('source', [('String', src)]),
+                    ]),
+                    ('Map', 'org.vistrails.vistrails.control_flow', [
+                        ('InputPort', [('List', "['i']")]),
+                        ('OutputPort', [('String', 'o')]),
+                        ('InputList', [('List', '[1, 2, 3, 4, 5]')]),
+                    ]),
+                    ('Integer', 'org.vistrails.vistrails.basic', [
+                        ('value', [('Integer', '10')]),
+                    ]),
+                ],
+                [
+                    (0, 'self', 1, 'FunctionPort'),
+                    (2, 'value', 0, 'j'),
+                ],
+                add_port_specs=[
+                    (0, 'input', 'i',
+                     'org.vistrails.vistrails.basic:Integer'),
+                    (0, 'input', 'j',
+                     'org.vistrails.vistrails.basic:Integer'),
+                    (0, 'output', 'o',
+                     'org.vistrails.vistrails.basic:Integer'),
+                ],
+                control_params=[
+                    (1, ModuleControlParam.PARALLEL_KEY, '3'),
+                ]))
+        self.assertEqual(results, [[11, 12, 13, 14, 15]])
+
 
 class TestUtils(unittest.TestCase):
     def test_filter(self):
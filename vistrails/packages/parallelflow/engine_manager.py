@@ -57,17 +57,16 @@ else:
     qt_available = False
 
 
-class ProfileItem(QtGui.QListWidgetItem):
-    def __init__(self, profile, text, italic=False):
-        QtGui.QListWidgetItem.__init__(self, text)
-        if italic:
-            font = self.font()
-            font.setItalic(True)
-            self.setFont(font)
-        self.profile = profile
-
-
 def choose_profile(profiles):
+    class ProfileItem(QtGui.QListWidgetItem):
+        def __init__(self, profile, text, italic=False):
+            QtGui.QListWidgetItem.__init__(self, text)
+            if italic:
+                font = self.font()
+                font.setItalic(True)
+                self.setFont(font)
+            self.profile = profile
+
     dialog = QtGui.QDialog()
     dialog.setWindowTitle("IPython profile selection")
 
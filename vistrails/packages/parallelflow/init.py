@@ -38,11 +38,17 @@ from __future__ import division
 
 from vistrails.core.modules.vistrails_module import Module
 from vistrails.core.modules.module_registry import get_module_registry
-from vistrails.core.modules.basic_modules import List, String
+from vistrails.core.modules.basic_modules import Integer, List, String
 
-from engine_manager import EngineManager
+from local_engine import LocalEngine
 from map import Map
 
+# The local engine can be used without IPython
+try:
+    from engine_manager import EngineManager
+except ImportError:
+    EngineManager = None
+
 
 def initialize(*args,**keywords):
     reg = get_module_registry()
@@ -52,14 +58,28 @@ def initialize(*args,**keywords):
     reg.add_input_port(Map, 'InputList', (List, ''))
     reg.add_input_port(Map, 'InputPort', (List, ''))
     reg.add_input_port(Map, 'OutputPort', (String, ''))
+    reg.add_input_port(Map, 'Engine', (String, ''), optional=True,
+                       entry_types=['enum'], values=["['ipython', 'local']"],
+                       defaults="['ipython']")
+    reg.add_input_port(Map, 'Processes', (Integer, ''), optional=True)
     reg.add_output_port(Map, 'Result', (List, ''))
 
 
 def finalize():
-    EngineManager.cleanup()
+    if EngineManager is not None:
+        EngineManager.cleanup()
+    LocalEngine.cleanup()
 
 
 def menu_items():
+    local_items = (
+            ("Start local worker processes",
+             lambda: LocalEngine.start()),
+            ("Stop local worker processes",
+             lambda: LocalEngine.cleanup()),
+    )
+    if EngineManager is None:
+        return local_items
     return (
             ("Start new engine processes",
              lambda: EngineManager.start_engines()),
@@ -71,4 +91,4 @@ def menu_items():
              lambda: EngineManager.cleanup()),
             ("Request cluster shutdown",
              lambda: EngineManager.shutdown_cluster()),
-    )
+    ) + local_items
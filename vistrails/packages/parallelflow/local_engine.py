@@ -0,0 +1,340 @@
+###############################################################################
+##
+## Copyright (C) 2014-2016, New York University.
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah.
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice,
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright
+##    notice, this list of conditions and the following disclaimer in the
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the New York University nor the names of its
+##    contributors may be used to endorse or promote products derived from
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Runs the iterations of a Map on a pool of local worker processes.
+
+This is an alternative to the IPython engines that doesn't need a cluster: the
+workers are forked once, keep their VisTrails application (and loaded
+packages) between executions, and receive the serialized subworkflow only
+once; each task then only carries the values of the element being mapped.
+"""
+
+from __future__ import division
+
+import multiprocessing
+import os
+import tempfile
+
+import vistrails.core.application
+import vistrails.core.db.action
+import vistrails.core.modules.module_registry
+from vistrails.core import debug
+from vistrails.core.db.io import serialize
+from vistrails.core.db.locator import XMLFileLocator
+from vistrails.core.interpreter.default import get_default_interpreter
+from vistrails.core.modules.vistrails_module import Module, ModuleError
+from vistrails.core.utils import initialize_worker
+from vistrails.core.vistrail.controller import VistrailController
+from vistrails.core.vistrail.module_function import ModuleFunction
+from vistrails.core.vistrail.module_param import ModuleParam
+from vistrails.core.vistrail.pipeline import Pipeline
+from vistrails.core.vistrail.vistrail import Vistrail
+from vistrails.db.domain import IdScope
+import vistrails.db.versions
+
+try:
+    import hashlib
+    sha1_hash = hashlib.sha1
+except ImportError:
+    import sha
+    sha1_hash = sha.new
+
+
+# Bound on the interpreter cache of a worker, which is not flushed between
+# iterations (only applied if no limit was configured)
+WORKER_CACHE_ENTRIES = 512
+
+# Number of subworkflows a worker keeps parsed
+WORKER_WORKFLOWS = 4
+
+
+def add_input_functions(module, functions):
+    """add_input_functions(module: Module, functions: list) -> None
+
+    Adds a function with a single parameter to module for each
+    (port_name, type, value) tuple in functions.
+    """
+    # getting highest id between functions and parameters to guarantee
+    # unique ids
+    high_id = 0
+    for function in module.functions:
+        high_id = max([high_id, function.db_id] +
+                      [param.db_id for param in function.params])
+
+    # TODO: 'pos' should not be always 0 here
+    id_scope = IdScope(beginId=long(high_id+1))
+    for port_name, type, value in functions:
+        mod_function = ModuleFunction(
+                id=id_scope.getNewId(ModuleFunction.vtType),
+                pos=0,
+                name=port_name)
+        mod_param = ModuleParam(id=id_scope.getNewId(ModuleParam.vtType),
+                                pos=0,
+                                type=type,
+                                val=value)
+        mod_function.add_parameter(mod_param)
+        module.add_function(mod_function)
+
+
+###############################################################################
+# Worker side
+#
+
+_workflows = {}
+
+# Error that happened while initializing this worker; the pool would keep
+# replacing a worker whose initializer raises, so it is reported by the
+# tasks instead
+_initialization_error = None
+
+
+def _initialize_worker():
+    global _initialization_error
+
+    try:
+        # Forked workers inherit the registry and the packages, even if
+        # VisTrails is not running as an application; others need their own
+        if vistrails.core.modules.module_registry.registry is None:
+            vistrails.core.application.init({'spawned': True}, args=[])
+
+        interpreter = get_default_interpreter()
+        if not interpreter.cache_max_entries:
+            interpreter.cache_max_entries = WORKER_CACHE_ENTRIES
+    except Exception, e:
+        _initialization_error = debug.format_exception(e)
+
+
+def _load_workflow(filename, digest):
+    try:
+        return _workflows[digest]
+    except KeyError:
+        if len(_workflows) >= WORKER_WORKFLOWS:
+            _workflows.clear()
+        workflow = XMLFileLocator(filename).load(Pipeline)
+        _workflows[digest] = workflow
+        return workflow
+
+
+def execute_element(task):
+    """execute_element(task: tuple) -> dict
+
+    Executes the subworkflow for one element of the Map, in a worker.
+
+    Returns a dictionary like parallelflow.map.execute_wf does.
+    """
+    if _initialization_error is not None:
+        return dict(errors=[_initialization_error], initialization_failed=True)
+    # Exceptions are returned as errors, as some of them can't be sent back
+    try:
+        return _execute_element(*task)
+    except Exception, e:
+        return dict(errors=[debug.format_exception(e)])
+
+
+def _execute_element(filename, digest, functions, output_port):
+    workflow = _load_workflow(filename, digest)
+    module = workflow.module_list[0].do_copy()
+    add_input_functions(module, functions)
+
+    # Build a Vistrail from this single module
+    vistrail = Vistrail()
+    action = vistrails.core.db.action.create_action([('add', module)])
+    vistrail.add_action(action, 0L)
+    vistrail.update_id_scope()
+
+    # Build a controller and execute
+    controller = VistrailController()
+    controller.set_vistrail(vistrail, None)
+    controller.change_selected_version(action.id)
+    execution = controller.execute_current_workflow(
+            reason='Parallel Flow Local Execution')
+    result = execution[0][0]
+
+    errors = ['%s: %s' % (module.name, error)
+              for error in result.errors.itervalues()]
+
+    # Get the execution log from the controller, unless logging is disabled
+    xml_log = machine_log = None
+    if controller.logging_on():
+        try:
+            module_log = controller.log.workflow_execs[0].item_execs[0]
+        except IndexError:
+            errors.append("Module log not found")
+            return dict(errors=errors)
+        workflow_exec = controller.log.workflow_execs[0]
+        xml_log = serialize(module_log)
+        machine_log = serialize(workflow_exec.machines[module_log.machine_id])
+
+    # Get the output value
+    output = None
+    if not result.errors:
+        try:
+            output = result.objects[module.id].get_output(output_port)
+        except ModuleError:
+            errors.append("Output port not found: %s" % output_port)
+            return dict(errors=errors)
+        if isinstance(output, Module):
+            errors.append("Output value is a Module instance")
+            return dict(errors=errors)
+
+    return dict(errors=errors,
+                output=output,
+                xml_log=xml_log,
+                machine_log=machine_log)
+
+
+###############################################################################
+# VisTrails side
+#
+
+class LocalEngine(object):
+    """Pool of worker processes executing Map iterations on this machine.
+    """
+    def __init__(self):
+        self._pool = None
+        self._processes = None
+
+    def start(self, processes=None):
+        """start(processes: int) -> None
+
+        Starts the worker processes if they are not already running. The
+        default is one process per CPU.
+        """
+        if processes is None:
+            processes = self._processes or multiprocessing.cpu_count()
+        if self._pool is not None:
+            if processes == self._processes:
+                return
+            self.cleanup()
+        self._pool = multiprocessing.Pool(processes,
+                                          initializer=initialize_worker,
+                                          initargs=(_initialize_worker,))
+        self._processes = processes
+
+    def map(self, wf, elements, output_port, processes=None):
+        """map(wf: str, elements: list, output_port: str,
+               processes: int) -> list
+
+        Executes the serialized subworkflow wf once for each list of
+        (port_name, type, value) functions in elements, and returns the
+        result dictionaries in order.
+        """
+        self.start(processes)
+
+        fd, filename = tempfile.mkstemp(prefix='vt_map_', suffix='.xml')
+        try:
+            os.write(fd, wf)
+            os.close(fd)
+            digest = sha1_hash(wf).hexdigest()
+            tasks = [(filename, digest, functions, output_port)
+                     for functions in elements]
+            results = self._pool.map(execute_element, tasks, chunksize=1)
+        finally:
+            os.unlink(filename)
+        for result in results:
+            if result.get('initialization_failed'):
+                # The workers are unusable, start new ones next time
+                self.cleanup()
+                raise RuntimeError("Couldn't initialize the worker "
+                                   "processes:\n%s" % result['errors'][0])
+        return results
+
+    def cleanup(self):
+        """Stops the worker processes.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+LocalEngine = LocalEngine()
+
+
+import unittest
+
+
+class TestLocalEngine(unittest.TestCase):
+    def test_map(self):
+        from vistrails.core.system import get_vistrails_basic_pkg_id
+
+        basic_pkg = get_vistrails_basic_pkg_id()
+        module = VistrailController.create_module_static(
+                IdScope(), basic_pkg, 'String')
+        pipeline = Pipeline(version=vistrails.db.versions.currentVersion)
+        pipeline.add_module(module)
+        wf = serialize(pipeline)
+
+        engine = type(LocalEngine)()
+        try:
+            results = engine.map(
+                    wf,
+                    [[('value', '%s:String' % basic_pkg, v)]
+                     for v in ['a', 'b', 'c']],
+                    'value',
+                    processes=2)
+        finally:
+            engine.cleanup()
+        self.assertEqual([r['errors'] for r in results], [[], [], []])
+        self.assertEqual([r['output'] for r in results], ['a', 'b', 'c'])
+
+    def test_initialization_error(self):
+        global _initialization_error
+
+        wf = serialize(Pipeline(version=vistrails.db.versions.currentVersion))
+        engine = type(LocalEngine)()
+        # Forked workers inherit this, as if their initializer had failed
+        _initialization_error = "simulated failure"
+        try:
+            with self.assertRaises(RuntimeError) as cm:
+                engine.map(wf, [[]], 'value', processes=1)
+        finally:
+            _initialization_error = None
+            engine.cleanup()
+        self.assertIn("simulated failure", str(cm.exception))
+        self.assertIsNone(engine._pool)
+
+    def test_input_function_ids(self):
+        from vistrails.core.system import get_vistrails_basic_pkg_id
+
+        basic_pkg = get_vistrails_basic_pkg_id()
+        module = VistrailController.create_module_static(
+                IdScope(), basic_pkg, 'ConcatenateString')
+        add_input_functions(module, [('str1', 'String', 'a')])
+        add_input_functions(module, [('str2', 'String', 'b'),
+                                     ('str3', 'String', 'c')])
+        functions = module.functions
+        self.assertEqual(len(set(f.real_id for f in functions)), 3)
+        self.assertEqual(len(set(f.params[0].real_id for f in functions)), 3)
@@ -52,24 +52,19 @@ from vistrails.core.modules.vistrails_module import Module, ModuleError, \
 from vistrails.core.vistrail.annotation import Annotation
 from vistrails.core.vistrail.controller import VistrailController
 from vistrails.core.vistrail.group import Group
-from vistrails.core.vistrail.module_function import ModuleFunction
-from vistrails.core.vistrail.module_param import ModuleParam
 from vistrails.core.vistrail.pipeline import Pipeline
 from vistrails.core.vistrail.vistrail import Vistrail
-from vistrails.db.domain import IdScope
 import vistrails.db.versions
 
 import copy
 import inspect
-from itertools import izip
 import os
 import re
 import sys
 import tempfile
 
-from IPython.parallel.error import CompositeError
-
 from .api import get_client
+from .local_engine import LocalEngine, add_input_functions
 
 try:
     import hashlib
@@ -182,7 +177,8 @@ def strip_ansi_codes(s):
 # Map Operator
 #
 class Map(Module):
-    """The Map Module executes a map operator in parallel on IPython engines.
+    """The Map Module executes a map operator in parallel on IPython engines,
+    or on local worker processes if Engine is set to 'local'.
 
     The FunctionPort should be connected to the 'self' output of the module you
     want to execute.
@@ -227,117 +223,14 @@ class Map(Module):
                                   e_msg)
                 for e_type, e_msg, tb, infos in e.elist)
 
-    def updateFunctionPort(self):
+    def execute_ipython(self, module, workflows, nameOutput):
         """
-        Function to be used inside the updateUsptream method of the Map module. It
-        updates the module connected to the FunctionPort port, executing it in
-        parallel.
+        Executes the serialized workflows on the IPython engines, returning
+        the list of results.
         """
-        nameInput = self.get_input('InputPort')
-        nameOutput = self.get_input('OutputPort')
-        rawInputList = self.get_input('InputList')
-
-        # Create inputList to always have iterable elements
-        # to simplify code
-        if len(nameInput) == 1:
-            element_is_iter = False
-            inputList = [[element] for element in rawInputList]
-        else:
-            element_is_iter = True
-            inputList = rawInputList
-
-        workflows = []
-        module = None
-        vtType = None
-
-        # iterating through the connectors
-        for connector in self.inputPorts.get('FunctionPort'):
-            module = connector.obj
-
-            # pipeline
-            original_pipeline = connector.obj.moduleInfo['pipeline']
-
-            # module
-            module_id = connector.obj.moduleInfo['moduleId']
-            vtType = original_pipeline.modules[module_id].vtType
-
-            # serialize the module for each value in the list
-            for i, element in enumerate(inputList):
-                if element_is_iter:
-                    self.element = element
-                else:
-                    self.element = element[0]
-
-                # checking type and setting input in the module
-                self.typeChecking(connector.obj, nameInput, inputList)
-                self.setInputValues(connector.obj, nameInput, element, i)
-
-                pipeline_db_module = original_pipeline.modules[module_id].do_copy()
-
-                # transforming a subworkflow in a group
-                # TODO: should we also transform inner subworkflows?
-                if pipeline_db_module.is_abstraction():
-                    group = Group(id=pipeline_db_module.id,
-                                  cache=pipeline_db_module.cache,
-                                  location=pipeline_db_module.location,
-                                  functions=pipeline_db_module.functions,
-                                  annotations=pipeline_db_module.annotations)
-
-                    source_port_specs = pipeline_db_module.sourcePorts()
-                    dest_port_specs = pipeline_db_module.destinationPorts()
-                    for source_port_spec in source_port_specs:
-                        group.add_port_spec(source_port_spec)
-                    for dest_port_spec in dest_port_specs:
-                        group.add_port_spec(dest_port_spec)
-
-                    group.pipeline = pipeline_db_module.pipeline
-                    pipeline_db_module = group
-
-                # getting highest id between functions to guarantee unique ids
-                # TODO: can get current IdScope here?
-                if pipeline_db_module.functions:
-                    high_id = max(function.db_id
-                                  for function in pipeline_db_module.functions)
-                else:
-                    high_id = 0
-
-                # adding function and parameter to module in pipeline
-                # TODO: 'pos' should not be always 0 here
-                id_scope = IdScope(beginId=long(high_id+1))
-                for elementValue, inputPort in izip(element, nameInput):
-
-                    p_spec = pipeline_db_module.get_port_spec(inputPort, 'input')
-                    descrs = p_spec.descriptors()
-                    if len(descrs) != 1:
-                        raise ModuleError(
-                                self,
-                                "Tuple input ports are not supported")
-                    if not issubclass(descrs[0].module, Constant):
-                        raise ModuleError(
-                                self,
-                                "Module inputs should be Constant types")
-                    type = p_spec.sigstring[1:-1]
-
-                    mod_function = ModuleFunction(id=id_scope.getNewId(ModuleFunction.vtType),
-                                                  pos=0,
-                                                  name=inputPort)
-                    mod_param = ModuleParam(id=0L,
-                                            pos=0,
-                                            type=type,
-                                            val=elementValue)
-
-                    mod_function.add_parameter(mod_param)
-                    pipeline_db_module.add_function(mod_function)
-
-                # serializing module
-                wf = self.serialize_module(pipeline_db_module)
-                workflows.append(wf)
-
-            # getting first connector, ignoring the rest
-            break
-
         # IPython stuff
         try:
+            from IPython.parallel.error import CompositeError
             rc = get_client()
         except Exception, error:
             raise ModuleError(self, "Exception while loading IPython: %s" %
@@ -401,12 +294,125 @@ class Map(Module):
         # each map returns a dictionary
         try:
             ldview = rc.load_balanced_view()
-            map_result = ldview.map_sync(execute_wf, workflows, [nameOutput]*len(workflows))
+            return ldview.map_sync(execute_wf, workflows,
+                                   [nameOutput]*len(workflows))
         except CompositeError, e:
             self.print_compositeerror(e)
             raise ModuleError(self, "Error from IPython engines:\n"
                               "%s" % self.list_exceptions(e))
 
+    def updateFunctionPort(self):
+        """
+        Function to be used inside the updateUsptream method of the Map module. It
+        updates the module connected to the FunctionPort port, executing it in
+        parallel.
+        """
+        nameInput = self.get_input('InputPort')
+        nameOutput = self.get_input('OutputPort')
+        rawInputList = self.get_input('InputList')
+
+        # Create inputList to always have iterable elements
+        # to simplify code
+        if len(nameInput) == 1:
+            element_is_iter = False
+            inputList = [[element] for element in rawInputList]
+        else:
+            element_is_iter = True
+            inputList = rawInputList
+
+        elements = []
+        module = None
+        vtType = None
+
+        # iterating through the connectors
+        for connector in self.inputPorts.get('FunctionPort'):
+            module = connector.obj
+
+            # pipeline
+            original_pipeline = connector.obj.moduleInfo['pipeline']
+
+            # module
+            module_id = connector.obj.moduleInfo['moduleId']
+            vtType = original_pipeline.modules[module_id].vtType
+
+            pipeline_db_module = original_pipeline.modules[module_id].do_copy()
+
+            # transforming a subworkflow in a group
+            # TODO: should we also transform inner subworkflows?
+            if pipeline_db_module.is_abstraction():
+                group = Group(id=pipeline_db_module.id,
+                              cache=pipeline_db_module.cache,
+                              location=pipeline_db_module.location,
+                              functions=pipeline_db_module.functions,
+                              annotations=pipeline_db_module.annotations)
+
+                source_port_specs = pipeline_db_module.sourcePorts()
+                dest_port_specs = pipeline_db_module.destinationPorts()
+                for source_port_spec in source_port_specs:
+                    group.add_port_spec(source_port_spec)
+                for dest_port_spec in dest_port_specs:
+                    group.add_port_spec(dest_port_spec)
+
+                group.pipeline = pipeline_db_module.pipeline
+                pipeline_db_module = group
+
+            # getting the parameter type of each input port
+            types = []
+            for inputPort in nameInput:
+                p_spec = pipeline_db_module.get_port_spec(inputPort, 'input')
+                descrs = p_spec.descriptors()
+                if len(descrs) != 1:
+                    raise ModuleError(
+                            self,
+                            "Tuple input ports are not supported")
+                if not issubclass(descrs[0].module, Constant):
+                    raise ModuleError(
+                            self,
+                            "Module inputs should be Constant types")
+                types.append(p_spec.sigstring[1:-1])
+
+            # building the functions to add for each value in the list
+            for i, element in enumerate(inputList):
+                if element_is_iter:
+                    self.element = element
+                else:
+                    self.element = element[0]
+
+                # checking type and setting input in the module
+                self.typeChecking(connector.obj, nameInput, inputList)
+                self.setInputValues(connector.obj, nameInput, element, i)
+
+                elements.append(zip(nameInput, types, element))
+
+            # getting first connector, ignoring the rest
+            break
+
+        engine_type = self.get_input('Engine')
+        if engine_type == 'local':
+            # setting computing color
+            module.logging.set_computing(module)
+
+            # the module is serialized once, the workers add the inputs
+            wf = self.serialize_module(pipeline_db_module)
+            try:
+                map_result = LocalEngine.map(
+                        wf, elements, nameOutput,
+                        self.force_get_input('Processes', None))
+            except Exception, e:
+                raise ModuleError(self, "Error from local workers:\n"
+                                  "%s" % debug.format_exception(e))
+        elif engine_type == 'ipython':
+            # serialize the module for each value in the list
+            workflows = []
+            for functions in elements:
+                element_module = pipeline_db_module.do_copy()
+                add_input_functions(element_module, functions)
+                workflows.append(self.serialize_module(element_module))
+
+            map_result = self.execute_ipython(module, workflows, nameOutput)
+        else:
+            raise ModuleError(self, "Unknown engine: %s" % engine_type)
+
         # verifying errors
         errors = []
         for engine in range(len(map_result)):
@@ -431,6 +437,9 @@ class Map(Module):
         # including execution logs
         for engine in range(len(map_result)):
             log = map_result[engine]['xml_log']
+            if log is None:
+                # execution log is disabled on the local workers
+                continue
             exec_ = None
             if (vtType == 'abstraction') or (vtType == 'group'):
                 exec_ = unserialize(log, GroupExec)
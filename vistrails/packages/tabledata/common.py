@@ -107,6 +107,15 @@ class TableObject(object):
         else:
             return self._columns[i]
 
+    def get_columns(self, indexes, numeric=False):
+        """Gets several columns from the table, as a list of columns.
+
+        This calls get_column() for each index; tables that can read several
+        columns at once more efficiently (e.g. in a single pass over a file)
+        should override it.
+        """
+        return [self.get_column(i, numeric) for i in indexes]
+
     def get_column_by_name(self, name, numeric=False):
         """Gets a column from its name.
 
@@ -302,8 +311,7 @@ class BuildTable(Module):
                                 item.rows, nb_rows))
                 else:
                     nb_rows = item.rows
-                cols.extend(item.get_column(c)
-                            for c in xrange(item.columns))
+                cols.extend(item.get_columns(xrange(item.columns)))
                 if item.names is not None:
                     names.extend(item.names)
                 else:
@@ -360,7 +368,7 @@ class HtmlRendererMixin(object):
         document.append('<tr>\n')
         document.extend('  <th>%s</th>\n' % name for name in names)
         document.append('</tr>\n')
-        columns = [table.get_column(col) for col in xrange(table.columns)]
+        columns = table.get_columns(xrange(table.columns))
         for row in xrange(table.rows):
             document.append('<tr>\n')
             for col in xrange(table.columns):
@@ -35,6 +35,8 @@
 
 from __future__ import division
 
+from itertools import izip
+import operator
 import re
 
 from vistrails.core.modules.vistrails_module import ModuleError
@@ -54,6 +56,44 @@ def utf8(obj):
         return bytes(obj)
 
 
+def take_rows(column, rows):
+    """Gets the values of a column at the given row indexes.
+
+    numpy arrays are indexed directly, other columns give a list.
+    """
+    numpy = get_numpy(False)
+    if numpy is not None and isinstance(column, numpy.ndarray):
+        return column[rows]
+    else:
+        return [column[i] for i in rows]
+
+
+def group_rows(column):
+    """Groups the rows of a column by value.
+
+    Returns a pair (first_rows, groups): the index of the first row of each
+    group, in order of appearance, and the group number of each row, as numpy
+    arrays.
+    """
+    numpy = get_numpy()
+    if isinstance(column, numpy.ndarray) and column.dtype.kind in 'biuf':
+        values, first_rows, groups = numpy.unique(column,
+                                                  return_index=True,
+                                                  return_inverse=True)
+        # Renumbers the groups in order of appearance
+        order = numpy.argsort(first_rows, kind='mergesort')
+        rank = numpy.empty_like(order)
+        rank[order] = numpy.arange(len(order))
+        return first_rows[order], rank[groups]
+    else:
+        codes = {}
+        groups = numpy.fromiter((codes.setdefault(val, len(codes))
+                                 for val in column),
+                                dtype=numpy.intp, count=len(column))
+        values, first_rows = numpy.unique(groups, return_index=True)
+        return first_rows, groups
+
+
 class JoinedTables(TableObject):
     def __init__(self, left_t, right_t, left_key_col, right_key_col,
                  case_sensitive=False, always_prefix=False):
@@ -67,7 +107,7 @@ class JoinedTables(TableObject):
         self.build_column_names()
         self.compute_row_map()
         self.column_cache = {}
-        self.rows = len(self.row_map)
+        self.rows = len(self.left_rows)
 
     def build_column_names(self):
         left_name = self.left_t.name
@@ -101,47 +141,50 @@ class JoinedTables(TableObject):
         if (index, numeric) in self.column_cache:
             return self.column_cache[(index, numeric)]
 
-        result = []
         if index < self.left_t.columns:
             column = self.left_t.get_column(index, numeric)
-            for i in xrange(self.left_t.rows):
-                if i in self.row_map:
-                    result.append(column[i])
+            result = take_rows(column, self.left_rows)
         else:
             column = self.right_t.get_column(index - self.left_t.columns,
                                              numeric)
-            for i in xrange(self.left_t.rows):
-                if i in self.row_map:
-                    j = self.row_map[i]
-                    result.append(column[j])
+            result = take_rows(column, self.right_rows)
 
         numpy = get_numpy(False)
         if numeric and numpy is not None:
-            result = numpy.array(result, dtype=numpy.float32)
+            result = numpy.asarray(result, dtype=numpy.float32)
         self.column_cache[(index, numeric)] = result
         return result
 
     def compute_row_map(self):
-        def build_key_dict(table, key_col):
-            column = table.get_column(key_col)
+        """Computes the pairs of rows to join.
+
+        This is a hash join on the normalized keys; left_rows and right_rows
+        are the row indexes in each table, as numpy arrays if possible.
+        """
+        def normalize(column):
             if self.case_sensitive:
-                key_dict = dict((utf8(val).strip(), i)
-                                for i, val in enumerate(column))
+                return [utf8(val).strip() for val in column]
             else:
-                key_dict = dict((utf8(val).strip().upper(), i)
-                                for i, val in enumerate(column))
-            return key_dict
+                return [utf8(val).strip().upper() for val in column]
 
-        right_keys = build_key_dict(self.right_t, self.right_key_col)
+        right_keys = dict((key, i) for i, key in enumerate(
+                normalize(self.right_t.get_column(self.right_key_col))))
 
-        self.row_map = {}
+        left_rows = []
+        right_rows = []
         for left_row_idx, key in enumerate(
-                self.left_t.get_column(self.left_key_col)):
-            key = utf8(key).strip()
-            if not self.case_sensitive:
-                key = key.upper()
-            if key in right_keys:
-                self.row_map[left_row_idx] = right_keys[key]
+                normalize(self.left_t.get_column(self.left_key_col))):
+            right_row_idx = right_keys.get(key)
+            if right_row_idx is not None:
+                left_rows.append(left_row_idx)
+                right_rows.append(right_row_idx)
+
+        numpy = get_numpy(False)
+        if numpy is not None:
+            left_rows = numpy.array(left_rows, dtype=numpy.intp)
+            right_rows = numpy.array(right_rows, dtype=numpy.intp)
+        self.left_rows = left_rows
+        self.right_rows = right_rows
 
 
 class JoinTables(Table):
@@ -204,6 +247,11 @@ class ProjectedTable(TableObject):
         mapped_idx = self.col_map[index]
         return self.table.get_column(mapped_idx, numeric)
 
+    def get_columns(self, indexes, numeric=False):
+        return self.table.get_columns([self.col_map[index]
+                                       for index in indexes],
+                                      numeric)
+
     @property
     def rows(self):
         return self.table.rows
@@ -317,19 +365,65 @@ class SelectFromTable(Table):
                                   "No column %d, table only has %d columns" % (
                                   idx, table.columns))
 
-        condition = self.make_condition(comparand, comparer)
-        numeric = isinstance(comparand, float)
-        column = table.get_column(idx, numeric)
-        matched_rows = [i
-                        for i, col_val in enumerate(column)
-                        if condition(col_val)]
-        columns = []
-        for col in xrange(table.columns):
-            column = table.get_column(col)
-            columns.append([column[row] for row in matched_rows])
-        selected_table = TableObject(columns, len(matched_rows), table.names)
+        numpy = get_numpy(False)
+        if numpy is not None and isinstance(comparand, float):
+            # Compares the whole column at once; values are converted to
+            # double precision, as the row-by-row condition does
+            column = numpy.asarray(table.get_column(idx),
+                                   dtype=numpy.float64)
+            mask = self.make_mask(column, comparand, comparer)
+            matched_rows = numpy.flatnonzero(mask)
+        else:
+            condition = self.make_condition(comparand, comparer)
+            matched_rows = [i
+                            for i, col_val in enumerate(table.get_column(idx))
+                            if condition(col_val)]
+        selected_table = SelectedTable(table, matched_rows)
         self.set_output('value', selected_table)
 
+    @staticmethod
+    def make_mask(column, comparand, comparer):
+        try:
+            compare = SelectFromTable.numeric_comparers[comparer]
+        except KeyError:
+            raise ValueError("Invalid comparison operator %r" % comparer)
+        return compare(column, comparand)
+
+    numeric_comparers = {'==': operator.eq,
+                         '!=': operator.ne,
+                         '<': operator.lt,
+                         '>': operator.gt,
+                         '<=': operator.le,
+                         '>=': operator.ge}
+
+
+class SelectedTable(TableObject):
+    """The rows of a table, selected by SelectFromTable.
+
+    Columns are only built when they are requested.
+    """
+    def __init__(self, table, row_indexes):
+        self.table = table
+        self.row_indexes = row_indexes
+        self.columns = table.columns
+        self.rows = len(row_indexes)
+        self.names = table.names
+        self.column_cache = {}
+
+    def get_column(self, index, numeric=False):
+        return self.get_columns([index], numeric)[0]
+
+    def get_columns(self, indexes, numeric=False):
+        indexes = list(indexes)
+        missing = [index for index in set(indexes)
+                   if (index, numeric) not in self.column_cache]
+        if missing:
+            columns = self.table.get_columns(missing, numeric)
+            for index, column in izip(missing, columns):
+                self.column_cache[(index, numeric)] = take_rows(
+                        column, self.row_indexes)
+        return [self.column_cache[(index, numeric)] for index in indexes]
+
 
 class AggregatedTable(TableObject):
     def __init__(self, table, op, col, group_col):
@@ -341,36 +435,45 @@ class AggregatedTable(TableObject):
         self.build_map()
 
     def build_map(self):
-        agg_map = {}
-        for i, val in enumerate(self.table.get_column(self.group_col)):
-            if val in agg_map:
-                agg_map[val].append(i)
-            else:
-                agg_map[val] = [i]
-        self.agg_rows = [(min(rows), rows) for rows in agg_map.itervalues()]
-        self.agg_rows.sort()
-        self.rows = len(self.agg_rows)
+        column = self.table.get_column(self.group_col)
+        if get_numpy(False) is not None:
+            self.first_rows, self.groups = group_rows(column)
+            self.agg_rows = None
+        else:
+            agg_map = {}
+            for i, val in enumerate(column):
+                if val in agg_map:
+                    agg_map[val].append(i)
+                else:
+                    agg_map[val] = [i]
+            self.agg_rows = [(min(rows), rows)
+                             for rows in agg_map.itervalues()]
+            self.agg_rows.sort()
+            self.first_rows = [x[0] for x in self.agg_rows]
+        self.rows = len(self.first_rows)
         self.columns = 2
         if self.table.names is not None:
             self.names = [self.table.names[self.group_col],
                           self.table.names[self.col]]
 
     def get_column(self, index, numeric=False):
-        def average(value_iter):
-            # value_iter can only be used once
-            sum = 0
-            count = 0
-            for count, v in enumerate(value_iter):
-                sum += v
-            return sum / (count+1)
-        op_map = {'sum': sum,
-                  'average': average,
-                  'min': min,
-                  'max': max}
         if index == 0:
             col = self.table.get_column(self.group_col, numeric)
-            return [col[x[0]] for x in self.agg_rows]
+            return [col[x] for x in self.first_rows]
+        elif self.agg_rows is None:
+            return self.reduce_groups()
         else:
+            def average(value_iter):
+                # value_iter can only be used once
+                sum = 0
+                count = 0
+                for count, v in enumerate(value_iter):
+                    sum += v
+                return sum / (count+1)
+            op_map = {'sum': sum,
+                      'average': average,
+                      'min': min,
+                      'max': max}
             if self.op == 'count':
                 return [len(x[1]) for x in self.agg_rows]
             elif self.op in op_map:
@@ -380,6 +483,38 @@ class AggregatedTable(TableObject):
             else:
                 raise ValueError('Unknown operation: "%s"' % self.op)
 
+    def reduce_groups(self):
+        """Computes the aggregated column with numpy.
+        """
+        numpy = get_numpy()
+        groups = self.groups
+        nb_groups = len(self.first_rows)
+        if self.op not in ('count', 'sum', 'average', 'min', 'max'):
+            raise ValueError('Unknown operation: "%s"' % self.op)
+        elif self.op == 'count':
+            return numpy.bincount(groups, minlength=nb_groups).tolist()
+        elif nb_groups == 0:
+            return []
+
+        values = numpy.asarray(self.table.get_column(self.col, True),
+                               dtype=numpy.float64)
+        if self.op in ('sum', 'average'):
+            result = numpy.bincount(groups, weights=values,
+                                    minlength=nb_groups)
+            if self.op == 'average':
+                result /= numpy.bincount(groups, minlength=nb_groups)
+        else:
+            # Sorts the values by group, then reduces each slice
+            order = numpy.argsort(groups, kind='mergesort')
+            starts = numpy.searchsorted(groups[order],
+                                        numpy.arange(nb_groups))
+            if self.op == 'min':
+                ufunc = numpy.minimum
+            else:
+                ufunc = numpy.maximum
+            result = ufunc.reduceat(values[order], starts)
+        return result.tolist()
+
 
 class AggregateColumn(Table):
     _input_ports = [('table', 'Table'),
@@ -734,3 +869,26 @@ class TestAggregate(unittest.TestCase):
                                    ('group_by_index', [('Integer', '2')])])
         self.assertEqual(table.get_column(0, False), ['T', 'F'])
         self.assertEqual(table.get_column(1, True), [-7, 21])
+
+    def test_aggregate_numpy(self):
+        """Compares the numpy and pure-Python aggregations.
+        """
+        import vistrails.packages.tabledata.operations as operations
+
+        table = TableObject([['a', 'b', 1, 'a', 'c', 1, 'b'],
+                             [4, '2', 5.5, 7, -1, 3, '6']],
+                            7, ['key', 'value'])
+        old_get_numpy = operations.get_numpy
+        for op in ('count', 'sum', 'average', 'min', 'max'):
+            results = []
+            for numpy in (old_get_numpy, lambda required=True: None):
+                operations.get_numpy = numpy
+                try:
+                    agg = AggregatedTable(table, op, 1, 0)
+                    results.append([agg.get_column(0), agg.get_column(1)])
+                finally:
+                    operations.get_numpy = old_get_numpy
+            self.assertEqual(results[0][0], ['a', 'b', 1, 'c'])
+            self.assertEqual(results[0][0], results[1][0])
+            for vec, ref in izip(results[0][1], results[1][1]):
+                self.assertAlmostEqual(vec, ref)
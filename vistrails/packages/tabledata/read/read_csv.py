@@ -36,11 +36,27 @@
 from __future__ import division
 
 import csv
+from itertools import izip
 import operator
+import os
+import tempfile
+
+try:
+    import hashlib
+    sha_hash = hashlib.sha1
+except ImportError:
+    import sha
+    sha_hash = sha.new
+
+from vistrails.core import debug
 
 from ..common import get_numpy, TableObject, Table, InternalModuleError
 
 
+# Number of rows converted at once when reading columns
+CHUNK_ROWS = 65536
+
+
 def count_lines(fp):
     lines = 0
     for line in fp:
@@ -48,10 +64,63 @@ def count_lines(fp):
     return lines
 
 
-# FIXME : test coverage for CSVTable
+class ColumnCache(object):
+    """Memory-mapped binary cache of numeric columns, next to a CSV file.
+
+    Columns are stored as .npy files in a directory next to the source file,
+    named after a key that changes if the file or the way it is read changes.
+    """
+    def __init__(self, csv_file, key):
+        self.directory = csv_file + '.columns'
+        stat = os.stat(csv_file)
+        hasher = sha_hash()
+        hasher.update(repr((stat.st_size, stat.st_mtime) + key))
+        self.key = hasher.hexdigest()[:16]
+
+    def filename(self, index):
+        return os.path.join(self.directory,
+                            'col%d-%s.npy' % (index, self.key))
+
+    def load(self, index):
+        numpy = get_numpy()
+        try:
+            return numpy.load(self.filename(index), mmap_mode='r')
+        except (IOError, ValueError):
+            return None
+
+    def store(self, index, column):
+        numpy = get_numpy()
+        try:
+            if not os.path.isdir(self.directory):
+                os.mkdir(self.directory)
+            fd, temp_filename = tempfile.mkstemp(dir=self.directory,
+                                                 suffix='.tmp')
+        except OSError, e:
+            debug.warning("Can't write column cache: %s" % e)
+            return column
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                numpy.save(fp, column)
+            # Removes the stale versions of this column
+            prefix = 'col%d-' % index
+            for name in os.listdir(self.directory):
+                if name.startswith(prefix) and name.endswith('.npy'):
+                    os.remove(os.path.join(self.directory, name))
+            os.rename(temp_filename, self.filename(index))
+        except (IOError, OSError), e:
+            debug.warning("Can't write column cache: %s" % e)
+            try:
+                os.remove(temp_filename)
+            except OSError:
+                pass
+            return column
+        return self.load(index)
+
+
 class CSVTable(TableObject):
     def __init__(self, csv_file, header_present, delimiter,
-                 skip_lines=0, dialect=None, use_sniffer=True):
+                 skip_lines=0, dialect=None, use_sniffer=True,
+                 binary_cache=False):
         self._rows = None
 
         self.header_present = header_present
@@ -68,6 +137,13 @@ class CSVTable(TableObject):
             self.skip_lines += 1
 
         self.column_cache = {}
+        if binary_cache and get_numpy(False) is not None:
+            self.binary_cache = ColumnCache(
+                    csv_file,
+                    (self.delimiter, self.skip_lines,
+                     getattr(self.dialect, 'quotechar', self.dialect)))
+        else:
+            self.binary_cache = None
 
     @staticmethod
     def read_file(filename, delimiter=None, header_present=True,
@@ -122,44 +198,100 @@ class CSVTable(TableObject):
         return column_count, column_names, delimiter, header_present, dialect
 
     def get_column(self, index, numeric=False):
-        if (index, numeric) in self.column_cache:
-            return self.column_cache[(index, numeric)]
+        return self.get_columns([index], numeric)[0]
+
+    def get_columns(self, indexes, numeric=False):
+        """Gets several columns, reading the file only once.
 
+        Only the requested columns are kept; numeric columns are built as
+        numpy arrays chunk by chunk. If the binary cache is enabled, numeric
+        columns are loaded from it, or stored in it after being read.
+        """
+        indexes = list(indexes)
         numpy = get_numpy(False)
+        binary_cache = self.binary_cache if numeric else None
+        missing = []
+        for index in indexes:
+            if ((index, numeric) not in self.column_cache and
+                    index not in missing):
+                column = None
+                if binary_cache is not None:
+                    column = binary_cache.load(index)
+                if column is not None:
+                    self.column_cache[(index, numeric)] = column
+                    if self._rows is None:
+                        self._rows = len(column)
+                else:
+                    missing.append(index)
+
+        if missing:
+            columns = self._read_columns(missing,
+                                         numpy if numeric else None,
+                                         numeric)
+            for index, column in izip(missing, columns):
+                if binary_cache is not None:
+                    column = binary_cache.store(index, column)
+                self.column_cache[(index, numeric)] = column
 
-        if numeric and numpy is not None:
-            result = numpy.loadtxt(
-                    self.filename,
-                    dtype=numpy.float32,
-                    delimiter=self.delimiter,
-                    skiprows=self.skip_lines,
-                    usecols=[index])
+        return [self.column_cache[(index, numeric)] for index in indexes]
+
+    def _read_columns(self, indexes, numpy, numeric):
+        """Reads the given columns in a single pass over the file.
+        """
+        if len(indexes) == 1:
+            index = indexes[0]
+            getter = lambda row: (row[index],)
         else:
-            with open(self.filename, 'rb') as fp:
-                for i in xrange(self.skip_lines):
-                    line = fp.readline()
-                    if not line:
-                        raise ValueError("skip_lines greater than the number "
-                                         "of lines in the file")
-                if self.dialect is not None:
-                    reader = csv.reader(fp, dialect=self.dialect)
+            getter = operator.itemgetter(*indexes)
+        chunks = [[] for index in indexes]
+
+        def convert(rows):
+            values = izip(*rows)
+            for chunk, column in izip(chunks, values):
+                if numpy is not None:
+                    chunk.append(numpy.array(column, dtype=numpy.float32))
+                elif numeric:
+                    chunk.extend(float(e) for e in column)
                 else:
-                    reader = csv.reader(fp, delimiter=self.delimiter)
+                    chunk.extend(column)
 
-                getter = operator.itemgetter(index)
+        with open(self.filename, 'rb') as fp:
+            for i in xrange(self.skip_lines):
+                line = fp.readline()
+                if not line:
+                    raise ValueError("skip_lines greater than the number "
+                                     "of lines in the file")
+            if self.dialect is not None:
+                reader = csv.reader(fp, dialect=self.dialect)
+            else:
+                reader = csv.reader(fp, delimiter=self.delimiter)
+
+            rows = []
+            nb_rows = 0
+            for rownb, row in enumerate(reader, 1):
+                if not row:
+                    continue
                 try:
-                    result = []
-                    for rownb, row in enumerate(reader, 1):
-                        result.append(getter(row))
+                    rows.append(getter(row))
                 except IndexError:
+                    index = [i for i in indexes if i >= len(row)][0]
                     raise ValueError("Invalid CSV file: only %d fields on "
                                      "line %d (column %d requested)" % (
                                          len(row), rownb, index))
-            if numeric:
-                result = [float(e) for e in result]
-
-        self.column_cache[(index, numeric)] = result
-        return result
+                if len(rows) == CHUNK_ROWS:
+                    convert(rows)
+                    nb_rows += len(rows)
+                    rows = []
+            convert(rows)
+            nb_rows += len(rows)
+        self._rows = nb_rows
+
+        if numpy is not None:
+            return [numpy.concatenate(chunk) if chunk
+                    else numpy.zeros((0,), dtype=numpy.float32)
+                    for chunk in chunks]
+        else:
+            return chunks
 
     @property
     def rows(self):
@@ -178,6 +310,10 @@ class CSVFile(Table):
     able to guess the actual format of the file in most cases, or you can use
     the 'delimiter', 'header_present' and 'skip_lines' ports to force how the
     file will be read.
+
+    Only the columns that are used are read from the file. If 'binary_cache'
+    is set, numeric columns are also kept in a memory-mapped binary cache, in
+    a directory next to the file, so that they don't need to be parsed again.
     """
     _input_ports = [
             ('file', '(org.vistrails.vistrails.basic:File)'),
@@ -190,7 +326,9 @@ class CSVFile(Table):
             ('skip_lines', '(org.vistrails.vistrails.basic:Integer)',
              {'optional': True, 'defaults': "['0']"}),
             ('dialect', '(org.vistrails.vistrails.basic:String)',
-             {'optional': True})]
+             {'optional': True}),
+            ('binary_cache', '(org.vistrails.vistrails.basic:Boolean)',
+             {'optional': True, 'defaults': "['False']"})]
     _output_ports = [
             ('column_count', '(org.vistrails.vistrails.basic:Integer)'),
             ('column_names', '(org.vistrails.vistrails.basic:List)'),
@@ -203,10 +341,11 @@ class CSVFile(Table):
         skip_lines = self.get_input('skip_lines')
         dialect = self.force_get_input('dialect', None)
         sniff_header = self.get_input('sniff_header')
+        binary_cache = self.get_input('binary_cache')
 
         try:
             table = CSVTable(csv_file, header_present, delimiter, skip_lines,
-                             dialect, sniff_header)
+                             dialect, sniff_header, binary_cache)
         except InternalModuleError, e:
             e.raise_module_error(self)
 
@@ -321,6 +460,65 @@ class CSVTestCase(unittest.TestCase):
                          ['col moutarde', '4', 'not a number', '7'])
 
 
+class TestCSVTable(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp(prefix='vt_csv_')
+        self.filename = os.path.join(self.directory, 'data.csv')
+        with open(self.filename, 'wb') as fp:
+            fp.write('a,b,c\n')
+            for i in xrange(10):
+                fp.write('%d,%d.5,name %d\n' % (i, i * 2, i))
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def test_chunks(self):
+        """Reads several columns at once, in multiple chunks."""
+        global CHUNK_ROWS
+        old_chunk_rows = CHUNK_ROWS
+        CHUNK_ROWS = 3
+        try:
+            table = CSVTable(self.filename, True, ',', use_sniffer=False)
+            a, b = table.get_columns([0, 1], True)
+            c, = table.get_columns([2])
+        finally:
+            CHUNK_ROWS = old_chunk_rows
+        self.assertEqual(table.rows, 10)
+        self.assertEqual(list(a), range(10))
+        self.assertEqual(list(b), [i * 2 + 0.5 for i in xrange(10)])
+        self.assertEqual(c, ['name %d' % i for i in xrange(10)])
+        self.assertIs(table.get_column(0, True), a)
+
+    def test_binary_cache(self):
+        """Reads numeric columns from the memory-mapped cache."""
+        numpy = get_numpy(False)
+        if numpy is None:
+            self.skipTest("numpy is not available")
+        table = CSVTable(self.filename, True, ',', use_sniffer=False,
+                         binary_cache=True)
+        column = table.get_column(1, True)
+        self.assertIsInstance(column, numpy.memmap)
+        self.assertEqual(len(os.listdir(table.binary_cache.directory)), 1)
+
+        table = CSVTable(self.filename, True, ',', use_sniffer=False,
+                         binary_cache=True)
+        table._read_columns = None # would fail if called
+        self.assertEqual(list(table.get_column(1, True)), list(column))
+        self.assertEqual(table.rows, 10)
+
+        # Changing the file invalidates the cache
+        with open(self.filename, 'ab') as fp:
+            fp.write('10,20.5,name 10\n')
+        os.utime(self.filename, (0, 0))
+        table = CSVTable(self.filename, True, ',', use_sniffer=False,
+                         binary_cache=True)
+        self.assertEqual(len(table.get_column(1, True)), 11)
+        self.assertEqual(table.rows, 11)
+        self.assertEqual(len(os.listdir(table.binary_cache.directory)), 1)
+
+
 class TestCountlines(unittest.TestCase):
     def test_countlines(self):
         # Simple
@@ -136,7 +136,7 @@ class TableCellWidget(QCellWidget):
         document.append('<tr>\n')
         document.extend('  <th>%s</th>\n' % name for name in names)
         document.append('</tr>\n')
-        columns = [table.get_column(col) for col in xrange(table.columns)]
+        columns = table.get_columns(xrange(table.columns))
         for row in xrange(table.rows):
             document.append('<tr>\n')
             for col in xrange(table.columns):
@@ -60,7 +60,7 @@ class WriteCSV(Module):
 
     @staticmethod
     def write(fname, table, delimiter=';', write_header=True):
-        cols = [table.get_column(i) for i in xrange(table.columns)]
+        cols = table.get_columns(xrange(table.columns))
 
         with open(fname, 'w') as fp:
             if write_header and table.names is not None:
@@ -73,7 +73,7 @@ def enable_package(identifier):
 
 
 def execute(modules, connections=[], add_port_specs=[],
-            enable_pkg=True, full_results=False):
+            enable_pkg=True, full_results=False, control_params=[]):
     """Build a pipeline and execute it.
 
     This is useful to simply build a pipeline in a test case, and run it. When
@@ -106,6 +106,12 @@ def execute(modules, connections=[], add_port_specs=[],
     It is useful to test modules that can have custom ports through a
     configuration widget.
 
+    control_params is a list of control parameters to set on modules, with
+    the following format:
+        [
+            (mod_id, 'name', 'value'),
+        ]
+
     The function returns the 'errors' dict it gets from the interpreter, so you
     should use a construct like self.assertFalse(execute(...)) if the execution
     is not supposed to fail.
@@ -135,6 +141,8 @@ def execute(modules, connections=[], add_port_specs=[],
     from vistrails.core.utils import DummyView
     from vistrails.core.vistrail.connection import Connection
     from vistrails.core.vistrail.module import Module
+    from vistrails.core.vistrail.module_control_param import \
+        ModuleControlParam
     from vistrails.core.vistrail.module_function import ModuleFunction
     from vistrails.core.vistrail.module_param import ModuleParam
     from vistrails.core.vistrail.pipeline import Pipeline
@@ -192,6 +200,10 @@ def execute(modules, connections=[], add_port_specs=[],
                         functions=function_list)
         for port_spec in port_spec_per_module.get(i, []):
             module.add_port_spec(port_spec)
+        for j, (mod_id, cp_name, cp_value) in enumerate(control_params):
+            if mod_id == i:
+                module.add_control_parameter(ModuleControlParam(
+                        id=j, name=cp_name, value=cp_value))
         pipeline.add_module(module)
         module_list.append(module)
 